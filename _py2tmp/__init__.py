@@ -12,4 +12,4 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-# This file was intentionally left blank.
+__version__ = '0.1.3'
@@ -13,10 +13,11 @@
 # limitations under the License.
 import re
 import textwrap
-from _py2tmp import ir3
+from _py2tmp import ir3, utils
 import typed_ast.ast3 as ast
 from typing import List, Tuple, Dict, Optional, Union, Callable
 from _py2tmp.utils import ast_to_string
+from _py2tmp.module_interface import ModuleInterface, BUILTIN_MODULE_NAMES
 
 class Symbol:
     def __init__(self, name: str, type: ir3.ExprType, is_function_that_may_throw: bool):
@@ -97,7 +98,7 @@ class CompilationContext:
         if is_function_that_may_throw:
             assert isinstance(type, ir3.FunctionType)
 
-        self._check_not_already_defined(name, definition_ast_node)
+        self.check_not_already_defined(name, definition_ast_node)
 
         self.symbol_table.add_symbol(name=name,
                                      type=type,
@@ -123,13 +124,18 @@ class CompilationContext:
     def add_symbol_for_function_with_unknown_return_type(self,
                                                          name: str,
                                                          definition_ast_node: ast.FunctionDef):
-        self._check_not_already_defined(name, definition_ast_node)
+        self.check_not_already_defined(name, definition_ast_node)
 
         self.partially_typechecked_function_definitions_by_name[name] = definition_ast_node
 
     def get_symbol_definition(self, name: str):
         return self.symbol_table.get_symbol_definition(name)
 
+    def get_source_location(self, ast_node: ast.AST):
+        return utils.SourceLocation(filename=self.filename,
+                                    line=ast_node.lineno,
+                                    function_name=self.current_function_name or '<toplevel>')
+
     def get_partial_function_definition(self, name: str):
         return self.partially_typechecked_function_definitions_by_name.get(name)
 
@@ -148,7 +154,7 @@ class CompilationContext:
         else:
             assert self.get_symbol_definition(name).symbol.type == type
 
-    def _check_not_already_defined(self, name: str, definition_ast_node: ast.AST):
+    def check_not_already_defined(self, name: str, definition_ast_node: ast.AST):
         symbol_lookup_result = self.symbol_table.get_symbol_definition(name)
         if not symbol_lookup_result:
             symbol_lookup_result = self.custom_types_symbol_table.get_symbol_definition(name)
@@ -198,15 +204,25 @@ class CompilationError(Exception):
                         line=compilation_context.source_lines[first_line_number - 1],
                         error_marker=error_marker)
 
-def module_ast_to_ir3(module_ast_node: ast.Module, filename: str, source_lines: List[str]):
+def module_ast_to_ir3(module_ast_node: ast.Module,
+                      filename: str,
+                      source_lines: List[str],
+                      module_interfaces: Optional[Dict[str, ModuleInterface]] = None):
+    '''Converts the module to IR3.
+
+    module_interfaces contains the interfaces of the (separately-compiled) TMPPy modules that can be imported, keyed by
+    module name.
+    '''
     compilation_context = CompilationContext(SymbolTable(),
                                              SymbolTable(),
                                              filename,
                                              source_lines)
+    module_interfaces = module_interfaces or dict()
 
     function_defns = []
     toplevel_assertions = []
     custom_types = []
+    imported_custom_types = []
 
     # First pass: process everything except function bodies and toplevel assertions
     for ast_node in module_ast_node.body:
@@ -225,15 +241,20 @@ def module_ast_to_ir3(module_ast_node: ast.Module, filename: str, source_lines:
                 compilation_context.add_symbol_for_function_with_unknown_return_type(
                     name=function_name,
                     definition_ast_node=ast_node)
+        elif isinstance(ast_node, ast.ImportFrom) and ast_node.module in module_interfaces:
+            import_from_module_ast_to_ir3(ast_node, module_interfaces[ast_node.module], compilation_context,
+                                          imported_custom_types)
         elif isinstance(ast_node, ast.ImportFrom):
             supported_imports_by_module = {
                 'tmppy': ('Type', 'empty_list', 'empty_set', 'match'),
                 'typing': ('List', 'Set', 'Callable')
             }
+            assert set(supported_imports_by_module.keys()) == set(BUILTIN_MODULE_NAMES)
             supported_imports = supported_imports_by_module.get(ast_node.module)
             if not supported_imports:
                 raise CompilationError(compilation_context, ast_node,
-                                       'The only modules that can be imported in TMPPy are: ' + ', '.join(sorted(supported_imports_by_module.keys())))
+                                       'The only modules that can be imported in TMPPy are: %s (and the TMPPy modules '
+                                       'with an interface file).' % ', '.join(sorted(supported_imports_by_module.keys())))
             if len(ast_node.names) == 0:
                 raise CompilationError(compilation_context, ast_node, 'Imports must import at least 1 symbol.')  # pragma: no cover
             for imported_name in ast_node.names:
@@ -278,7 +299,62 @@ def module_ast_to_ir3(module_ast_node: ast.Module, filename: str, source_lines:
     return ir3.Module(function_defns=function_defns,
                       assertions=toplevel_assertions,
                       custom_types=custom_types,
-                      public_names=public_names)
+                      public_names=public_names,
+                      imported_custom_types=imported_custom_types)
+
+def import_from_module_ast_to_ir3(ast_node: ast.ImportFrom,
+                                  module_interface: ModuleInterface,
+                                  compilation_context: CompilationContext,
+                                  imported_custom_types: List[ir3.CustomType]):
+    # The custom types defined in the imported module (and in the modules that it imports) can be used even if they're
+    # not imported explicitly, e.g. as the type of the value returned by an imported function, so they're all added to
+    # the types' symbol table (but only the imported ones can be referenced by name).
+    imported_custom_type_names = {custom_type.name for custom_type in imported_custom_types}
+    for custom_type_interface in module_interface.custom_types:
+        custom_type = custom_type_interface.custom_type
+        if custom_type.name not in imported_custom_type_names:
+            compilation_context.check_not_already_defined(custom_type.name, ast_node)
+            compilation_context.custom_types_symbol_table.add_symbol(name=custom_type.name,
+                                                                     type=custom_type,
+                                                                     definition_ast_node=ast_node,
+                                                                     is_only_partially_defined=False,
+                                                                     is_function_that_may_throw=False)
+            imported_custom_types.append(custom_type)
+            imported_custom_type_names.add(custom_type.name)
+
+    function_interface_by_name = {function_interface.name: function_interface
+                                  for function_interface in module_interface.functions}
+    custom_type_by_name = {custom_type_interface.custom_type.name: custom_type_interface.custom_type
+                           for custom_type_interface in module_interface.custom_types
+                           if custom_type_interface.module_name == module_interface.module_name}
+    if len(ast_node.names) == 0:
+        raise CompilationError(compilation_context, ast_node, 'Imports must import at least 1 symbol.')  # pragma: no cover
+    for imported_name in ast_node.names:
+        if not isinstance(imported_name, ast.alias) or imported_name.asname:
+            raise CompilationError(compilation_context, ast_node, 'TMPPy only supports imports of the form "from some_module import some_symbol, some_other_symbol".')
+        if imported_name.name in function_interface_by_name:
+            function_interface = function_interface_by_name[imported_name.name]
+            compilation_context.add_symbol(name=function_interface.name,
+                                           type=function_interface.type,
+                                           definition_ast_node=ast_node,
+                                           is_only_partially_defined=False,
+                                           is_function_that_may_throw=function_interface.is_function_that_may_throw)
+        elif imported_name.name in custom_type_by_name:
+            custom_type = custom_type_by_name[imported_name.name]
+            if compilation_context.get_symbol_definition(custom_type.name):
+                compilation_context.check_not_already_defined(custom_type.name, ast_node)
+            # The type itself was added above, so we only need to add the constructor.
+            compilation_context.symbol_table.add_symbol(name=custom_type.name,
+                                                        type=ir3.FunctionType(argtypes=[arg.type
+                                                                                        for arg in custom_type.arg_types],
+                                                                              returns=custom_type),
+                                                        definition_ast_node=ast_node,
+                                                        is_only_partially_defined=False,
+                                                        is_function_that_may_throw=False)
+        else:
+            raise CompilationError(compilation_context, ast_node,
+                                   'The module %s doesn\'t define a public function or type called %s.' % (
+                                       module_interface.module_name, imported_name.name))
 
 def match_expression_ast_to_ir3(ast_node: ast.Call, compilation_context: CompilationContext, in_match_pattern: bool, check_var_reference: Callable[[ast.Name], None]):
     assert isinstance(ast_node.func, ast.Call)
@@ -408,7 +484,8 @@ def match_expression_ast_to_ir3(ast_node: ast.Call, compilation_context: Compila
                                'The lambda argument %s was not used in any pattern, it should be removed.' % unused_arg_name)
 
     return ir3.MatchExpr(matched_exprs=matched_exprs,
-                         match_cases=match_cases)
+                         match_cases=match_cases,
+                         source_location=compilation_context.get_source_location(ast_node))
 
 def return_stmt_ast_to_ir3(ast_node: ast.Return,
                            compilation_context: CompilationContext):
@@ -758,7 +835,8 @@ def function_def_ast_to_ir3(ast_node: ast.FunctionDef, compilation_context: Comp
     return ir3.FunctionDefn(name=ast_node.name,
                             args=args,
                             body=statements,
-                            return_type=return_type)
+                            return_type=return_type,
+                            source_location=function_body_compilation_context.get_source_location(ast_node))
 
 def assert_ast_to_ir3(ast_node: ast.Assert, compilation_context: CompilationContext):
     expr = expression_ast_to_ir3(ast_node.test, compilation_context, in_match_pattern=False, check_var_reference=lambda ast_node: None)
@@ -1118,7 +1196,8 @@ def list_comprehension_ast_to_ir3(ast_node: ast.ListComp,
                                                            type=list_expr.elem_type,
                                                            is_global_function=False,
                                                            is_function_that_may_throw=False),
-                                 result_elem_expr=result_elem_expr)
+                                 result_elem_expr=result_elem_expr,
+                                 source_location=compilation_context.get_source_location(ast_node))
 
 def set_comprehension_ast_to_ir3(ast_node: ast.SetComp,
                                  compilation_context: CompilationContext,
@@ -1169,7 +1248,8 @@ def set_comprehension_ast_to_ir3(ast_node: ast.SetComp,
                                                           type=set_expr.elem_type,
                                                           is_global_function=False,
                                                           is_function_that_may_throw=False),
-                                result_elem_expr=result_elem_expr)
+                                result_elem_expr=result_elem_expr,
+                                source_location=compilation_context.get_source_location(ast_node))
 
 
 def add_expression_ast_to_ir3(ast_node: ast.BinOp,
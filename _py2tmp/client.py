@@ -0,0 +1,146 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''A thin client for the py2tmp compilation server (see server.py).
+
+This module only uses the standard library (and it must stay that way), so that the client starts quickly: the point
+of the server is to avoid paying for the imports of the compiler in each process.
+
+The protocol is simple: the client connects to the server's Unix socket, sends a request (a JSON object followed by a
+newline), and the server replies with a response in the same format and then closes the connection.
+'''
+
+import argparse
+import json
+import os
+import socket
+import sys
+from typing import Dict, Any, List, Optional
+
+SOCKET_ENV_VAR = 'PY2TMP_SOCKET'
+
+class ServerError(Exception):
+    pass
+
+def send_message(sock: socket.socket, message: Dict[str, Any]):
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+def receive_message(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    '''Returns the next message received on the socket, or None if the connection was closed before that.'''
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            if chunks:
+                raise ServerError('Connection closed in the middle of a message')
+            return None
+        newline_index = chunk.find(b'\n')
+        if newline_index != -1:
+            chunks.append(chunk[:newline_index])
+            break
+        chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+def send_request(socket_path: str, request: Dict[str, Any], timeout: Optional[float] = None) -> Dict[str, Any]:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise ServerError('Could not connect to the py2tmp server at %s (is "py2tmp --serve %s" running?): %s' % (
+                socket_path, socket_path, e))
+        send_message(sock, request)
+        response = receive_message(sock)
+    finally:
+        sock.close()
+    if response is None:
+        raise ServerError('The py2tmp server closed the connection without replying')
+    if 'error' in response:
+        raise ServerError(response['error'])
+    return response
+
+def compile_files(socket_path: str, source_file_names: List[str], format: str = 'native') -> List[Dict[str, Any]]:
+    '''Asks the server to convert the given TMPPy source files.
+
+    Returns a list with a dict for each source file (in the same order), with the keys 'source_file_name',
+    'output_file_name', 'cpp_source', 'additional_cpp_sources' and 'error'. Exactly one of 'cpp_source' and 'error' is
+    not None. 'additional_cpp_sources' contains the other headers generated when the server splits the output (keyed by
+    the path relative to the directory of 'output_file_name').
+    '''
+    response = send_request(socket_path, {
+        'command': 'compile',
+        # The server might have a different working directory.
+        'sources': [os.path.abspath(source_file_name) for source_file_name in source_file_names],
+        'format': format,
+    })
+    return response['results']
+
+def ping(socket_path: str, timeout: Optional[float] = None) -> str:
+    '''Checks that the server is running. Returns the py2tmp version used by the server.'''
+    return send_request(socket_path, {'command': 'ping'}, timeout=timeout)['version']
+
+def shutdown(socket_path: str):
+    send_request(socket_path, {'command': 'shutdown'})
+
+def main():
+    parser = argparse.ArgumentParser(description='Converts python source code into C++ metafunctions, using a py2tmp '
+                                                 'server started with "py2tmp --serve".')
+    parser.add_argument('sources', nargs='*', help='The python source files to convert')
+    parser.add_argument('--socket', default=os.environ.get(SOCKET_ENV_VAR),
+                        help='The Unix socket of the server. Defaults to the value of the %s environment variable.'
+                             % SOCKET_ENV_VAR)
+    parser.add_argument('--format', choices=('native', 'clang-format'), default='native',
+                        help='How to format the generated C++ code.')
+    parser.add_argument('--ping', action='store_true', help='Only check that the server is running.')
+    parser.add_argument('--shutdown', action='store_true', help='Stop the server.')
+    args = parser.parse_args()
+
+    if not args.socket:
+        parser.error('The socket must be specified with --socket or with the %s environment variable.' % SOCKET_ENV_VAR)
+
+    try:
+        if args.ping:
+            print('py2tmp server version: ' + ping(args.socket))
+            return
+        if args.shutdown:
+            shutdown(args.socket)
+            return
+        if not args.sources:
+            parser.error('No source files specified.')
+        results = compile_files(args.socket, args.sources, format=args.format)
+    except ServerError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(2)
+
+    succeeded = True
+    for result in results:
+        if result['error'] is not None:
+            succeeded = False
+            print(result['error'], file=sys.stderr)
+            continue
+        with open(result['output_file_name'], 'w') as output_file:
+            output_file.write(result['cpp_source'])
+        for file_name, cpp_source in result.get('additional_cpp_sources', {}).items():
+            file_name = os.path.join(os.path.dirname(result['output_file_name']), file_name)
+            os.makedirs(os.path.dirname(file_name), exist_ok=True)
+            with open(file_name, 'w') as output_file:
+                output_file.write(cpp_source)
+
+    if not succeeded:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+from typing import Dict, Optional, Any
+
+import _py2tmp
+
+_ENTRY_SUFFIX = '.h'
+_OPTIMIZED_TEMPLATE_ENTRY_SUFFIX = '.pickle'
+_ENTRY_SUFFIXES = (_ENTRY_SUFFIX, _OPTIMIZED_TEMPLATE_ENTRY_SUFFIX)
+
+def _compute_compiler_digest():
+    # The version alone is not enough when running py2tmp from a source checkout: any change to the compiler must
+    # invalidate the cached outputs, so we also hash the compiler's own sources.
+    hasher = hashlib.sha256()
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for file_name in sorted(os.listdir(package_dir)):
+        if file_name.endswith('.py'):
+            hasher.update(file_name.encode('utf-8'))
+            with open(os.path.join(package_dir, file_name), 'rb') as f:
+                hasher.update(f.read())
+    return hasher.hexdigest()
+
+_compiler_digest = None
+
+def _get_compiler_digest():
+    global _compiler_digest
+    if _compiler_digest is None:
+        _compiler_digest = _compute_compiler_digest()
+    return _compiler_digest
+
+class CompilationCache:
+    '''A persistent, content-addressed cache for the results of convert_to_cpp().
+
+    Entries are keyed by the Python source, the py2tmp version and the conversion options. When the total size of the
+    cache exceeds max_size_bytes, the least recently used entries are evicted.
+
+    The cache also stores the results of the optimization of single templates (see optimize_ir0.optimize_header()), so
+    that after a change to a module only the templates affected by the change need to be optimized again.
+    '''
+    def __init__(self, cache_dir: str, max_size_bytes: int = 256 * 1024 * 1024):
+        assert max_size_bytes > 0
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        # An estimate of the current size of the cache, to avoid scanning the cache dir on every write. It's computed
+        # lazily and it might be inaccurate if other processes are using the same cache dir, so we recompute it on each
+        # eviction.
+        self._estimated_size_bytes = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def compute_key(self, python_source: str, options: Dict[str, Any]):
+        return self._compute_key(python_source, options)
+
+    def get(self, key: str) -> Optional[str]:
+        data = self._read_entry(key + _ENTRY_SUFFIX)
+        return data.decode('utf-8') if data is not None else None
+
+    def put(self, key: str, value: str):
+        self._write_entry(key + _ENTRY_SUFFIX, value.encode('utf-8'))
+
+    def compute_optimized_template_key(self, canonical_template_info: str, optimization_options: Dict[str, Any]):
+        return self._compute_key(canonical_template_info, options={'kind': 'optimized_template',
+                                                                   'optimization_options': optimization_options})
+
+    def get_optimized_template(self, key: str) -> Optional[Any]:
+        data = self._read_entry(key + _OPTIMIZED_TEMPLATE_ENTRY_SUFFIX)
+        return pickle.loads(data) if data is not None else None
+
+    def put_optimized_template(self, key: str, value: Any):
+        self._write_entry(key + _OPTIMIZED_TEMPLATE_ENTRY_SUFFIX, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(_ENTRY_SUFFIXES):
+                self._remove(entry.path)
+
+    def _compute_key(self, content: str, options: Dict[str, Any]):
+        hasher = hashlib.sha256()
+        hasher.update(json.dumps({
+            'version': _py2tmp.__version__,
+            'compiler_digest': _get_compiler_digest(),
+            'options': options,
+        }, sort_keys=True).encode('utf-8'))
+        hasher.update(b'\0')
+        hasher.update(content.encode('utf-8'))
+        return hasher.hexdigest()
+
+    def _read_entry(self, file_name: str) -> Optional[bytes]:
+        path = os.path.join(self.cache_dir, file_name)
+        try:
+            with open(path, 'rb') as f:
+                result = f.read()
+        except FileNotFoundError:
+            return None
+        # The mtime is used as the "last used" time for the LRU eviction.
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted concurrently by another process, that's fine.
+            pass
+        return result
+
+    def _write_entry(self, file_name: str, data: bytes):
+        # We write to a temporary file and then rename it, so that concurrent readers never see a partial entry.
+        fd, temp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, os.path.join(self.cache_dir, file_name))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        if self._estimated_size_bytes is None:
+            self._evict_if_needed()
+        else:
+            self._estimated_size_bytes += len(data)
+            if self._estimated_size_bytes > self.max_size_bytes:
+                self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(_ENTRY_SUFFIXES):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+
+        if total_size > self.max_size_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= self.max_size_bytes:
+                    break
+                self._remove(path)
+                total_size -= size
+
+        self._estimated_size_bytes = total_size
+
+    def _remove(self, path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,672 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''An evaluator for IR0 exprs that don't depend on template parameters (e.g. f<int, 3>::type).
+
+The evaluator interprets the TemplateDefns of the header (including the selection of the specialization) and the
+templates of tmppy.h that the generated code uses. The values are IR0 exprs too (Literals, or type exprs without
+references to local vars).
+
+Evaluation is conservative: when the result might differ from what the C++ compiler would compute (e.g. when
+comparing two types that might be typedefs of each other) or when the instantiation would fail (e.g. a static_assert
+that doesn't hold) the evaluation fails, and the expr is left for the C++ compiler to evaluate.
+'''
+
+from typing import Dict, Tuple, Optional, List, Set, Callable, Union
+
+from _py2tmp import ir0
+
+# The type exprs in a TemplateInstantiation that are bound to a variadic template parameter.
+_VariadicValue = Tuple[ir0.Expr, ...]
+
+_Env = Dict[str, Union[ir0.Expr, _VariadicValue]]
+
+_MIN_INT64 = -2**63
+_MAX_INT64 = 2**63 - 1
+
+# The evaluation fails above this instantiation depth, to avoid exceeding the Python recursion limit.
+MAX_INSTANTIATION_DEPTH = 50
+
+# Types that can't be typedefs of a different type, so two of these are equal iff they have the same name.
+_FUNDAMENTAL_TYPES = frozenset(('void', 'bool', 'char', 'int', 'float', 'double'))
+
+_LIST_TEMPLATE_NAMES = ('List', 'Int64List', 'BoolList')
+
+_LIST_ELEM_TYPE_BY_LIST_TEMPLATE_NAME = {
+    'List': ir0.TypeType(),
+    'Int64List': ir0.Int64Type(),
+    'BoolList': ir0.BoolType(),
+}
+
+class CannotEvaluateException(Exception):
+    '''Raised when an expr can't be evaluated at conversion time, see the module docstring.'''
+
+class Evaluator:
+    '''Evaluates IR0 exprs, with a limit on the number of evaluation steps.
+
+    The results of the template instantiations are memoized, so evaluating many exprs with the same Evaluator is
+    cheaper than evaluating each with a new one.
+    '''
+    def __init__(self, template_defn_by_name: Dict[str, ir0.TemplateDefn], step_budget: int):
+        self.template_defn_by_name = template_defn_by_name
+        self.remaining_steps = step_budget
+        # The members of each instantiated template (or None if the instantiation can't be evaluated).
+        self.members_by_instantiation = dict()  # type: Dict[Tuple[str, Tuple[ir0.Expr, ...]], Optional[Dict[str, ir0.Expr]]]
+        self.instantiation_depth = 0
+
+    def try_evaluate(self, expr: ir0.Expr, env: _Env, local_names: Set[str]) -> Optional[ir0.Expr]:
+        '''Returns the value of expr, or None if it can't be evaluated.
+
+        env contains the values of the local vars that are known, local_names all the local names in scope (including
+        the ones in env).
+        '''
+        try:
+            value = self.evaluate(expr, env, local_names)
+        except CannotEvaluateException:
+            return None
+        if isinstance(value, tuple):
+            return None
+        return value
+
+    def evaluate(self, expr: ir0.Expr, env: _Env, local_names: Set[str]) -> Union[ir0.Expr, _VariadicValue]:
+        self._step()
+        if isinstance(expr, ir0.Literal):
+            return expr
+        elif isinstance(expr, ir0.AtomicTypeLiteral):
+            return self._evaluate_type_literal(expr, env, local_names)
+        elif isinstance(expr, ir0.ClassMemberAccess):
+            class_type = self._evaluate_non_variadic(expr.expr, env, local_names)
+            if not (isinstance(class_type, ir0.TemplateInstantiation)
+                    and isinstance(class_type.template_expr, ir0.AtomicTypeLiteral)):
+                raise CannotEvaluateException()
+            members = self.instantiate(class_type.template_expr.cpp_type, class_type.args)
+            value = members.get(expr.member_name)
+            if value is None:
+                raise CannotEvaluateException()
+            return value
+        elif isinstance(expr, ir0.NotExpr):
+            return ir0.Literal(not _get_literal_value(self._evaluate_non_variadic(expr.expr, env, local_names)))
+        elif isinstance(expr, ir0.UnaryMinusExpr):
+            return _int64_literal(-_get_literal_value(self._evaluate_non_variadic(expr.expr, env, local_names)))
+        elif isinstance(expr, ir0.ComparisonExpr):
+            lhs = _get_literal_value(self._evaluate_non_variadic(expr.lhs, env, local_names))
+            rhs = _get_literal_value(self._evaluate_non_variadic(expr.rhs, env, local_names))
+            return ir0.Literal(_COMPARISON_OPS[expr.op](lhs, rhs))
+        elif isinstance(expr, ir0.Int64BinaryOpExpr):
+            lhs = _get_literal_value(self._evaluate_non_variadic(expr.lhs, env, local_names))
+            rhs = _get_literal_value(self._evaluate_non_variadic(expr.rhs, env, local_names))
+            return _int64_literal(_evaluate_int64_binary_op(lhs, rhs, expr.op))
+        elif isinstance(expr, ir0.TemplateInstantiation):
+            template_expr = self._evaluate_non_variadic(expr.template_expr, env, local_names)
+            if not isinstance(template_expr, ir0.AtomicTypeLiteral):
+                raise CannotEvaluateException()
+            args = self._evaluate_args(expr.args, env, local_names)
+            return _create_template_instantiation(template_expr, args, expr.instantiation_might_trigger_static_asserts)
+        elif isinstance(expr, (ir0.PointerTypeExpr, ir0.ArrayTypeExpr)):
+            type_expr = self._evaluate_non_variadic(expr.type_expr, env, local_names)
+            if isinstance(_normalize_type(type_expr), (ir0.ReferenceTypeExpr, ir0.RvalueReferenceTypeExpr)):
+                # Pointers to references and arrays of references are ill-formed.
+                raise CannotEvaluateException()
+            return expr.__class__(type_expr)
+        elif isinstance(expr, (ir0.ReferenceTypeExpr, ir0.RvalueReferenceTypeExpr)):
+            type_expr = self._evaluate_non_variadic(expr.type_expr, env, local_names)
+            normalized_type_expr = _normalize_type(type_expr)
+            # Reference collapsing: e.g. T&& with T=int& is int&.
+            if isinstance(normalized_type_expr, ir0.ReferenceTypeExpr):
+                return type_expr
+            elif isinstance(normalized_type_expr, ir0.RvalueReferenceTypeExpr):
+                if isinstance(expr, ir0.RvalueReferenceTypeExpr):
+                    return type_expr
+                return ir0.ReferenceTypeExpr(normalized_type_expr.type_expr)
+            return expr.__class__(type_expr)
+        elif isinstance(expr, ir0.ConstTypeExpr):
+            type_expr = self._evaluate_non_variadic(expr.type_expr, env, local_names)
+            if not isinstance(_normalize_type(type_expr), (ir0.AtomicTypeLiteral, ir0.PointerTypeExpr,
+                                                           ir0.TemplateInstantiation)):
+                # E.g. "const" on a reference is ignored, we don't bother with these cases.
+                raise CannotEvaluateException()
+            return ir0.ConstTypeExpr(type_expr)
+        elif isinstance(expr, ir0.FunctionTypeExpr):
+            return_type_expr = self._evaluate_non_variadic(expr.return_type_expr, env, local_names)
+            if isinstance(_normalize_type(return_type_expr), (ir0.ArrayTypeExpr, ir0.FunctionTypeExpr)):
+                raise CannotEvaluateException()
+            return ir0.FunctionTypeExpr(return_type_expr=return_type_expr,
+                                        arg_exprs=self._evaluate_args(expr.arg_exprs, env, local_names))
+        else:
+            # E.g. a VariadicTypeExpansion outside of a list of template args.
+            raise CannotEvaluateException()
+
+    def instantiate(self, template_name: str, args: Tuple[ir0.Expr, ...]) -> Dict[str, ir0.Expr]:
+        '''Returns the members of the instantiation template_name<args...>, by name.'''
+        key = (template_name, tuple(args))
+        if key in self.members_by_instantiation:
+            members = self.members_by_instantiation[key]
+            if members is None:
+                raise CannotEvaluateException()
+            return members
+
+        self._step()
+        if self.instantiation_depth >= MAX_INSTANTIATION_DEPTH:
+            raise _MaxInstantiationDepthExceededException()
+        self.instantiation_depth += 1
+        try:
+            template_defn = self.template_defn_by_name.get(template_name)
+            if template_defn is not None:
+                members = self._instantiate_template_defn(template_defn, args)
+            elif template_name in _BUILTIN_TEMPLATES:
+                members = _BUILTIN_TEMPLATES[template_name](self, args)
+            else:
+                raise CannotEvaluateException()
+        except (_StepBudgetExceededException, _MaxInstantiationDepthExceededException):
+            # This might succeed with a bigger budget (or at a lower depth, e.g. when this instantiation is later
+            # reached from a shallower one), so we don't memoize it.
+            raise
+        except CannotEvaluateException:
+            self.members_by_instantiation[key] = None
+            raise
+        finally:
+            self.instantiation_depth -= 1
+        self.members_by_instantiation[key] = members
+        return members
+
+    def _step(self):
+        self.remaining_steps -= 1
+        if self.remaining_steps < 0:
+            raise _StepBudgetExceededException()
+
+    def _evaluate_non_variadic(self, expr: ir0.Expr, env: _Env, local_names: Set[str]) -> ir0.Expr:
+        value = self.evaluate(expr, env, local_names)
+        if isinstance(value, tuple):
+            raise CannotEvaluateException()
+        return value
+
+    def _evaluate_type_literal(self, type_literal: ir0.AtomicTypeLiteral, env: _Env, local_names: Set[str]):
+        value = env.get(type_literal.cpp_type)
+        if value is not None:
+            return value
+        if type_literal.is_local or any(identifier in local_names
+                                        for identifier in type_literal.tokenized_cpp_type.slots_by_identifier):
+            # This depends on a template parameter (or on a local var whose value is not known).
+            raise CannotEvaluateException()
+        return type_literal
+
+    def _evaluate_args(self, args: Tuple[ir0.Expr, ...], env: _Env, local_names: Set[str]) -> Tuple[ir0.Expr, ...]:
+        result = []  # type: List[ir0.Expr]
+        for arg in args:
+            if not isinstance(arg, ir0.VariadicTypeExpansion):
+                result.append(self._evaluate_non_variadic(arg, env, local_names))
+                continue
+            # The variadic vars (i.e. the ones bound to a list of values) expanded in this arg.
+            variadic_values_by_name = {identifier: env[identifier]
+                                       for identifier in arg.expr.get_referenced_identifiers()
+                                       if isinstance(env.get(identifier), tuple)}
+            if not variadic_values_by_name:
+                raise CannotEvaluateException()
+            lengths = {len(values) for values in variadic_values_by_name.values()}
+            if len(lengths) != 1:
+                raise CannotEvaluateException()
+            [length] = lengths
+            for i in range(length):
+                elem_env = env.copy()
+                for name, values in variadic_values_by_name.items():
+                    elem_env[name] = values[i]
+                result.append(self._evaluate_non_variadic(arg.expr, elem_env, local_names))
+        return tuple(result)
+
+    def _instantiate_template_defn(self, template_defn: ir0.TemplateDefn, args: Tuple[ir0.Expr, ...]):
+        # As in C++, if a single specialization matches it's used, and if none does the main definition is used. We
+        # don't implement the partial ordering of specializations, so the evaluation fails if more than one matches.
+        matches = []  # type: List[Tuple[ir0.TemplateSpecialization, _Env]]
+        for specialization in template_defn.specializations:
+            env = _match_patterns(specialization, args, self.template_defn_by_name)
+            if env is not None:
+                matches.append((specialization, env))
+        if len(matches) > 1:
+            raise CannotEvaluateException()
+        elif matches:
+            [(specialization, env)] = matches
+        elif template_defn.main_definition is not None:
+            specialization = template_defn.main_definition
+            env = _bind_args(specialization.args, args)
+        else:
+            # This would be an instantiation of an incomplete type.
+            raise CannotEvaluateException()
+
+        local_names = {arg_decl.name for arg_decl in specialization.args if arg_decl.name}
+        local_names.update(elem.name
+                           for elem in specialization.body
+                           if isinstance(elem, (ir0.ConstantDef, ir0.Typedef, ir0.TemplateDefn)))
+        members = dict()  # type: Dict[str, ir0.Expr]
+        for elem in specialization.body:
+            if isinstance(elem, (ir0.ConstantDef, ir0.Typedef)):
+                value = self._evaluate_non_variadic(elem.expr, env, local_names)
+                env[elem.name] = value
+                members[elem.name] = value
+            elif isinstance(elem, ir0.StaticAssert):
+                value = self._evaluate_non_variadic(elem.expr, env, local_names)
+                if _get_literal_value(value) is not True:
+                    # The instantiation would fail, the C++ compiler will report the error.
+                    raise CannotEvaluateException()
+            else:
+                # E.g. an inner template.
+                raise CannotEvaluateException()
+        return members
+
+class _StepBudgetExceededException(CannotEvaluateException):
+    pass
+
+class _MaxInstantiationDepthExceededException(CannotEvaluateException):
+    pass
+
+def _get_literal_value(value: ir0.Expr) -> Union[bool, int]:
+    if not isinstance(value, ir0.Literal):
+        raise CannotEvaluateException()
+    return value.value
+
+def _int64_literal(n: int):
+    if not _MIN_INT64 <= n <= _MAX_INT64:
+        # Overflows are compilation errors in constant expressions.
+        raise CannotEvaluateException()
+    return ir0.Literal(n)
+
+_COMPARISON_OPS = {
+    '==': lambda x, y: x == y,
+    '!=': lambda x, y: x != y,
+    '<': lambda x, y: x < y,
+    '>': lambda x, y: x > y,
+    '<=': lambda x, y: x <= y,
+    '>=': lambda x, y: x >= y,
+}
+
+def _evaluate_int64_binary_op(lhs: int, rhs: int, op: str):
+    if op == '+':
+        return lhs + rhs
+    elif op == '-':
+        return lhs - rhs
+    elif op == '*':
+        return lhs * rhs
+    if rhs == 0:
+        raise CannotEvaluateException()
+    # C++ rounds the quotient towards zero.
+    quotient = abs(lhs) // abs(rhs)
+    if (lhs < 0) != (rhs < 0):
+        quotient = -quotient
+    if op == '/':
+        return quotient
+    elif op == '%':
+        return lhs - rhs * quotient
+    else:
+        raise NotImplementedError('Unexpected op: %s' % op)
+
+def _create_template_instantiation(template_expr: ir0.AtomicTypeLiteral,
+                                  args: Tuple[ir0.Expr, ...],
+                                  instantiation_might_trigger_static_asserts: bool):
+    argtypes = template_expr.type.argtypes
+    if (len(argtypes) != len(args)
+            and not any(argtype.kind == ir0.ExprKind.VARIADIC_TYPE for argtype in argtypes)):
+        # This happens when expanding a variadic var, e.g. in List<Ts...>.
+        template_expr = ir0.AtomicTypeLiteral.for_nonlocal_template(
+            cpp_type=template_expr.cpp_type,
+            arg_types=[arg.type for arg in args],
+            is_metafunction_that_may_return_error=template_expr.is_metafunction_that_may_return_error)
+    return ir0.TemplateInstantiation(template_expr=template_expr,
+                                     args=args,
+                                     instantiation_might_trigger_static_asserts=instantiation_might_trigger_static_asserts)
+
+def _normalize_type(value: ir0.Expr) -> ir0.Expr:
+    '''Converts compound AtomicTypeLiterals like "int*" to the equivalent type expr (only at the outer level).'''
+    if isinstance(value, ir0.AtomicTypeLiteral) and value.type.kind == ir0.ExprKind.TYPE:
+        cpp_type = value.cpp_type.strip()
+        for suffix, type_expr_class in (('&&', ir0.RvalueReferenceTypeExpr),
+                                        ('&', ir0.ReferenceTypeExpr),
+                                        ('*', ir0.PointerTypeExpr)):
+            if cpp_type.endswith(suffix) and cpp_type[:-len(suffix)].strip():
+                return type_expr_class(ir0.AtomicTypeLiteral.for_nonlocal_type(cpp_type[:-len(suffix)].strip()))
+    return value
+
+def _is_known_class_template(template_name: str, template_defn_by_name: Dict[str, ir0.TemplateDefn]):
+    return template_name in template_defn_by_name or template_name in _LIST_TEMPLATE_NAMES
+
+def _get_type_kind(value: ir0.Expr, template_defn_by_name: Dict[str, ir0.TemplateDefn]):
+    '''Returns an object that identifies the kind of the type value, or None if it's not known.
+
+    Types of different kinds are always different.
+    '''
+    if isinstance(value, ir0.AtomicTypeLiteral):
+        if value.cpp_type in _FUNDAMENTAL_TYPES:
+            return value.cpp_type
+        # This might be a typedef for any type.
+        return None
+    elif isinstance(value, ir0.TemplateInstantiation):
+        if (isinstance(value.template_expr, ir0.AtomicTypeLiteral)
+                and _is_known_class_template(value.template_expr.cpp_type, template_defn_by_name)):
+            return value.template_expr.cpp_type
+        # This might be an alias template.
+        return None
+    elif isinstance(value, (ir0.PointerTypeExpr, ir0.ReferenceTypeExpr, ir0.RvalueReferenceTypeExpr,
+                            ir0.ArrayTypeExpr, ir0.FunctionTypeExpr)):
+        return value.__class__
+    else:
+        return None
+
+def types_equal(value1: ir0.Expr,
+                value2: ir0.Expr,
+                template_defn_by_name: Dict[str, ir0.TemplateDefn]) -> Optional[bool]:
+    '''Compares two values. Returns None if it's not known whether they're equal (e.g. for "Foo" and "Bar").'''
+    if value1 == value2:
+        return True
+    if isinstance(value1, ir0.Literal) and isinstance(value2, ir0.Literal):
+        return value1.value == value2.value
+    value1 = _normalize_type(value1)
+    value2 = _normalize_type(value2)
+    if value1 == value2:
+        return True
+    kind1 = _get_type_kind(value1, template_defn_by_name)
+    kind2 = _get_type_kind(value2, template_defn_by_name)
+    if kind1 is None or kind2 is None:
+        return None
+    if kind1 != kind2:
+        return False
+    if isinstance(value1, ir0.AtomicTypeLiteral):
+        return value1.cpp_type == value2.cpp_type
+    elif isinstance(value1, ir0.TemplateInstantiation):
+        exprs1 = value1.args
+        exprs2 = value2.args
+    elif isinstance(value1, ir0.FunctionTypeExpr):
+        exprs1 = (value1.return_type_expr,) + value1.arg_exprs
+        exprs2 = (value2.return_type_expr,) + value2.arg_exprs
+    else:
+        exprs1 = (value1.type_expr,)
+        exprs2 = (value2.type_expr,)
+    return _all_equal(exprs1, exprs2, template_defn_by_name)
+
+def _all_equal(exprs1: Tuple[ir0.Expr, ...],
+               exprs2: Tuple[ir0.Expr, ...],
+               template_defn_by_name: Dict[str, ir0.TemplateDefn]) -> Optional[bool]:
+    if len(exprs1) != len(exprs2):
+        return False
+    result = True  # type: Optional[bool]
+    for expr1, expr2 in zip(exprs1, exprs2):
+        if expr1.type.kind != expr2.type.kind:
+            return False
+        equal = types_equal(expr1, expr2, template_defn_by_name)
+        if equal is False:
+            return False
+        elif equal is None:
+            result = None
+    return result
+
+def _bind_args(arg_decls: Tuple[ir0.TemplateArgDecl, ...], args: Tuple[ir0.Expr, ...]) -> _Env:
+    env = dict()  # type: _Env
+    if arg_decls and arg_decls[-1].type.kind == ir0.ExprKind.VARIADIC_TYPE:
+        num_non_variadic_args = len(arg_decls) - 1
+        if len(args) < num_non_variadic_args:
+            raise CannotEvaluateException()
+        if arg_decls[-1].name:
+            env[arg_decls[-1].name] = tuple(args[num_non_variadic_args:])
+    elif len(args) != len(arg_decls):
+        raise CannotEvaluateException()
+    for arg_decl, arg in zip(arg_decls[:len(args)], args):
+        if arg_decl.type.kind == ir0.ExprKind.VARIADIC_TYPE:
+            break
+        if arg_decl.name:
+            env[arg_decl.name] = arg
+    return env
+
+def _match_patterns(specialization: ir0.TemplateSpecialization,
+                    args: Tuple[ir0.Expr, ...],
+                    template_defn_by_name: Dict[str, ir0.TemplateDefn]) -> Optional[_Env]:
+    '''Returns the values of the specialization's args if the specialization matches the args, or None if it doesn't.'''
+    arg_names = {arg_decl.name for arg_decl in specialization.args}
+    variadic_arg_names = {arg_decl.name
+                          for arg_decl in specialization.args
+                          if arg_decl.type.kind == ir0.ExprKind.VARIADIC_TYPE}
+    env = dict()  # type: _Env
+    if _match_list(specialization.patterns, args, arg_names, variadic_arg_names, env, template_defn_by_name):
+        return env
+    return None
+
+def _match_list(patterns: Tuple[ir0.Expr, ...],
+                values: Tuple[ir0.Expr, ...],
+                arg_names: Set[str],
+                variadic_arg_names: Set[str],
+                env: _Env,
+                template_defn_by_name: Dict[str, ir0.TemplateDefn]) -> bool:
+    if patterns and isinstance(patterns[-1], ir0.VariadicTypeExpansion):
+        variadic_pattern = patterns[-1].expr
+        if not (isinstance(variadic_pattern, ir0.AtomicTypeLiteral) and variadic_pattern.cpp_type in variadic_arg_names):
+            raise CannotEvaluateException()
+        patterns = patterns[:-1]
+        if len(values) < len(patterns):
+            return False
+        variadic_values = tuple(values[len(patterns):])
+        values = values[:len(patterns)]
+        if not _bind_pattern_var(variadic_pattern.cpp_type, variadic_values, env, template_defn_by_name):
+            return False
+    elif len(patterns) != len(values):
+        return False
+
+    result = True
+    for pattern, value in zip(patterns, values):
+        if isinstance(pattern, ir0.VariadicTypeExpansion) or isinstance(value, ir0.VariadicTypeExpansion):
+            raise CannotEvaluateException()
+        # We go on even if there's no match, since we need to raise if the result for a later pattern is unknown.
+        if not _match(pattern, value, arg_names, variadic_arg_names, env, template_defn_by_name):
+            result = False
+    return result
+
+def _bind_pattern_var(name: str,
+                      value: Union[ir0.Expr, _VariadicValue],
+                      env: _Env,
+                      template_defn_by_name: Dict[str, ir0.TemplateDefn]):
+    if name not in env:
+        env[name] = value
+        return True
+    previous_value = env[name]
+    if isinstance(value, tuple) or isinstance(previous_value, tuple):
+        if not (isinstance(value, tuple) and isinstance(previous_value, tuple)):
+            raise CannotEvaluateException()
+        equal = _all_equal(previous_value, value, template_defn_by_name)
+    else:
+        equal = types_equal(previous_value, value, template_defn_by_name)
+    if equal is None:
+        raise CannotEvaluateException()
+    return equal
+
+def _match(pattern: ir0.Expr,
+           value: ir0.Expr,
+           arg_names: Set[str],
+           variadic_arg_names: Set[str],
+           env: _Env,
+           template_defn_by_name: Dict[str, ir0.TemplateDefn]) -> bool:
+    '''Returns whether the value matches the pattern, binding the specialization's args in env.
+
+    Raises CannotEvaluateException if it's not known whether the value matches.
+    '''
+    if isinstance(pattern, ir0.AtomicTypeLiteral) and pattern.cpp_type in arg_names:
+        if pattern.cpp_type in variadic_arg_names:
+            raise CannotEvaluateException()
+        return _bind_pattern_var(pattern.cpp_type, value, env, template_defn_by_name)
+
+    if not pattern.references_any_of(arg_names) and not any(identifier in arg_names
+                                                            for identifier in pattern.get_referenced_identifiers()):
+        equal = types_equal(pattern, value, template_defn_by_name)
+        if equal is None:
+            raise CannotEvaluateException()
+        return equal
+
+    value = _normalize_type(value)
+    if isinstance(pattern, (ir0.PointerTypeExpr, ir0.ReferenceTypeExpr, ir0.RvalueReferenceTypeExpr,
+                            ir0.ArrayTypeExpr, ir0.FunctionTypeExpr, ir0.TemplateInstantiation)):
+        pattern_kind = _get_type_kind(pattern, template_defn_by_name)
+        value_kind = _get_type_kind(value, template_defn_by_name)
+        if pattern_kind is None or value_kind is None:
+            raise CannotEvaluateException()
+        if pattern_kind != value_kind:
+            return False
+        if isinstance(pattern, ir0.TemplateInstantiation):
+            return _match_list(pattern.args, value.args, arg_names, variadic_arg_names, env, template_defn_by_name)
+        elif isinstance(pattern, ir0.FunctionTypeExpr):
+            return (_match(pattern.return_type_expr, value.return_type_expr, arg_names, variadic_arg_names, env,
+                           template_defn_by_name)
+                    and _match_list(pattern.arg_exprs, value.arg_exprs, arg_names, variadic_arg_names, env,
+                                    template_defn_by_name))
+        else:
+            return _match(pattern.type_expr, value.type_expr, arg_names, variadic_arg_names, env, template_defn_by_name)
+
+    # E.g. a compound AtomicTypeLiteral referencing the args, or a ConstTypeExpr.
+    raise CannotEvaluateException()
+
+def _get_list_elems(value: ir0.Expr, list_template_name: str) -> Tuple[ir0.Expr, ...]:
+    if not (isinstance(value, ir0.TemplateInstantiation)
+            and isinstance(value.template_expr, ir0.AtomicTypeLiteral)
+            and value.template_expr.cpp_type == list_template_name):
+        raise CannotEvaluateException()
+    return value.args
+
+def _create_list(list_template_name: str, elems: Tuple[ir0.Expr, ...]):
+    elem_type = _LIST_ELEM_TYPE_BY_LIST_TEMPLATE_NAME[list_template_name]
+    return ir0.TemplateInstantiation(template_expr=ir0.AtomicTypeLiteral.for_nonlocal_template(cpp_type=list_template_name,
+                                                                                               arg_types=[elem_type] * len(elems),
+                                                                                               is_metafunction_that_may_return_error=False),
+                                     args=elems,
+                                     instantiation_might_trigger_static_asserts=False)
+
+def _is_in_set(evaluator: Evaluator, elems: Tuple[ir0.Expr, ...], value: ir0.Expr) -> bool:
+    result = False
+    for elem in elems:
+        equal = types_equal(elem, value, evaluator.template_defn_by_name)
+        if equal is True:
+            return True
+        elif equal is None:
+            result = None
+    if result is None:
+        raise CannotEvaluateException()
+    return result
+
+def _add_to_set(evaluator: Evaluator, list_template_name: str, s: ir0.Expr, value: ir0.Expr):
+    elems = _get_list_elems(s, list_template_name)
+    if _is_in_set(evaluator, elems, value):
+        return s
+    return _create_list(list_template_name, elems + (value,))
+
+def _is_void(evaluator: Evaluator, value: ir0.Expr):
+    equal = types_equal(value, ir0.AtomicTypeLiteral.for_nonlocal_type('void'), evaluator.template_defn_by_name)
+    if equal is None:
+        raise CannotEvaluateException()
+    return equal
+
+def _get_first_error(evaluator: Evaluator, errors: Tuple[ir0.Expr, ...]):
+    for error in errors:
+        if not _is_void(evaluator, error):
+            return error
+    return ir0.AtomicTypeLiteral.for_nonlocal_type('void')
+
+def _int64_list_sum(elems: Tuple[ir0.Expr, ...]):
+    # The sum is computed from the last element, as in tmppy.h (so that intermediate overflows are detected too).
+    result = 0
+    for elem in reversed(elems):
+        result = _get_literal_value(_int64_literal(result + _get_literal_value(elem)))
+    return ir0.Literal(result)
+
+def _create_transform_list_template(list_template_name: str, result_list_template_name: str):
+    result_member_name = 'type' if result_list_template_name == 'List' else 'value'
+    def transform(evaluator: Evaluator, args: Tuple[ir0.Expr, ...]):
+        l, f = args
+        if not isinstance(f, ir0.AtomicTypeLiteral):
+            raise CannotEvaluateException()
+        errors = []
+        results = []
+        for elem in _get_list_elems(l, list_template_name):
+            members = evaluator.instantiate(f.cpp_type, (elem,))
+            if 'error' not in members or result_member_name not in members:
+                raise CannotEvaluateException()
+            errors.append(members['error'])
+            results.append(members[result_member_name])
+        return {'error': _get_first_error(evaluator, tuple(errors)),
+                'type': _create_list(result_list_template_name, tuple(results))}
+    return transform
+
+def _create_list_to_set_template(list_template_name: str):
+    def list_to_set(evaluator: Evaluator, args: Tuple[ir0.Expr, ...]):
+        [l] = args
+        s = _create_list(list_template_name, ())
+        for elem in _get_list_elems(l, list_template_name):
+            s = _add_to_set(evaluator, list_template_name, s, elem)
+        return {'type': s}
+    return list_to_set
+
+def _create_set_equals_template(list_template_name: str):
+    def set_equals(evaluator: Evaluator, args: Tuple[ir0.Expr, ...]):
+        elems1, elems2 = (_get_list_elems(arg, list_template_name) for arg in args)
+        # We must check all elems (even after finding one that's not in the other set), since the result might not be
+        # known for some of them.
+        results = [_is_in_set(evaluator, elems2, elem) for elem in elems1]
+        results += [_is_in_set(evaluator, elems1, elem) for elem in elems2]
+        return {'value': ir0.Literal(all(results))}
+    return set_equals
+
+def _is_same(evaluator: Evaluator, args: Tuple[ir0.Expr, ...]):
+    value1, value2 = args
+    equal = types_equal(value1, value2, evaluator.template_defn_by_name)
+    if equal is None:
+        raise CannotEvaluateException()
+    return {'value': ir0.Literal(equal)}
+
+def _create_concat_template(list_template_name: str):
+    def concat(evaluator: Evaluator, args: Tuple[ir0.Expr, ...]):
+        l1, l2 = args
+        return {'type': _create_list(list_template_name,
+                                     _get_list_elems(l1, list_template_name) + _get_list_elems(l2, list_template_name))}
+    return concat
+
+# The templates of the standard library and of tmppy.h that the evaluator knows about. Each one is a function that
+# takes the evaluator and the template args, and returns the members of the instantiation.
+_BUILTIN_TEMPLATES = {
+    'std::is_same': _is_same,
+    'AlwaysTrueFromBool': lambda evaluator, args: {'value': ir0.Literal(True)},
+    'AlwaysTrueFromInt64': lambda evaluator, args: {'value': ir0.Literal(True)},
+    'AlwaysTrueFromType': lambda evaluator, args: {'value': ir0.Literal(True)},
+    'AlwaysFalseFromType': lambda evaluator, args: {'value': ir0.Literal(False)},
+    'TypeListConcat': _create_concat_template('List'),
+    'Int64ListConcat': _create_concat_template('Int64List'),
+    'BoolListConcat': _create_concat_template('BoolList'),
+    'Int64ListSum': lambda evaluator, args: {'value': _int64_list_sum(_get_list_elems(args[0], 'Int64List'))},
+    'BoolListAll': lambda evaluator, args: {'value': ir0.Literal(all(_get_literal_value(elem)
+                                                                     for elem in _get_list_elems(args[0], 'BoolList')))},
+    'BoolListAny': lambda evaluator, args: {'value': ir0.Literal(any(_get_literal_value(elem)
+                                                                     for elem in _get_list_elems(args[0], 'BoolList')))},
+    'GetFirstError': lambda evaluator, args: {'type': _get_first_error(evaluator, args)},
+    'AddToBoolSet': lambda evaluator, args: {'type': _add_to_set(evaluator, 'BoolList', *args)},
+    'AddToInt64Set': lambda evaluator, args: {'type': _add_to_set(evaluator, 'Int64List', *args)},
+    'AddToTypeSet': lambda evaluator, args: {'type': _add_to_set(evaluator, 'List', *args)},
+    'IsInBoolSet': lambda evaluator, args: {'value': ir0.Literal(_is_in_set(evaluator, _get_list_elems(args[0], 'BoolList'), args[1]))},
+    'IsInInt64Set': lambda evaluator, args: {'value': ir0.Literal(_is_in_set(evaluator, _get_list_elems(args[0], 'Int64List'), args[1]))},
+    'IsInTypeSet': lambda evaluator, args: {'value': ir0.Literal(_is_in_set(evaluator, _get_list_elems(args[0], 'List'), args[1]))},
+    'BoolSetEquals': _create_set_equals_template('BoolList'),
+    'Int64SetEquals': _create_set_equals_template('Int64List'),
+    'TypeSetEquals': _create_set_equals_template('List'),
+    'BoolListToSet': _create_list_to_set_template('BoolList'),
+    'Int64ListToSet': _create_list_to_set_template('Int64List'),
+    'TypeListToSet': _create_list_to_set_template('List'),
+}  # type: Dict[str, Callable[[Evaluator, Tuple[ir0.Expr, ...]], Dict[str, ir0.Expr]]]
+
+for _select_1st_kind in ('Bool', 'Int64', 'Type'):
+    for _select_2nd_kind in ('Bool', 'Int64', 'Type'):
+        _BUILTIN_TEMPLATES['Select1st%s%s' % (_select_1st_kind, _select_2nd_kind)] = lambda evaluator, args: {'value': args[0]}
+
+for _list_template_name, _kind in (('BoolList', 'Bool'), ('Int64List', 'Int64'), ('List', 'Type')):
+    for _result_list_template_name, _result_kind in (('BoolList', 'Bool'), ('Int64List', 'Int64'), ('List', 'Type')):
+        _BUILTIN_TEMPLATES['Transform%sListTo%sList' % (_kind, _result_kind)] = _create_transform_list_template(
+            _list_template_name, _result_list_template_name)
@@ -0,0 +1,301 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict, Union, Tuple, List, Set, Callable, Any, Optional
+
+import networkx as nx
+
+from _py2tmp import ir0, transform_ir0
+from _py2tmp.optimize_ir0 import compute_template_dependency_graph
+
+class SizePolynomial:
+    '''A polynomial with non-negative coefficients in n, the size of the arguments of a metafunction.
+
+    n is the length of the lists (and sets) passed to the metafunction, or the depth of the recursion for recursive
+    metafunctions (that usually also depends on the values of the arguments).
+    '''
+    __slots__ = ('coefficients',)
+
+    def __init__(self, coefficients: Tuple[int, ...]):
+        # coefficients[i] is the coefficient of n^i.
+        coefficients = tuple(coefficients)
+        while coefficients and coefficients[-1] == 0:
+            coefficients = coefficients[:-1]
+        self.coefficients = coefficients
+
+    @staticmethod
+    def constant(value: int) -> 'SizePolynomial':
+        return SizePolynomial((value,))
+
+    @property
+    def degree(self) -> int:
+        return max(len(self.coefficients) - 1, 0)
+
+    def evaluate(self, n: int) -> int:
+        return sum(coefficient * n ** degree for degree, coefficient in enumerate(self.coefficients))
+
+    def max(self, other: 'SizePolynomial') -> 'SizePolynomial':
+        '''An upper bound for both polynomials (the coefficient-wise maximum).'''
+        length = max(len(self.coefficients), len(other.coefficients))
+        return SizePolynomial(tuple(max(self._coefficient(i), other._coefficient(i)) for i in range(length)))
+
+    def _coefficient(self, degree: int):
+        return self.coefficients[degree] if degree < len(self.coefficients) else 0
+
+    def __add__(self, other: Union['SizePolynomial', int]) -> 'SizePolynomial':
+        if isinstance(other, int):
+            other = SizePolynomial.constant(other)
+        length = max(len(self.coefficients), len(other.coefficients))
+        return SizePolynomial(tuple(self._coefficient(i) + other._coefficient(i) for i in range(length)))
+
+    __radd__ = __add__
+
+    def __mul__(self, other: Union['SizePolynomial', int]) -> 'SizePolynomial':
+        if isinstance(other, int):
+            other = SizePolynomial.constant(other)
+        coefficients = [0] * (len(self.coefficients) + len(other.coefficients))
+        for i, coefficient1 in enumerate(self.coefficients):
+            for j, coefficient2 in enumerate(other.coefficients):
+                coefficients[i + j] += coefficient1 * coefficient2
+        return SizePolynomial(tuple(coefficients))
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        return isinstance(other, SizePolynomial) and self.coefficients == other.coefficients
+
+    def __hash__(self):
+        return hash(self.coefficients)
+
+    def __str__(self):
+        terms = []
+        for degree, coefficient in reversed(list(enumerate(self.coefficients))):
+            if coefficient == 0:
+                continue
+            if degree == 0:
+                terms.append(str(coefficient))
+                continue
+            variable = 'n' if degree == 1 else 'n^%s' % degree
+            terms.append(variable if coefficient == 1 else '%s*%s' % (coefficient, variable))
+        return ' + '.join(terms) or '0'
+
+    def __repr__(self):
+        return 'SizePolynomial(%s)' % str(self)
+
+_N = SizePolynomial((0, 1))
+
+class InstantiationCost:
+    '''The estimated cost of instantiating a class template, including the instantiations that it triggers.'''
+    def __init__(self, num_instantiations: SizePolynomial, max_depth: SizePolynomial):
+        # The number of distinct class template instantiations.
+        self.num_instantiations = num_instantiations
+        # The maximum nesting of the instantiations, that the C++ compiler limits (e.g. with -ftemplate-depth).
+        self.max_depth = max_depth
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'num_instantiations': str(self.num_instantiations),
+            'num_instantiations_coefficients': list(self.num_instantiations.coefficients),
+            'max_depth': str(self.max_depth),
+            'max_depth_coefficients': list(self.max_depth.coefficients),
+        }
+
+    def __repr__(self):
+        return 'InstantiationCost(num_instantiations=%s, max_depth=%s)' % (self.num_instantiations, self.max_depth)
+
+_UNIT_COST = InstantiationCost(SizePolynomial.constant(1), SizePolynomial.constant(1))
+
+# These are only declared (see tmppy.h), so they're never instantiated.
+_DECLARED_ONLY_TEMPLATE_NAMES = ('List', 'BoolList', 'Int64List')
+
+def _transform_cost(fun_cost: InstantiationCost):
+    # The template itself, F<x> for each element and the GetFirstError<...> chain over the errors.
+    return InstantiationCost(1 + _N * fun_cost.num_instantiations + _N,
+                             1 + _N.max(fun_cost.max_depth))
+
+def _fold_cost(fun_cost: InstantiationCost):
+    # A Fold*ToType<...> and an F<...> for each element, with nested Fold*ToType<...> instantiations.
+    return InstantiationCost(_N * (1 + fun_cost.num_instantiations),
+                             _N + fun_cost.max_depth)
+
+_ADD_TO_BOOL_OR_INT64_SET_COST = InstantiationCost(SizePolynomial.constant(2), SizePolynomial.constant(2))
+# The helper, and std::is_same<> plus AlwaysFalseFromType<> for each element.
+_ADD_TO_TYPE_SET_COST = InstantiationCost(2 + 2 * _N, SizePolynomial.constant(2))
+_IS_IN_BOOL_OR_INT64_SET_COST = InstantiationCost(SizePolynomial.constant(2), SizePolynomial.constant(2))
+_IS_IN_TYPE_SET_COST = InstantiationCost(2 + 2 * _N, SizePolynomial.constant(2))
+
+def _set_equals_cost(is_in_set_cost: InstantiationCost):
+    # An Is*InSet<...> for each element of each set, plus std::is_same<> and (for types) AlwaysTrueFromType<>.
+    return InstantiationCost(2 + 2 * _N * is_in_set_cost.num_instantiations + 2 * _N,
+                             1 + is_in_set_cost.max_depth)
+
+def _list_to_set_cost(add_to_set_cost: InstantiationCost):
+    fold_cost = _fold_cost(add_to_set_cost)
+    return InstantiationCost(1 + fold_cost.num_instantiations, 1 + fold_cost.max_depth)
+
+# The cost of the templates in tmppy.h, as a function of the cost of the template passed as the second argument (if
+# any). Other templates that are not defined in the header (e.g. std::is_same) are assumed to cost a single
+# instantiation.
+_BUILTIN_TEMPLATE_COSTS = {
+    'GetFirstError': lambda fun_cost: InstantiationCost(_N, _N),
+    'Int64ListSum': lambda fun_cost: InstantiationCost(1 + _N, 1 + _N),
+    'BoolListAll': lambda fun_cost: _IS_IN_BOOL_OR_INT64_SET_COST,
+    'BoolListAny': lambda fun_cost: _IS_IN_BOOL_OR_INT64_SET_COST,
+    'AddToBoolSet': lambda fun_cost: _ADD_TO_BOOL_OR_INT64_SET_COST,
+    'AddToInt64Set': lambda fun_cost: _ADD_TO_BOOL_OR_INT64_SET_COST,
+    'AddToTypeSet': lambda fun_cost: _ADD_TO_TYPE_SET_COST,
+    'IsInBoolSet': lambda fun_cost: _IS_IN_BOOL_OR_INT64_SET_COST,
+    'IsInInt64Set': lambda fun_cost: _IS_IN_BOOL_OR_INT64_SET_COST,
+    'IsInTypeSet': lambda fun_cost: _IS_IN_TYPE_SET_COST,
+    'BoolSetEquals': lambda fun_cost: _set_equals_cost(_IS_IN_BOOL_OR_INT64_SET_COST),
+    'Int64SetEquals': lambda fun_cost: _set_equals_cost(_IS_IN_BOOL_OR_INT64_SET_COST),
+    'TypeSetEquals': lambda fun_cost: _set_equals_cost(_IS_IN_TYPE_SET_COST),
+    'FoldBoolsToType': _fold_cost,
+    'FoldInt64sToType': _fold_cost,
+    'FoldTypesToType': _fold_cost,
+    'BoolListToSet': lambda fun_cost: _list_to_set_cost(_ADD_TO_BOOL_OR_INT64_SET_COST),
+    'Int64ListToSet': lambda fun_cost: _list_to_set_cost(_ADD_TO_BOOL_OR_INT64_SET_COST),
+    'TypeListToSet': lambda fun_cost: _list_to_set_cost(_ADD_TO_TYPE_SET_COST),
+}  # type: Dict[str, Callable[[InstantiationCost], InstantiationCost]]
+for _elem_kind in ('Bool', 'Int64', 'Type'):
+    for _result_elem_kind in ('Bool', 'Int64', 'Type'):
+        _BUILTIN_TEMPLATE_COSTS['Transform%sListTo%sList' % (_elem_kind, _result_elem_kind)] = _transform_cost
+
+class _TemplateInstantiationsCollector(transform_ir0.Transformation):
+    def __init__(self):
+        super().__init__()
+        self.template_instantiations = []  # type: List[ir0.TemplateInstantiation]
+
+    def transform_template_instantiation(self,
+                                         template_instantiation: ir0.TemplateInstantiation,
+                                         writer: transform_ir0.Writer):
+        self.template_instantiations.append(template_instantiation)
+        return super().transform_template_instantiation(template_instantiation, writer)
+
+def _get_template_instantiations(specialization: ir0.TemplateSpecialization) -> List[ir0.TemplateInstantiation]:
+    '''Returns the distinct template instantiations in the specialization (including the ones in nested templates).'''
+    writer = transform_ir0.ToplevelWriter(identifier_generator=iter([]))
+    transformation = _TemplateInstantiationsCollector()
+    transformation.transform_template_specialization(specialization, writer)
+    # The C++ compiler instantiates each template only once for the same arguments.
+    template_instantiations = []
+    for template_instantiation in transformation.template_instantiations:
+        if template_instantiation not in template_instantiations:
+            template_instantiations.append(template_instantiation)
+    return template_instantiations
+
+def _get_referenced_template_name(expr: ir0.Expr) -> Optional[str]:
+    if isinstance(expr, ir0.AtomicTypeLiteral) and not expr.is_local and isinstance(expr.type, ir0.TemplateType):
+        return expr.cpp_type
+    if (isinstance(expr, ir0.ClassMemberAccess)
+            and isinstance(expr.type, ir0.TemplateType)
+            and isinstance(expr.expr, ir0.TemplateInstantiation)):
+        # E.g. HelperWrapper<X, Y>::Helper. The cost of HelperWrapper includes the instantiations in Helper.
+        return _get_referenced_template_name(expr.expr.template_expr)
+    return None
+
+def estimate_instantiation_costs(header: ir0.Header) -> Dict[str, InstantiationCost]:
+    '''Estimates the cost of instantiating each public template in the header, as a function of the argument sizes.
+
+    The cost of a template is computed from the template instantiations in its definition (taking the most expensive
+    specialization), adding the cost of the instantiated templates. The templates in tmppy.h are modeled based on their
+    definition, e.g. TransformTypeListToTypeList<L, F> instantiates F once for each element of L. Recursive templates
+    (and mutually-recursive ones) are assumed to recurse n times, each time with different arguments (since instantiations
+    with the same arguments are cached by the compiler).
+
+    This is only an estimate: e.g. templates passed as arguments to templates that are not in tmppy.h are assumed to be
+    instantiated once, and the cost of instantiating a template param is unknown, so it's assumed to be 1.
+    '''
+    template_defn_by_name = {template_defn.name: template_defn
+                             for template_defn in header.template_defns}
+    cost_by_template_name = dict()  # type: Dict[str, InstantiationCost]
+
+    def compute_body_cost(specialization: ir0.TemplateSpecialization, excluded_template_names: Set[str]):
+        '''Returns the cost of the instantiations in the specialization, excluding the recursive ones.'''
+        num_instantiations = SizePolynomial.constant(0)
+        max_depth = SizePolynomial.constant(0)
+        def add(cost: InstantiationCost):
+            nonlocal num_instantiations, max_depth
+            num_instantiations = num_instantiations + cost.num_instantiations
+            max_depth = max_depth.max(cost.max_depth)
+
+        for template_instantiation in _get_template_instantiations(specialization):
+            template_name = _get_referenced_template_name(template_instantiation.template_expr)
+            arg_template_names = [_get_referenced_template_name(arg) for arg in template_instantiation.args]
+            if template_name is None:
+                add(_UNIT_COST)
+            elif template_name in excluded_template_names or template_name in _DECLARED_ONLY_TEMPLATE_NAMES:
+                pass
+            elif template_name in cost_by_template_name:
+                add(cost_by_template_name[template_name])
+            elif template_name in _BUILTIN_TEMPLATE_COSTS:
+                fun_template_name = arg_template_names[1] if len(arg_template_names) >= 2 else None
+                fun_cost = cost_by_template_name.get(fun_template_name, _UNIT_COST)
+                add(_BUILTIN_TEMPLATE_COSTS[template_name](fun_cost))
+                # The function passed to the builtin template is already accounted for.
+                arg_template_names = [name for name in arg_template_names if name != fun_template_name]
+            else:
+                add(_UNIT_COST)
+            for arg_template_name in arg_template_names:
+                if arg_template_name in cost_by_template_name:
+                    add(cost_by_template_name[arg_template_name])
+        return num_instantiations, max_depth
+
+    template_dependency_graph = compute_template_dependency_graph(header.template_defns)
+    condensed_graph = nx.condensation(template_dependency_graph)
+    for connected_component_index in nx.topological_sort(condensed_graph, reverse=True):
+        connected_component = condensed_graph.node[connected_component_index]['members']
+        is_recursive = (len(connected_component) > 1
+                        or any(template_dependency_graph.has_edge(node, node) for node in connected_component))
+        excluded_template_names = connected_component if is_recursive else set()
+
+        # Each instantiation only uses one specialization, so we take the most expensive one.
+        body_costs = dict()  # type: Dict[str, Tuple[SizePolynomial, SizePolynomial]]
+        for template_name in connected_component:
+            template_defn = template_defn_by_name[template_name]
+            num_instantiations = SizePolynomial.constant(0)
+            max_depth = SizePolynomial.constant(0)
+            for specialization in ((template_defn.main_definition,) if template_defn.main_definition else ()) \
+                    + template_defn.specializations:
+                specialization_num_instantiations, specialization_max_depth = compute_body_cost(specialization,
+                                                                                                excluded_template_names)
+                num_instantiations = num_instantiations.max(specialization_num_instantiations)
+                max_depth = max_depth.max(specialization_max_depth)
+            body_costs[template_name] = (num_instantiations, max_depth)
+
+        if is_recursive:
+            # Each step of the recursion instantiates (at most) all the templates in the component once.
+            step_num_instantiations = sum((1 + num_instantiations for num_instantiations, _ in body_costs.values()),
+                                          SizePolynomial.constant(0))
+            max_body_depth = SizePolynomial.constant(0)
+            for _, max_depth in body_costs.values():
+                max_body_depth = max_body_depth.max(max_depth)
+            cost = InstantiationCost(_N * step_num_instantiations,
+                                     _N * len(connected_component) + max_body_depth)
+            for template_name in connected_component:
+                cost_by_template_name[template_name] = cost
+        else:
+            [template_name] = connected_component
+            num_instantiations, max_depth = body_costs[template_name]
+            cost_by_template_name[template_name] = InstantiationCost(1 + num_instantiations, 1 + max_depth)
+
+    return {template_defn.name: cost_by_template_name[template_defn.name]
+            for template_defn in header.template_defns
+            if template_defn.name in header.public_names
+            and not _is_check_if_error_template_name(template_defn.name)}
+
+def _is_check_if_error_template_name(template_name: str):
+    # The CheckIfError template (see ir1_to_ir0.ToplevelWriter) is public since the C++ code that uses the generated
+    # code refers to it, but it's not a metafunction.
+    return template_name == 'CheckIfError' or template_name.startswith('TmppyCheckIfError_')
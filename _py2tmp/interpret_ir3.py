@@ -0,0 +1,568 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''A reference interpreter for IR3, that executes TMPPy code directly instead of compiling the generated C++ code.
+
+The values are:
+* Python bools and ints, for bool and int.
+* Tuples for Type values, e.g. ('pointer', ('atomic', 'int')) for int*. These are normalized as the C++ compiler
+  would, e.g. a reference to a reference is collapsed into a single reference.
+* Tuples for lists and sets (without duplicates, in insertion order).
+* CustomTypeValue objects for custom types (including exceptions), FunctionValue objects for functions.
+
+Integer arithmetic and the selection of the branch of a match() follow the C++ semantics, so the interpreter gives the
+same results as the generated C++ code. When that's not possible (e.g. when comparing Type('size_t') and
+Type('unsigned long'), that might or might not be the same type, or on int64 overflow) the interpreter raises
+CannotInterpretException, and the code has to be compiled instead.
+
+Note that the interpreter doesn't check that the C++ types used in the code exist.
+'''
+
+from typing import Dict, List, Tuple, Optional, Any
+
+from _py2tmp import ir3
+
+class CannotInterpretException(Exception):
+    '''The code can't be interpreted exactly, it must be compiled to find out the result.'''
+
+class ProgramErrorException(Exception):
+    '''An assertion failed, an exception was not caught or a list unpacking failed.
+
+    In the generated C++ code, these errors are all reported as static_assert failures with the same message.
+    '''
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+class CustomTypeValue:
+    def __init__(self, type: ir3.CustomType, field_values: Tuple[Any, ...]):
+        self.type = type
+        self.field_values = field_values
+
+    def get_field_value(self, field_name: str):
+        for arg_decl, value in zip(self.type.arg_types, self.field_values):
+            if arg_decl.name == field_name:
+                return value
+        raise NotImplementedError('Unexpected field: %s' % field_name)
+
+class FunctionValue:
+    '''A global function or the constructor of a custom type.'''
+    def __init__(self, name: str):
+        self.name = name
+
+TypeValue = Tuple[Any, ...]
+
+# The recursion in TMPPy functions is limited, to avoid exceeding the Python recursion limit.
+MAX_CALL_DEPTH = 64
+
+_MIN_INT64 = -2**63
+_MAX_INT64 = 2**63 - 1
+
+# The fundamental types that can be written as a single identifier. These are known to be different from each other and
+# from any non-atomic type; other atomic types might be typedefs.
+_FUNDAMENTAL_TYPES = {
+    'void', 'bool', 'char', 'wchar_t', 'char16_t', 'char32_t', 'short', 'int', 'long', 'unsigned', 'float', 'double',
+}
+
+class _RaisedException(Exception):
+    def __init__(self, value: CustomTypeValue):
+        super().__init__()
+        self.value = value
+
+class _ReturnValue:
+    def __init__(self, value):
+        self.value = value
+
+_Env = Dict[str, Any]
+
+class Interpreter:
+    def __init__(self, module: ir3.Module):
+        self.function_defn_by_name = {function_defn.name: function_defn
+                                      for function_defn in module.function_defns}
+        self.custom_type_by_name = {custom_type.name: custom_type
+                                    for custom_type in module.custom_types}
+        self.custom_type_by_name.update((custom_type.name, custom_type)
+                                        for custom_type in module.imported_custom_types)
+        self.call_depth = 0
+
+    def check_assertions(self, assertions: List[ir3.Assert]):
+        '''Checks the toplevel assertions of the module, in order.
+
+        Raises ProgramErrorException if one of them fails (or raises an exception).
+        '''
+        for assertion in assertions:
+            try:
+                self.execute_stmts([assertion], env=dict())
+            except _RaisedException as e:
+                raise ProgramErrorException(e.value.type.exception_message)
+
+    def call_function(self, fun: FunctionValue, args: List[Any]):
+        custom_type = self.custom_type_by_name.get(fun.name)
+        if custom_type is not None:
+            return CustomTypeValue(custom_type, tuple(args))
+
+        function_defn = self.function_defn_by_name.get(fun.name)
+        if function_defn is None:
+            # E.g. a function imported from another module.
+            raise CannotInterpretException('The definition of %s is not available' % fun.name)
+        if self.call_depth >= MAX_CALL_DEPTH:
+            raise CannotInterpretException('Maximum call depth exceeded')
+        self.call_depth += 1
+        try:
+            result = self.execute_stmts(function_defn.body,
+                                        env={arg_decl.name: arg
+                                             for arg_decl, arg in zip(function_defn.args, args)})
+        finally:
+            self.call_depth -= 1
+        if result is None:
+            raise CannotInterpretException('%s returned without a value' % fun.name)
+        return result.value
+
+    def execute_stmts(self, stmts: List[ir3.Stmt], env: _Env) -> Optional[_ReturnValue]:
+        for stmt in stmts:
+            result = self.execute_stmt(stmt, env)
+            if result is not None:
+                return result
+        return None
+
+    def execute_stmt(self, stmt: ir3.Stmt, env: _Env) -> Optional[_ReturnValue]:
+        if isinstance(stmt, ir3.Assert):
+            if not self.evaluate(stmt.expr, env):
+                raise ProgramErrorException(_unescape_message(stmt.message))
+        elif isinstance(stmt, ir3.Assignment):
+            env[stmt.lhs.name] = self.evaluate(stmt.rhs, env)
+        elif isinstance(stmt, ir3.UnpackingAssignment):
+            values = self.evaluate(stmt.rhs, env)
+            if len(values) != len(stmt.lhs_list):
+                raise ProgramErrorException(_unescape_message(stmt.error_message))
+            for var, value in zip(stmt.lhs_list, values):
+                env[var.name] = value
+        elif isinstance(stmt, ir3.ReturnStmt):
+            return _ReturnValue(self.evaluate(stmt.expr, env))
+        elif isinstance(stmt, ir3.IfStmt):
+            if self.evaluate(stmt.cond_expr, env):
+                return self.execute_stmts(stmt.if_stmts, env)
+            else:
+                return self.execute_stmts(stmt.else_stmts, env)
+        elif isinstance(stmt, ir3.RaiseStmt):
+            raise _RaisedException(self.evaluate(stmt.expr, env))
+        elif isinstance(stmt, ir3.TryExcept):
+            try:
+                return self.execute_stmts(stmt.try_body, env)
+            except _RaisedException as e:
+                if e.value.type != stmt.caught_exception_type:
+                    raise
+                env[stmt.caught_exception_name] = e.value
+                return self.execute_stmts(stmt.except_body, env)
+        else:
+            raise NotImplementedError('Unexpected stmt: %s' % str(stmt.__class__))
+        return None
+
+    def evaluate(self, expr: ir3.Expr, env: _Env):
+        if isinstance(expr, ir3.VarReference):
+            if not expr.is_global_function:
+                return env[expr.name]
+            if expr.name not in self.function_defn_by_name and expr.name not in self.custom_type_by_name:
+                raise CannotInterpretException('The definition of %s is not available' % expr.name)
+            return FunctionValue(expr.name)
+        elif isinstance(expr, ir3.MatchExpr):
+            return self._evaluate_match_expr(expr, env)
+        elif isinstance(expr, ir3.BoolLiteral):
+            return expr.value
+        elif isinstance(expr, ir3.IntLiteral):
+            return _check_int64(expr.value)
+        elif isinstance(expr, (ir3.AtomicTypeLiteral,
+                               ir3.PointerTypeExpr,
+                               ir3.ReferenceTypeExpr,
+                               ir3.RvalueReferenceTypeExpr,
+                               ir3.ConstTypeExpr,
+                               ir3.ArrayTypeExpr,
+                               ir3.FunctionTypeExpr,
+                               ir3.TemplateInstantiationExpr)):
+            return self._evaluate_type_expr(expr, env, pattern_vars=dict())
+        elif isinstance(expr, ir3.TemplateMemberAccessExpr):
+            # We don't know what type this is, it might even not exist.
+            return ('template_member',
+                    self.evaluate(expr.class_type_expr, env),
+                    expr.member_name,
+                    self.evaluate(expr.arg_list_expr, env))
+        elif isinstance(expr, ir3.ListExpr):
+            return tuple(self.evaluate(elem_expr, env)
+                         for elem_expr in expr.elem_exprs)
+        elif isinstance(expr, ir3.SetExpr):
+            return _create_set((self.evaluate(elem_expr, env)
+                                for elem_expr in expr.elem_exprs),
+                               expr.elem_type)
+        elif isinstance(expr, (ir3.IntListSumExpr, ir3.IntSetSumExpr)):
+            return _check_int64(sum(self.evaluate(expr.list_expr if isinstance(expr, ir3.IntListSumExpr) else expr.set_expr,
+                                                  env)))
+        elif isinstance(expr, (ir3.BoolListAllExpr, ir3.BoolSetAllExpr)):
+            return all(self.evaluate(expr.list_expr if isinstance(expr, ir3.BoolListAllExpr) else expr.set_expr, env))
+        elif isinstance(expr, (ir3.BoolListAnyExpr, ir3.BoolSetAnyExpr)):
+            return any(self.evaluate(expr.list_expr if isinstance(expr, ir3.BoolListAnyExpr) else expr.set_expr, env))
+        elif isinstance(expr, ir3.FunctionCall):
+            fun = self.evaluate(expr.fun_expr, env)
+            args = [self.evaluate(arg, env) for arg in expr.args]
+            return self.call_function(fun, args)
+        elif isinstance(expr, ir3.EqualityComparison):
+            return values_equal(self.evaluate(expr.lhs, env), self.evaluate(expr.rhs, env), expr.lhs.type)
+        elif isinstance(expr, ir3.AttributeAccessExpr):
+            value = self.evaluate(expr.expr, env)
+            if isinstance(expr.expr.type, ir3.CustomType):
+                return value.get_field_value(expr.attribute_name)
+            # A member of a C++ type, e.g. T.type. We don't know what type this is.
+            return ('attribute', value, expr.attribute_name)
+        elif isinstance(expr, ir3.AndExpr):
+            return self.evaluate(expr.lhs, env) and self.evaluate(expr.rhs, env)
+        elif isinstance(expr, ir3.OrExpr):
+            return self.evaluate(expr.lhs, env) or self.evaluate(expr.rhs, env)
+        elif isinstance(expr, ir3.NotExpr):
+            return not self.evaluate(expr.expr, env)
+        elif isinstance(expr, ir3.IntComparisonExpr):
+            lhs = self.evaluate(expr.lhs, env)
+            rhs = self.evaluate(expr.rhs, env)
+            return {
+                '<': lambda: lhs < rhs,
+                '>': lambda: lhs > rhs,
+                '<=': lambda: lhs <= rhs,
+                '>=': lambda: lhs >= rhs,
+            }[expr.op]()
+        elif isinstance(expr, ir3.IntUnaryMinusExpr):
+            return _check_int64(-self.evaluate(expr.expr, env))
+        elif isinstance(expr, ir3.IntBinaryOpExpr):
+            return _evaluate_int_binary_op(self.evaluate(expr.lhs, env), self.evaluate(expr.rhs, env), expr.op)
+        elif isinstance(expr, ir3.ListConcatExpr):
+            return self.evaluate(expr.lhs, env) + self.evaluate(expr.rhs, env)
+        elif isinstance(expr, ir3.ListComprehension):
+            return tuple(self.evaluate(expr.result_elem_expr, dict(env, **{expr.loop_var.name: elem}))
+                         for elem in self.evaluate(expr.list_expr, env))
+        elif isinstance(expr, ir3.SetComprehension):
+            return _create_set((self.evaluate(expr.result_elem_expr, dict(env, **{expr.loop_var.name: elem}))
+                                for elem in self.evaluate(expr.set_expr, env)),
+                               expr.result_elem_expr.type)
+        else:
+            raise NotImplementedError('Unexpected expr: %s' % str(expr.__class__))
+
+    def _evaluate_type_expr(self, expr: ir3.Expr, env: _Env, pattern_vars: Dict[str, TypeValue]) -> TypeValue:
+        '''Evaluates a type expr, or a pattern where the vars in pattern_vars have the given values.'''
+        def evaluate(expr: ir3.Expr):
+            return self._evaluate_type_expr(expr, env, pattern_vars)
+        if isinstance(expr, ir3.VarReference) and expr.name in pattern_vars:
+            return pattern_vars[expr.name]
+        elif isinstance(expr, ir3.AtomicTypeLiteral):
+            return ('atomic', 'int' if expr.cpp_type == 'signed' else expr.cpp_type)
+        elif isinstance(expr, ir3.PointerTypeExpr):
+            return _pointer(evaluate(expr.type_expr))
+        elif isinstance(expr, ir3.ReferenceTypeExpr):
+            return _reference('reference', evaluate(expr.type_expr))
+        elif isinstance(expr, ir3.RvalueReferenceTypeExpr):
+            return _reference('rvalue_reference', evaluate(expr.type_expr))
+        elif isinstance(expr, ir3.ConstTypeExpr):
+            return _const(evaluate(expr.type_expr))
+        elif isinstance(expr, ir3.ArrayTypeExpr):
+            return _array(evaluate(expr.type_expr))
+        elif isinstance(expr, ir3.FunctionTypeExpr):
+            return _function(evaluate(expr.return_type_expr), self._evaluate_type_list(expr.arg_list_expr, evaluate, env))
+        elif isinstance(expr, ir3.TemplateInstantiationExpr):
+            return ('template_instantiation',
+                    expr.template_atomic_cpp_type,
+                    self._evaluate_type_list(expr.arg_list_expr, evaluate, env))
+        else:
+            return self.evaluate(expr, env)
+
+    def _evaluate_type_list(self, expr: ir3.Expr, evaluate_elem, env: _Env) -> Tuple[TypeValue, ...]:
+        if isinstance(expr, ir3.ListExpr):
+            return tuple(evaluate_elem(elem_expr) for elem_expr in expr.elem_exprs)
+        return self.evaluate(expr, env)
+
+    def _evaluate_match_expr(self, expr: ir3.MatchExpr, env: _Env):
+        values = [self.evaluate(matched_expr, env) for matched_expr in expr.matched_exprs]
+        main_definition = None
+        matching_cases = []  # type: List[Tuple[ir3.MatchCase, Dict[str, TypeValue]]]
+        for match_case in expr.match_cases:
+            if match_case.is_main_definition():
+                main_definition = match_case
+                continue
+            bindings = dict()  # type: Dict[str, TypeValue]
+            if self._match_list(match_case.type_patterns, values, match_case.matched_var_names, bindings, env):
+                matching_cases.append((match_case, bindings))
+
+        if not matching_cases:
+            bindings = dict()
+            if main_definition is None or not self._match_list(main_definition.type_patterns,
+                                                               values,
+                                                               main_definition.matched_var_names,
+                                                               bindings,
+                                                               env):
+                raise CannotInterpretException('No match() branch matches the values')
+            match_case = main_definition
+        else:
+            # As in C++, the most specialized branch is used.
+            best_cases = [(match_case, bindings)
+                          for match_case, bindings in matching_cases
+                          if all(other_case is match_case
+                                 or (self._is_more_specialized(match_case, other_case, env)
+                                     and not self._is_more_specialized(other_case, match_case, env))
+                                 for other_case, _ in matching_cases)]
+            if len(best_cases) != 1:
+                raise CannotInterpretException('Ambiguous match()')
+            [(match_case, bindings)] = best_cases
+
+        return self.evaluate(match_case.expr, dict(env, **bindings))
+
+    def _is_more_specialized(self, match_case1: ir3.MatchCase, match_case2: ir3.MatchCase, env: _Env):
+        '''Returns true if the patterns of match_case2 match anything matched by the patterns of match_case1.'''
+        unique_types = {var_name: ('unique', var_name) for var_name in match_case1.matched_var_names}
+        values = [self._evaluate_type_expr(pattern, env, pattern_vars=unique_types)
+                  for pattern in match_case1.type_patterns]
+        return self._match_list(match_case2.type_patterns, values, match_case2.matched_var_names, dict(), env)
+
+    def _match_list(self, patterns: List[ir3.Expr], values, pattern_vars, bindings: Dict[str, TypeValue], env: _Env):
+        return (len(patterns) == len(values)
+                and all(self._match(pattern, value, pattern_vars, bindings, env)
+                        for pattern, value in zip(patterns, values)))
+
+    def _match(self, pattern: ir3.Expr, value: TypeValue, pattern_vars, bindings: Dict[str, TypeValue], env: _Env):
+        if isinstance(pattern, ir3.VarReference) and pattern.name in pattern_vars:
+            if pattern.name in bindings:
+                return types_equal(bindings[pattern.name], value)
+            bindings[pattern.name] = value
+            return True
+
+        if not any(var.name in pattern_vars for var in pattern.get_free_variables()):
+            return types_equal(self._evaluate_type_expr(pattern, env, pattern_vars=dict()), value)
+
+        if _is_opaque(value):
+            # E.g. a typedef, that might match the pattern.
+            raise CannotInterpretException('Can\'t match %s' % type_value_to_string(value))
+
+        def match(pattern, value):
+            return self._match(pattern, value, pattern_vars, bindings, env)
+
+        if isinstance(pattern, ir3.PointerTypeExpr):
+            return value[0] == 'pointer' and match(pattern.type_expr, value[1])
+        elif isinstance(pattern, ir3.ReferenceTypeExpr):
+            return value[0] == 'reference' and match(pattern.type_expr, value[1])
+        elif isinstance(pattern, ir3.RvalueReferenceTypeExpr):
+            return value[0] == 'rvalue_reference' and match(pattern.type_expr, value[1])
+        elif isinstance(pattern, ir3.ConstTypeExpr):
+            if value[0] == 'array' and value[1][0] == 'const':
+                # An array of const elements is also const-qualified in C++.
+                raise CannotInterpretException('Can\'t match %s' % type_value_to_string(value))
+            return value[0] == 'const' and match(pattern.type_expr, value[1])
+        elif isinstance(pattern, ir3.ArrayTypeExpr):
+            return value[0] == 'array' and match(pattern.type_expr, value[1])
+        elif isinstance(pattern, ir3.FunctionTypeExpr):
+            if value[0] != 'function':
+                return False
+            if not isinstance(pattern.arg_list_expr, ir3.ListExpr):
+                raise CannotInterpretException('Can\'t match %s' % type_value_to_string(value))
+            return (match(pattern.return_type_expr, value[1])
+                    and self._match_list(pattern.arg_list_expr.elem_exprs, value[2], pattern_vars, bindings, env))
+        elif isinstance(pattern, ir3.TemplateInstantiationExpr):
+            if value[0] != 'template_instantiation':
+                return False
+            if (value[1] != pattern.template_atomic_cpp_type
+                    or not isinstance(pattern.arg_list_expr, ir3.ListExpr)
+                    or len(pattern.arg_list_expr.elem_exprs) != len(value[2])):
+                # The templates might be aliases, or have default arguments.
+                raise CannotInterpretException('Can\'t match %s' % type_value_to_string(value))
+            return self._match_list(pattern.arg_list_expr.elem_exprs, value[2], pattern_vars, bindings, env)
+        else:
+            raise NotImplementedError('Unexpected pattern: %s' % str(pattern.__class__))
+
+def interpret_module(module: ir3.Module):
+    '''Checks the toplevel assertions in the module.
+
+    Raises ProgramErrorException if the C++ compilation would fail with a static_assert error, or
+    CannotInterpretException if the interpreter can't determine the result.
+    '''
+    interpreter = Interpreter(module)
+    try:
+        interpreter.check_assertions(module.assertions)
+    except RecursionError:
+        raise CannotInterpretException('Maximum recursion depth exceeded')
+
+def _unescape_message(message: str):
+    # The messages in IR3 are already escaped for use in C++ string literals.
+    result = []
+    i = 0
+    while i < len(message):
+        if message[i] == '\\' and i + 1 < len(message):
+            result.append('\n' if message[i + 1] == 'n' else message[i + 1])
+            i += 2
+        else:
+            result.append(message[i])
+            i += 1
+    return ''.join(result)
+
+def _check_int64(n: int):
+    if not _MIN_INT64 <= n <= _MAX_INT64:
+        raise CannotInterpretException('int64 overflow')
+    return n
+
+def _evaluate_int_binary_op(lhs: int, rhs: int, op: str):
+    if op == '+':
+        return _check_int64(lhs + rhs)
+    elif op == '-':
+        return _check_int64(lhs - rhs)
+    elif op == '*':
+        return _check_int64(lhs * rhs)
+    if rhs == 0:
+        raise CannotInterpretException('Division by zero')
+    # The generated C++ code rounds the quotient towards zero.
+    quotient = abs(lhs) // abs(rhs)
+    if (lhs < 0) != (rhs < 0):
+        quotient = -quotient
+    if op == '//':
+        return _check_int64(quotient)
+    elif op == '%':
+        return lhs - rhs * quotient
+    else:
+        raise NotImplementedError('Unexpected op: %s' % op)
+
+def _is_void(value: TypeValue):
+    return value == ('atomic', 'void')
+
+def _pointer(value: TypeValue):
+    if value[0] in ('reference', 'rvalue_reference'):
+        raise CannotInterpretException('Pointer to reference')
+    return ('pointer', value)
+
+def _reference(kind: str, value: TypeValue):
+    if _is_void(value):
+        raise CannotInterpretException('Reference to void')
+    if value[0] in ('reference', 'rvalue_reference'):
+        # Reference collapsing: T& & and T&& & are T&, T&& && is T&&.
+        return ('reference' if 'reference' in (kind, value[0]) else 'rvalue_reference', value[1])
+    return (kind, value)
+
+def _const(value: TypeValue):
+    if value[0] in ('reference', 'rvalue_reference', 'const'):
+        # const is ignored on references and on types that are already const.
+        return value
+    elif value[0] == 'array':
+        return ('array', _const(value[1]))
+    elif value[0] == 'function':
+        raise CannotInterpretException('const function type')
+    return ('const', value)
+
+def _array(value: TypeValue):
+    if value[0] in ('reference', 'rvalue_reference', 'function') or _is_void(value):
+        raise CannotInterpretException('Invalid array type')
+    return ('array', value)
+
+def _function(return_type: TypeValue, arg_types: Tuple[TypeValue, ...]):
+    if return_type[0] in ('array', 'function'):
+        raise CannotInterpretException('Invalid function return type')
+    adjusted_arg_types = []
+    for arg_type in arg_types:
+        # As in C++, arrays and functions are converted to pointers and the top-level const is dropped.
+        if _is_void(arg_type):
+            raise CannotInterpretException('void function parameter')
+        elif arg_type[0] == 'array':
+            arg_type = ('pointer', arg_type[1])
+        elif arg_type[0] == 'function':
+            arg_type = ('pointer', arg_type)
+        elif arg_type[0] == 'const':
+            arg_type = arg_type[1]
+        adjusted_arg_types.append(arg_type)
+    return ('function', return_type, tuple(adjusted_arg_types))
+
+def _is_opaque(value: TypeValue):
+    '''Returns true if the type might be equal to other types with a different structure (e.g. a typedef).'''
+    return ((value[0] == 'atomic' and value[1] not in _FUNDAMENTAL_TYPES)
+            or value[0] in ('template_member', 'attribute'))
+
+def types_equal(value1: TypeValue, value2: TypeValue) -> bool:
+    if value1 == value2:
+        return True
+    if value1[0] == 'unique' or value2[0] == 'unique':
+        return False
+    if _is_opaque(value1) or _is_opaque(value2):
+        raise CannotInterpretException('Can\'t compare %s and %s' % (type_value_to_string(value1),
+                                                                       type_value_to_string(value2)))
+    if value1[0] != value2[0]:
+        return False
+    kind = value1[0]
+    if kind == 'atomic':
+        return False
+    elif kind in ('pointer', 'reference', 'rvalue_reference', 'const', 'array'):
+        return types_equal(value1[1], value2[1])
+    elif kind == 'function':
+        return (types_equal(value1[1], value2[1])
+                and len(value1[2]) == len(value2[2])
+                and all(types_equal(arg1, arg2) for arg1, arg2 in zip(value1[2], value2[2])))
+    elif kind == 'template_instantiation':
+        if value1[1] != value2[1] or len(value1[2]) != len(value2[2]):
+            # The templates might be aliases, or have default arguments.
+            raise CannotInterpretException('Can\'t compare %s and %s' % (type_value_to_string(value1),
+                                                                           type_value_to_string(value2)))
+        return all(types_equal(arg1, arg2) for arg1, arg2 in zip(value1[2], value2[2]))
+    else:
+        raise NotImplementedError('Unexpected kind: %s' % kind)
+
+def values_equal(value1, value2, type: ir3.ExprType) -> bool:
+    if isinstance(type, ir3.TypeType):
+        return types_equal(value1, value2)
+    elif isinstance(type, ir3.ListType):
+        return (len(value1) == len(value2)
+                and all(values_equal(elem1, elem2, type.elem_type) for elem1, elem2 in zip(value1, value2)))
+    elif isinstance(type, ir3.SetType):
+        return (len(value1) == len(value2)
+                and all(_set_contains(value2, elem, type.elem_type) for elem in value1))
+    elif isinstance(type, ir3.CustomType):
+        return all(values_equal(field_value1, field_value2, arg_decl.type)
+                   for arg_decl, field_value1, field_value2 in zip(type.arg_types,
+                                                                   value1.field_values,
+                                                                   value2.field_values))
+    else:
+        return value1 == value2
+
+def _set_contains(s: Tuple[Any, ...], value, elem_type: ir3.ExprType):
+    return any(values_equal(elem, value, elem_type) for elem in s)
+
+def _create_set(values, elem_type: ir3.ExprType):
+    elems = []
+    for value in values:
+        if not _set_contains(elems, value, elem_type):
+            elems.append(value)
+    return tuple(elems)
+
+def type_value_to_string(value: TypeValue) -> str:
+    kind = value[0]
+    if kind in ('atomic', 'unique'):
+        return value[1]
+    elif kind == 'pointer':
+        return '%s*' % type_value_to_string(value[1])
+    elif kind == 'reference':
+        return '%s&' % type_value_to_string(value[1])
+    elif kind == 'rvalue_reference':
+        return '%s&&' % type_value_to_string(value[1])
+    elif kind == 'const':
+        return '%s const' % type_value_to_string(value[1])
+    elif kind == 'array':
+        return '%s[]' % type_value_to_string(value[1])
+    elif kind == 'function':
+        return '%s(%s)' % (type_value_to_string(value[1]), ', '.join(type_value_to_string(arg) for arg in value[2]))
+    elif kind == 'template_instantiation':
+        return '%s<%s>' % (value[1], ', '.join(type_value_to_string(arg) for arg in value[2]))
+    elif kind == 'template_member':
+        return '%s::template %s<%s>' % (type_value_to_string(value[1]),
+                                        value[2],
+                                        ', '.join(type_value_to_string(arg) for arg in value[3]))
+    elif kind == 'attribute':
+        return '%s::%s' % (type_value_to_string(value[1]), value[2])
+    else:
+        raise NotImplementedError('Unexpected kind: %s' % kind)
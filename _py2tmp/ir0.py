@@ -24,32 +24,46 @@ class ExprKind(Enum):
     TEMPLATE = 4
     VARIADIC_TYPE = 5
 
-class ExprType(utils.ValueType):
+class ExprType(utils.HashConsedValueType):
+    __slots__ = ('kind',)
+
     def __init__(self, kind: ExprKind):
         self.kind = kind
 
 class BoolType(ExprType):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(kind=ExprKind.BOOL)
 
 class Int64Type(ExprType):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(kind=ExprKind.INT64)
 
 class TypeType(ExprType):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(kind=ExprKind.TYPE)
 
 class TemplateType(ExprType):
+    __slots__ = ('argtypes',)
+
     def __init__(self, argtypes: List[ExprType]):
         super().__init__(kind=ExprKind.TEMPLATE)
         self.argtypes = tuple(argtypes)
 
 class VariadicType(ExprType):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__(kind=ExprKind.VARIADIC_TYPE)
 
-class Expr(utils.ValueType):
+class Expr(utils.HashConsedValueType):
+    __slots__ = ('type',)
+
     def __init__(self, type: ExprType):
         self.type = type
 
@@ -60,9 +74,13 @@ class Expr(utils.ValueType):
     def get_referenced_identifiers(self) -> Iterable[str]: ...  # pragma: no cover
 
 class TemplateBodyElement:
+    __slots__ = ()
+
     def get_referenced_identifiers(self) -> Iterable[str]: ...  # pragma: no cover
 
 class StaticAssert(TemplateBodyElement):
+    __slots__ = ('expr', 'message')
+
     def __init__(self, expr: Expr, message: str):
         assert isinstance(expr.type, BoolType)
         self.expr = expr
@@ -73,6 +91,8 @@ class StaticAssert(TemplateBodyElement):
             yield identifier
 
 class ConstantDef(TemplateBodyElement):
+    __slots__ = ('name', 'expr')
+
     def __init__(self, name: str, expr: Expr):
         assert isinstance(expr.type, (BoolType, Int64Type))
         self.name = name
@@ -83,6 +103,8 @@ class ConstantDef(TemplateBodyElement):
             yield identifier
 
 class Typedef(TemplateBodyElement):
+    __slots__ = ('name', 'expr')
+
     def __init__(self, name: str, expr: Expr):
         assert isinstance(expr.type, (TypeType, TemplateType))
         self.name = name
@@ -93,6 +115,8 @@ class Typedef(TemplateBodyElement):
             yield identifier
 
 class TemplateArgDecl:
+    __slots__ = ('type', 'name')
+
     def __init__(self, type: ExprType, name: str = ''):
         self.type = type
         self.name = name
@@ -100,6 +124,8 @@ class TemplateArgDecl:
 _non_identifier_char_pattern = re.compile('[^a-zA-Z0-9_]+')
 
 class TemplateSpecialization:
+    __slots__ = ('args', 'patterns', 'body')
+
     def __init__(self,
                  args: List[TemplateArgDecl],
                  patterns: 'Optional[List[Expr]]',
@@ -118,14 +144,18 @@ class TemplateSpecialization:
             for identifier in elem.get_referenced_identifiers():
                 yield identifier
 
-class TemplateDefn(TemplateBodyElement):
+class TemplateDefn(TemplateBodyElement, utils.HasSourceLocation):
+    __slots__ = ('name', 'args', 'main_definition', 'specializations', 'description', 'result_element_names',
+                 '_source_location')
+
     def __init__(self,
                  args: List[TemplateArgDecl],
                  main_definition: Optional[TemplateSpecialization],
                  specializations: List[TemplateSpecialization],
                  name: str,
                  description: str,
-                 result_element_names: List[str]):
+                 result_element_names: List[str],
+                 source_location: Optional[utils.SourceLocation] = None):
         assert main_definition or specializations
         assert not main_definition or main_definition.patterns is None
         assert '\n' not in description
@@ -135,6 +165,7 @@ class TemplateDefn(TemplateBodyElement):
         self.specializations = tuple(specializations)
         self.description = description
         self.result_element_names = tuple(sorted(result_element_names))
+        self._source_location = source_location
 
     def get_referenced_identifiers(self):
         if self.main_definition:
@@ -145,6 +176,8 @@ class TemplateDefn(TemplateBodyElement):
                 yield identifier
 
 class Literal(Expr):
+    __slots__ = ('value',)
+
     def __init__(self, value: Union[bool, int]):
         if isinstance(value, bool):
             type = BoolType()
@@ -167,6 +200,8 @@ class Literal(Expr):
             yield  # pragma: no cover
 
 class AtomicTypeLiteral(Expr):
+    __slots__ = ('cpp_type', 'is_local', 'is_metafunction_that_may_return_error', '_tokenized_cpp_type')
+
     def __init__(self,
                  cpp_type: str,
                  is_local: bool,
@@ -217,6 +252,16 @@ class AtomicTypeLiteral(Expr):
                                                        arg_types=[arg.type for arg in template_defn.args],
                                                        is_metafunction_that_may_return_error=is_metafunction_that_may_return_error)
 
+    @property
+    def tokenized_cpp_type(self) -> utils.TokenizedCppType:
+        # This is computed lazily (instead of in __init__) so that it's also available in unpickled instances.
+        try:
+            return self._tokenized_cpp_type
+        except AttributeError:
+            tokenized_cpp_type = utils.TokenizedCppType(self.cpp_type)
+            object.__setattr__(self, '_tokenized_cpp_type', tokenized_cpp_type)
+            return tokenized_cpp_type
+
     def references_any_of(self, variables: Set[str]):
         return self.cpp_type in variables
 
@@ -225,9 +270,11 @@ class AtomicTypeLiteral(Expr):
             yield self
 
     def get_referenced_identifiers(self):
-        yield self.cpp_type
+        return iter(self.tokenized_cpp_type.slots_by_identifier)
 
 class PointerTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -245,6 +292,8 @@ class PointerTypeExpr(Expr):
             yield identifier
 
 class ReferenceTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -262,6 +311,8 @@ class ReferenceTypeExpr(Expr):
             yield identifier
 
 class RvalueReferenceTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -279,6 +330,8 @@ class RvalueReferenceTypeExpr(Expr):
             yield identifier
 
 class ConstTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -296,6 +349,8 @@ class ConstTypeExpr(Expr):
             yield identifier
 
 class ArrayTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -313,6 +368,8 @@ class ArrayTypeExpr(Expr):
             yield identifier
 
 class FunctionTypeExpr(Expr):
+    __slots__ = ('return_type_expr', 'arg_exprs')
+
     def __init__(self, return_type_expr: Expr, arg_exprs: List[Expr]):
         assert return_type_expr.type == TypeType(), return_type_expr.type.__class__.__name__
 
@@ -337,6 +394,8 @@ class FunctionTypeExpr(Expr):
                     yield identifier
 
 class UnaryExpr(Expr):
+    __slots__ = ('expr',)
+
     def __init__(self, expr: Expr, result_type: ExprType):
         super().__init__(type=result_type)
         self.expr = expr
@@ -353,6 +412,8 @@ class UnaryExpr(Expr):
             yield identifier
 
 class BinaryExpr(Expr):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs: Expr, rhs: Expr, result_type: ExprType):
         super().__init__(type=result_type)
         self.lhs = lhs
@@ -372,6 +433,8 @@ class BinaryExpr(Expr):
                 yield identifier
 
 class ComparisonExpr(BinaryExpr):
+    __slots__ = ('op',)
+
     def __init__(self, lhs: Expr, rhs: Expr, op: str):
         assert lhs.type == rhs.type
         if isinstance(lhs.type, BoolType):
@@ -384,6 +447,8 @@ class ComparisonExpr(BinaryExpr):
         self.op = op
 
 class Int64BinaryOpExpr(BinaryExpr):
+    __slots__ = ('op',)
+
     def __init__(self, lhs: Expr, rhs: Expr, op: str):
         super().__init__(lhs, rhs, result_type=Int64Type())
         assert isinstance(lhs.type, Int64Type)
@@ -392,6 +457,8 @@ class Int64BinaryOpExpr(BinaryExpr):
         self.op = op
 
 class TemplateInstantiation(Expr):
+    __slots__ = ('template_expr', 'args', 'instantiation_might_trigger_static_asserts')
+
     def __init__(self,
                  template_expr: Expr,
                  args: List[Expr],
@@ -430,23 +497,33 @@ class TemplateInstantiation(Expr):
                     yield identifier
 
 class ClassMemberAccess(UnaryExpr):
+    __slots__ = ('member_name',)
+
     def __init__(self, class_type_expr: Expr, member_name: str, member_type: ExprType):
         super().__init__(class_type_expr, result_type=member_type)
         self.member_name = member_name
 
 class NotExpr(UnaryExpr):
+    __slots__ = ()
+
     def __init__(self, expr: Expr):
         super().__init__(expr, result_type=BoolType())
 
 class UnaryMinusExpr(UnaryExpr):
+    __slots__ = ()
+
     def __init__(self, expr: Expr):
         super().__init__(expr, result_type=Int64Type())
 
 class VariadicTypeExpansion(UnaryExpr):
+    __slots__ = ()
+
     def __init__(self, expr: Expr):
         super().__init__(expr, result_type=TypeType())
 
 class Header:
+    __slots__ = ('template_defns', 'toplevel_content', 'public_names')
+
     def __init__(self,
                  template_defns: List[TemplateDefn],
                  toplevel_content: List[Union[StaticAssert, ConstantDef, Typedef]],
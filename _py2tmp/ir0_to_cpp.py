@@ -12,8 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List, Iterator, Tuple, Union, Callable
-from _py2tmp import ir0
+import re
+from collections import defaultdict, OrderedDict
+from typing import List, Iterator, Tuple, Union, Callable, Dict, Set, Optional
+from _py2tmp import ir0, utils, module_interface
 
 class Writer:
     def new_id(self) -> str: ...  # pragma: no cover
@@ -27,9 +29,19 @@ class Writer:
     def get_toplevel_writer(self) -> 'ToplevelWriter': ...  # pragma: no cover
 
 class ToplevelWriter(Writer):
-    def __init__(self, identifier_generator: Iterator[str]):
+    def __init__(self,
+                 identifier_generator: Iterator[str],
+                 shared_templates: Optional[Dict[str, Tuple[str, str]]] = None,
+                 source_locations: bool = False):
         self.identifier_generator = identifier_generator
         self.strings = []
+        # If not None, the helper templates that only depend on their own structure are added here (as a
+        # (forward declaration, definition) pair, keyed by name) instead, so that they can be defined once in the shared
+        # support header. See header_to_cpp_with_shared_templates().
+        self.shared_templates = shared_templates
+        # If True, each template with a known source location is preceded by a comment with that location, see
+        # parse_source_location_comments().
+        self.source_locations = source_locations
 
     def new_id(self):
         return next(self.identifier_generator)
@@ -148,15 +160,26 @@ def static_assert_to_cpp(assert_stmt: ir0.StaticAssert,
 
         # All of this function's params are functions, we can't use any of the predefined AlwaysTrue* templates.
         # We need to define a new AlwaysTrueFromType variant for this specific function type.
-        always_true_id = writer.new_id()
         template_param_decl = _type_to_template_param_declaration(type=enclosing_function_defn_args[0].type)
         template_param = enclosing_function_defn_args[0].name
-        writer.write_template_body_elem('''\
+        shared_templates = writer.get_toplevel_writer().shared_templates
+        if shared_templates is None:
+            always_true_id = writer.new_id()
+        else:
+            # The variant only depends on the param declaration, so all modules can share it.
+            always_true_id = utils.content_derived_identifier('AlwaysTrueFor', template_param_decl)
+        always_true_defn = '''\
             // Custom AlwaysTrueFor* template
             template <{template_param_decl}>
             struct {always_true_id} {{
               static constexpr bool value = true;
             }};
+            '''.format(**locals())
+        if shared_templates is None:
+            writer.write_template_body_elem(always_true_defn)
+        else:
+            shared_templates.setdefault(always_true_id, ('', always_true_defn))
+        writer.write_template_body_elem('''\
             static_assert({always_true_id}<{template_param}>::value && {cpp_meta_expr}, "{message}");
             '''.format(**locals()))
 
@@ -230,7 +253,10 @@ def _type_to_template_param_declaration(type: ir0.ExprType):
         raise NotImplementedError('Unsupported argument kind: ' + str(type.kind))
 
 def template_arg_decl_to_cpp(arg_decl: ir0.TemplateArgDecl):
-    return _type_to_template_param_declaration(arg_decl.type) + ' ' + arg_decl.name
+    if arg_decl.name:
+        return _type_to_template_param_declaration(arg_decl.type) + ' ' + arg_decl.name
+    else:
+        return _type_to_template_param_declaration(arg_decl.type)
 
 def template_specialization_to_cpp(specialization: ir0.TemplateSpecialization,
                                    cxx_name: str,
@@ -277,6 +303,18 @@ def template_specialization_to_cpp(specialization: ir0.TemplateSpecialization,
             }};
             '''.format(**locals()))
 
+_SOURCE_LOCATION_COMMENT_PREFIX = 'Source location of '
+_SOURCE_LOCATION_COMMENT_REGEX = re.compile(r'^\s*// %s(\w+): (.*):([0-9]+) \(in (.*)\)\s*$'
+                                            % re.escape(_SOURCE_LOCATION_COMMENT_PREFIX),
+                                            re.MULTILINE)
+
+def parse_source_location_comments(cpp_source: str) -> Dict[str, utils.SourceLocation]:
+    '''Returns the source location of each template in C++ code generated with source_locations=True, keyed by name.'''
+    return {match.group(1): utils.SourceLocation(filename=match.group(2),
+                                                 line=int(match.group(3)),
+                                                 function_name=match.group(4))
+            for match in _SOURCE_LOCATION_COMMENT_REGEX.finditer(cpp_source)}
+
 def template_defn_to_cpp_forward_decl(template_defn: ir0.TemplateDefn,
                                       enclosing_function_defn_args: List[ir0.TemplateArgDecl],
                                       writer: Writer):
@@ -292,6 +330,10 @@ def template_defn_to_cpp(template_defn: ir0.TemplateDefn,
                          enclosing_function_defn_args: List[ir0.TemplateArgDecl],
                          writer: Writer):
     template_name = template_defn.name
+    if writer.get_toplevel_writer().source_locations and template_defn.source_location:
+        writer.write_toplevel_elem('// %s%s: %s\n' % (_SOURCE_LOCATION_COMMENT_PREFIX,
+                                                      template_name,
+                                                      str(template_defn.source_location)))
     if template_defn.main_definition:
         if template_defn.description:
             writer.write_toplevel_elem('// %s\n' % template_defn.description)
@@ -391,10 +433,19 @@ def template_instantiation_to_cpp(instantiation_expr: ir0.TemplateInstantiation,
                 }[(arg_to_replace.type.kind, arg_decl.type.kind)]()
             else:
                 # We need to define a new Select1st variant for the desired function type.
-                select1st_variant = writer.new_id()
-                forwarded_param_id = writer.new_id()
                 template_param_decl1 = _type_to_template_param_declaration(type=arg_to_replace.type)
                 template_param_decl2 = _type_to_template_param_declaration(type=arg_decl.type)
+                shared_templates = writer.get_toplevel_writer().shared_templates
+                if shared_templates is None:
+                    select1st_variant = writer.new_id()
+                    forwarded_param_id = writer.new_id()
+                else:
+                    # The variant only depends on the param declarations, so all modules can share it.
+                    select1st_identifier_generator = utils.content_derived_identifier_generator('Select1st',
+                                                                                                template_param_decl1,
+                                                                                                template_param_decl2)
+                    select1st_variant = next(select1st_identifier_generator)
+                    forwarded_param_id = next(select1st_identifier_generator)
 
                 select1st_variant_body_writer = TemplateElemWriter(writer.get_toplevel_writer())
                 if arg_to_replace.type.kind in (ir0.ExprKind.BOOL, ir0.ExprKind.INT64):
@@ -414,13 +465,17 @@ def template_instantiation_to_cpp(instantiation_expr: ir0.TemplateInstantiation,
 
                 select1st_variant_body_str = ''.join(select1st_variant_body_writer.strings)
 
-                writer.write_template_body_elem('''
+                select1st_variant_defn = '''
                     // Custom Select1st* template
                     template <{template_param_decl1} {forwarded_param_id}, {template_param_decl2}>
                     struct {select1st_variant} {{
                       {select1st_variant_body_str}
                     }};
-                    '''.format(**locals()))
+                    '''.format(**locals())
+                if shared_templates is None:
+                    writer.write_template_body_elem(select1st_variant_defn)
+                else:
+                    shared_templates.setdefault(select1st_variant, ('', select1st_variant_defn))
 
             select1st_type = ir0.TemplateType(argtypes=[arg_to_replace.type, arg_decl.type])
             select1st_instantiation = ir0.TemplateInstantiation(template_expr=ir0.AtomicTypeLiteral.for_local(cpp_type=select1st_variant,
@@ -511,25 +566,248 @@ def toplevel_elem_to_cpp(elem: Union[ir0.StaticAssert, ir0.ConstantDef, ir0.Type
     else:
         raise NotImplementedError('Unexpected toplevel element: %s' % str(elem.__class__))
 
-def header_to_cpp(header: ir0.Header, identifier_generator: Iterator[str]):
-    writer = ToplevelWriter(identifier_generator)
-    writer.write_toplevel_elem('''\
-        #include <tmppy/tmppy.h>
-        #include <type_traits>
-        ''')
-    for elem in header.template_defns:
+def _write_template_defns(template_defns: List[ir0.TemplateDefn],
+                          writer: ToplevelWriter,
+                          content_derived_identifiers: bool):
+    for elem in template_defns:
         # TODO: only do this when needed, many of these forward declarations are unnecessary.
         template_defn_to_cpp_forward_decl(elem,
                                           enclosing_function_defn_args=[],
                                           writer=writer)
-    for elem in header.template_defns:
+    for elem in template_defns:
+        if content_derived_identifiers:
+            writer.identifier_generator = utils.content_derived_identifier_generator('cpp', elem.name)
         template_defn_to_cpp(elem,
                              enclosing_function_defn_args=[],
                              writer=writer)
-    for elem in header.toplevel_content:
+
+def _write_toplevel_elems(toplevel_elems: List[Union[ir0.StaticAssert, ir0.ConstantDef, ir0.Typedef]],
+                          writer: ToplevelWriter,
+                          content_derived_identifiers: bool):
+    num_occurrences_by_toplevel_elem_ir_string = defaultdict(lambda: 0)  # type: Dict[str, int]
+    for elem in toplevel_elems:
+        if content_derived_identifiers:
+            elem_ir_string = utils.ir_to_string(elem)
+            num_occurrences = num_occurrences_by_toplevel_elem_ir_string[elem_ir_string]
+            num_occurrences_by_toplevel_elem_ir_string[elem_ir_string] = num_occurrences + 1
+            writer.identifier_generator = utils.content_derived_identifier_generator('cpp', elem_ir_string,
+                                                                                     str(num_occurrences))
         toplevel_elem_to_cpp(elem, writer)
+
+def header_to_cpp(header: ir0.Header,
+                  identifier_generator: Iterator[str],
+                  content_derived_identifiers: bool = False,
+                  module_name: Optional[str] = None,
+                  included_headers: List[str] = (),
+                  source_locations: bool = False):
+    '''Converts the header to C++.
+
+    If content_derived_identifiers is True, identifier_generator is not used. Instead, the identifiers generated for
+    each template (or toplevel element) only depend on that template.
+
+    If module_name is specified, the internal identifiers are qualified with it and the header can be included more than
+    once, so that the headers generated for multiple modules can be used in the same C++ file. The generated code
+    includes included_headers (the headers of the imported modules), as written.
+
+    If source_locations is True, each template is preceded by a comment with the location of the TMPPy code that it was
+    generated from (if known); parse_source_location_comments() reads them back.
+    '''
+    writer = ToplevelWriter(identifier_generator, source_locations=source_locations)
+    if module_name is not None:
+        writer.write_toplevel_elem('#pragma once\n')
+    writer.write_toplevel_elem('''\
+        #include <tmppy/tmppy.h>
+        #include <type_traits>
+        ''')
+    for included_header in included_headers:
+        writer.write_toplevel_elem('#include "%s"\n' % included_header)
+    _write_template_defns(header.template_defns, writer, content_derived_identifiers)
+    _write_toplevel_elems(header.toplevel_content, writer, content_derived_identifiers)
+    result = ''.join(writer.strings)
+    if module_name is not None:
+        # This also covers the identifiers generated above, e.g. for the custom Select1st* variants.
+        result = re.sub(r'\bTmppyInternal_',
+                        'TmppyInternal_%s_' % module_interface.module_name_to_identifier(module_name),
+                        result)
+    return result
+
+# The template that checks for errors in the toplevel code. Its main definition doesn't depend on the module, while each
+# module adds a specialization for each of its error types.
+_CHECK_IF_ERROR_TEMPLATE_NAME = 'CheckIfError'
+
+def header_to_cpp_with_shared_templates(header: ir0.Header,
+                                        shared_template_names: Set[str],
+                                        shared_support_header: str) -> Tuple[str, Dict[str, Tuple[str, str]]]:
+    '''Converts the header to C++, leaving out the templates that can be defined once for multiple modules.
+
+    The header must have content-derived identifiers, and shared_template_names must be the names returned by
+    optimize_ir0.get_module_independent_template_names(). The returned C++ code includes shared_support_header instead
+    of defining those templates. Returns the C++ code and the (forward declaration, definition) of each shared template,
+    keyed by name; shared_support_header_to_cpp() combines the ones from multiple modules into the shared support
+    header. As well as the templates in shared_template_names, these include the main definition of CheckIfError
+    and the custom AlwaysTrueFor* and Select1st* variants.
+    '''
+    shared_templates = OrderedDict()  # type: Dict[str, Tuple[str, str]]
+    writer = ToplevelWriter(iter([]), shared_templates=shared_templates)
+    writer.write_toplevel_elem('''\
+        #include <tmppy/tmppy.h>
+        #include <type_traits>
+        #include "{shared_support_header}"
+        '''.format(**locals()))
+
+    template_defns = []
+    for template_defn in header.template_defns:
+        if template_defn.name in shared_template_names:
+            forward_decl_writer = ToplevelWriter(iter([]), shared_templates=shared_templates)
+            template_defn_to_cpp_forward_decl(template_defn, enclosing_function_defn_args=[], writer=forward_decl_writer)
+            defn_writer = ToplevelWriter(utils.content_derived_identifier_generator('cpp', template_defn.name),
+                                         shared_templates=shared_templates)
+            template_defn_to_cpp(template_defn, enclosing_function_defn_args=[], writer=defn_writer)
+            shared_templates[template_defn.name] = (''.join(forward_decl_writer.strings), ''.join(defn_writer.strings))
+        elif template_defn.name == _CHECK_IF_ERROR_TEMPLATE_NAME and template_defn.main_definition:
+            main_definition_writer = ToplevelWriter(iter([]), shared_templates=shared_templates)
+            template_defn_to_cpp(ir0.TemplateDefn(args=template_defn.args,
+                                                  main_definition=template_defn.main_definition,
+                                                  specializations=[],
+                                                  name=template_defn.name,
+                                                  description=template_defn.description,
+                                                  result_element_names=template_defn.result_element_names,
+                                                  source_location=template_defn.source_location),
+                                 enclosing_function_defn_args=[],
+                                 writer=main_definition_writer)
+            shared_templates[template_defn.name] = ('', ''.join(main_definition_writer.strings))
+            if template_defn.specializations:
+                template_defns.append(ir0.TemplateDefn(args=template_defn.args,
+                                                       main_definition=None,
+                                                       specializations=template_defn.specializations,
+                                                       name=template_defn.name,
+                                                       description=template_defn.description,
+                                                       result_element_names=template_defn.result_element_names,
+                                                       source_location=template_defn.source_location))
+        else:
+            template_defns.append(template_defn)
+
+    for template_defn in template_defns:
+        if template_defn.name not in shared_templates:
+            template_defn_to_cpp_forward_decl(template_defn, enclosing_function_defn_args=[], writer=writer)
+    for template_defn in template_defns:
+        writer.identifier_generator = utils.content_derived_identifier_generator('cpp', template_defn.name)
+        template_defn_to_cpp(template_defn, enclosing_function_defn_args=[], writer=writer)
+    _write_toplevel_elems(header.toplevel_content, writer, content_derived_identifiers=True)
+    return ''.join(writer.strings), shared_templates
+
+def shared_support_header_to_cpp(shared_templates_by_module: List[Dict[str, Tuple[str, str]]]):
+    '''Returns the C++ code of the shared support header for the modules converted with header_to_cpp_with_shared_templates().
+
+    Each template is defined once, even if multiple modules use it.
+    '''
+    # This keeps the relative order of the templates of each module, like header_to_cpp() does.
+    merged_shared_templates = OrderedDict()  # type: Dict[str, Tuple[str, str]]
+    for shared_templates in shared_templates_by_module:
+        for name, forward_decl_and_defn in shared_templates.items():
+            merged_shared_templates.setdefault(name, forward_decl_and_defn)
+
+    writer = ToplevelWriter(iter([]))
+    writer.write_toplevel_elem('''\
+        #pragma once
+        #include <tmppy/tmppy.h>
+        #include <type_traits>
+        ''')
+    for forward_decl, _ in merged_shared_templates.values():
+        writer.write_toplevel_elem(forward_decl)
+    for _, defn in merged_shared_templates.values():
+        writer.write_toplevel_elem(defn)
     return ''.join(writer.strings)
 
+# The name of the header (in the directory with the per-name headers) with the templates used by more than one public
+# name. Public names can't start with an underscore, so this can't clash with the header for a public name.
+SPLIT_INTERNAL_HEADER_NAME = '_internal'
+
+def header_to_split_cpp(header: ir0.Header,
+                        identifier_generator: Iterator[str],
+                        header_name: str,
+                        content_derived_identifiers: bool = False,
+                        source_locations: bool = False) -> Dict[str, str]:
+    '''Converts the header to C++, splitting the result into a header for each public name.
+
+    header_name is the name of the main header (without directory and extension). Returns a dict with the C++ source
+    for each header, keyed by its path relative to the directory of the main header:
+      * <header_name>/<public_name>.h contains the templates used only by that public name, and includes
+        <header_name>/_internal.h if it uses templates that are also used by other public names.
+      * <header_name>/_internal.h contains the templates used by more than one public name.
+      * <header_name>.h includes all the above, and also contains the toplevel code (e.g. assertions) and the
+        templates used only there. So it's equivalent to the result of header_to_cpp().
+    source_locations is as in header_to_cpp().
+    '''
+    template_defn_by_name = {template_defn.name: template_defn
+                             for template_defn in header.template_defns}
+    public_names = sorted(name
+                          for name in header.public_names
+                          if name in template_defn_by_name)
+
+    def get_reachable_template_names(template_name: str):
+        reachable_template_names = set()
+        names_to_visit = [template_name]
+        while names_to_visit:
+            name = names_to_visit.pop()
+            if name not in reachable_template_names:
+                reachable_template_names.add(name)
+                names_to_visit.extend(identifier
+                                      for identifier in template_defn_by_name[name].get_referenced_identifiers()
+                                      if identifier in template_defn_by_name)
+        return reachable_template_names
+
+    # The toplevel code is only in the main header, so it doesn't make a template shared.
+    reachable_template_names_by_public_name = {public_name: get_reachable_template_names(public_name)
+                                               for public_name in public_names}
+    user_names_by_template_name = defaultdict(set)  # type: Dict[str, Set[str]]
+    for public_name, reachable_template_names in reachable_template_names_by_public_name.items():
+        for template_name in reachable_template_names:
+            user_names_by_template_name[template_name].add(public_name)
+
+    def get_header_with_template(template_name: str):
+        user_names = user_names_by_template_name[template_name]
+        if not user_names:
+            return header_name
+        elif len(user_names) == 1:
+            [public_name] = user_names
+            return '%s/%s' % (header_name, public_name)
+        else:
+            return '%s/%s' % (header_name, SPLIT_INTERNAL_HEADER_NAME)
+
+    template_defns_by_header = defaultdict(list)  # type: Dict[str, List[ir0.TemplateDefn]]
+    for template_defn in header.template_defns:
+        template_defns_by_header[get_header_with_template(template_defn.name)].append(template_defn)
+
+    # The included headers for each header, with paths relative to the directory of the including header.
+    internal_header = '%s/%s' % (header_name, SPLIT_INTERNAL_HEADER_NAME)
+    included_headers_by_header = dict()  # type: Dict[str, List[str]]
+    if internal_header in template_defns_by_header:
+        included_headers_by_header[internal_header] = []
+    for public_name in public_names:
+        if any(len(user_names_by_template_name[template_name]) > 1
+               for template_name in reachable_template_names_by_public_name[public_name]):
+            included_headers_by_header['%s/%s' % (header_name, public_name)] = [SPLIT_INTERNAL_HEADER_NAME]
+        else:
+            included_headers_by_header['%s/%s' % (header_name, public_name)] = []
+    included_headers_by_header[header_name] = list(included_headers_by_header.keys())
+
+    result = dict()
+    for current_header, included_headers in included_headers_by_header.items():
+        writer = ToplevelWriter(identifier_generator, source_locations=source_locations)
+        writer.write_toplevel_elem('''\
+            #pragma once
+            #include <tmppy/tmppy.h>
+            #include <type_traits>
+            ''')
+        for included_header in included_headers:
+            writer.write_toplevel_elem('#include "%s.h"\n' % included_header)
+        _write_template_defns(template_defns_by_header[current_header], writer, content_derived_identifiers)
+        if current_header == header_name:
+            _write_toplevel_elems(header.toplevel_content, writer, content_derived_identifiers)
+        result[current_header + '.h'] = ''.join(writer.strings)
+    return result
+
 def type_expr_to_cpp(expr: ir0.Expr,
                      enclosing_function_defn_args: List[ir0.TemplateArgDecl],
                      writer: ExprWriter):
@@ -632,3 +910,44 @@ def unary_modifier_type_expr_to_cpp_prefix_suffix(modifier_str: str,
 
 def atomic_type_literal_expr_to_cpp(expr: ir0.AtomicTypeLiteral):
     return expr.cpp_type
+
+def format_cpp(cpp_source: str):
+    '''Re-indents the C++ code generated by header_to_cpp() and removes empty lines.
+
+    This is a much cheaper alternative to utils.clang_format() that doesn't need to spawn a process. It only relies on
+    the structure of the code that we generate: each nesting level is indented by 2 spaces and lines are never wrapped.
+    '''
+    result_lines = []
+    indent_level = 0
+    for line in cpp_source.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        num_leading_closed_braces = len(line) - len(line.lstrip('}'))
+        result_lines.append('  ' * max(indent_level - num_leading_closed_braces, 0) + line)
+        indent_level = max(indent_level + _count_unmatched_braces(line), 0)
+    return ''.join(line + '\n' for line in result_lines)
+
+def _count_unmatched_braces(line: str):
+    # Returns the number of braces opened in this line minus the number of braces closed, ignoring the ones in string
+    # literals, char literals and comments.
+    result = 0
+    quote_char = None
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if quote_char:
+            if c == '\\':
+                i += 1
+            elif c == quote_char:
+                quote_char = None
+        elif c in ('"', "'"):
+            quote_char = c
+        elif line.startswith('//', i):
+            break
+        elif c == '{':
+            result += 1
+        elif c == '}':
+            result -= 1
+        i += 1
+    return result
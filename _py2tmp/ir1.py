@@ -42,30 +42,44 @@ class Writer:
         self.current_indent = old_indent
 
 class ExprType(utils.ValueType):
+    __slots__ = ()
+
     def __str__(self) -> str: ...  # pragma: no cover
 
 class BoolType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'bool'
 
 # A type with no values. This is the return type of functions that never return.
 class BottomType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'BottomType'
 
 class IntType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'int'
 
 class TypeType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'Type'
 
 class ErrorOrVoidType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'ErrorOrVoid'
 
 class FunctionType(ExprType):
+    __slots__ = ('argtypes', 'returns')
+
     def __init__(self, argtypes: List[ExprType], returns: ExprType):
         self.argtypes = tuple(argtypes)
         self.returns = returns
@@ -77,6 +91,8 @@ class FunctionType(ExprType):
             str(self.returns))
 
 class CustomTypeArgDecl(utils.ValueType):
+    __slots__ = ('name', 'type')
+
     def __init__(self, name: str, type: ExprType):
         self.name = name
         self.type = type
@@ -85,6 +101,8 @@ class CustomTypeArgDecl(utils.ValueType):
         return '%s: %s' % (self.name, str(self.type))
 
 class CustomType(ExprType):
+    __slots__ = ('name', 'arg_types')
+
     def __init__(self, name: str, arg_types: List[CustomTypeArgDecl]):
         self.name = name
         self.arg_types = tuple(arg_types)
@@ -102,6 +120,8 @@ class CustomType(ExprType):
                     writer.writeln('self.%s = %s' % (arg.name, arg.name))
 
 class Expr:
+    __slots__ = ('type',)
+
     def __init__(self, type: ExprType):
         self.type = type
 
@@ -114,6 +134,8 @@ class Expr:
     def describe_other_fields(self) -> str: ...  # pragma: no cover
 
 class FunctionArgDecl:
+    __slots__ = ('type', 'name')
+
     def __init__(self, type: ExprType, name: str = ''):
         self.type = type
         self.name = name
@@ -122,6 +144,8 @@ class FunctionArgDecl:
         return '%s: %s' % (self.name, str(self.type))
 
 class VarReference(Expr):
+    __slots__ = ('name', 'is_global_function', 'is_function_that_may_throw')
+
     def __init__(self, type: ExprType, name: str, is_global_function: bool, is_function_that_may_throw: bool):
         super().__init__(type=type)
         assert name
@@ -142,6 +166,8 @@ class VarReference(Expr):
             self.is_function_that_may_throw)
 
 class MatchCase:
+    __slots__ = ('type_patterns', 'matched_var_names', 'expr')
+
     def __init__(self,
                  type_patterns: List[Expr],
                  matched_var_names: List[str],
@@ -169,8 +195,13 @@ class MatchCase:
                 writer.write(str(self.expr))
                 writer.writeln(',')
 
-class MatchExpr(Expr):
-    def __init__(self, matched_vars: List[VarReference], match_cases: List[MatchCase]):
+class MatchExpr(Expr, utils.HasSourceLocation):
+    __slots__ = ('matched_vars', 'match_cases', '_source_location')
+
+    def __init__(self,
+                 matched_vars: List[VarReference],
+                 match_cases: List[MatchCase],
+                 source_location: Optional[utils.SourceLocation] = None):
         assert matched_vars
         assert match_cases
         for match_case in match_cases:
@@ -178,6 +209,7 @@ class MatchExpr(Expr):
         super().__init__(type=match_cases[0].expr.type)
         self.matched_vars = tuple(matched_vars)
         self.match_cases = tuple(match_cases)
+        self._source_location = source_location
 
         assert len([match_case
                     for match_case in match_cases
@@ -205,6 +237,8 @@ class MatchExpr(Expr):
         return ''
 
 class BoolLiteral(Expr):
+    __slots__ = ('value',)
+
     def __init__(self, value: bool):
         super().__init__(BoolType())
         self.value = value
@@ -221,6 +255,8 @@ class BoolLiteral(Expr):
 
 
 class AtomicTypeLiteral(Expr):
+    __slots__ = ('cpp_type',)
+
     def __init__(self, cpp_type: str):
         super().__init__(type=TypeType())
         self.cpp_type = cpp_type
@@ -237,6 +273,8 @@ class AtomicTypeLiteral(Expr):
 
 
 class PointerTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -253,6 +291,8 @@ class PointerTypeExpr(Expr):
         return self.type_expr.describe_other_fields()
 
 class ReferenceTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -269,6 +309,8 @@ class ReferenceTypeExpr(Expr):
         return self.type_expr.describe_other_fields()
 
 class RvalueReferenceTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -285,6 +327,8 @@ class RvalueReferenceTypeExpr(Expr):
         return self.type_expr.describe_other_fields()
 
 class ConstTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -301,6 +345,8 @@ class ConstTypeExpr(Expr):
         return self.type_expr.describe_other_fields()
 
 class ArrayTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -317,6 +363,8 @@ class ArrayTypeExpr(Expr):
         return self.type_expr.describe_other_fields()
 
 class FunctionTypeExpr(Expr):
+    __slots__ = ('return_type_expr', 'arg_list_expr')
+
     def __init__(self, return_type_expr: Expr, arg_list_expr: Expr):
         assert return_type_expr.type == TypeType()
         assert arg_list_expr.type == TypeType()
@@ -339,6 +387,8 @@ class FunctionTypeExpr(Expr):
                                                        str(self.arg_list_expr.describe_other_fields()))
 
 class TemplateInstantiation(Expr):
+    __slots__ = ('template_name', 'arg_exprs', 'instantiation_might_trigger_static_asserts')
+
     def __init__(self,
                  template_name: str,
                  arg_exprs: List[Expr],
@@ -362,6 +412,8 @@ class TemplateInstantiation(Expr):
                                   for arg_expr in self.arg_exprs)
 
 class TemplateInstantiationWithList(Expr):
+    __slots__ = ('template_name', 'arg_list_expr', 'instantiation_might_trigger_static_asserts')
+
     def __init__(self,
                  template_name: str,
                  arg_list_expr: Expr,
@@ -382,6 +434,8 @@ class TemplateInstantiationWithList(Expr):
         return self.arg_list_expr.describe_other_fields()
 
 class ClassMemberAccess(Expr):
+    __slots__ = ('class_type_expr', 'member_name', 'member_type')
+
     def __init__(self, class_type_expr: Expr, member_name: str, member_type: ExprType):
         super().__init__(type=member_type)
         self.class_type_expr = class_type_expr
@@ -400,6 +454,8 @@ class ClassMemberAccess(Expr):
         return self.class_type_expr.describe_other_fields()
 
 class TemplateMemberAccess(Expr):
+    __slots__ = ('class_type_expr', 'member_name', 'arg_list_expr')
+
     def __init__(self, class_type_expr: VarReference, member_name: str, arg_list_expr: VarReference):
         super().__init__(type=TypeType())
         self.class_type_expr = class_type_expr
@@ -419,6 +475,8 @@ class TemplateMemberAccess(Expr):
         return self.class_type_expr.describe_other_fields()
 
 class FunctionCall(Expr):
+    __slots__ = ('fun', 'args')
+
     def __init__(self, fun: VarReference, args: List[VarReference]):
         assert isinstance(fun.type, FunctionType)
         assert len(fun.type.argtypes) == len(args)
@@ -446,6 +504,8 @@ class FunctionCall(Expr):
                          for var in vars)
 
 class EqualityComparison(Expr):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs: VarReference, rhs: VarReference):
         super().__init__(type=BoolType())
         assert (lhs.type == ErrorOrVoidType() and rhs.type == TypeType()) or (lhs.type == rhs.type), '%s vs %s' % (str(lhs.type), str(rhs.type))
@@ -465,6 +525,8 @@ class EqualityComparison(Expr):
         return '(lhs: %s; rhs: %s)' % (self.lhs.describe_other_fields(), self.rhs.describe_other_fields())
 
 class SetEqualityComparison(Expr):
+    __slots__ = ('lhs', 'rhs', 'elem_type')
+
     def __init__(self, lhs: VarReference, rhs: VarReference, elem_type: ExprType):
         super().__init__(type=BoolType())
         assert isinstance(lhs.type, TypeType)
@@ -485,6 +547,8 @@ class SetEqualityComparison(Expr):
         return '(lhs: %s; rhs: %s)' % (self.lhs.describe_other_fields(), self.rhs.describe_other_fields())
 
 class ListToSetExpr(Expr):
+    __slots__ = ('elem_type', 'var')
+
     def __init__(self, var: VarReference, elem_type: ExprType):
         assert var.type == TypeType()
         super().__init__(type=TypeType())
@@ -502,6 +566,8 @@ class ListToSetExpr(Expr):
         return self.var.describe_other_fields()
 
 class AttributeAccessExpr(Expr):
+    __slots__ = ('var', 'attribute_name')
+
     def __init__(self, var: VarReference, attribute_name: str, type: ExprType):
         super().__init__(type=type)
         assert isinstance(var.type, (TypeType, CustomType))
@@ -520,6 +586,8 @@ class AttributeAccessExpr(Expr):
         return ''
 
 class IntLiteral(Expr):
+    __slots__ = ('value',)
+
     def __init__(self, value: int):
         super().__init__(type=IntType())
         self.value = value
@@ -535,6 +603,8 @@ class IntLiteral(Expr):
         return ''
 
 class NotExpr(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference):
         assert var.type == BoolType()
         super().__init__(type=BoolType())
@@ -551,6 +621,8 @@ class NotExpr(Expr):
         return self.var.describe_other_fields()
 
 class UnaryMinusExpr(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference):
         assert var.type == IntType()
         super().__init__(type=IntType())
@@ -567,6 +639,8 @@ class UnaryMinusExpr(Expr):
         return self.var.describe_other_fields()
 
 class IntComparisonExpr(Expr):
+    __slots__ = ('lhs', 'rhs', 'op')
+
     def __init__(self, lhs: VarReference, rhs: VarReference, op: str):
         assert lhs.type == IntType()
         assert rhs.type == IntType()
@@ -588,6 +662,8 @@ class IntComparisonExpr(Expr):
         return '(lhs: %s; rhs: %s)' % (self.lhs.describe_other_fields(), self.rhs.describe_other_fields())
 
 class IntBinaryOpExpr(Expr):
+    __slots__ = ('lhs', 'rhs', 'op')
+
     def __init__(self, lhs: VarReference, rhs: VarReference, op: str):
         assert lhs.type == IntType()
         assert rhs.type == IntType()
@@ -609,6 +685,8 @@ class IntBinaryOpExpr(Expr):
         return '(lhs: %s; rhs: %s)' % (self.lhs.describe_other_fields(), self.rhs.describe_other_fields())
 
 class IsInstanceExpr(Expr):
+    __slots__ = ('var', 'checked_type')
+
     def __init__(self, var: VarReference, checked_type: CustomType):
         super().__init__(type=BoolType())
         self.var = var
@@ -625,6 +703,8 @@ class IsInstanceExpr(Expr):
         return ''
 
 class SafeUncheckedCast(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference, type: ExprType):
         assert isinstance(var.type, ErrorOrVoidType)
         assert isinstance(type, CustomType)
@@ -641,13 +721,20 @@ class SafeUncheckedCast(Expr):
     def describe_other_fields(self):
         return ''
 
-class ListComprehensionExpr(Expr):
-    def __init__(self, list_var: VarReference, loop_var: VarReference, result_elem_expr: FunctionCall):
+class ListComprehensionExpr(Expr, utils.HasSourceLocation):
+    __slots__ = ('list_var', 'loop_var', 'result_elem_expr', '_source_location')
+
+    def __init__(self,
+                 list_var: VarReference,
+                 loop_var: VarReference,
+                 result_elem_expr: FunctionCall,
+                 source_location: Optional[utils.SourceLocation] = None):
         assert isinstance(list_var.type, TypeType)
         super().__init__(type=TypeType())
         self.list_var = list_var
         self.loop_var = loop_var
         self.result_elem_expr = result_elem_expr
+        self._source_location = source_location
 
     def get_free_variables(self):
         for var in self.list_var.get_free_variables():
@@ -663,6 +750,8 @@ class ListComprehensionExpr(Expr):
         return ''
 
 class AddToSetExpr(Expr):
+    __slots__ = ('set_expr', 'elem_expr')
+
     def __init__(self, set_expr: VarReference, elem_expr: VarReference):
         assert isinstance(set_expr.type, TypeType)
         super().__init__(type=TypeType())
@@ -683,6 +772,8 @@ class AddToSetExpr(Expr):
         return 'set: %s; elem: %s' % (self.set_expr.describe_other_fields(), self.elem_expr.describe_other_fields())
 
 class ReturnTypeInfo:
+    __slots__ = ('type', 'always_returns')
+
     def __init__(self, type: Optional[ExprType], always_returns: bool):
         # When expr_type is None, the statement never returns.
         # expr_type can't be None if always_returns is True.
@@ -690,6 +781,7 @@ class ReturnTypeInfo:
         self.always_returns = always_returns
 
 class Stmt:
+    __slots__ = ()
     # Note: it's the caller's responsibility to de-duplicate VarReference objects that reference the same symbol, if
     # desired.
     def get_free_variables(self) -> 'Iterable[VarReference]': ...  # pragma: no cover
@@ -697,6 +789,8 @@ class Stmt:
     def write(self, writer: Writer, verbose: bool): ...  # pragma: no cover
 
 class Assert(Stmt):
+    __slots__ = ('var', 'message')
+
     def __init__(self, var: VarReference, message: str):
         assert isinstance(var.type, BoolType)
         self.var = var
@@ -715,11 +809,13 @@ class Assert(Stmt):
             writer.writeln('')
 
 class Assignment(Stmt):
+    __slots__ = ('lhs', 'lhs2', 'rhs')
+
     def __init__(self,
                  lhs: VarReference,
                  rhs: Expr,
                  lhs2: Optional[VarReference] = None):
-        assert lhs.type == rhs.type, 'Different types: %s vs %s' % (str(lhs.type.__dict__), str(rhs.type.__dict__))
+        assert lhs.type == rhs.type, 'Different types: %s vs %s' % (utils.ir_to_string(lhs.type), utils.ir_to_string(rhs.type))
         if lhs2:
             assert isinstance(lhs2.type, ErrorOrVoidType)
             assert isinstance(rhs, (MatchExpr, FunctionCall, ListComprehensionExpr))
@@ -747,6 +843,8 @@ class Assignment(Stmt):
                 writer.writeln('')
 
 class UnpackingAssignment(Stmt):
+    __slots__ = ('lhs_list', 'rhs', 'error_message')
+
     def __init__(self,
                  lhs_list: List[VarReference],
                  rhs: VarReference,
@@ -776,6 +874,8 @@ class UnpackingAssignment(Stmt):
             writer.writeln('')
 
 class ReturnStmt(Stmt):
+    __slots__ = ('result', 'error')
+
     def __init__(self, result: Optional[VarReference], error: Optional[VarReference]):
         assert result or error
         self.result = result
@@ -800,6 +900,8 @@ class ReturnStmt(Stmt):
             writer.writeln('')
 
 class IfStmt(Stmt):
+    __slots__ = ('cond', 'if_stmts', 'else_stmts')
+
     def __init__(self, cond: VarReference, if_stmts: List[Stmt], else_stmts: List[Stmt]):
         assert cond.type == BoolType()
         assert if_stmts
@@ -831,19 +933,23 @@ class IfStmt(Stmt):
                 for stmt in self.else_stmts:
                     stmt.write(writer, verbose)
 
-class FunctionDefn:
+class FunctionDefn(utils.HasSourceLocation):
+    __slots__ = ('name', 'description', 'args', 'body', 'return_type', '_source_location')
+
     def __init__(self,
                  name: str,
                  description: str,
                  args: List[FunctionArgDecl],
                  body: List[Stmt],
-                 return_type: ExprType):
+                 return_type: ExprType,
+                 source_location: Optional[utils.SourceLocation] = None):
         assert body
         self.name = name
         self.description = description
         self.args = tuple(args)
         self.body = tuple(body)
         self.return_type = return_type
+        self._source_location = source_location
 
     def write(self, writer: Writer, verbose: bool):
         if self.description:
@@ -859,6 +965,8 @@ class FunctionDefn:
         writer.writeln('')
 
 class CheckIfErrorDefn:
+    __slots__ = ('error_types_and_messages',)
+
     def __init__(self, error_types_and_messages: List[Tuple[CustomType, str]]):
         self.error_types_and_messages = tuple(error_types_and_messages)
 
@@ -874,6 +982,8 @@ class CheckIfErrorDefn:
         writer.writeln('')
 
 class Module:
+    __slots__ = ('body', 'public_names')
+
     def __init__(self,
                  body: List[Union[FunctionDefn, Assignment, Assert, CustomType, CheckIfErrorDefn]],
                  public_names: Set[str]):
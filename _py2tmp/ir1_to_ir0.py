@@ -12,10 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from contextlib import contextmanager
 from _py2tmp import ir0
 from _py2tmp import ir1
 from _py2tmp import utils
-from typing import List, Tuple, Optional, Iterator, Union, Callable, Dict
+from _py2tmp.module_interface import module_name_to_identifier
+from typing import List, Tuple, Optional, Iterator, Union, Callable, Dict, ContextManager
 
 class Writer:
     def new_id(self) -> str: ...  # pragma: no cover
@@ -24,19 +26,42 @@ class Writer:
 
     def get_is_instance_template_name_for_error(self, error_name: str) -> str: ...  # pragma: no cover
 
+    def source_location(self, source_location: Optional[utils.SourceLocation]) -> ContextManager[None]: ...  # pragma: no cover
+
 class ToplevelWriter(Writer):
-    def __init__(self, identifier_generator: Iterator[str]):
+    def __init__(self, identifier_generator: Iterator[str], module_name: Optional[str] = None):
         self.identifier_generator = identifier_generator
         self.template_defns = []  # type: List[ir0.TemplateDefn]
         self.toplevel_content = []  # type: List[Union[ir0.StaticAssert, ir0.ConstantDef, ir0.Typedef]]
         self.holder_template_name_for_error = dict()  # type: Dict[str, str]
         self.is_instance_template_name_for_error = dict()  # type: Dict[str, str]
+        # When compiling a module that can be imported by other modules (or that imports other modules), the helper
+        # templates for custom types have names that other modules can compute, and each module has its own
+        # CheckIfError template (since headers for different modules can be included in the same C++ file).
+        self.module_name = module_name
+        if module_name is None:
+            self.check_if_error_template_name = 'CheckIfError'
+        else:
+            self.check_if_error_template_name = 'TmppyCheckIfError_' + module_name_to_identifier(module_name)
+        # The location of the TMPPy code being converted, if known. The templates written while converting it (e.g. the
+        # helper templates for match cases and comprehensions) are attributed to this location.
+        self.current_source_location = None  # type: Optional[utils.SourceLocation]
 
     def new_id(self):
         return next(self.identifier_generator)
 
+    @contextmanager
+    def source_location(self, source_location: Optional[utils.SourceLocation]):
+        old_source_location = self.current_source_location
+        if source_location:
+            self.current_source_location = source_location
+        yield
+        self.current_source_location = old_source_location
+
     def write(self, elem: Union[ir0.TemplateDefn, ir0.StaticAssert, ir0.ConstantDef, ir0.Typedef]):
         if isinstance(elem, ir0.TemplateDefn):
+            if elem.source_location is None:
+                elem.source_location = self.current_source_location
             self.template_defns.append(elem)
         else:
           self.toplevel_content.append(elem)
@@ -47,6 +72,9 @@ class ToplevelWriter(Writer):
         self.holder_template_name_for_error[error_name] = error_holder_name
 
     def get_holder_template_name_for_error(self, error_name: str):
+        if self.module_name is not None and error_name not in self.holder_template_name_for_error:
+            # A type defined in another module.
+            return _holder_template_name_in_module(error_name)
         return self.holder_template_name_for_error[error_name]
 
     def set_is_instance_template_name_for_error(self,
@@ -55,8 +83,17 @@ class ToplevelWriter(Writer):
         self.is_instance_template_name_for_error[error_name] = is_instance_template_name
 
     def get_is_instance_template_name_for_error(self, error_name: str):
+        if self.module_name is not None and error_name not in self.is_instance_template_name_for_error:
+            # A type defined in another module.
+            return _is_instance_template_name_in_module(error_name)
         return self.is_instance_template_name_for_error[error_name]
 
+def _holder_template_name_in_module(custom_type_name: str):
+    return 'TmppyHolder_' + custom_type_name
+
+def _is_instance_template_name_in_module(custom_type_name: str):
+    return 'TmppyIsInstance_' + custom_type_name
+
 class TemplateBodyWriter(Writer):
     def __init__(self,
                  writer: Writer,
@@ -115,6 +152,9 @@ class TemplateBodyWriter(Writer):
     def get_is_instance_template_name_for_error(self, error_name: str):
         return self.writer.get_is_instance_template_name_for_error(error_name)
 
+    def source_location(self, source_location: Optional[utils.SourceLocation]):
+        return self.writer.source_location(source_location)
+
 def type_to_ir0(type: ir1.ExprType):
     if isinstance(type, ir1.BoolType):
         return ir0.BoolType()
@@ -228,7 +268,7 @@ def _create_metafunction_call(template_expr: ir0.Expr,
     if isinstance(writer, ToplevelWriter) and (not isinstance(template_expr, ir0.AtomicTypeLiteral)
                                                or template_expr.is_metafunction_that_may_return_error):
         # using T = CheckIfError<F<x, y>::error>::type;
-        check_if_error_template_instantiation_expr = ir0.TemplateInstantiation(template_expr=ir0.AtomicTypeLiteral.for_nonlocal_template(cpp_type='CheckIfError',
+        check_if_error_template_instantiation_expr = ir0.TemplateInstantiation(template_expr=ir0.AtomicTypeLiteral.for_nonlocal_template(cpp_type=writer.check_if_error_template_name,
                                                                                                                                          arg_types=[ir0.TypeType()],
                                                                                                                                          is_metafunction_that_may_return_error=False),
                                                                                args=[ir0.ClassMemberAccess(class_type_expr=template_instantiation_expr,
@@ -277,6 +317,11 @@ def _create_metafunction_specialization(args: List[ir0.TemplateArgDecl],
 
 def match_expr_to_ir0(match_expr: ir1.MatchExpr,
                       writer: TemplateBodyWriter):
+    with writer.source_location(match_expr.source_location):
+        return _match_expr_to_ir0(match_expr, writer)
+
+def _match_expr_to_ir0(match_expr: ir1.MatchExpr,
+                       writer: TemplateBodyWriter):
     forwarded_args = []  # type: List[ir1.VarReference]
     forwarded_args_names = set()
     for match_case in match_expr.match_cases:
@@ -538,6 +583,10 @@ def safe_unchecked_cast_expr_to_ir0(expr: ir1.SafeUncheckedCast):
                                                  is_function_that_may_throw=expr.var.is_function_that_may_throw))
 
 def list_comprehension_expr_to_ir0(expr: ir1.ListComprehensionExpr, writer: Writer):
+    with writer.source_location(expr.source_location):
+        return _list_comprehension_expr_to_ir0(expr, writer)
+
+def _list_comprehension_expr_to_ir0(expr: ir1.ListComprehensionExpr, writer: Writer):
     captured_vars = [var
                      for var in ir1.get_unique_free_variables_in_stmts([ir1.ReturnStmt(result=expr.result_elem_expr,
                                                                                        error=None)])
@@ -905,7 +954,10 @@ def custom_type_defn_to_ir0(custom_type: ir1.CustomType, writer: ToplevelWriter)
     #
     # With different names for the helper identifiers, of course. Only MyType, x and y retain their name.
 
-    holder_template_id = writer.new_id()
+    if writer.module_name is None:
+        holder_template_id = writer.new_id()
+    else:
+        holder_template_id = _holder_template_name_in_module(custom_type.name)
 
     arg_types = []
     arg_decls = []
@@ -964,7 +1016,11 @@ def custom_type_defn_to_ir0(custom_type: ir1.CustomType, writer: ToplevelWriter)
 
     writer.set_holder_template_name_for_error(custom_type.name, holder_template_id)
 
-    is_instance_template = ir0.TemplateDefn(name=writer.new_id(),
+    if writer.module_name is None:
+        is_instance_template_name = writer.new_id()
+    else:
+        is_instance_template_name = _is_instance_template_name_in_module(custom_type.name)
+    is_instance_template = ir0.TemplateDefn(name=is_instance_template_name,
                                             description='isinstance() (meta)function for the custom type %s' % custom_type.name,
                                             args=[ir0.TemplateArgDecl(type=ir0.TypeType())],
                                             main_definition=ir0.TemplateSpecialization(args=[ir0.TemplateArgDecl(type=ir0.TypeType())],
@@ -1250,6 +1306,10 @@ def _select_arbitrary_parent_arg(args: List[ir0.TemplateArgDecl]) -> ir0.Templat
     return args[0]
 
 def function_defn_to_ir0(function_defn: ir1.FunctionDefn, writer: ToplevelWriter):
+    with writer.source_location(function_defn.source_location):
+        _function_defn_to_ir0(function_defn, writer)
+
+def _function_defn_to_ir0(function_defn: ir1.FunctionDefn, writer: ToplevelWriter):
     try:
         args = [function_arg_decl_to_ir0(arg)
                 for arg in function_defn.args]
@@ -1315,15 +1375,20 @@ def check_if_error_defn_to_ir0(check_if_error_defn: ir1.CheckIfErrorDefn, writer
                                                   body=[ir0.StaticAssert(expr=ir0.Literal(value=False),
                                                                          message=error_message)])
                        for custom_error_type, error_message in check_if_error_defn.error_types_and_messages]
-    writer.write(ir0.TemplateDefn(name='CheckIfError',
+    writer.write(ir0.TemplateDefn(name=writer.check_if_error_template_name,
                                   description='',
                                   main_definition=main_definition,
                                   specializations=specializations,
                                   args=main_definition.args,
                                   result_element_names=['type']))
 
-def module_to_ir0(module: ir1.Module, identifier_generator: Iterator[str]):
-    writer = ToplevelWriter(identifier_generator)
+def module_to_ir0(module: ir1.Module, identifier_generator: Iterator[str], module_name: Optional[str] = None):
+    '''Converts the module to IR0.
+
+    If module_name is specified, the generated code can be used by other modules that import this one (and this module
+    can use the code generated for the modules that it imports). See module_interface.ModuleInterface.
+    '''
+    writer = ToplevelWriter(identifier_generator, module_name)
     public_names = module.public_names.copy()
     for toplevel_elem in module.body:
         if isinstance(toplevel_elem, ir1.FunctionDefn):
@@ -1336,10 +1401,18 @@ def module_to_ir0(module: ir1.Module, identifier_generator: Iterator[str]):
             custom_type_defn_to_ir0(toplevel_elem, writer)
         elif isinstance(toplevel_elem, ir1.CheckIfErrorDefn):
             check_if_error_defn_to_ir0(toplevel_elem, writer)
-            public_names.add('CheckIfError')
+            public_names.add(writer.check_if_error_template_name)
         else:
             raise NotImplementedError('Unexpected toplevel element: %s' % str(toplevel_elem.__class__))
 
+    if module_name is not None:
+        # The modules that import this one use these directly.
+        public_names.update(toplevel_elem.name
+                            for toplevel_elem in module.body
+                            if isinstance(toplevel_elem, ir1.CustomType))
+        public_names.update(writer.holder_template_name_for_error.values())
+        public_names.update(writer.is_instance_template_name_for_error.values())
+
     return ir0.Header(template_defns=writer.template_defns,
                       toplevel_content=writer.toplevel_content,
                       public_names=public_names)
@@ -42,30 +42,44 @@ class Writer:
         self.current_indent = old_indent
 
 class ExprType(utils.ValueType):
+    __slots__ = ()
+
     def __str__(self) -> str: ...  # pragma: no cover
 
 class BoolType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'bool'
 
 # A type with no values. This is the return type of functions that never return.
 class BottomType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'BottomType'
 
 class IntType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'int'
 
 class TypeType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'Type'
 
 class ErrorOrVoidType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'ErrorOrVoid'
 
 class FunctionType(ExprType):
+    __slots__ = ('argtypes', 'returns')
+
     def __init__(self, argtypes: List[ExprType], returns: ExprType):
         self.argtypes = argtypes
         self.returns = returns
@@ -77,6 +91,8 @@ class FunctionType(ExprType):
             str(self.returns))
 
 class ListType(ExprType):
+    __slots__ = ('elem_type',)
+
     def __init__(self, elem_type: ExprType):
         assert not isinstance(elem_type, FunctionType)
         self.elem_type = elem_type
@@ -85,6 +101,8 @@ class ListType(ExprType):
         return 'List[%s]' % str(self.elem_type)
 
 class CustomTypeArgDecl(utils.ValueType):
+    __slots__ = ('name', 'type')
+
     def __init__(self, name: str, type: ExprType):
         self.name = name
         self.type = type
@@ -93,6 +111,8 @@ class CustomTypeArgDecl(utils.ValueType):
         return '%s: %s' % (self.name, str(self.type))
 
 class CustomType(ExprType):
+    __slots__ = ('name', 'arg_types')
+
     def __init__(self, name: str, arg_types: List[CustomTypeArgDecl]):
         self.name = name
         self.arg_types = arg_types
@@ -110,6 +130,8 @@ class CustomType(ExprType):
                     writer.writeln('self.%s = %s' % (arg.name, arg.name))
 
 class Expr:
+    __slots__ = ('type',)
+
     def __init__(self, type: ExprType):
         self.type = type
 
@@ -122,6 +144,8 @@ class Expr:
     def describe_other_fields(self) -> str: ...  # pragma: no cover
 
 class PatternExpr:
+    __slots__ = ('type',)
+
     def __init__(self, type: ExprType):
         self.type = type
 
@@ -134,6 +158,8 @@ class PatternExpr:
     def describe_other_fields(self) -> str: ...  # pragma: no cover
 
 class FunctionArgDecl:
+    __slots__ = ('type', 'name')
+
     def __init__(self, type: ExprType, name: str = ''):
         self.type = type
         self.name = name
@@ -142,6 +168,8 @@ class FunctionArgDecl:
         return '%s: %s' % (self.name, str(self.type))
 
 class VarReference(Expr):
+    __slots__ = ('name', 'is_global_function', 'is_function_that_may_throw')
+
     def __init__(self, type: ExprType, name: str, is_global_function: bool, is_function_that_may_throw: bool):
         super().__init__(type=type)
         assert name
@@ -162,6 +190,8 @@ class VarReference(Expr):
             self.is_function_that_may_throw)
 
 class VarReferencePattern(PatternExpr):
+    __slots__ = ('name', 'is_global_function', 'is_function_that_may_throw')
+
     def __init__(self, type: ExprType, name: str, is_global_function: bool, is_function_that_may_throw: bool):
         super().__init__(type=type)
         assert name
@@ -182,6 +212,8 @@ class VarReferencePattern(PatternExpr):
             self.is_function_that_may_throw)
 
 class MatchCase:
+    __slots__ = ('type_patterns', 'matched_var_names', 'expr')
+
     def __init__(self,
                  type_patterns: List[PatternExpr],
                  matched_var_names: List[str],
@@ -202,8 +234,13 @@ class MatchCase:
                 writer.write(str(self.expr))
                 writer.writeln(',')
 
-class MatchExpr(Expr):
-    def __init__(self, matched_vars: List[VarReference], match_cases: List[MatchCase]):
+class MatchExpr(Expr, utils.HasSourceLocation):
+    __slots__ = ('matched_vars', 'match_cases', '_source_location')
+
+    def __init__(self,
+                 matched_vars: List[VarReference],
+                 match_cases: List[MatchCase],
+                 source_location: Optional[utils.SourceLocation] = None):
         assert matched_vars
         assert match_cases
         for match_case in match_cases:
@@ -211,6 +248,7 @@ class MatchExpr(Expr):
         super().__init__(type=match_cases[0].expr.type)
         self.matched_vars = matched_vars
         self.match_cases = match_cases
+        self._source_location = source_location
 
         assert len([match_case
                     for match_case in match_cases
@@ -238,6 +276,8 @@ class MatchExpr(Expr):
         return ''
 
 class BoolLiteral(Expr):
+    __slots__ = ('value',)
+
     def __init__(self, value: bool):
         super().__init__(BoolType())
         self.value = value
@@ -253,6 +293,8 @@ class BoolLiteral(Expr):
         return ''
 
 class AtomicTypeLiteral(Expr):
+    __slots__ = ('cpp_type',)
+
     def __init__(self, cpp_type: str):
         super().__init__(type=TypeType())
         self.cpp_type = cpp_type
@@ -268,6 +310,8 @@ class AtomicTypeLiteral(Expr):
         return ''
 
 class AtomicTypeLiteralPattern(PatternExpr):
+    __slots__ = ('cpp_type',)
+
     def __init__(self, cpp_type: str):
         super().__init__(type=TypeType())
         self.cpp_type = cpp_type
@@ -283,6 +327,8 @@ class AtomicTypeLiteralPattern(PatternExpr):
         return ''
 
 class PointerTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: VarReference):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -299,6 +345,8 @@ class PointerTypeExpr(Expr):
         return self.type_expr.describe_other_fields()
 
 class PointerTypePatternExpr(PatternExpr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: PatternExpr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -315,6 +363,8 @@ class PointerTypePatternExpr(PatternExpr):
         return self.type_expr.describe_other_fields()
 
 class ReferenceTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: VarReference):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -331,6 +381,8 @@ class ReferenceTypeExpr(Expr):
         return self.type_expr.describe_other_fields()
 
 class ReferenceTypePatternExpr(PatternExpr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: PatternExpr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -347,6 +399,8 @@ class ReferenceTypePatternExpr(PatternExpr):
         return self.type_expr.describe_other_fields()
 
 class RvalueReferenceTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: VarReference):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -363,6 +417,8 @@ class RvalueReferenceTypeExpr(Expr):
         return self.type_expr.describe_other_fields()
 
 class RvalueReferenceTypePatternExpr(PatternExpr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: PatternExpr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -379,6 +435,8 @@ class RvalueReferenceTypePatternExpr(PatternExpr):
         return self.type_expr.describe_other_fields()
 
 class ConstTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: VarReference):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -395,6 +453,8 @@ class ConstTypeExpr(Expr):
         return self.type_expr.describe_other_fields()
 
 class ConstTypePatternExpr(PatternExpr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: PatternExpr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -411,6 +471,8 @@ class ConstTypePatternExpr(PatternExpr):
         return self.type_expr.describe_other_fields()
 
 class ArrayTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: VarReference):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -427,6 +489,8 @@ class ArrayTypeExpr(Expr):
         return self.type_expr.describe_other_fields()
 
 class ArrayTypePatternExpr(PatternExpr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: PatternExpr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -443,6 +507,8 @@ class ArrayTypePatternExpr(PatternExpr):
         return self.type_expr.describe_other_fields()
 
 class FunctionTypeExpr(Expr):
+    __slots__ = ('return_type_expr', 'arg_list_expr')
+
     def __init__(self, return_type_expr: VarReference, arg_list_expr: VarReference):
         assert return_type_expr.type == TypeType()
         assert arg_list_expr.type == ListType(TypeType())
@@ -464,6 +530,8 @@ class FunctionTypeExpr(Expr):
                                                        str(self.arg_list_expr.describe_other_fields()))
 
 class FunctionTypePatternExpr(PatternExpr):
+    __slots__ = ('return_type_expr', 'arg_list_expr')
+
     def __init__(self, return_type_expr: PatternExpr, arg_list_expr: PatternExpr):
         assert return_type_expr.type == TypeType()
         assert arg_list_expr.type == ListType(TypeType())
@@ -486,6 +554,8 @@ class FunctionTypePatternExpr(PatternExpr):
 
 # E.g. TemplateInstantiationExpr('std::vector', [AtomicTypeLiteral('int')]) is the type 'std::vector<int>'.
 class TemplateInstantiationExpr(Expr):
+    __slots__ = ('template_atomic_cpp_type', 'arg_list_expr')
+
     def __init__(self, template_atomic_cpp_type: str, arg_list_expr: VarReference):
         assert arg_list_expr.type == ListType(TypeType())
 
@@ -505,6 +575,8 @@ class TemplateInstantiationExpr(Expr):
 
 # E.g. TemplateInstantiationExpr('std::vector', [AtomicTypeLiteral('int')]) is the type 'std::vector<int>'.
 class TemplateInstantiationPatternExpr(PatternExpr):
+    __slots__ = ('template_atomic_cpp_type', 'arg_exprs')
+
     def __init__(self, template_atomic_cpp_type: str, arg_exprs: List[PatternExpr]):
         for arg in arg_exprs:
             assert arg.type == TypeType()
@@ -527,6 +599,8 @@ class TemplateInstantiationPatternExpr(PatternExpr):
 
 # E.g. TemplateMemberAccessExpr(AtomicTypeLiteral('foo'), 'bar', [AtomicTypeLiteral('int')]) is the type 'foo::bar<int>'.
 class TemplateMemberAccessExpr(Expr):
+    __slots__ = ('class_type_expr', 'member_name', 'arg_list_expr')
+
     def __init__(self, class_type_expr: VarReference, member_name: str, arg_list_expr: VarReference):
         assert class_type_expr.type == TypeType()
         assert arg_list_expr.type == ListType(TypeType())
@@ -551,6 +625,8 @@ class TemplateMemberAccessExpr(Expr):
                                                       str(self.arg_list_expr.describe_other_fields()))
 
 class ListExpr(Expr):
+    __slots__ = ('elem_type', 'elems')
+
     def __init__(self, elem_type: ExprType, elems: List[VarReference]):
         assert not isinstance(elem_type, FunctionType)
         super().__init__(type=ListType(elem_type))
@@ -570,6 +646,8 @@ class ListExpr(Expr):
         return ''
 
 class ListPatternExpr(PatternExpr):
+    __slots__ = ('elem_type', 'elems')
+
     def __init__(self, elem_type: ExprType, elems: List[PatternExpr]):
         assert not isinstance(elem_type, FunctionType)
         super().__init__(type=ListType(elem_type))
@@ -590,6 +668,8 @@ class ListPatternExpr(PatternExpr):
                                   for elem in self.elems)
 
 class AddToSetExpr(Expr):
+    __slots__ = ('set_expr', 'elem_expr')
+
     def __init__(self, set_expr: VarReference, elem_expr: VarReference):
         assert isinstance(set_expr.type, ListType)
         assert set_expr.type.elem_type == elem_expr.type
@@ -611,6 +691,8 @@ class AddToSetExpr(Expr):
         return 'set: %s; elem: %s' % (self.set_expr.describe_other_fields(), self.elem_expr.describe_other_fields())
 
 class SetToListExpr(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference):
         assert isinstance(var.type, ListType)
         super().__init__(type=ListType(elem_type=var.type.elem_type))
@@ -627,6 +709,8 @@ class SetToListExpr(Expr):
         return self.var.describe_other_fields()
 
 class ListToSetExpr(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference):
         assert isinstance(var.type, ListType)
         super().__init__(type=ListType(elem_type=var.type.elem_type))
@@ -643,6 +727,8 @@ class ListToSetExpr(Expr):
         return self.var.describe_other_fields()
 
 class FunctionCall(Expr):
+    __slots__ = ('fun', 'args')
+
     def __init__(self, fun: VarReference, args: List[VarReference]):
         assert isinstance(fun.type, FunctionType)
         assert len(fun.type.argtypes) == len(args)
@@ -670,10 +756,12 @@ class FunctionCall(Expr):
                          for var in vars)
 
 class EqualityComparison(Expr):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs: VarReference, rhs: VarReference):
         super().__init__(type=BoolType())
         assert (lhs.type == ErrorOrVoidType() and rhs.type == TypeType()) or (lhs.type == rhs.type), '%s (%s) vs %s (%s)' % (
-            str(lhs.type), lhs.type.__dict__, str(rhs.type), rhs.type.__dict__)
+            str(lhs.type), utils.ir_to_string(lhs.type), str(rhs.type), utils.ir_to_string(rhs.type))
         assert not isinstance(lhs.type, FunctionType)
         self.lhs = lhs
         self.rhs = rhs
@@ -690,6 +778,8 @@ class EqualityComparison(Expr):
         return '(lhs: %s; rhs: %s)' % (self.lhs.describe_other_fields(), self.rhs.describe_other_fields())
 
 class SetEqualityComparison(Expr):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs: VarReference, rhs: VarReference):
         super().__init__(type=BoolType())
         assert isinstance(lhs.type, ListType)
@@ -709,6 +799,8 @@ class SetEqualityComparison(Expr):
         return '(lhs: %s; rhs: %s)' % (self.lhs.describe_other_fields(), self.rhs.describe_other_fields())
 
 class AttributeAccessExpr(Expr):
+    __slots__ = ('var', 'attribute_name')
+
     def __init__(self, var: VarReference, attribute_name: str, type: ExprType):
         super().__init__(type=type)
         assert isinstance(var.type, (TypeType, CustomType))
@@ -727,6 +819,8 @@ class AttributeAccessExpr(Expr):
         return ''
 
 class IntLiteral(Expr):
+    __slots__ = ('value',)
+
     def __init__(self, value: int):
         super().__init__(type=IntType())
         self.value = value
@@ -742,6 +836,8 @@ class IntLiteral(Expr):
         return ''
 
 class NotExpr(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference):
         assert var.type == BoolType()
         super().__init__(type=BoolType())
@@ -758,6 +854,8 @@ class NotExpr(Expr):
         return self.var.describe_other_fields()
 
 class UnaryMinusExpr(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference):
         assert var.type == IntType()
         super().__init__(type=IntType())
@@ -774,6 +872,8 @@ class UnaryMinusExpr(Expr):
         return self.var.describe_other_fields()
 
 class IntListSumExpr(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference):
         assert isinstance(var.type, ListType)
         assert isinstance(var.type.elem_type, IntType)
@@ -791,6 +891,8 @@ class IntListSumExpr(Expr):
         return self.var.describe_other_fields()
 
 class BoolListAllExpr(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference):
         assert isinstance(var.type, ListType)
         assert isinstance(var.type.elem_type, BoolType)
@@ -808,6 +910,8 @@ class BoolListAllExpr(Expr):
         return self.var.describe_other_fields()
 
 class BoolListAnyExpr(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference):
         assert isinstance(var.type, ListType)
         assert isinstance(var.type.elem_type, BoolType)
@@ -825,6 +929,8 @@ class BoolListAnyExpr(Expr):
         return self.var.describe_other_fields()
 
 class IntComparisonExpr(Expr):
+    __slots__ = ('lhs', 'rhs', 'op')
+
     def __init__(self, lhs: VarReference, rhs: VarReference, op: str):
         assert lhs.type == IntType()
         assert rhs.type == IntType()
@@ -846,6 +952,8 @@ class IntComparisonExpr(Expr):
         return '(lhs: %s; rhs: %s)' % (self.lhs.describe_other_fields(), self.rhs.describe_other_fields())
 
 class IntBinaryOpExpr(Expr):
+    __slots__ = ('lhs', 'rhs', 'op')
+
     def __init__(self, lhs: VarReference, rhs: VarReference, op: str):
         assert lhs.type == IntType()
         assert rhs.type == IntType()
@@ -867,6 +975,8 @@ class IntBinaryOpExpr(Expr):
         return '(lhs: %s; rhs: %s)' % (self.lhs.describe_other_fields(), self.rhs.describe_other_fields())
 
 class ListConcatExpr(Expr):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs: VarReference, rhs: VarReference):
         assert isinstance(lhs.type, ListType)
         assert lhs.type == rhs.type
@@ -886,6 +996,8 @@ class ListConcatExpr(Expr):
         return '(lhs: %s; rhs: %s)' % (self.lhs.describe_other_fields(), self.rhs.describe_other_fields())
 
 class IsInstanceExpr(Expr):
+    __slots__ = ('var', 'checked_type')
+
     def __init__(self, var: VarReference, checked_type: CustomType):
         super().__init__(type=BoolType())
         self.var = var
@@ -902,6 +1014,8 @@ class IsInstanceExpr(Expr):
         return ''
 
 class SafeUncheckedCast(Expr):
+    __slots__ = ('var',)
+
     def __init__(self, var: VarReference, type: ExprType):
         assert isinstance(var.type, ErrorOrVoidType)
         assert isinstance(type, CustomType)
@@ -918,14 +1032,21 @@ class SafeUncheckedCast(Expr):
     def describe_other_fields(self):
         return ''
 
-class ListComprehensionExpr(Expr):
-    def __init__(self, list_var: VarReference, loop_var: VarReference, result_elem_expr: FunctionCall):
+class ListComprehensionExpr(Expr, utils.HasSourceLocation):
+    __slots__ = ('list_var', 'loop_var', 'result_elem_expr', '_source_location')
+
+    def __init__(self,
+                 list_var: VarReference,
+                 loop_var: VarReference,
+                 result_elem_expr: FunctionCall,
+                 source_location: Optional[utils.SourceLocation] = None):
         assert isinstance(list_var.type, ListType)
         assert list_var.type.elem_type == loop_var.type
         super().__init__(type=ListType(result_elem_expr.type))
         self.list_var = list_var
         self.loop_var = loop_var
         self.result_elem_expr = result_elem_expr
+        self._source_location = source_location
 
     def get_free_variables(self):
         for var in self.list_var.get_free_variables():
@@ -941,6 +1062,8 @@ class ListComprehensionExpr(Expr):
         return ''
 
 class ReturnTypeInfo:
+    __slots__ = ('type', 'always_returns')
+
     def __init__(self, type: Optional[ExprType], always_returns: bool):
         # When expr_type is None, the statement never returns.
         # expr_type can't be None if always_returns is True.
@@ -948,6 +1071,7 @@ class ReturnTypeInfo:
         self.always_returns = always_returns
 
 class Stmt:
+    __slots__ = ()
     # Note: it's the caller's responsibility to de-duplicate VarReference objects that reference the same symbol, if
     # desired.
     def get_free_variables(self) -> 'Iterable[VarReference]': ...  # pragma: no cover
@@ -955,6 +1079,8 @@ class Stmt:
     def write(self, writer: Writer, verbose: bool): ...  # pragma: no cover
 
 class Assert(Stmt):
+    __slots__ = ('var', 'message')
+
     def __init__(self, var: VarReference, message: str):
         assert isinstance(var.type, BoolType)
         self.var = var
@@ -973,6 +1099,8 @@ class Assert(Stmt):
             writer.writeln('')
 
 class Assignment(Stmt):
+    __slots__ = ('lhs', 'lhs2', 'rhs')
+
     def __init__(self,
                  lhs: VarReference,
                  rhs: Expr,
@@ -1005,6 +1133,8 @@ class Assignment(Stmt):
                 writer.writeln('')
 
 class UnpackingAssignment(Stmt):
+    __slots__ = ('lhs_list', 'rhs', 'error_message')
+
     def __init__(self,
                  lhs_list: List[VarReference],
                  rhs: VarReference,
@@ -1036,6 +1166,8 @@ class UnpackingAssignment(Stmt):
             writer.writeln('')
 
 class ReturnStmt(Stmt):
+    __slots__ = ('result', 'error')
+
     def __init__(self, result: Optional[VarReference], error: Optional[VarReference]):
         assert result or error
         self.result = result
@@ -1060,6 +1192,8 @@ class ReturnStmt(Stmt):
             writer.writeln('')
 
 class IfStmt(Stmt):
+    __slots__ = ('cond', 'if_stmts', 'else_stmts')
+
     def __init__(self, cond: VarReference, if_stmts: List[Stmt], else_stmts: List[Stmt]):
         assert cond.type == BoolType()
         assert if_stmts
@@ -1091,19 +1225,23 @@ class IfStmt(Stmt):
                 for stmt in self.else_stmts:
                     stmt.write(writer, verbose)
 
-class FunctionDefn:
+class FunctionDefn(utils.HasSourceLocation):
+    __slots__ = ('name', 'description', 'args', 'body', 'return_type', '_source_location')
+
     def __init__(self,
                  name: str,
                  description: str,
                  args: List[FunctionArgDecl],
                  body: List[Stmt],
-                 return_type: ExprType):
+                 return_type: ExprType,
+                 source_location: Optional[utils.SourceLocation] = None):
         assert body
         self.name = name
         self.description = description
         self.args = args
         self.body = body
         self.return_type = return_type
+        self._source_location = source_location
 
     def write(self, writer: Writer, verbose: bool):
         if self.description:
@@ -1120,6 +1258,8 @@ class FunctionDefn:
         writer.writeln('')
 
 class CheckIfErrorDefn:
+    __slots__ = ('error_types_and_messages',)
+
     def __init__(self, error_types_and_messages: List[Tuple[CustomType, str]]):
         self.error_types_and_messages = error_types_and_messages
 
@@ -1135,6 +1275,8 @@ class CheckIfErrorDefn:
         writer.writeln('')
 
 class Module:
+    __slots__ = ('body', 'public_names')
+
     def __init__(self,
                  body: List[Union[FunctionDefn, Assignment, Assert, CustomType, CheckIfErrorDefn]],
                  public_names: Set[str]):
@@ -184,7 +184,8 @@ def match_expr_to_ir1(match_expr: ir2.MatchExpr):
                                                                    for pattern in match_case.type_patterns],
                                                     matched_var_names=match_case.matched_var_names,
                                                     expr=function_call_to_ir1(match_case.expr))
-                                      for match_case in match_expr.match_cases])
+                                      for match_case in match_expr.match_cases],
+                         source_location=match_expr.source_location)
 
 def bool_literal_to_ir1(literal: ir2.BoolLiteral):
     return ir1.BoolLiteral(value=literal.value)
@@ -350,7 +351,8 @@ def list_concat_expr_to_ir1(expr: ir2.ListConcatExpr):
 def list_comprehension_expr_to_ir1(expr: ir2.ListComprehensionExpr):
     return ir1.ListComprehensionExpr(list_var=var_reference_to_ir1(expr.list_var),
                                      loop_var=var_reference_to_ir1(expr.loop_var),
-                                     result_elem_expr=function_call_to_ir1(expr.result_elem_expr))
+                                     result_elem_expr=function_call_to_ir1(expr.result_elem_expr),
+                                     source_location=expr.source_location)
 
 def is_instance_expr_to_ir1(expr: ir2.IsInstanceExpr):
     return ir1.IsInstanceExpr(var=var_reference_to_ir1(expr.var),
@@ -472,7 +474,8 @@ def function_defn_to_ir1(function_defn: ir2.FunctionDefn, writer: FunWriter):
                                   args=[function_arg_decl_to_ir1(arg)
                                         for arg in function_defn.args],
                                   body=stmt_writer.stmts,
-                                  return_type=return_type))
+                                  return_type=return_type,
+                                  source_location=function_defn.source_location))
 
 def module_to_ir1(module: ir2.Module):
     writer = FunWriter()
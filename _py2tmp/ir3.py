@@ -16,26 +16,38 @@ from typing import List, Iterable, Optional, Dict, Set
 from _py2tmp import utils
 
 class ExprType(utils.ValueType):
+    __slots__ = ()
+
     def __str__(self) -> str: ...  # pragma: no cover
 
 class BoolType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'bool'
 
 # A type with no values. This is the return type of functions that never return.
 class BottomType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'BottomType'
 
 class IntType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'int'
 
 class TypeType(ExprType):
+    __slots__ = ()
+
     def __str__(self):
         return 'Type'
 
 class FunctionType(ExprType):
+    __slots__ = ('argtypes', 'returns')
+
     def __init__(self, argtypes: List[ExprType], returns: ExprType):
         self.argtypes = argtypes
         self.returns = returns
@@ -47,6 +59,8 @@ class FunctionType(ExprType):
             str(self.returns))
 
 class ListType(ExprType):
+    __slots__ = ('elem_type',)
+
     def __init__(self, elem_type: ExprType):
         assert not isinstance(elem_type, FunctionType)
         self.elem_type = elem_type
@@ -55,6 +69,8 @@ class ListType(ExprType):
         return "List[%s]" % str(self.elem_type)
 
 class SetType(ExprType):
+    __slots__ = ('elem_type',)
+
     def __init__(self, elem_type: ExprType):
         assert not isinstance(elem_type, FunctionType)
         self.elem_type = elem_type
@@ -63,11 +79,15 @@ class SetType(ExprType):
         return "Set[%s]" % str(self.elem_type)
 
 class CustomTypeArgDecl:
+    __slots__ = ('name', 'type')
+
     def __init__(self, name: str, type: ExprType):
         self.name = name
         self.type = type
 
 class CustomType(ExprType):
+    __slots__ = ('name', 'arg_types', 'is_exception_class', 'exception_message')
+
     def __init__(self,
                  name: str,
                  arg_types: List[CustomTypeArgDecl],
@@ -83,6 +103,8 @@ class CustomType(ExprType):
         return self.name
 
 class Expr:
+    __slots__ = ('type',)
+
     def __init__(self, type: ExprType):
         self.type = type
 
@@ -91,11 +113,15 @@ class Expr:
     def get_free_variables(self) -> 'Iterable[VarReference]': ...  # pragma: no cover
 
 class FunctionArgDecl:
+    __slots__ = ('type', 'name')
+
     def __init__(self, type: ExprType, name: str = ''):
         self.type = type
         self.name = name
 
 class VarReference(Expr):
+    __slots__ = ('name', 'is_global_function', 'is_function_that_may_throw')
+
     def __init__(self, type: ExprType, name: str, is_global_function: bool, is_function_that_may_throw: bool):
         super().__init__(type=type)
         assert name
@@ -108,6 +134,8 @@ class VarReference(Expr):
             yield self
 
 class MatchCase:
+    __slots__ = ('matched_var_names', 'type_patterns', 'expr')
+
     def __init__(self, matched_var_names: Set[str], type_patterns: List[Expr], expr: Expr):
         self.matched_var_names = matched_var_names
         self.type_patterns = type_patterns
@@ -118,8 +146,13 @@ class MatchCase:
         return all(isinstance(pattern, VarReference) and pattern.name in matched_var_names_set
                    for pattern in self.type_patterns)
 
-class MatchExpr(Expr):
-    def __init__(self, matched_exprs: List[Expr], match_cases: List[MatchCase]):
+class MatchExpr(Expr, utils.HasSourceLocation):
+    __slots__ = ('matched_exprs', 'match_cases', '_source_location')
+
+    def __init__(self,
+                 matched_exprs: List[Expr],
+                 match_cases: List[MatchCase],
+                 source_location: Optional[utils.SourceLocation] = None):
         assert matched_exprs
         assert match_cases
         for match_case in match_cases:
@@ -128,6 +161,7 @@ class MatchExpr(Expr):
         super().__init__(type=match_cases[0].expr.type)
         self.matched_exprs = matched_exprs
         self.match_cases = match_cases
+        self._source_location = source_location
 
         assert len([match_case
                     for match_case in match_cases
@@ -144,6 +178,8 @@ class MatchExpr(Expr):
                     yield var
 
 class BoolLiteral(Expr):
+    __slots__ = ('value',)
+
     def __init__(self, value: bool):
         super().__init__(BoolType())
         self.value = value
@@ -153,6 +189,8 @@ class BoolLiteral(Expr):
             yield  # pragma: no cover
 
 class AtomicTypeLiteral(Expr):
+    __slots__ = ('cpp_type',)
+
     def __init__(self, cpp_type: str):
         super().__init__(type=TypeType())
         self.cpp_type = cpp_type
@@ -162,6 +200,8 @@ class AtomicTypeLiteral(Expr):
             yield  # pragma: no cover
 
 class PointerTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -172,6 +212,8 @@ class PointerTypeExpr(Expr):
             yield var
 
 class ReferenceTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -182,6 +224,8 @@ class ReferenceTypeExpr(Expr):
             yield var
 
 class RvalueReferenceTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -192,6 +236,8 @@ class RvalueReferenceTypeExpr(Expr):
             yield var
 
 class ConstTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -202,6 +248,8 @@ class ConstTypeExpr(Expr):
             yield var
 
 class ArrayTypeExpr(Expr):
+    __slots__ = ('type_expr',)
+
     def __init__(self, type_expr: Expr):
         super().__init__(type=TypeType())
         assert type_expr.type == TypeType()
@@ -212,6 +260,8 @@ class ArrayTypeExpr(Expr):
             yield var
 
 class FunctionTypeExpr(Expr):
+    __slots__ = ('return_type_expr', 'arg_list_expr')
+
     def __init__(self, return_type_expr: Expr, arg_list_expr: Expr):
         assert return_type_expr.type == TypeType()
         assert arg_list_expr.type == ListType(TypeType())
@@ -227,6 +277,8 @@ class FunctionTypeExpr(Expr):
 
 # E.g. TemplateInstantiationExpr('std::vector', [AtomicTypeLiteral('int')]) is the type 'std::vector<int>'.
 class TemplateInstantiationExpr(Expr):
+    __slots__ = ('template_atomic_cpp_type', 'arg_list_expr')
+
     def __init__(self, template_atomic_cpp_type: str, arg_list_expr: Expr):
         assert arg_list_expr.type == ListType(TypeType())
 
@@ -240,6 +292,8 @@ class TemplateInstantiationExpr(Expr):
 
 # E.g. TemplateMemberAccessExpr(AtomicTypeLiteral('foo'), 'bar', [AtomicTypeLiteral('int')]) is the type 'foo::bar<int>'.
 class TemplateMemberAccessExpr(Expr):
+    __slots__ = ('class_type_expr', 'member_name', 'arg_list_expr')
+
     def __init__(self, class_type_expr: Expr, member_name: str, arg_list_expr: Expr):
         assert class_type_expr.type == TypeType()
         assert arg_list_expr.type == ListType(TypeType())
@@ -255,6 +309,8 @@ class TemplateMemberAccessExpr(Expr):
                 yield var
 
 class ListExpr(Expr):
+    __slots__ = ('elem_type', 'elem_exprs')
+
     def __init__(self, elem_type: ExprType, elem_exprs: List[Expr]):
         assert not isinstance(elem_type, FunctionType)
         super().__init__(type=ListType(elem_type))
@@ -267,6 +323,8 @@ class ListExpr(Expr):
                 yield var
 
 class SetExpr(Expr):
+    __slots__ = ('elem_type', 'elem_exprs')
+
     def __init__(self, elem_type: ExprType, elem_exprs: List[Expr]):
         assert not isinstance(elem_type, FunctionType)
         super().__init__(type=SetType(elem_type))
@@ -279,6 +337,8 @@ class SetExpr(Expr):
                 yield var
 
 class IntListSumExpr(Expr):
+    __slots__ = ('list_expr',)
+
     def __init__(self, list_expr: Expr):
         assert isinstance(list_expr.type, ListType)
         assert isinstance(list_expr.type.elem_type, IntType)
@@ -290,6 +350,8 @@ class IntListSumExpr(Expr):
             yield var
 
 class IntSetSumExpr(Expr):
+    __slots__ = ('set_expr',)
+
     def __init__(self, set_expr: Expr):
         assert isinstance(set_expr.type, SetType)
         assert isinstance(set_expr.type.elem_type, IntType)
@@ -301,6 +363,8 @@ class IntSetSumExpr(Expr):
             yield var
 
 class BoolListAllExpr(Expr):
+    __slots__ = ('list_expr',)
+
     def __init__(self, list_expr: Expr):
         assert isinstance(list_expr.type, ListType)
         assert isinstance(list_expr.type.elem_type, BoolType)
@@ -312,6 +376,8 @@ class BoolListAllExpr(Expr):
             yield var
 
 class BoolSetAllExpr(Expr):
+    __slots__ = ('set_expr',)
+
     def __init__(self, set_expr: Expr):
         assert isinstance(set_expr.type, SetType)
         assert isinstance(set_expr.type.elem_type, BoolType)
@@ -323,6 +389,8 @@ class BoolSetAllExpr(Expr):
             yield var
 
 class BoolListAnyExpr(Expr):
+    __slots__ = ('list_expr',)
+
     def __init__(self, list_expr: Expr):
         assert isinstance(list_expr.type, ListType)
         assert isinstance(list_expr.type.elem_type, BoolType)
@@ -334,6 +402,8 @@ class BoolListAnyExpr(Expr):
             yield var
 
 class BoolSetAnyExpr(Expr):
+    __slots__ = ('set_expr',)
+
     def __init__(self, set_expr: Expr):
         assert isinstance(set_expr.type, SetType)
         assert isinstance(set_expr.type.elem_type, BoolType)
@@ -345,6 +415,8 @@ class BoolSetAnyExpr(Expr):
             yield var
 
 class FunctionCall(Expr):
+    __slots__ = ('fun_expr', 'args', 'may_throw')
+
     def __init__(self,
                  fun_expr: Expr,
                  args: List[Expr],
@@ -364,6 +436,8 @@ class FunctionCall(Expr):
                 yield var
 
 class EqualityComparison(Expr):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs: Expr, rhs: Expr):
         super().__init__(type=BoolType())
         assert lhs.type == rhs.type
@@ -377,6 +451,8 @@ class EqualityComparison(Expr):
                 yield var
 
 class AttributeAccessExpr(Expr):
+    __slots__ = ('expr', 'attribute_name')
+
     def __init__(self, expr: Expr, attribute_name: str, type: ExprType):
         super().__init__(type=type)
         assert isinstance(expr.type, (TypeType, CustomType))
@@ -388,6 +464,8 @@ class AttributeAccessExpr(Expr):
             yield var
 
 class AndExpr(Expr):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs: Expr, rhs: Expr):
         assert lhs.type == BoolType()
         assert rhs.type == BoolType()
@@ -401,6 +479,8 @@ class AndExpr(Expr):
                 yield var
 
 class OrExpr(Expr):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs: Expr, rhs: Expr):
         assert lhs.type == BoolType()
         assert rhs.type == BoolType()
@@ -414,6 +494,8 @@ class OrExpr(Expr):
                 yield var
 
 class NotExpr(Expr):
+    __slots__ = ('expr',)
+
     def __init__(self, expr: Expr):
         assert expr.type == BoolType()
         super().__init__(type=BoolType())
@@ -424,6 +506,8 @@ class NotExpr(Expr):
             yield var
 
 class IntLiteral(Expr):
+    __slots__ = ('value',)
+
     def __init__(self, value: int):
         super().__init__(type=IntType())
         self.value = value
@@ -433,6 +517,8 @@ class IntLiteral(Expr):
             yield  # pragma: no cover
 
 class IntComparisonExpr(Expr):
+    __slots__ = ('lhs', 'rhs', 'op')
+
     def __init__(self, lhs: Expr, rhs: Expr, op: str):
         assert lhs.type == IntType()
         assert rhs.type == IntType()
@@ -448,6 +534,8 @@ class IntComparisonExpr(Expr):
                 yield var
 
 class IntUnaryMinusExpr(Expr):
+    __slots__ = ('expr',)
+
     def __init__(self, expr: Expr):
         assert expr.type == IntType()
         super().__init__(type=IntType())
@@ -458,6 +546,8 @@ class IntUnaryMinusExpr(Expr):
             yield var
 
 class IntBinaryOpExpr(Expr):
+    __slots__ = ('lhs', 'rhs', 'op')
+
     def __init__(self, lhs: Expr, rhs: Expr, op: str):
         assert lhs.type == IntType()
         assert rhs.type == IntType()
@@ -472,6 +562,8 @@ class IntBinaryOpExpr(Expr):
                 yield var
 
 class ListConcatExpr(Expr):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs: Expr, rhs: Expr):
         assert isinstance(lhs.type, ListType)
         assert lhs.type == rhs.type
@@ -484,15 +576,19 @@ class ListConcatExpr(Expr):
             for var in expr.get_free_variables():
                 yield var
 
-class ListComprehension(Expr):
+class ListComprehension(Expr, utils.HasSourceLocation):
+    __slots__ = ('list_expr', 'loop_var', 'result_elem_expr', '_source_location')
+
     def __init__(self,
                  list_expr: Expr,
                  loop_var: VarReference,
-                 result_elem_expr: Expr):
+                 result_elem_expr: Expr,
+                 source_location: Optional[utils.SourceLocation] = None):
         super().__init__(type=ListType(result_elem_expr.type))
         self.list_expr = list_expr
         self.loop_var = loop_var
         self.result_elem_expr = result_elem_expr
+        self._source_location = source_location
 
     def get_free_variables(self):
         for var in self.list_expr.get_free_variables():
@@ -501,16 +597,20 @@ class ListComprehension(Expr):
             if var.name != self.loop_var.name:
                 yield var
 
-class SetComprehension(Expr):
+class SetComprehension(Expr, utils.HasSourceLocation):
+    __slots__ = ('set_expr', 'loop_var', 'result_elem_expr', '_source_location')
+
     def __init__(self,
                  set_expr: Expr,
                  loop_var: VarReference,
-                 result_elem_expr: Expr):
+                 result_elem_expr: Expr,
+                 source_location: Optional[utils.SourceLocation] = None):
         assert isinstance(set_expr.type, SetType)
         super().__init__(type=SetType(result_elem_expr.type))
         self.set_expr = set_expr
         self.loop_var = loop_var
         self.result_elem_expr = result_elem_expr
+        self._source_location = source_location
 
     def get_free_variables(self):
         for var in self.set_expr.get_free_variables():
@@ -520,6 +620,8 @@ class SetComprehension(Expr):
                 yield var
 
 class ReturnTypeInfo:
+    __slots__ = ('type', 'always_returns')
+
     def __init__(self, type: Optional[ExprType], always_returns: bool):
         # When expr_type is None, the statement never returns.
         # expr_type can't be None if always_returns is True.
@@ -527,9 +629,13 @@ class ReturnTypeInfo:
         self.always_returns = always_returns
 
 class Stmt:
+    __slots__ = ()
+
     def get_return_type(self) -> ReturnTypeInfo: ...  # pragma: no cover
 
 class Assert(Stmt):
+    __slots__ = ('expr', 'message')
+
     def __init__(self, expr: Expr, message: str):
         assert isinstance(expr.type, BoolType)
         self.expr = expr
@@ -539,6 +645,8 @@ class Assert(Stmt):
         return ReturnTypeInfo(type=None, always_returns=False)
 
 class Assignment(Stmt):
+    __slots__ = ('lhs', 'rhs')
+
     def __init__(self, lhs: VarReference, rhs: Expr):
         assert lhs.type == rhs.type
         self.lhs = lhs
@@ -548,6 +656,8 @@ class Assignment(Stmt):
         return ReturnTypeInfo(type=None, always_returns=False)
 
 class UnpackingAssignment(Stmt):
+    __slots__ = ('lhs_list', 'rhs', 'error_message')
+
     def __init__(self, lhs_list: List[VarReference], rhs: Expr, error_message: str):
         assert isinstance(rhs.type, ListType)
         assert lhs_list
@@ -561,6 +671,8 @@ class UnpackingAssignment(Stmt):
         return ReturnTypeInfo(type=None, always_returns=False)
 
 class ReturnStmt(Stmt):
+    __slots__ = ('expr',)
+
     def __init__(self, expr: Expr):
         self.expr = expr
 
@@ -585,6 +697,8 @@ def _combine_return_type_of_branches(branch1_stmts: List[Stmt], branch2_stmts: L
                           always_returns=branch1_return_type_info.always_returns and branch2_return_type_info.always_returns)
 
 class IfStmt(Stmt):
+    __slots__ = ('cond_expr', 'if_stmts', 'else_stmts')
+
     def __init__(self, cond_expr: Expr, if_stmts: List[Stmt], else_stmts: List[Stmt]):
         assert cond_expr.type == BoolType()
         assert if_stmts
@@ -596,6 +710,8 @@ class IfStmt(Stmt):
         return _combine_return_type_of_branches(self.if_stmts, self.else_stmts)
 
 class RaiseStmt(Stmt):
+    __slots__ = ('expr',)
+
     def __init__(self, expr: Expr):
         assert isinstance(expr.type, CustomType)
         assert expr.type.is_exception_class
@@ -605,6 +721,8 @@ class RaiseStmt(Stmt):
         return ReturnTypeInfo(type=None, always_returns=True)
 
 class TryExcept(Stmt):
+    __slots__ = ('try_body', 'caught_exception_type', 'caught_exception_name', 'except_body')
+
     def __init__(self,
                  try_body: List[Stmt],
                  caught_exception_type: ExprType,
@@ -618,24 +736,33 @@ class TryExcept(Stmt):
     def get_return_type(self):
         return _combine_return_type_of_branches(self.try_body, self.except_body)
 
-class FunctionDefn:
+class FunctionDefn(utils.HasSourceLocation):
+    __slots__ = ('name', 'args', 'body', 'return_type', '_source_location')
+
     def __init__(self,
                  name: str,
                  args: List[FunctionArgDecl],
                  body: List[Stmt],
-                 return_type: ExprType):
+                 return_type: ExprType,
+                 source_location: Optional[utils.SourceLocation] = None):
         self.name = name
         self.args = args
         self.body = body
         self.return_type = return_type
+        self._source_location = source_location
 
 class Module:
+    __slots__ = ('function_defns', 'assertions', 'custom_types', 'public_names', 'imported_custom_types')
+
     def __init__(self,
                  function_defns: List[FunctionDefn],
                  assertions: List[Assert],
                  custom_types: List[CustomType],
-                 public_names: Set[str]):
+                 public_names: Set[str],
+                 imported_custom_types: List[CustomType] = ()):
         self.function_defns = function_defns
         self.assertions = assertions
         self.custom_types = custom_types
         self.public_names = public_names
+        # The custom types defined in other (separately-compiled) modules, that might be used in this module.
+        self.imported_custom_types = imported_custom_types
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import itertools
 from collections import defaultdict
 from _py2tmp import ir2
 from _py2tmp import ir3
@@ -30,10 +31,21 @@ class FunWriter(Writer):
                                              is_global_function=True)
         self.function_defns = [self._create_is_error_fun_defn()]
         self.obfuscated_identifiers_by_identifier = defaultdict(lambda: self.new_id())  # type: Dict[str, str]
+        # The location of the TMPPy code being converted, if known. The helper functions written while converting it
+        # (e.g. for match cases, comprehensions and try-except) are attributed to this location.
+        self.current_source_location = None  # type: Optional[utils.SourceLocation]
 
     def new_id(self):
         return next(self.identifier_generator)
 
+    @contextmanager
+    def source_location(self, source_location: Optional[utils.SourceLocation]):
+        old_source_location = self.current_source_location
+        if source_location:
+            self.current_source_location = source_location
+        yield
+        self.current_source_location = old_source_location
+
     def obfuscate_identifier(self, identifier: str):
         return self.obfuscated_identifiers_by_identifier[identifier]
 
@@ -321,6 +333,10 @@ def _select_arbitrary_forwarded_arg(args: List[ir2.FunctionArgDecl]):
                             is_function_that_may_throw=isinstance(selected_arg.type, ir2.FunctionType))
 
 def match_expr_to_ir2(match_expr: ir3.MatchExpr, writer: StmtWriter):
+    with writer.fun_writer.source_location(match_expr.source_location):
+        return _match_expr_to_ir2(match_expr, writer)
+
+def _match_expr_to_ir2(match_expr: ir3.MatchExpr, writer: StmtWriter):
     matched_vars = [expr_to_ir2(expr, writer)
                     for expr in match_expr.matched_exprs]
 
@@ -341,7 +357,8 @@ def match_expr_to_ir2(match_expr: ir3.MatchExpr, writer: StmtWriter):
                                                description='(meta)function wrapping the code in a branch of a match expression',
                                                args=arg_decls,
                                                body=match_case_writer.stmts,
-                                               return_type=match_case_var.type))
+                                               return_type=match_case_var.type,
+                                               source_location=writer.fun_writer.current_source_location))
         match_fun_ref = ir2.VarReference(type=ir2.FunctionType(argtypes=[var.type
                                                                          for var in forwarded_vars],
                                                                returns=match_case_var.type),
@@ -356,7 +373,8 @@ def match_expr_to_ir2(match_expr: ir3.MatchExpr, writer: StmtWriter):
                                          expr=ir2.FunctionCall(fun=match_fun_ref,
                                                                args=forwarded_vars)))
 
-    return writer.new_var_for_expr_with_error_checking(ir2.MatchExpr(matched_vars, match_cases))
+    return writer.new_var_for_expr_with_error_checking(
+        ir2.MatchExpr(matched_vars, match_cases, source_location=writer.fun_writer.current_source_location))
 
 def bool_literal_to_ir2(literal: ir3.BoolLiteral, writer: StmtWriter):
     return writer.new_var_for_expr(ir2.BoolLiteral(value=literal.value))
@@ -523,7 +541,15 @@ def list_concat_expr_to_ir2(expr: ir3.ListConcatExpr, writer: StmtWriter):
 def deconstructed_list_comprehension_expr_to_ir2(list_var: ir3.VarReference,
                                                  loop_var: ir2.VarReference,
                                                  result_elem_expr: ir2.Expr,
+                                                 source_location: Optional[utils.SourceLocation],
                                                  writer: StmtWriter):
+    with writer.fun_writer.source_location(source_location):
+        return _deconstructed_list_comprehension_expr_to_ir2(list_var, loop_var, result_elem_expr, writer)
+
+def _deconstructed_list_comprehension_expr_to_ir2(list_var: ir3.VarReference,
+                                                  loop_var: ir2.VarReference,
+                                                  result_elem_expr: ir2.Expr,
+                                                  writer: StmtWriter):
     # [f(x, y) * 2
     #  for x in l]
     #
@@ -554,7 +580,8 @@ def deconstructed_list_comprehension_expr_to_ir2(list_var: ir3.VarReference,
                                            args=[ir2.FunctionArgDecl(type=var.type, name=var.name)
                                                  for var in forwarded_vars],
                                            body=helper_fun_writer.stmts,
-                                           return_type=result_elem_type))
+                                           return_type=result_elem_type,
+                                           source_location=writer.fun_writer.current_source_location))
 
     helper_fun_call = ir2.FunctionCall(fun=ir2.VarReference(name=helper_fun_name,
                                                             type=ir2.FunctionType(argtypes=[var.type
@@ -565,7 +592,8 @@ def deconstructed_list_comprehension_expr_to_ir2(list_var: ir3.VarReference,
                                        args=forwarded_vars)
     return writer.new_var_for_expr_with_error_checking(ir2.ListComprehensionExpr(list_var=list_var,
                                                                                  loop_var=var_reference_to_ir2(loop_var, writer),
-                                                                                 result_elem_expr=helper_fun_call))
+                                                                                 result_elem_expr=helper_fun_call,
+                                                                                 source_location=writer.fun_writer.current_source_location))
 
 
 def list_comprehension_expr_to_ir2(expr: ir3.ListComprehension, writer: StmtWriter):
@@ -574,6 +602,7 @@ def list_comprehension_expr_to_ir2(expr: ir3.ListComprehension, writer: StmtWrit
     return deconstructed_list_comprehension_expr_to_ir2(list_var=l_var,
                                                         loop_var=expr.loop_var,
                                                         result_elem_expr=expr.result_elem_expr,
+                                                        source_location=expr.source_location,
                                                         writer=writer)
 
 
@@ -594,6 +623,7 @@ def set_comprehension_expr_to_ir2(expr: ir3.SetComprehension, writer: StmtWriter
     l2_var = deconstructed_list_comprehension_expr_to_ir2(list_var=l_var,
                                                           loop_var=expr.loop_var,
                                                           result_elem_expr=expr.result_elem_expr,
+                                                          source_location=expr.source_location,
                                                           writer=writer)
 
     return writer.new_var_for_expr(ir2.ListToSetExpr(l2_var))
@@ -706,7 +736,8 @@ def try_except_stmt_to_ir2(try_except_stmt: ir3.TryExcept,
                                          args=[ir2.FunctionArgDecl(type=var.type, name=var.name)
                                                for var in then_fun_forwarded_vars],
                                          body=then_stmts_writer.stmts,
-                                         return_type=writer.current_fun_return_type)
+                                         return_type=writer.current_fun_return_type,
+                                         source_location=writer.fun_writer.current_source_location)
         writer.write_function(then_fun_defn)
 
         then_fun_ref = ir2.VarReference(type=ir2.FunctionType(argtypes=[arg.type
@@ -735,7 +766,8 @@ def try_except_stmt_to_ir2(try_except_stmt: ir3.TryExcept,
                                        args=[ir2.FunctionArgDecl(type=var.type, name=var.name)
                                              for var in except_fun_forwarded_vars],
                                        body=except_stmts_writer.stmts,
-                                       return_type=writer.current_fun_return_type)
+                                       return_type=writer.current_fun_return_type,
+                                       source_location=writer.fun_writer.current_source_location)
     writer.write_function(except_fun_defn)
 
     except_fun_ref = ir2.VarReference(type=ir2.FunctionType(argtypes=[arg.type
@@ -838,6 +870,10 @@ def stmts_to_ir2(stmts: List[ir3.Stmt], writer: StmtWriter):
             raise NotImplementedError('Unexpected statement: %s' % str(stmt.__class__))
 
 def function_defn_to_ir2(function_defn: ir3.FunctionDefn, writer: FunWriter):
+    with writer.source_location(function_defn.source_location):
+        _function_defn_to_ir2(function_defn, writer)
+
+def _function_defn_to_ir2(function_defn: ir3.FunctionDefn, writer: FunWriter):
     return_type = type_to_ir2(function_defn.return_type)
     arg_decls = [function_arg_decl_to_ir2(arg, writer) for arg in function_defn.args]
 
@@ -848,7 +884,8 @@ def function_defn_to_ir2(function_defn: ir3.FunctionDefn, writer: FunWriter):
                                            description='',
                                            args=arg_decls,
                                            body=stmt_writer.stmts,
-                                           return_type=return_type))
+                                           return_type=return_type,
+                                           source_location=function_defn.source_location))
 
 def module_to_ir2(module: ir3.Module, identifier_generator: Iterator[str]):
     writer = FunWriter(identifier_generator)
@@ -860,7 +897,10 @@ def module_to_ir2(module: ir3.Module, identifier_generator: Iterator[str]):
         assert_to_ir2(assertion, stmt_writer)
 
     custom_types_defns = [type_to_ir2(type) for type in module.custom_types]
+    # The exceptions defined in imported modules can also propagate to the toplevel code of this module.
     check_if_error_defn = ir2.CheckIfErrorDefn([(type_to_ir2(type), type.exception_message)
-                                                for type in module.custom_types if type.is_exception_class])
+                                                for type in itertools.chain(module.imported_custom_types,
+                                                                            module.custom_types)
+                                                if type.is_exception_class])
     return ir2.Module(body=custom_types_defns + [check_if_error_defn] + writer.function_defns + stmt_writer.stmts,
                       public_names=module.public_names)
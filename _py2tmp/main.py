@@ -13,90 +13,898 @@
 # limitations under the License.
 
 import itertools
+import os
 import typed_ast.ast3 as ast
 
 from _py2tmp import (
     ast_to_ir3,
+    module_interface,
     ir3_to_ir2,
     ir2_to_ir1,
     ir1_to_ir0,
     optimize_ir3,
     optimize_ir0,
     ir0_to_cpp,
+    ir0,
+    instantiation_cost,
     utils,
+    profiling,
+    server,
 )
+from _py2tmp.compilation_cache import CompilationCache
+from _py2tmp.module_interface import ModuleInterface
+from _py2tmp.optimize_ir0 import OptimizationOptions, OptimizationStatus
+from _py2tmp.profiling import CompilationStats
 
 import argparse
+import concurrent.futures
+import json
+import sys
+import traceback
+from collections import OrderedDict
+from typing import Optional, List, Dict, Tuple, Iterator, Callable
 
-def convert_to_cpp(python_source, filename='<unknown>', verbose=False):
+_FORMATS = ('native', 'clang-format')
+_NAMINGS = ('sequential', 'content-derived')
+
+def convert_to_cpp(python_source,
+                   filename='<unknown>',
+                   verbose=False,
+                   cache: Optional[CompilationCache] = None,
+                   format='native',
+                   stats: Optional[CompilationStats] = None,
+                   verbose_templates: Optional[List[str]] = None,
+                   optimization_options: Optional[OptimizationOptions] = None,
+                   naming='sequential',
+                   source_locations=False):
+    '''Converts the given TMPPy source to C++.
+
+    optimization_options controls how much the generated code is optimized; by default that's -O1, see
+    OptimizationOptions.
+
+    naming controls how the internal identifiers are generated. With "sequential" they're numbered in order, so changing
+    a function usually changes the generated code for the functions after it too. With "content-derived" they only depend
+    on the function that they're generated for, so the code generated for unchanged functions doesn't change.
+
+    If `stats` is specified, statistics for each stage of the conversion (and each optimization) are recorded there.
+    In verbose mode, if verbose_templates is specified, the changes made by the optimizations are only printed for the
+    templates whose names match one of these fnmatch-style patterns.
+
+    If source_locations is True, each generated template is preceded by a comment with the location of the TMPPy code
+    that it was generated from, so that e.g. the C++ compiler's instantiation times can be attributed to TMPPy functions
+    and lines (see time_trace.py).
+    '''
+    return _convert_to_cpp_with_cache(python_source, filename, verbose, cache, format, stats, verbose_templates,
+                                      optimization_options, naming, split_header_name=None, shared_support_header=None,
+                                      module_name=None, module_interfaces=None, source_locations=source_locations)
+
+def convert_to_split_cpp(python_source,
+                         header_name: str,
+                         filename='<unknown>',
+                         verbose=False,
+                         cache: Optional[CompilationCache] = None,
+                         format='native',
+                         stats: Optional[CompilationStats] = None,
+                         verbose_templates: Optional[List[str]] = None,
+                         optimization_options: Optional[OptimizationOptions] = None,
+                         naming='sequential',
+                         source_locations=False) -> Dict[str, str]:
+    '''Like convert_to_cpp(), but generates a separate header for each public function.
+
+    This way a C++ file that only uses some of the public functions doesn't have to parse the templates used only by
+    the others. Returns a dict with the C++ source of each header, keyed by the path relative to the directory of the
+    main header, <header_name>.h; see ir0_to_cpp.header_to_split_cpp() for details.
+    '''
+    return _convert_to_cpp_with_cache(python_source, filename, verbose, cache, format, stats, verbose_templates,
+                                      optimization_options, naming, split_header_name=header_name,
+                                      shared_support_header=None, module_name=None, module_interfaces=None,
+                                      source_locations=source_locations)
+
+def convert_to_cpp_with_shared_templates(python_source,
+                                         shared_support_header: str,
+                                         filename='<unknown>',
+                                         verbose=False,
+                                         cache: Optional[CompilationCache] = None,
+                                         format='native',
+                                         stats: Optional[CompilationStats] = None,
+                                         verbose_templates: Optional[List[str]] = None,
+                                         optimization_options: Optional[OptimizationOptions] = None
+                                         ) -> Tuple[str, Dict[str, Tuple[str, str]]]:
+    '''Like convert_to_cpp(), but the helper templates that don't depend on the module are defined in a shared header.
+
+    When a C++ file includes the headers generated for many modules, this way each of these helper templates is only
+    parsed (and each of its instantiations is only done) once, instead of once per module. This always uses
+    content-derived naming, so that identical helper templates in different modules have the same name.
+
+    The generated code includes shared_support_header, as written. Returns the C++ code and the shared templates, that
+    must be passed to shared_support_header_to_cpp() (together with the ones of the other modules) to generate the
+    shared support header.
+    '''
+    return _convert_to_cpp_with_cache(python_source, filename, verbose, cache, format, stats, verbose_templates,
+                                      optimization_options, naming='content-derived', split_header_name=None,
+                                      shared_support_header=shared_support_header, module_name=None,
+                                      module_interfaces=None, source_locations=False)
+
+def convert_module_to_cpp(python_source,
+                          module_name: str,
+                          module_interfaces: Optional[Dict[str, ModuleInterface]] = None,
+                          filename='<unknown>',
+                          verbose=False,
+                          cache: Optional[CompilationCache] = None,
+                          format='native',
+                          stats: Optional[CompilationStats] = None,
+                          verbose_templates: Optional[List[str]] = None,
+                          optimization_options: Optional[OptimizationOptions] = None,
+                          naming='sequential',
+                          source_locations=False) -> Tuple[str, ModuleInterface]:
+    '''Like convert_to_cpp(), but for a module that can import (and be imported by) separately-compiled modules.
+
+    The source can contain imports like "from mylib.traits import f" for the modules in module_interfaces (keyed by
+    module name), and the generated code includes their headers (e.g. "mylib/traits.h"). Returns the C++ code and the
+    interface of this module, that the modules that import it need (instead of its source). The headers of all the
+    modules can be used in the same C++ file.
+    '''
+    return _convert_to_cpp_with_cache(python_source, filename, verbose, cache, format, stats, verbose_templates,
+                                      optimization_options, naming, split_header_name=None, shared_support_header=None,
+                                      module_name=module_name, module_interfaces=module_interfaces or dict(),
+                                      source_locations=source_locations)
+
+def compute_module_interface(python_source,
+                             module_name: str,
+                             module_interfaces: Optional[Dict[str, ModuleInterface]] = None,
+                             filename='<unknown>') -> ModuleInterface:
+    '''Returns the interface of the module, like convert_module_to_cpp() but much faster.
+
+    This only typechecks the module, so it can be used to get the interfaces that the modules that import this one need
+    before generating the code for this module (e.g. to generate the code for all the modules in parallel).
+    '''
+    module_interfaces = module_interfaces or dict()
     source_ast = ast.parse(python_source, filename=filename)
+    module_ir3 = ast_to_ir3.module_ast_to_ir3(source_ast, filename, python_source.splitlines(), module_interfaces)
+    return _compute_module_interface(module_ir3, source_ast, module_name, module_interfaces)
+
+def estimate_instantiation_costs(python_source,
+                                 filename='<unknown>',
+                                 optimization_options: Optional[OptimizationOptions] = None,
+                                 module_name: Optional[str] = None,
+                                 module_interfaces: Optional[Dict[str, ModuleInterface]] = None
+                                 ) -> Dict[str, instantiation_cost.InstantiationCost]:
+    '''Estimates how expensive the code generated by convert_to_cpp() is for the C++ compiler.
+
+    Returns the estimated number of class template instantiations and the maximum instantiation depth needed by each
+    public metafunction, as polynomials in the size of its arguments; see
+    instantiation_cost.estimate_instantiation_costs() for details. For modules, module_name and module_interfaces must
+    be the ones passed to convert_module_to_cpp().
+    '''
+    if optimization_options is None:
+        optimization_options = OptimizationOptions()
+    _, header_ir0, _ = _convert_to_ir0(python_source, filename, verbose=False, cache=None, stats=None,
+                                       verbose_templates=None, optimization_options=optimization_options,
+                                       module_name=module_name, module_interfaces=module_interfaces,
+                                       identifier_generator=_create_identifier_generator())
+    return instantiation_cost.estimate_instantiation_costs(header_ir0)
 
+def _compute_module_interface(module_ir3,source_ast: ast.Module, module_name: str,
+                              module_interfaces: Dict[str, ModuleInterface]):
+    imported_module_interfaces = {imported_module_name: module_interfaces[imported_module_name]
+                                  for imported_module_name in module_interface.get_imported_module_names(source_ast)}
+    return module_interface.module_to_interface(module_ir3, module_name, imported_module_interfaces,
+                                                optimize_ir3.compute_function_can_throw_info(module_ir3))
+
+def shared_support_header_to_cpp(shared_templates_by_module: List[Dict[str, Tuple[str, str]]], format='native'):
+    '''Generates the shared support header for the given modules, see convert_to_cpp_with_shared_templates().'''
+    assert format in _FORMATS, format
+    return _format_cpp(ir0_to_cpp.shared_support_header_to_cpp(shared_templates_by_module), format, stats=None)
+
+def _convert_to_cpp_with_cache(python_source,
+                               filename,
+                               verbose,
+                               cache: Optional[CompilationCache],
+                               format,
+                               stats: Optional[CompilationStats],
+                               verbose_templates: Optional[List[str]],
+                               optimization_options: Optional[OptimizationOptions],
+                               naming: str,
+                               split_header_name: Optional[str],
+                               shared_support_header: Optional[str],
+                               module_name: Optional[str],
+                               module_interfaces: Optional[Dict[str, ModuleInterface]],
+                               source_locations: bool,
+                               header_ir0_callback: Optional[Callable[[ir0.Header], None]] = None):
+    assert format in _FORMATS, format
+    assert naming in _NAMINGS, naming
+    assert len([x for x in (split_header_name, shared_support_header, module_name) if x is not None]) <= 1
+    if optimization_options is None:
+        optimization_options = OptimizationOptions()
+    # In verbose mode the caller wants to see the intermediate steps, so we bypass the cache.
+    if cache is None or verbose:
+        return _convert_to_cpp(python_source, filename, verbose, format, cache=None, stats=stats,
+                               verbose_templates=verbose_templates, optimization_options=optimization_options,
+                               naming=naming, split_header_name=split_header_name,
+                               shared_support_header=shared_support_header, module_name=module_name,
+                               module_interfaces=module_interfaces, source_locations=source_locations,
+                               header_ir0_callback=header_ir0_callback)
+
+    key = cache.compute_key(python_source, options={'filename': filename,
+                                                    'format': format,
+                                                    'naming': naming,
+                                                    'split_header_name': split_header_name,
+                                                    'shared_support_header': shared_support_header,
+                                                    'module_name': module_name,
+                                                    'module_interfaces': None if module_interfaces is None else {
+                                                        name: interface.to_json()
+                                                        for name, interface in module_interfaces.items()},
+                                                    'source_locations': source_locations,
+                                                    'optimization_options': optimization_options.to_json()})
+    # The cache doesn't store the IR0, so if the caller wants it we must convert the source anyway (but the optimized
+    # templates can still come from the cache).
+    if header_ir0_callback is None:
+        result = profiling.run_stage(stats, 'compilation_cache_lookup', None, lambda: cache.get(key))
+    else:
+        result = None
+    if result is None:
+        optimization_status = OptimizationStatus()
+        result = _convert_to_cpp(python_source, filename, verbose, format, cache, stats, verbose_templates,
+                                 optimization_options, naming, split_header_name, shared_support_header, module_name,
+                                 module_interfaces, source_locations, optimization_status, header_ir0_callback)
+        # When a template exceeded its time budget the result depends on the machine's speed, so we don't cache it.
+        if not optimization_status.exceeded_deadline:
+            # The cache only stores strings.
+            if split_header_name is not None:
+                cache.put(key, json.dumps(result))
+            elif shared_support_header is not None:
+                cpp_source, shared_templates = result
+                cache.put(key, json.dumps([cpp_source,
+                                           [[name, forward_decl, defn]
+                                            for name, (forward_decl, defn) in shared_templates.items()]]))
+            elif module_name is not None:
+                cpp_source, interface = result
+                cache.put(key, json.dumps([cpp_source, interface.to_json()]))
+            else:
+                cache.put(key, result)
+    elif split_header_name is not None:
+        result = json.loads(result)
+    elif shared_support_header is not None:
+        cpp_source, shared_templates = json.loads(result)
+        result = (cpp_source, OrderedDict((name, (forward_decl, defn))
+                                          for name, forward_decl, defn in shared_templates))
+    elif module_name is not None:
+        cpp_source, interface_json = json.loads(result)
+        result = (cpp_source, ModuleInterface.from_json(interface_json))
+    return result
+
+def _create_identifier_generator() -> Iterator[str]:
     def identifier_generator_fun():
         for i in itertools.count():
             yield 'TmppyInternal_%s' % i
-    identifier_generator = iter(identifier_generator_fun())
+    return iter(identifier_generator_fun())
+
+def _convert_to_ir0(python_source,
+                    filename,
+                    verbose,
+                    cache: Optional[CompilationCache],
+                    stats: Optional[CompilationStats],
+                    verbose_templates: Optional[List[str]],
+                    optimization_options: OptimizationOptions,
+                    module_name: Optional[str],
+                    module_interfaces: Optional[Dict[str, ModuleInterface]],
+                    identifier_generator: Iterator[str],
+                    optimization_status: Optional[OptimizationStatus] = None
+                    ) -> Tuple[ast.Module, ir0.Header, Optional[ModuleInterface]]:
+    source_ast = profiling.run_stage(stats, 'parse', None,
+                                     lambda: ast.parse(python_source, filename=filename))
 
-    module_ir3 = ast_to_ir3.module_ast_to_ir3(source_ast, filename, python_source.splitlines())
+    module_ir3 = profiling.run_stage(stats, 'ast_to_ir3', source_ast,
+                                     lambda: ast_to_ir3.module_ast_to_ir3(source_ast, filename, python_source.splitlines(),
+                                                                          module_interfaces))
     if verbose:
         print('TMPPy IR3:')
         print(utils.ir_to_string(module_ir3))
         print()
 
-    module_ir3 = optimize_ir3.optimize_module(module_ir3)
+    module_ir3 = profiling.run_stage(stats, 'optimize_ir3', module_ir3,
+                                     lambda: optimize_ir3.optimize_module(module_ir3))
     if verbose:
         print('TMPPy IR3 after optimization:')
         print(utils.ir_to_string(module_ir3))
         print()
 
-    module_ir2 = ir3_to_ir2.module_to_ir2(module_ir3, identifier_generator)
+    interface = None
+    if module_name is not None:
+        interface = profiling.run_stage(stats, 'compute_module_interface', module_ir3,
+                                        lambda: _compute_module_interface(module_ir3, source_ast, module_name,
+                                                                          module_interfaces))
+
+    module_ir2 = profiling.run_stage(stats, 'ir3_to_ir2', module_ir3,
+                                     lambda: ir3_to_ir2.module_to_ir2(module_ir3, identifier_generator))
     if verbose:
         print('TMPPy IR2:')
         print(utils.ir_to_string(module_ir2))
         print()
 
-    module_ir1 = ir2_to_ir1.module_to_ir1(module_ir2)
+    module_ir1 = profiling.run_stage(stats, 'ir2_to_ir1', module_ir2,
+                                     lambda: ir2_to_ir1.module_to_ir1(module_ir2))
     if verbose:
         print('TMPPy IR1:')
         print(utils.ir_to_string(module_ir1))
         print()
 
-    header_ir0 = ir1_to_ir0.module_to_ir0(module_ir1, identifier_generator)
+    header_ir0 = profiling.run_stage(stats, 'ir1_to_ir0', module_ir1,
+                                     lambda: ir1_to_ir0.module_to_ir0(module_ir1, identifier_generator, module_name))
     if verbose:
         print('TMPPy IR0:')
         print(utils.ir_to_string(header_ir0))
         print()
 
-    header_ir0 = optimize_ir0.optimize_header(header_ir0, identifier_generator)
+    header_ir0 = profiling.run_stage(stats, 'optimize_ir0', header_ir0,
+                                     lambda: optimize_ir0.optimize_header(header_ir0,
+                                                                          identifier_generator,
+                                                                          verbose=verbose,
+                                                                          cache=cache,
+                                                                          stats=stats,
+                                                                          verbose_templates=verbose_templates,
+                                                                          options=optimization_options,
+                                                                          status=optimization_status))
     if verbose:
         print('TMPPy IR0 after optimization:')
         print(utils.ir_to_string(header_ir0))
         print()
 
-    result = ir0_to_cpp.header_to_cpp(header_ir0, identifier_generator)
-    result = utils.clang_format(result)
+    return source_ast, header_ir0, interface
+
+def _convert_to_cpp(python_source,
+                    filename,
+                    verbose,
+                    format,
+                    cache: Optional[CompilationCache],
+                    stats: Optional[CompilationStats],
+                    verbose_templates: Optional[List[str]],
+                    optimization_options: OptimizationOptions,
+                    naming: str,
+                    split_header_name: Optional[str],
+                    shared_support_header: Optional[str],
+                    module_name: Optional[str],
+                    module_interfaces: Optional[Dict[str, ModuleInterface]],
+                    source_locations: bool,
+                    optimization_status: Optional[OptimizationStatus] = None,
+                    header_ir0_callback: Optional[Callable[[ir0.Header], None]] = None):
+    identifier_generator = _create_identifier_generator()
+    source_ast, header_ir0, interface = _convert_to_ir0(python_source, filename, verbose, cache, stats,
+                                                        verbose_templates, optimization_options, module_name,
+                                                        module_interfaces, identifier_generator, optimization_status)
+    if header_ir0_callback is not None:
+        header_ir0_callback(header_ir0)
+
+    if naming == 'content-derived':
+        header_ir0 = profiling.run_stage(stats, 'assign_content_derived_internal_identifiers', header_ir0,
+                                         lambda: optimize_ir0.assign_content_derived_internal_identifiers(header_ir0))
+
+    if shared_support_header is not None:
+        shared_template_names = profiling.run_stage(stats, 'get_module_independent_template_names', header_ir0,
+                                                    lambda: optimize_ir0.get_module_independent_template_names(header_ir0))
+        result, shared_templates = profiling.run_stage(stats, 'ir0_to_cpp', header_ir0,
+                                                       lambda: ir0_to_cpp.header_to_cpp_with_shared_templates(header_ir0,
+                                                                                                              shared_template_names,
+                                                                                                              shared_support_header))
+        result = _format_cpp(result, format, stats)
+        if verbose:
+            print('Conversion result:')
+            print(result)
+        return result, shared_templates
+
+    if split_header_name is not None:
+        results = profiling.run_stage(stats, 'ir0_to_cpp', header_ir0,
+                                      lambda: ir0_to_cpp.header_to_split_cpp(header_ir0,
+                                                                             identifier_generator,
+                                                                             split_header_name,
+                                                                             content_derived_identifiers=(naming == 'content-derived'),
+                                                                             source_locations=source_locations))
+        results = {file_name: _format_cpp(result, format, stats)
+                   for file_name, result in results.items()}
+        if verbose:
+            for file_name, result in sorted(results.items()):
+                print('Conversion result (%s):' % file_name)
+                print(result)
+        return results
+
+    if module_name is not None:
+        included_headers = [module_interfaces[imported_module_name].header_name
+                            for imported_module_name in module_interface.get_imported_module_names(source_ast)]
+    else:
+        included_headers = []
+    result = profiling.run_stage(stats, 'ir0_to_cpp', header_ir0,
+                                 lambda: ir0_to_cpp.header_to_cpp(header_ir0,
+                                                                  identifier_generator,
+                                                                  content_derived_identifiers=(naming == 'content-derived'),
+                                                                  module_name=module_name,
+                                                                  included_headers=included_headers,
+                                                                  source_locations=source_locations))
+    result = _format_cpp(result, format, stats)
 
     if verbose:
         print('Conversion result:')
         print(result)
+    if module_name is not None:
+        return result, interface
     return result
 
+def _format_cpp(cpp_source: str, format: str, stats: Optional[CompilationStats]):
+    if format == 'clang-format':
+        return profiling.run_stage(stats, 'clang_format', None, lambda: utils.clang_format(cpp_source))
+    else:
+        return profiling.run_stage(stats, 'format_cpp', None, lambda: ir0_to_cpp.format_cpp(cpp_source))
+
+class BatchCompilationResult:
+    def __init__(self,
+                 source_file_name: str,
+                 cpp_source: Optional[str],
+                 error: Optional[str],
+                 stats: Optional[CompilationStats] = None,
+                 additional_cpp_sources: Optional[Dict[str, str]] = None,
+                 shared_templates: Optional[Dict[str, Tuple[str, str]]] = None,
+                 module_interface: Optional[ModuleInterface] = None,
+                 instantiation_costs: Optional[Dict[str, instantiation_cost.InstantiationCost]] = None):
+        assert (cpp_source is None) != (error is None)
+        self.source_file_name = source_file_name
+        self.cpp_source = cpp_source
+        self.error = error
+        self.stats = stats
+        # When splitting the output, the C++ source of the other headers, keyed by the path relative to the directory
+        # of output_file_name.
+        self.additional_cpp_sources = additional_cpp_sources or dict()
+        # When using a shared support header, the templates to define there, see convert_to_cpp_with_shared_templates().
+        self.shared_templates = shared_templates or OrderedDict()
+        # When compiling modules that can import each other, the interface of this module, see convert_module_to_cpp().
+        self.module_interface = module_interface
+        # If requested, the estimated cost of each public metafunction, see estimate_instantiation_costs().
+        self.instantiation_costs = instantiation_costs
+
+    @property
+    def output_file_name(self):
+        suffix = '.py'
+        assert self.source_file_name.endswith(suffix)
+        return self.source_file_name[:-len(suffix)] + '.h'
+
+    @property
+    def output_files(self) -> Dict[str, str]:
+        '''The C++ source for each output file, keyed by the file name.'''
+        output_files = {self.output_file_name: self.cpp_source}
+        for file_name, cpp_source in self.additional_cpp_sources.items():
+            output_files[os.path.join(os.path.dirname(self.output_file_name), file_name)] = cpp_source
+        if self.module_interface is not None:
+            output_files[self.interface_file_name] = self.module_interface.serialize()
+        return output_files
+
+    @property
+    def interface_file_name(self):
+        return self.source_file_name[:-len('.py')] + module_interface.INTERFACE_FILE_EXTENSION
+
+def _compile_file(source_file_name: str,
+                  verbose: bool,
+                  cache: Optional[CompilationCache],
+                  format: str,
+                  profile: bool,
+                  verbose_templates: Optional[List[str]],
+                  optimization_options: Optional[OptimizationOptions],
+                  naming: str,
+                  split_output: bool,
+                  shared_support_header: Optional[str],
+                  module_name: Optional[str],
+                  module_interfaces: Optional[Dict[str, ModuleInterface]],
+                  cost_report: bool,
+                  source_locations: bool):
+    # This is called in a worker process, so we must report all errors in the result instead of raising.
+    if not source_file_name.endswith('.py'):
+        return BatchCompilationResult(source_file_name, cpp_source=None,
+                                      error='An input file name does not end with .py: ' + source_file_name)
+    stats = CompilationStats() if profile else None
+    # For the cost report we need the IR0 of the file, so we get it from the conversion instead of converting again.
+    header_ir0s = []  # type: List[ir0.Header]
+    header_ir0_callback = header_ir0s.append if cost_report else None
+    try:
+        with open(source_file_name) as source_file:
+            source = source_file.read()
+        # These calls are like the ones in convert_to_split_cpp(), convert_to_cpp_with_shared_templates(),
+        # convert_module_to_cpp() and convert_to_cpp(), but also pass header_ir0_callback.
+        if split_output:
+            header_name = os.path.basename(source_file_name)[:-len('.py')]
+            additional_cpp_sources = _convert_to_cpp_with_cache(source, source_file_name, verbose, cache, format, stats,
+                                                                verbose_templates, optimization_options, naming,
+                                                                split_header_name=header_name,
+                                                                shared_support_header=None, module_name=None,
+                                                                module_interfaces=None,
+                                                                source_locations=source_locations,
+                                                                header_ir0_callback=header_ir0_callback)
+            cpp_source = additional_cpp_sources.pop(header_name + '.h')
+            shared_templates = None
+            interface = None
+        elif shared_support_header is not None:
+            output_dir = os.path.dirname(os.path.abspath(source_file_name))
+            cpp_source, shared_templates = _convert_to_cpp_with_cache(
+                source, source_file_name, verbose, cache, format, stats, verbose_templates, optimization_options,
+                naming='content-derived', split_header_name=None,
+                shared_support_header=os.path.relpath(os.path.abspath(shared_support_header), output_dir),
+                module_name=None, module_interfaces=None, source_locations=False,
+                header_ir0_callback=header_ir0_callback)
+            additional_cpp_sources = None
+            interface = None
+        elif module_name is not None:
+            cpp_source, interface = _convert_to_cpp_with_cache(source, source_file_name, verbose, cache, format, stats,
+                                                               verbose_templates, optimization_options, naming,
+                                                               split_header_name=None, shared_support_header=None,
+                                                               module_name=module_name,
+                                                               module_interfaces=module_interfaces or dict(),
+                                                               source_locations=source_locations,
+                                                               header_ir0_callback=header_ir0_callback)
+            additional_cpp_sources = None
+            shared_templates = None
+        else:
+            cpp_source = _convert_to_cpp_with_cache(source, source_file_name, verbose, cache, format, stats,
+                                                    verbose_templates, optimization_options, naming,
+                                                    split_header_name=None, shared_support_header=None,
+                                                    module_name=None, module_interfaces=None,
+                                                    source_locations=source_locations,
+                                                    header_ir0_callback=header_ir0_callback)
+            additional_cpp_sources = None
+            shared_templates = None
+            interface = None
+        if cost_report:
+            [header_ir0] = header_ir0s
+            instantiation_costs = profiling.run_stage(
+                stats, 'estimate_instantiation_costs', header_ir0,
+                lambda: instantiation_cost.estimate_instantiation_costs(header_ir0))
+        else:
+            instantiation_costs = None
+    except ast_to_ir3.CompilationError as e:
+        return BatchCompilationResult(source_file_name, cpp_source=None, error=str(e), stats=stats)
+    except Exception:
+        return BatchCompilationResult(source_file_name, cpp_source=None, error=traceback.format_exc(), stats=stats)
+    return BatchCompilationResult(source_file_name, cpp_source=cpp_source, error=None, stats=stats,
+                                  additional_cpp_sources=additional_cpp_sources, shared_templates=shared_templates,
+                                  module_interface=interface, instantiation_costs=instantiation_costs)
+
+def _get_module_name(source_file_name: str, import_dirs: List[str]) -> Optional[str]:
+    source_file_name = os.path.abspath(source_file_name)
+    for import_dir in import_dirs:
+        relative_path = os.path.relpath(source_file_name, os.path.abspath(import_dir))
+        if relative_path.split(os.sep)[0] != os.pardir and relative_path.endswith('.py'):
+            return relative_path[:-len('.py')].replace(os.sep, '.')
+    return None
+
+def _get_imported_module_interfaces(source_file_names: List[str],
+                                    module_name_by_source_file_name: Dict[str, str],
+                                    import_dirs: List[str]) -> Dict[str, Dict[str, Optional[ModuleInterface]]]:
+    '''Returns the interfaces of the modules imported by each source file, keyed by source file and module name.
+
+    The interfaces of the modules in the batch are computed from their source (that's much faster than converting them),
+    the others are read from the interface files in the import dirs. The interfaces that can't be computed (e.g. due to
+    an error in the imported module) are None.
+    '''
+    source_by_module_name = dict()  # type: Dict[str, Tuple[str, str]]
+    imported_module_names_by_module_name = dict()  # type: Dict[str, List[str]]
+    for source_file_name in source_file_names:
+        module_name = module_name_by_source_file_name[source_file_name]
+        try:
+            with open(source_file_name) as source_file:
+                source = source_file.read()
+            source_ast = ast.parse(source, filename=source_file_name)
+        except Exception:
+            # The error will be reported when converting this file.
+            imported_module_names_by_module_name[module_name] = []
+            continue
+        source_by_module_name[module_name] = (source_file_name, source)
+        imported_module_names_by_module_name[module_name] = module_interface.get_imported_module_names(source_ast)
+
+    interface_by_module_name = dict()  # type: Dict[str, Optional[ModuleInterface]]
+    def get_interface(module_name: str):
+        if module_name in interface_by_module_name:
+            return interface_by_module_name[module_name]
+        # This is only used if there's an import cycle.
+        interface_by_module_name[module_name] = None
+        if module_name in source_by_module_name:
+            source_file_name, source = source_by_module_name[module_name]
+            imported_module_interfaces = {imported_module_name: get_interface(imported_module_name)
+                                          for imported_module_name in imported_module_names_by_module_name[module_name]}
+            if all(imported_module_interfaces.values()):
+                try:
+                    interface_by_module_name[module_name] = compute_module_interface(source, module_name,
+                                                                                     imported_module_interfaces,
+                                                                                     source_file_name)
+                except Exception:
+                    # The error will be reported when converting this file.
+                    pass
+        else:
+            interface_file_name = module_interface.find_interface_file(module_name, import_dirs)
+            if interface_file_name:
+                with open(interface_file_name) as interface_file:
+                    interface_by_module_name[module_name] = ModuleInterface.deserialize(interface_file.read())
+        return interface_by_module_name[module_name]
+
+    return {source_file_name: {imported_module_name: get_interface(imported_module_name)
+                               for imported_module_name in imported_module_names_by_module_name[module_name]}
+            for source_file_name, module_name in module_name_by_source_file_name.items()}
+
+def compile_batch(source_file_names: List[str],
+                  jobs: Optional[int] = None,
+                  verbose: bool = False,
+                  cache: Optional[CompilationCache] = None,
+                  format='native',
+                  profile: bool = False,
+                  verbose_templates: Optional[List[str]] = None,
+                  optimization_options: Optional[OptimizationOptions] = None,
+                  naming='sequential',
+                  split_output: bool = False,
+                  shared_support_header: Optional[str] = None,
+                  import_dirs: Optional[List[str]] = None,
+                  cost_report: bool = False,
+                  source_locations: bool = False) -> List[BatchCompilationResult]:
+    '''Converts multiple independent TMPPy source files, using up to `jobs` worker processes.
+
+    If jobs is None, the number of CPUs is used. A failure in one file does not affect the others: the returned list
+    has a result for each source file (in the same order), containing either the generated C++ code or an error
+    (with import_dirs, a module can't be converted if a module that it imports has an error).
+    If profile is True, each result also contains the CompilationStats for that file.
+    If split_output is True, each result also contains a separate header for each public function, see
+    convert_to_split_cpp().
+    If shared_support_header (a path) is specified, the helper templates that don't depend on the module are left out of
+    the generated code, that includes that header instead. Each result contains those templates, and
+    shared_support_header_to_cpp() generates the header from the results. See convert_to_cpp_with_shared_templates().
+    If import_dirs is specified, the source files are modules that can import each other (and the modules with an
+    interface file in the import dirs), see convert_module_to_cpp(). Each source file must be in one of the import dirs,
+    e.g. <import_dir>/mylib/traits.py is the module mylib.traits, and each result also contains the interface of the
+    module, to write to <import_dir>/mylib/traits.tmppyi. The interfaces of the modules in the batch are computed first,
+    so all the modules are still converted in parallel.
+    If cost_report is True, each result also contains the estimated cost of each public metafunction for the C++
+    compiler, see estimate_instantiation_costs().
+    If source_locations is True, the generated code has a comment with the source location of each template, see
+    convert_to_cpp(). This is ignored with shared_support_header.
+    '''
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    assert jobs >= 1
+    assert not (split_output and shared_support_header)
+    assert import_dirs is None or not (split_output or shared_support_header)
+
+    errors_by_source_file_name = dict()  # type: Dict[str, str]
+    module_name_by_source_file_name = dict()  # type: Dict[str, str]
+    imported_module_interfaces_by_source_file_name = dict()  # type: Dict[str, Dict[str, ModuleInterface]]
+    if import_dirs is not None:
+        for source_file_name in source_file_names:
+            module_name = _get_module_name(source_file_name, import_dirs)
+            if module_name is None:
+                errors_by_source_file_name[source_file_name] = (
+                    'The source file %s is not in any of the import dirs.' % source_file_name)
+            else:
+                module_name_by_source_file_name[source_file_name] = module_name
+        imported_module_interfaces_by_source_file_name = _get_imported_module_interfaces(
+            [source_file_name
+             for source_file_name in source_file_names
+             if source_file_name in module_name_by_source_file_name],
+            module_name_by_source_file_name,
+            import_dirs)
+        for source_file_name, imported_module_interfaces in imported_module_interfaces_by_source_file_name.items():
+            for imported_module_name, interface in imported_module_interfaces.items():
+                if interface is None:
+                    errors_by_source_file_name[source_file_name] = (
+                        '%s: error: Couldn\'t get the interface of the imported module %s. It must be either in the '
+                        'same batch (and compile without errors, with no import cycles) or have an interface file '
+                        'in one of the import dirs.' % (source_file_name, imported_module_name))
+
+    source_file_names_to_compile = [source_file_name
+                                    for source_file_name in source_file_names
+                                    if source_file_name not in errors_by_source_file_name]
+    module_names = [module_name_by_source_file_name.get(source_file_name)
+                    for source_file_name in source_file_names_to_compile]
+    module_interfaces = [imported_module_interfaces_by_source_file_name.get(source_file_name)
+                         for source_file_name in source_file_names_to_compile]
+
+    if jobs == 1 or len(source_file_names_to_compile) <= 1:
+        results = [_compile_file(source_file_name, verbose, cache, format, profile, verbose_templates,
+                                 optimization_options, naming, split_output, shared_support_header, module_name,
+                                 imported_module_interfaces, cost_report, source_locations)
+                   for source_file_name, module_name, imported_module_interfaces in zip(source_file_names_to_compile,
+                                                                                       module_names,
+                                                                                       module_interfaces)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(source_file_names_to_compile))) as executor:
+            results = list(executor.map(_compile_file,
+                                        source_file_names_to_compile,
+                                        itertools.repeat(verbose),
+                                        itertools.repeat(cache),
+                                        itertools.repeat(format),
+                                        itertools.repeat(profile),
+                                        itertools.repeat(verbose_templates),
+                                        itertools.repeat(optimization_options),
+                                        itertools.repeat(naming),
+                                        itertools.repeat(split_output),
+                                        itertools.repeat(shared_support_header),
+                                        module_names,
+                                        module_interfaces,
+                                        itertools.repeat(cost_report),
+                                        itertools.repeat(source_locations)))
+
+    if not errors_by_source_file_name:
+        return results
+    result_by_source_file_name = {result.source_file_name: result for result in results}
+    return [result_by_source_file_name[source_file_name]
+            if source_file_name in result_by_source_file_name
+            else BatchCompilationResult(source_file_name, cpp_source=None, error=errors_by_source_file_name[source_file_name])
+            for source_file_name in source_file_names]
+
 def main():
     parser = argparse.ArgumentParser(description='Converts python source code into C++ metafunctions.')
-    parser.add_argument('sources', nargs='+', help='The python source files to convert')
+    parser.add_argument('sources', nargs='*', help='The python source files to convert')
     parser.add_argument('--output-dir', help='Output dir for the generated files')
     parser.add_argument('--verbose', help='If "true", prints verbose messages during the conversion')
+    parser.add_argument('--verbose-template', metavar='PATTERN', action='append', dest='verbose_templates',
+                        help='Implies --verbose=true, but only prints the changes made by the optimizations to the '
+                             'templates whose name matches this fnmatch-style pattern (e.g. "foo" or "foo*"). Can be '
+                             'specified multiple times. Use "%s" for the toplevel code.'
+                             % optimize_ir0.TOPLEVEL_VERBOSE_TEMPLATE_NAME)
+    parser.add_argument('--cache-dir', help='If specified, the results of the conversion are cached in this directory '
+                                            'and reused when converting the same source with the same options.')
+    parser.add_argument('--cache-max-size-mb', type=int, default=256,
+                        help='The maximum size of the cache (in MB). When exceeded, the least recently used entries '
+                             'are evicted. Only used if --cache-dir is specified.')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='The number of source files to convert in parallel. If 0, the number of CPUs is used.')
+    parser.add_argument('--format', choices=_FORMATS, default='native',
+                        help='How to format the generated C++ code. "native" is much faster, "clang-format" requires '
+                             'clang-format to be installed.')
+    parser.add_argument('--naming', choices=_NAMINGS, default='sequential',
+                        help='How to generate the internal identifiers. With "content-derived", the code generated for a '
+                             'function doesn\'t change when other functions in the same module are changed, so build '
+                             'caches (e.g. ccache) are more effective.')
+    parser.add_argument('--split-output', action='store_true',
+                        help='If specified, for each source file foo.py, in addition to foo.h (that includes '
+                             'everything) py2tmp generates a header foo/<name>.h for each public function, that only '
+                             'contains the templates needed by that function.')
+    parser.add_argument('--shared-support-header', metavar='FILE',
+                        help='If specified, the helper templates that don\'t depend on the module are defined only once, '
+                             'in this header, that the headers generated for the source files include. This avoids '
+                             'parsing and instantiating duplicates when a C++ file includes many generated headers. '
+                             'Implies --naming=content-derived. Can\'t be used with --split-output or --serve.')
+    parser.add_argument('--import-dir', metavar='DIR', action='append', dest='import_dirs',
+                        help='If specified, the source files are modules that can import each other, e.g. '
+                             '<DIR>/mylib/traits.py is the module mylib.traits and other modules can use "from '
+                             'mylib.traits import f". For each module, py2tmp also generates an interface file '
+                             '(mylib/traits%s) that the modules that import it use instead of its source, so they can '
+                             'be converted in a separate invocation. Can be specified multiple times. Can\'t be used '
+                             'with --split-output, --shared-support-header or --serve.'
+                             % module_interface.INTERFACE_FILE_EXTENSION)
+    parser.add_argument('--profile-passes', metavar='FILE',
+                        help='If specified, writes to this file a JSON report with the time, peak memory and IR size '
+                             'for each stage of the conversion and for each optimization, for each source file. Can\'t '
+                             'be used with --serve.')
+    parser.add_argument('--cost-report', metavar='FILE',
+                        help='If specified, writes to this file a JSON report with the estimated number of class '
+                             'template instantiations and the maximum instantiation depth needed by each public '
+                             'function, as polynomials in the size n of its arguments (e.g. the length of a list '
+                             'argument, or the recursion depth), for each source file. When this is specified only the '
+                             'optimized templates (not the whole output) are taken from the --cache-dir cache, since '
+                             'the estimation needs the intermediate representation of the code. Can\'t be used with '
+                             '--serve.')
+    parser.add_argument('--source-locations', action='store_true',
+                        help='If specified, each generated template is preceded by a comment with the location of the '
+                             'TMPPy code that it was generated from. py2tmp-time-trace uses these to attribute the '
+                             'instantiation times in a clang -ftime-trace report to TMPPy functions and lines. Ignored '
+                             'with --shared-support-header.')
+
+    parser.add_argument('-O', type=int, choices=optimize_ir0.OPTIMIZATION_LEVELS, default=1, dest='optimization_level',
+                        help='The optimization level: 0 disables the optimizations (fastest conversion), 1 (the '
+                             'default) optimizes each template once, 2 repeats the optimizations until they have no '
+                             'further effect (slowest conversion, best output).')
+    parser.add_argument('--template-time-budget', metavar='SECONDS', type=float,
+                        help='If specified, no further optimizations are started on a template after this time. This '
+                             'makes the output depend on the speed of the machine.')
+    parser.add_argument('--template-node-budget', metavar='NODES', type=int,
+                        help='If specified, optimizations that would make a template bigger than this number of IR '
+                             'nodes are skipped.')
+    parser.add_argument('--partial-evaluation-step-budget', metavar='STEPS', type=int, default=0,
+                        help='If specified, the metafunction calls with constant arguments in each template are '
+                             'evaluated at conversion time, using up to this number of evaluation steps (e.g. 10000). '
+                             'The default, 0, disables this evaluation.')
+
+    parser.add_argument('--serve', metavar='SOCKET_PATH',
+                        help='If specified, instead of converting the source files, py2tmp starts a server that listens '
+                             'on this Unix socket and converts the source files sent by py2tmp-client, until it gets '
+                             'a shutdown request.')
 
     args = parser.parse_args()
 
-    for source_file_name in args.sources:
-        with open(source_file_name) as source_file:
-            source = source_file.read()
-        suffix = '.py'
-        if not source_file_name.endswith(suffix):
-            raise Exception('An input file name does not end with .py: ' + source_file_name)
-        output_file_name = source_file_name[:-len(suffix)] + '.h'
-        with open(output_file_name, 'w') as output_file:
-            output_file.write(convert_to_cpp(source, source_file_name, verbose=(args.verbose == 'true')))
+    cache = CompilationCache(args.cache_dir, max_size_bytes=args.cache_max_size_mb * 1024 * 1024) if args.cache_dir else None
+    optimization_options = OptimizationOptions(level=args.optimization_level,
+                                               template_time_budget_seconds=args.template_time_budget,
+                                               template_node_budget=args.template_node_budget,
+                                               partial_evaluation_step_budget=args.partial_evaluation_step_budget)
+
+    if args.shared_support_header and args.split_output:
+        parser.error('--shared-support-header can\'t be used with --split-output.')
+    if args.import_dirs and (args.shared_support_header or args.split_output):
+        parser.error('--import-dir can\'t be used with --split-output or --shared-support-header.')
+
+    if args.serve:
+        if args.sources:
+            parser.error('No source files can be specified with --serve.')
+        if args.shared_support_header:
+            parser.error('--shared-support-header can\'t be used with --serve.')
+        if args.import_dirs:
+            parser.error('--import-dir can\'t be used with --serve.')
+        # These reports are written once all the source files have been converted, which never happens with --serve.
+        if args.profile_passes:
+            parser.error('--profile-passes can\'t be used with --serve.')
+        if args.cost_report:
+            parser.error('--cost-report can\'t be used with --serve.')
+        compilation_server = server.CompilationServer(args.serve,
+                                                      compile_files=lambda source_file_names, format: compile_batch(source_file_names,
+                                                                                                                    jobs=args.jobs or None,
+                                                                                                                    verbose=(args.verbose == 'true' or args.verbose_templates is not None),
+                                                                                                                    cache=cache,
+                                                                                                                    format=format,
+                                                                                                                    verbose_templates=args.verbose_templates,
+                                                                                                                    optimization_options=optimization_options,
+                                                                                                                    naming=args.naming,
+                                                                                                                    split_output=args.split_output,
+                                                                                                                    source_locations=args.source_locations))
+        compilation_server.serve_until_shutdown()
+        return
+
+    if not args.sources:
+        parser.error('No source files specified.')
+
+    results = compile_batch(args.sources,
+                            jobs=args.jobs or None,
+                            verbose=(args.verbose == 'true' or args.verbose_templates is not None),
+                            cache=cache,
+                            format=args.format,
+                            profile=args.profile_passes is not None,
+                            verbose_templates=args.verbose_templates,
+                            optimization_options=optimization_options,
+                            naming=args.naming,
+                            split_output=args.split_output,
+                            shared_support_header=args.shared_support_header,
+                            import_dirs=args.import_dirs,
+                            cost_report=args.cost_report is not None,
+                            source_locations=args.source_locations)
+
+    succeeded = True
+    for result in results:
+        if result.error is not None:
+            succeeded = False
+            print(result.error, file=sys.stderr)
+            continue
+        for output_file_name, cpp_source in result.output_files.items():
+            os.makedirs(os.path.dirname(os.path.abspath(output_file_name)), exist_ok=True)
+            with open(output_file_name, 'w') as output_file:
+                output_file.write(cpp_source)
+
+    if args.shared_support_header:
+        os.makedirs(os.path.dirname(os.path.abspath(args.shared_support_header)), exist_ok=True)
+        with open(args.shared_support_header, 'w') as output_file:
+            output_file.write(shared_support_header_to_cpp([result.shared_templates
+                                                            for result in results
+                                                            if result.error is None],
+                                                           format=args.format))
+
+    if args.profile_passes:
+        with open(args.profile_passes, 'w') as profile_file:
+            json.dump({result.source_file_name: result.stats.to_json()
+                       for result in results
+                       if result.stats is not None},
+                      profile_file,
+                      indent=2)
+
+    if args.cost_report:
+        with open(args.cost_report, 'w') as cost_report_file:
+            json.dump({result.source_file_name: {name: cost.to_json()
+                                                 for name, cost in sorted(result.instantiation_costs.items())}
+                       for result in results
+                       if result.instantiation_costs is not None},
+                      cost_report_file,
+                      indent=2)
+
+    if not succeeded:
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,204 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+from typing import List, Dict, Any, Optional, Iterable
+
+import typed_ast.ast3 as ast
+
+from _py2tmp import ir3
+
+# The extension of the interface files. For a module foo.bar these are in foo/bar.tmppyi (and the header in foo/bar.h),
+# relative to one of the import dirs.
+INTERFACE_FILE_EXTENSION = '.tmppyi'
+
+# The modules that are part of TMPPy itself, the other imports refer to TMPPy modules compiled separately.
+BUILTIN_MODULE_NAMES = ('tmppy', 'typing')
+
+class FunctionInterface:
+    def __init__(self, name: str, type: ir3.FunctionType, is_function_that_may_throw: bool):
+        self.name = name
+        self.type = type
+        self.is_function_that_may_throw = is_function_that_may_throw
+
+class CustomTypeInterface:
+    def __init__(self, module_name: str, custom_type: ir3.CustomType):
+        # The module that defines this type.
+        self.module_name = module_name
+        self.custom_type = custom_type
+
+class ModuleInterface:
+    '''What's needed to compile a module that imports this module, without processing the source of this module.
+
+    This contains the signatures of the public functions (and whether they can throw), and the custom types. The
+    latter include the ones defined in the imported modules (and in the modules that they import, and so on), since
+    their exceptions can propagate through the functions of this module.
+    '''
+    def __init__(self,
+                 module_name: str,
+                 functions: List[FunctionInterface],
+                 custom_types: List[CustomTypeInterface]):
+        self.module_name = module_name
+        self.functions = functions
+        self.custom_types = custom_types
+
+    @property
+    def header_name(self):
+        '''The path of the header generated for this module, relative to the import dir.'''
+        return self.module_name.replace('.', '/') + '.h'
+
+    def get_defined_names(self) -> Iterable[str]:
+        '''The names that can be imported from this module.'''
+        for function in self.functions:
+            yield function.name
+        for custom_type_interface in self.custom_types:
+            if custom_type_interface.module_name == self.module_name:
+                yield custom_type_interface.custom_type.name
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'module_name': self.module_name,
+            'functions': [{'name': function.name,
+                           'type': _type_to_json(function.type),
+                           'may_throw': function.is_function_that_may_throw}
+                          for function in self.functions],
+            'custom_types': [{'module_name': custom_type_interface.module_name,
+                              'name': custom_type_interface.custom_type.name,
+                              'args': [{'name': arg.name, 'type': _type_to_json(arg.type)}
+                                       for arg in custom_type_interface.custom_type.arg_types],
+                              'exception_message': custom_type_interface.custom_type.exception_message}
+                             for custom_type_interface in self.custom_types],
+        }
+
+    @staticmethod
+    def from_json(module_interface_json: Dict[str, Any]) -> 'ModuleInterface':
+        # Custom types only reference the ones before them, so we can resolve the references while reading them.
+        custom_type_by_name = dict()  # type: Dict[str, ir3.CustomType]
+        custom_types = []
+        for custom_type_json in module_interface_json['custom_types']:
+            custom_type = ir3.CustomType(name=custom_type_json['name'],
+                                         arg_types=[ir3.CustomTypeArgDecl(name=arg_json['name'],
+                                                                          type=_type_from_json(arg_json['type'],
+                                                                                               custom_type_by_name))
+                                                    for arg_json in custom_type_json['args']],
+                                         is_exception_class=custom_type_json['exception_message'] is not None,
+                                         exception_message=custom_type_json['exception_message'])
+            custom_type_by_name[custom_type.name] = custom_type
+            custom_types.append(CustomTypeInterface(custom_type_json['module_name'], custom_type))
+        functions = [FunctionInterface(name=function_json['name'],
+                                       type=_type_from_json(function_json['type'], custom_type_by_name),
+                                       is_function_that_may_throw=function_json['may_throw'])
+                     for function_json in module_interface_json['functions']]
+        return ModuleInterface(module_interface_json['module_name'], functions, custom_types)
+
+    def serialize(self) -> str:
+        return json.dumps(self.to_json(), indent=2, sort_keys=True)
+
+    @staticmethod
+    def deserialize(s: str) -> 'ModuleInterface':
+        return ModuleInterface.from_json(json.loads(s))
+
+def _type_to_json(type: ir3.ExprType):
+    if isinstance(type, ir3.BoolType):
+        return 'bool'
+    elif isinstance(type, ir3.IntType):
+        return 'int'
+    elif isinstance(type, ir3.TypeType):
+        return 'Type'
+    elif isinstance(type, ir3.BottomType):
+        return 'BottomType'
+    elif isinstance(type, ir3.ListType):
+        return {'list': _type_to_json(type.elem_type)}
+    elif isinstance(type, ir3.SetType):
+        return {'set': _type_to_json(type.elem_type)}
+    elif isinstance(type, ir3.FunctionType):
+        return {'args': [_type_to_json(arg_type) for arg_type in type.argtypes],
+                'returns': _type_to_json(type.returns)}
+    elif isinstance(type, ir3.CustomType):
+        return {'custom_type': type.name}
+    else:
+        raise NotImplementedError('Unexpected type: %s' % str(type.__class__))
+
+def _type_from_json(type_json: Any, custom_type_by_name: Dict[str, ir3.CustomType]) -> ir3.ExprType:
+    if type_json == 'bool':
+        return ir3.BoolType()
+    elif type_json == 'int':
+        return ir3.IntType()
+    elif type_json == 'Type':
+        return ir3.TypeType()
+    elif type_json == 'BottomType':
+        return ir3.BottomType()
+    elif 'list' in type_json:
+        return ir3.ListType(_type_from_json(type_json['list'], custom_type_by_name))
+    elif 'set' in type_json:
+        return ir3.SetType(_type_from_json(type_json['set'], custom_type_by_name))
+    elif 'returns' in type_json:
+        return ir3.FunctionType(argtypes=[_type_from_json(arg_type_json, custom_type_by_name)
+                                          for arg_type_json in type_json['args']],
+                                returns=_type_from_json(type_json['returns'], custom_type_by_name))
+    else:
+        return custom_type_by_name[type_json['custom_type']]
+
+def module_to_interface(module: ir3.Module,
+                        module_name: str,
+                        module_interfaces: Dict[str, ModuleInterface],
+                        function_can_throw: Dict[str, bool]) -> ModuleInterface:
+    '''Returns the interface of a module, given the interfaces of the modules that it imports.
+
+    function_can_throw must contain the can-throw info of the functions of the module, as computed by
+    optimize_ir3.compute_function_can_throw_info().
+    '''
+    custom_types = []
+    custom_type_names = set()
+    for module_interface in module_interfaces.values():
+        for custom_type_interface in module_interface.custom_types:
+            if custom_type_interface.custom_type.name not in custom_type_names:
+                custom_type_names.add(custom_type_interface.custom_type.name)
+                custom_types.append(custom_type_interface)
+    for custom_type in module.custom_types:
+        custom_types.append(CustomTypeInterface(module_name, custom_type))
+
+    functions = [FunctionInterface(name=function_defn.name,
+                                   type=ir3.FunctionType(argtypes=[arg.type for arg in function_defn.args],
+                                                         returns=function_defn.return_type),
+                                   is_function_that_may_throw=function_can_throw[function_defn.name])
+                 for function_defn in module.function_defns
+                 if function_defn.name in module.public_names]
+
+    return ModuleInterface(module_name, functions, custom_types)
+
+def module_name_to_path(module_name: str):
+    return os.path.join(*module_name.split('.'))
+
+def module_name_to_identifier(module_name: str):
+    '''Returns a string that can be used in C++ identifiers, to make them unique to the module.'''
+    return module_name.replace('.', '_')
+
+def get_imported_module_names(module_ast: ast.Module) -> List[str]:
+    '''Returns the names of the (non-builtin) modules imported by the given module, in order.'''
+    module_names = []
+    for ast_node in module_ast.body:
+        if (isinstance(ast_node, ast.ImportFrom)
+                and ast_node.module not in BUILTIN_MODULE_NAMES
+                and ast_node.module not in module_names):
+            module_names.append(ast_node.module)
+    return module_names
+
+def find_interface_file(module_name: str, import_dirs: List[str]) -> Optional[str]:
+    for import_dir in import_dirs:
+        interface_file_name = os.path.join(import_dir, module_name_to_path(module_name) + INTERFACE_FILE_EXTENSION)
+        if os.path.exists(interface_file_name):
+            return interface_file_name
+    return None
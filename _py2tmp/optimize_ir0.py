@@ -11,19 +11,27 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import bisect
 import difflib
+import fnmatch
+import re
 from collections import defaultdict
 
 import itertools
+import time
 
-from _py2tmp import ir0, utils, transform_ir0, ir0_to_cpp
+from _py2tmp import ir0, utils, transform_ir0, ir0_to_cpp, profiling, evaluate_ir0
+from _py2tmp.compilation_cache import CompilationCache
+from _py2tmp.profiling import CompilationStats
 import networkx as nx
-from typing import List, Tuple, Union, Dict, Set, Iterator, Callable
+from typing import List, Tuple, Union, Dict, Set, Iterator, Callable, Optional, Any, TypeVar, Iterable
+
+T = TypeVar('T')
 
 def template_defn_to_cpp(template_defn: ir0.TemplateDefn, identifier_generator: Iterator[str]):
   writer = ir0_to_cpp.ToplevelWriter(identifier_generator)
   ir0_to_cpp.template_defn_to_cpp(template_defn, enclosing_function_defn_args=[], writer=writer)
-  return utils.clang_format(''.join(writer.strings))
+  return ir0_to_cpp.format_cpp(''.join(writer.strings))
 
 def template_body_elems_to_cpp(elems: List[ir0.TemplateBodyElement],
                                identifier_generator: Iterator[str]):
@@ -35,7 +43,7 @@ def template_body_elems_to_cpp(elems: List[ir0.TemplateBodyElement],
                                                                  if not isinstance(elem, ir0.TemplateDefn)],
                                                public_names=set()),
                                     identifier_generator)
-  return utils.clang_format(result)
+  return ir0_to_cpp.format_cpp(result)
 
 def expr_to_cpp(expr: ir0.Expr):
   writer = ir0_to_cpp.ToplevelWriter(identifier_generator=iter([]))
@@ -51,15 +59,117 @@ def compare_optimized_cpp_to_original(original_cpp: str, optimized_cpp: str, opt
               + 'After ' + optimization_name + ':\n' + optimized_cpp + '\n'
               + 'Diff:\n' + diff + '\n')
 
+OPTIMIZATION_LEVELS = (0, 1, 2)
+
+class OptimizationOptions:
+    '''Controls which optimizations optimize_header() performs, trading the quality of the output for conversion time.
+
+    At level 0 no optimizations are performed. At level 1 (the default) the local optimizations are performed once on
+    each template (after inlining the templates that it references), and at level 2 they're repeated until a fixpoint is
+    reached (i.e. until a round doesn't change the template) or until max_iterations rounds have been performed.
+
+    The optimization of each template (and of the toplevel code) can also be limited with per-template budgets:
+      * template_time_budget_seconds: no further optimization rounds are started on a template after this time. Note
+        that this makes the output depend on the machine's speed.
+      * template_node_budget: the result of an optimization round is discarded if it would make the template grow beyond
+        this number of IR nodes.
+    A template that exceeded its budget is still correct, just less optimized.
+
+    At level 1 and above, the exprs that don't depend on template parameters (e.g. calls to metafunctions with constant
+    args) can also be evaluated at conversion time (see evaluate_ir0), with up to partial_evaluation_step_budget
+    evaluation steps for each template (and for the toplevel code). This partial evaluation is disabled by default
+    (i.e. with a budget of 0).
+    '''
+    def __init__(self,
+                 level: int = 1,
+                 max_iterations: Optional[int] = None,
+                 template_time_budget_seconds: Optional[float] = None,
+                 template_node_budget: Optional[int] = None,
+                 partial_evaluation_step_budget: int = 0):
+        assert level in OPTIMIZATION_LEVELS, level
+        if max_iterations is None:
+            max_iterations = {0: 0, 1: 1, 2: 10}[level]
+        assert level != 0 or max_iterations == 0
+        self.level = level
+        self.max_iterations = max_iterations
+        self.template_time_budget_seconds = template_time_budget_seconds
+        self.template_node_budget = template_node_budget
+        self.partial_evaluation_step_budget = partial_evaluation_step_budget
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+class OptimizationStatus:
+    '''Filled in by optimize_header() with information about how the optimization went.
+
+    exceeded_deadline is True if the optimization of at least one template (or of the toplevel code) was cut short by
+    OptimizationOptions.template_time_budget_seconds, so the result depends on the machine's speed.
+    '''
+    def __init__(self):
+        self.exceeded_deadline = False
+
+class _OptimizationBudget:
+    '''Keeps track of the resources used to optimize a single template (or the toplevel code).'''
+    def __init__(self, options: OptimizationOptions):
+        if options.template_time_budget_seconds is None:
+            self.deadline = None
+        else:
+            self.deadline = time.perf_counter() + options.template_time_budget_seconds
+        self.node_budget = options.template_node_budget
+        self.exceeded_deadline = False
+
+    def allows_more_optimizations(self):
+        if self.deadline is not None and time.perf_counter() > self.deadline:
+            self.exceeded_deadline = True
+        return not self.exceeded_deadline
+
+    def allows_result(self, ir_before: Any, ir_after: Any):
+        if self.node_budget is None:
+            return True
+        num_nodes_after, _ = profiling.count_ir_nodes(ir_after)
+        if num_nodes_after <= self.node_budget:
+            return True
+        num_nodes_before, _ = profiling.count_ir_nodes(ir_before)
+        return num_nodes_after <= num_nodes_before
+
+def _optimize_until_fixpoint(ir: T,
+                             optimize: Callable[[T], T],
+                             options: OptimizationOptions,
+                             budget: _OptimizationBudget) -> T:
+    for _ in range(options.max_iterations):
+        if not budget.allows_more_optimizations():
+            break
+        new_ir = optimize(ir)
+        if utils.ir_equals(ir, new_ir) or not budget.allows_result(ir, new_ir):
+            break
+        ir = new_ir
+    return ir
+
+# This can be used in verbose_templates to show the changes to the toplevel elems.
+TOPLEVEL_VERBOSE_TEMPLATE_NAME = '<toplevel>'
+
+def _is_verbose_template(template_name: str, verbose_templates: Optional[List[str]]):
+    '''Returns true if the changes to this template should be printed in verbose mode.
+
+    verbose_templates is a list of fnmatch-style patterns (e.g. 'foo' or 'foo*'); if None, all templates match.
+    '''
+    return verbose_templates is None or any(fnmatch.fnmatchcase(template_name, pattern)
+                                            for pattern in verbose_templates)
+
 def apply_optimization(template_defn: ir0.TemplateDefn,
                        identifier_generator: Iterator[str],
                        optimization: Callable[[], ir0.TemplateDefn],
                        optimization_name: str,
                        verbose: bool,
-                       other_context: Callable[[], str] = lambda: ''):
-    new_template_defn = optimization()
-
-    if verbose:
+                       other_context: Callable[[], str] = lambda: '',
+                       stats: Optional[CompilationStats] = None,
+                       verbose_templates: Optional[List[str]] = None):
+    new_template_defn = profiling.run_optimization(stats, optimization_name, template_defn, optimization)
+
+    # Rendering the C++ code is expensive, so we only do it for the templates that were changed by the optimization.
+    if (verbose
+            and _is_verbose_template(template_defn.name, verbose_templates)
+            and not utils.ir_equals(template_defn, new_template_defn)):
         original_cpp = template_defn_to_cpp(template_defn, identifier_generator)
         optimized_cpp = template_defn_to_cpp(new_template_defn, identifier_generator)
         compare_optimized_cpp_to_original(original_cpp, optimized_cpp, optimization_name=optimization_name, other_context=other_context())
@@ -71,10 +181,14 @@ def apply_toplevel_elems_optimization(toplevel_elems: List[Union[ir0.StaticAsser
                                       optimization: Callable[[], List[ir0.TemplateBodyElement]],
                                       optimization_name: str,
                                       verbose: bool,
-                                      other_context: Callable[[], str] = lambda: ''):
-  new_toplevel_elems = optimization()
-
-  if verbose:
+                                      other_context: Callable[[], str] = lambda: '',
+                                      stats: Optional[CompilationStats] = None,
+                                      verbose_templates: Optional[List[str]] = None):
+  new_toplevel_elems = profiling.run_optimization(stats, optimization_name, toplevel_elems, optimization)
+
+  if (verbose
+          and _is_verbose_template(TOPLEVEL_VERBOSE_TEMPLATE_NAME, verbose_templates)
+          and not utils.ir_equals(toplevel_elems, new_toplevel_elems)):
     original_cpp = template_body_elems_to_cpp(toplevel_elems, identifier_generator)
     optimized_cpp = template_body_elems_to_cpp(new_toplevel_elems, identifier_generator)
     compare_optimized_cpp_to_original(original_cpp, optimized_cpp, optimization_name=optimization_name, other_context=other_context())
@@ -145,7 +259,8 @@ class CommonSubexpressionEliminationTransformation(transform_ir0.Transformation)
                                     specializations=[self._transform_template_specialization(specialization, template_defn.result_element_names, writer) for specialization in template_defn.specializations],
                                     name=template_defn.name,
                                     description=template_defn.description,
-                                    result_element_names=template_defn.result_element_names))
+                                    result_element_names=template_defn.result_element_names,
+                                    source_location=template_defn.source_location))
 
     def _transform_template_specialization(self,
                                            specialization: ir0.TemplateSpecialization,
@@ -190,6 +305,7 @@ class CommonSubexpressionEliminationTransformation(transform_ir0.Transformation)
                 result_elems.append(elem)
                 if isinstance(elem, (ir0.ConstantDef, ir0.Typedef)):
                     name_by_expr[elem.expr] = elem.name
+                    type_by_name[elem.name] = elem.expr.type
 
         additional_result_elems = []
 
@@ -205,12 +321,12 @@ class CommonSubexpressionEliminationTransformation(transform_ir0.Transformation)
               additional_result_elems.append(create_var_to_var_assignment(lhs=result_elem_name,
                                                                           rhs=replacements2[replacement],
                                                                           type=type_by_name[replacement]))
-            elif replacement in arg_names:
-              # We've eliminated the assignment to the result var against the definition of an argument.
-              # So we need to add it back.
+            elif replacement in arg_names or replacement in result_element_names:
+              # We've eliminated the assignment to the result var against the definition of an argument (or of
+              # another result element, that can't be renamed). So we need to add it back.
               additional_result_elems.append(create_var_to_var_assignment(lhs=result_elem_name,
                                                                           rhs=replacement,
-                                                                          type=type_by_name[replacement]))
+                                                                          type=type_by_name[result_elem_name]))
             else:
               replacements2[replacement] = result_elem_name
 
@@ -263,23 +379,18 @@ class ReplaceVarWithExprTransformation(transform_ir0.Transformation):
         if type_literal.cpp_type == self.var:
             return self.replacement_expr
 
-        if self.var not in type_literal.get_referenced_identifiers():
+        tokenized_cpp_type = type_literal.tokenized_cpp_type
+        if self.var not in tokenized_cpp_type.slots_by_identifier:
             return type_literal
 
         if isinstance(self.replacement_expr, ir0.AtomicTypeLiteral):
-            referenced_locals = []
-            for referenced_local in type_literal.referenced_locals:
-                if referenced_local.cpp_type != self.var:
-                    referenced_locals.append(referenced_local)
-            for referenced_local in self.replacement_expr.referenced_locals:
-                referenced_locals.append(referenced_local)
-            return ir0.AtomicTypeLiteral(cpp_type=utils.replace_identifiers(type_literal.cpp_type, {self.var: self.replacement_expr.cpp_type}),
-                                   is_local=type_literal.is_local and self.replacement_expr.is_local,
-                                   is_metafunction_that_may_return_error=type_literal.is_metafunction_that_may_return_error or self.replacement_expr.is_metafunction_that_may_return_error,
-                                   referenced_locals=referenced_locals,
-                                   type=type_literal.type)
-
-        # TODO: implement this.
+            return ir0.AtomicTypeLiteral(cpp_type=tokenized_cpp_type.replace_identifiers({self.var: self.replacement_expr.cpp_type}),
+                                         is_local=type_literal.is_local and self.replacement_expr.is_local,
+                                         is_metafunction_that_may_return_error=type_literal.is_metafunction_that_may_return_error or self.replacement_expr.is_metafunction_that_may_return_error,
+                                         type=type_literal.type)
+
+        # Other exprs can't be embedded in the C++ text of an AtomicTypeLiteral without losing track of the vars that
+        # they reference.
         raise NotImplementedError('The replacement of "%s" with "%s" in "%s" is not implemented yet.' % (self.var, expr_to_cpp(self.replacement_expr), type_literal.cpp_type))
 
 def replace_var_with_expr(elem: ir0.TemplateBodyElement, var: str, expr: ir0.Expr) -> ir0.TemplateBodyElement:
@@ -316,203 +427,333 @@ def _elem_can_trigger_static_asserts(stmt: ir0.TemplateBodyElement):
     transformation.transform_template_body_elems([stmt], writer)
     return transformation.can_trigger_static_asserts
 
-class ConstantFoldingTransformation(transform_ir0.Transformation):
-    def __init__(self, inline_template_instantiations_with_multiple_references: bool):
+class _InlineVarsTransformation(transform_ir0.Transformation):
+    '''Performs a sequence of replacements of vars with exprs in a single walk.
+
+    The result is the same as calling replace_var_with_expr() for each (var, expr) in `replacements`, in order: an
+    occurrence of a var in the original elem is replaced with the expr of the first replacement for that var, while an
+    occurrence that comes from the expr of the i-th replacement is only affected by the replacements after the i-th.
+    '''
+    def __init__(self, replacements: List[Tuple[str, ir0.Expr]]):
         super().__init__()
-        self.inline_template_instantiations_with_multiple_references = inline_template_instantiations_with_multiple_references
+        self.replacements = replacements
+        self.replacement_indexes_by_var = defaultdict(list)  # type: Dict[str, List[int]]
+        for index, (var, _) in enumerate(replacements):
+            self.replacement_indexes_by_var[var].append(index)
+        # Only the replacements with an index >= this one apply to the expr currently being transformed.
+        self.first_applicable_replacement_index = 0
+        # The result only depends on the index, so we transform each replacement expr at most once.
+        self.transformed_replacement_expr_by_index = dict()  # type: Dict[int, ir0.Expr]
 
-    def transform_template_defn(self, template_defn: ir0.TemplateDefn, writer: transform_ir0.Writer):
-      writer.write(ir0.TemplateDefn(args=template_defn.args,
-                                    main_definition=self._transform_template_specialization(template_defn.main_definition,
-                                                                                            template_defn.result_element_names)
-                                        if template_defn.main_definition is not None else None,
-                                    specializations=[self._transform_template_specialization(specialization,
-                                                                                             template_defn.result_element_names)
-                                                     for specialization in template_defn.specializations],
-                                    name=template_defn.name,
-                                    description=template_defn.description,
-                                    result_element_names=template_defn.result_element_names))
+    def transform_type_literal(self, type_literal: ir0.AtomicTypeLiteral, writer: transform_ir0.Writer):
+        index = self._get_applicable_replacement_index(type_literal.cpp_type)
+        if index is not None:
+            return self._transform_replacement_expr(index, writer)
+
+        is_local = type_literal.is_local
+        is_metafunction_that_may_return_error = type_literal.is_metafunction_that_may_return_error
+        identifier_replacements = dict()
+        for identifier in type_literal.tokenized_cpp_type.slots_by_identifier:
+            index = self._get_applicable_replacement_index(identifier)
+            if index is not None:
+                replacement_expr = self._transform_replacement_expr(index, writer)
+                # ConstantFoldingTransformation only inlines non-literal exprs if the var doesn't occur in a compound
+                # literal (as in ReplaceVarWithExprTransformation).
+                assert isinstance(replacement_expr, ir0.AtomicTypeLiteral)
+                identifier_replacements[identifier] = replacement_expr.cpp_type
+                is_local = is_local and replacement_expr.is_local
+                is_metafunction_that_may_return_error = is_metafunction_that_may_return_error or replacement_expr.is_metafunction_that_may_return_error
+        if not identifier_replacements:
+            return type_literal
+        return ir0.AtomicTypeLiteral(cpp_type=type_literal.tokenized_cpp_type.replace_identifiers(identifier_replacements),
+                                     is_local=is_local,
+                                     is_metafunction_that_may_return_error=is_metafunction_that_may_return_error,
+                                     type=type_literal.type)
 
-    def _transform_template_specialization(self,
-                                          specialization: ir0.TemplateSpecialization,
-                                          result_element_names: Tuple[str]) -> ir0.TemplateSpecialization:
-      return ir0.TemplateSpecialization(args=specialization.args,
-                                        patterns=specialization.patterns,
-                                        body=self._transform_template_body_elems(specialization.body,
-                                                                                 result_element_names))
+    def _get_applicable_replacement_index(self, var: str) -> Optional[int]:
+        indexes = self.replacement_indexes_by_var.get(var)
+        if indexes is None:
+            return None
+        position = bisect.bisect_left(indexes, self.first_applicable_replacement_index)
+        return indexes[position] if position < len(indexes) else None
+
+    def _transform_replacement_expr(self, index: int, writer: transform_ir0.Writer):
+        result = self.transformed_replacement_expr_by_index.get(index)
+        if result is None:
+            old_first_applicable_replacement_index = self.first_applicable_replacement_index
+            self.first_applicable_replacement_index = index + 1
+            try:
+                result = self.transform_expr(self.replacements[index][1], writer)
+            finally:
+                self.first_applicable_replacement_index = old_first_applicable_replacement_index
+            self.transformed_replacement_expr_by_index[index] = result
+        return result
+
+def _inline_vars(elem: ir0.TemplateBodyElement, replacements: List[Tuple[str, ir0.Expr]]) -> ir0.TemplateBodyElement:
+    toplevel_writer = transform_ir0.ToplevelWriter(identifier_generator=[], allow_template_defns=False, allow_toplevel_elems=False)
+    writer = transform_ir0.TemplateBodyWriter(toplevel_writer)
+    _InlineVarsTransformation(replacements).transform_template_body_elem(elem, writer)
+    [elem] = writer.elems
+    return elem
 
-    def _transform_template_body_elems(self,
-                                       stmts: Tuple[ir0.TemplateBodyElement],
-                                       result_element_names: Tuple[str]):
-        stmts = list(stmts)
+class _CompoundTypeLiteralIdentifiersCollector(transform_ir0.Transformation):
+    def __init__(self):
+        super().__init__()
+        self.identifiers = set()  # type: Set[str]
+
+    def transform_type_literal(self, type_literal: ir0.AtomicTypeLiteral, writer: transform_ir0.Writer):
+        if type_literal.tokenized_cpp_type.identifiers != (type_literal.cpp_type,):
+            self.identifiers.update(type_literal.tokenized_cpp_type.slots_by_identifier)
+        return type_literal
+
+def _get_compound_type_literal_identifiers(elem: ir0.TemplateBodyElement):
+    '''Returns the identifiers that occur in AtomicTypeLiterals that are not just an identifier (e.g. 'std::vector').'''
+    writer = transform_ir0.ToplevelWriter(identifier_generator=iter([]))
+    transformation = _CompoundTypeLiteralIdentifiersCollector()
+    transformation.transform_template_body_elems([elem], writer)
+    return transformation.identifiers
+
+class _ConstantFoldingWorklist:
+    '''The def-use analysis and the inlining for a single body, used by ConstantFoldingTransformation.
+
+    Stmts are processed from the last to the first. For each stmt, the vars that it references are visited as a
+    worklist; when a var is inlined, the vars referenced in its definition are added to the worklist. All the inlinings
+    in a stmt are then performed with a single walk of the stmt (see _InlineVarsTransformation). Use counts are kept up
+    to date incrementally, and definitions whose var is no longer used are eliminated (transitively).
+    '''
+    def __init__(self,
+                 stmts: Tuple[ir0.TemplateBodyElement],
+                 result_element_names: Tuple[str],
+                 inline_template_instantiations_with_multiple_references: bool):
+        self.stmts = list(stmts)
+        self.inline_template_instantiations_with_multiple_references = inline_template_instantiations_with_multiple_references
 
         # stmt[var_name_to_defining_stmt_index['x']] is the stmt that defines 'x'
-        var_name_to_defining_stmt_index = {stmt.name: i
-                                           for i, stmt in enumerate(stmts)
-                                           if isinstance(stmt, (ir0.ConstantDef, ir0.Typedef))}
+        self.var_name_to_defining_stmt_index = {stmt.name: i
+                                                for i, stmt in enumerate(self.stmts)
+                                                if isinstance(stmt, (ir0.ConstantDef, ir0.Typedef))}
+        # defined_var_by_stmt_index[i] is the var defined by stmts[i] (if any).
+        self.defined_var_by_stmt_index = [stmt.name if isinstance(stmt, (ir0.ConstantDef, ir0.Typedef)) else None
+                                          for stmt in self.stmts]
 
         # remaining_uses_of_var_by_stmt_index[i]['x'] is the number of remaining VarReferences referencing 'x' in
         # stmts[i].
-        remaining_uses_of_var_by_stmt_index = [defaultdict(lambda: 0)
-                                               for stmt in stmts]
+        self.remaining_uses_of_var_by_stmt_index = [defaultdict(lambda: 0)
+                                                    for stmt in self.stmts]
         # remaining_uses_of_var['x'] = sum(uses['x'] for uses in remaining_uses_of_var_by_stmt_index), possibly +1 if
         # it's a result element (e.g. "type").
-        remaining_uses_of_var = defaultdict(lambda: 0)
+        self.remaining_uses_of_var = defaultdict(lambda: 0)
         # referenced_vars_by_stmt_index[i] are all the names of vars referenced in stmt[i]
-        referenced_vars_by_stmt_index = [set() for stmt in stmts]
+        self.referenced_vars_by_stmt_index = [set() for stmt in self.stmts]
         # referenced_var_list_by_stmt_index[i] are all the names of vars referenced in stmt[i], in order (but only with
         # the first occurrence of each var)
-        referenced_var_list_by_stmt_index = [[] for stmt in stmts]
-        for i, stmt in enumerate(stmts):
+        self.referenced_var_list_by_stmt_index = [[] for stmt in self.stmts]
+        for i, stmt in enumerate(self.stmts):
             for identifier in stmt.get_referenced_identifiers():
-                if identifier in var_name_to_defining_stmt_index:
-                    remaining_uses_of_var[identifier] = remaining_uses_of_var[identifier] + 1
-                    remaining_uses_of_var_by_stmt_index[i][identifier] = remaining_uses_of_var_by_stmt_index[i][identifier] + 1
-                    if identifier not in referenced_vars_by_stmt_index[i]:
-                        referenced_vars_by_stmt_index[i].add(identifier)
-                        referenced_var_list_by_stmt_index[i].append(identifier)
+                if identifier in self.var_name_to_defining_stmt_index:
+                    self.remaining_uses_of_var[identifier] += 1
+                    self.remaining_uses_of_var_by_stmt_index[i][identifier] += 1
+                    if identifier not in self.referenced_vars_by_stmt_index[i]:
+                        self.referenced_vars_by_stmt_index[i].add(identifier)
+                        self.referenced_var_list_by_stmt_index[i].append(identifier)
 
         for var in result_element_names:
-            if var in var_name_to_defining_stmt_index:
-                remaining_uses_of_var[var] = remaining_uses_of_var[var] + 1
+            if var in self.var_name_to_defining_stmt_index:
+                self.remaining_uses_of_var[var] += 1
 
         # can_trigger_static_asserts_by_stmt_index[i] describes whether stmts[i] can trigger static asserts.
-        can_trigger_static_asserts_by_stmt_index = [_elem_can_trigger_static_asserts(stmt)
-                                                    for stmt in stmts]
-        was_inlined_by_stmt_index = [False for stmt in stmts]
+        self.can_trigger_static_asserts_by_stmt_index = [_elem_can_trigger_static_asserts(stmt)
+                                                         for stmt in self.stmts]
+        self.was_inlined_by_stmt_index = [False for stmt in self.stmts]
+
+        # Computed lazily, see _get_compound_type_literal_identifiers().
+        self.compound_type_literal_identifiers_by_stmt_index = dict()  # type: Dict[int, Set[str]]
+
+        # The (sorted) indexes of the stmts that can trigger static asserts and that will be emitted (as far as we know
+        # so far). A definition that can trigger static asserts can't be moved past these.
+        self.barrier_stmt_indexes = []  # type: List[int]
+        self.is_barrier_by_stmt_index = [False for stmt in self.stmts]
 
         # Disregard "uses" of vars in useless stmts that will be eliminated.
         already_useless_stmt_indexes = [i
-                                        for i, stmt in enumerate(stmts)
-                                        if isinstance(stmt, (ir0.ConstantDef, ir0.Typedef))
-                                        and remaining_uses_of_var[stmt.name] == 0
-                                        and not can_trigger_static_asserts_by_stmt_index[i]]
+                                        for i, var in enumerate(self.defined_var_by_stmt_index)
+                                        if var is not None
+                                        and self.remaining_uses_of_var[var] == 0
+                                        and not self.can_trigger_static_asserts_by_stmt_index[i]]
         for i in already_useless_stmt_indexes:
-          for indirectly_unused_var in referenced_var_list_by_stmt_index[i]:
-            assert isinstance(indirectly_unused_var, str)
-            self._decrease_remaining_uses(remaining_uses_of_var,
-                                          remaining_uses_of_var_by_stmt_index,
-                                          referenced_vars_by_stmt_index,
-                                          var_name_to_defining_stmt_index,
-                                          can_trigger_static_asserts_by_stmt_index,
-                                          was_inlined_by_stmt_index,
-                                          indirectly_unused_var,
-                                          i,
-                                          remaining_uses_of_var_by_stmt_index[i][indirectly_unused_var])
+            for indirectly_unused_var in self.referenced_var_list_by_stmt_index[i]:
+                self._decrease_remaining_uses(indirectly_unused_var,
+                                              from_stmt_index=i,
+                                              by=self.remaining_uses_of_var_by_stmt_index[i][indirectly_unused_var])
 
+        for i in range(len(self.stmts)):
+            self._update_barrier_status(i)
 
+    def run(self) -> List[ir0.TemplateBodyElement]:
+        stmts = self.stmts
         # Start inlining (from the last statement to the first)
-        for i, stmt in reversed(list(enumerate(stmts))):
-            if (isinstance(stmt, (ir0.ConstantDef, ir0.Typedef))
-                and remaining_uses_of_var[stmt.name] == 0
-                and (not can_trigger_static_asserts_by_stmt_index[i]
-                     or was_inlined_by_stmt_index[i])):
+        for i in reversed(range(len(stmts))):
+            if self._will_be_eliminated(i):
                 # All references have been inlined and this statement can't trigger static asserts, no need to emit this
                 # assignment.
                 stmts[i] = None
                 continue
 
-            referenced_var_list = referenced_var_list_by_stmt_index[i]
+            replacements = []  # type: List[Tuple[str, ir0.Expr]]
+            # The identifiers in compound AtomicTypeLiterals in stmt[i] (after the replacements). This is a superset, it
+            # might include identifiers that have already been replaced.
+            compound_type_literal_identifiers = None  # type: Optional[Set[str]]
+
+            referenced_var_list = self.referenced_var_list_by_stmt_index[i]
             while referenced_var_list:
                 var = referenced_var_list[-1]
-                defining_stmt_index = var_name_to_defining_stmt_index[var]
+                defining_stmt_index = self.var_name_to_defining_stmt_index[var]
                 defining_stmt = stmts[defining_stmt_index]
                 assert isinstance(defining_stmt, (ir0.ConstantDef, ir0.Typedef))
 
-                can_inline_var = (not can_trigger_static_asserts_by_stmt_index[defining_stmt_index]
-                                  or all(not can_trigger_static_asserts_by_stmt_index[crossed_stmt_index]
-                                             # If all references have been inlined, we won't emit this assignment; so we
-                                             # can disregard it in the crossing calculation.
-                                             or (isinstance(stmts[crossed_stmt_index], (ir0.ConstantDef, ir0.Typedef))
-                                                 and remaining_uses_of_var[stmts[crossed_stmt_index].name] == 0
-                                                 and was_inlined_by_stmt_index[crossed_stmt_index])
-                                         for crossed_stmt_index in range(defining_stmt_index + 1, i)))
+                can_inline_var = (not self.can_trigger_static_asserts_by_stmt_index[defining_stmt_index]
+                                  or not self._has_barrier_between(defining_stmt_index, i))
 
                 if self.inline_template_instantiations_with_multiple_references and isinstance(defining_stmt.expr, ir0.TemplateInstantiation):
                     want_to_inline_var = True
                 elif isinstance(defining_stmt.expr, ir0.Literal):
                     want_to_inline_var = True
-                elif isinstance(defining_stmt.expr, ir0.AtomicTypeLiteral) and len(list(defining_stmt.expr.get_referenced_identifiers())) <= 1:
+                elif isinstance(defining_stmt.expr, ir0.AtomicTypeLiteral):
                     want_to_inline_var = True
                 else:
-                    want_to_inline_var = (remaining_uses_of_var[var] == 1)
+                    want_to_inline_var = (self.remaining_uses_of_var[var] == 1)
 
                 if not (can_inline_var and want_to_inline_var):
                     referenced_var_list.pop()
                     continue
 
-                # Actually inline `var' into `stmt`.
-                try:
-                  stmt = replace_var_with_expr(stmt, var, defining_stmt.expr)
-                except NotImplementedError as e:
-                  # TODO: remove this once ReplaceVarWithExprTransformation is implemented for the general case (see the
-                  # TODO there).
-                  referenced_var_list.pop()
-                  continue
+                if compound_type_literal_identifiers is None:
+                    compound_type_literal_identifiers = set(self._get_compound_type_literal_identifiers(i))
+                if var in compound_type_literal_identifiers:
+                    if not isinstance(defining_stmt.expr, ir0.AtomicTypeLiteral):
+                        # ReplaceVarWithExprTransformation doesn't support this (see the comment there).
+                        referenced_var_list.pop()
+                        continue
+                    compound_type_literal_identifiers.update(defining_stmt.expr.tokenized_cpp_type.slots_by_identifier)
+                compound_type_literal_identifiers.update(self._get_compound_type_literal_identifiers(defining_stmt_index))
 
-                stmts[i] = stmt
-                num_replacements = remaining_uses_of_var_by_stmt_index[i][var]
+                # Inline `var' into `stmt` (the actual replacement is done below, together with the other ones).
+                replacements.append((var, defining_stmt.expr))
 
-                for var2, num_uses_in_replacement_expr in remaining_uses_of_var_by_stmt_index[defining_stmt_index].items():
-                    remaining_uses_of_var[var2] = remaining_uses_of_var[var2] + num_uses_in_replacement_expr * num_replacements
-                    remaining_uses_of_var_by_stmt_index[i][var2] = remaining_uses_of_var_by_stmt_index[i][var2] + num_uses_in_replacement_expr * num_replacements
+                num_replacements = self.remaining_uses_of_var_by_stmt_index[i][var]
+
+                for var2, num_uses_in_replacement_expr in self.remaining_uses_of_var_by_stmt_index[defining_stmt_index].items():
+                    self.remaining_uses_of_var[var2] += num_uses_in_replacement_expr * num_replacements
+                    self.remaining_uses_of_var_by_stmt_index[i][var2] += num_uses_in_replacement_expr * num_replacements
+                    self._update_barrier_status(self.var_name_to_defining_stmt_index[var2])
 
                 if num_replacements > 0:
-                  was_inlined_by_stmt_index[defining_stmt_index] = True
-                  self._decrease_remaining_uses(remaining_uses_of_var,
-                                                remaining_uses_of_var_by_stmt_index,
-                                                referenced_vars_by_stmt_index,
-                                                var_name_to_defining_stmt_index,
-                                                can_trigger_static_asserts_by_stmt_index,
-                                                was_inlined_by_stmt_index,
-                                                var=var,
-                                                from_stmt_index=i,
-                                                by=num_replacements)
-
-                referenced_var_list_by_stmt_index[i].pop()
-                referenced_vars_by_stmt_index[i].remove(var)
-                for var in referenced_var_list_by_stmt_index[defining_stmt_index]:
-                    if var not in referenced_vars_by_stmt_index[i]:
-                        referenced_vars_by_stmt_index[i].add(var)
-                        referenced_var_list_by_stmt_index[i].append(var)
-
-                can_trigger_static_asserts_by_stmt_index[i] = can_trigger_static_asserts_by_stmt_index[i] or _elem_can_trigger_static_asserts(defining_stmt)
+                    self.was_inlined_by_stmt_index[defining_stmt_index] = True
+                    self._decrease_remaining_uses(var, from_stmt_index=i, by=num_replacements)
+
+                referenced_var_list.pop()
+                self.referenced_vars_by_stmt_index[i].remove(var)
+                for var in self.referenced_var_list_by_stmt_index[defining_stmt_index]:
+                    if var not in self.referenced_vars_by_stmt_index[i]:
+                        self.referenced_vars_by_stmt_index[i].add(var)
+                        referenced_var_list.append(var)
+
+                if self.can_trigger_static_asserts_by_stmt_index[defining_stmt_index]:
+                    self.can_trigger_static_asserts_by_stmt_index[i] = True
+                    self._update_barrier_status(i)
+
+            if replacements:
+                stmts[i] = _inline_vars(stmts[i], replacements)
 
         return [stmt
                 for stmt in stmts
                 if stmt is not None]
 
-    def _decrease_remaining_uses(self,
-                                 remaining_uses_of_var: Dict[str, int],
-                                 remaining_uses_of_var_by_stmt_index: List[Dict[str, int]],
-                                 referenced_vars_by_stmt_index: List[Set[str]],
-                                 var_name_to_defining_stmt_index: Dict[str, int],
-                                 can_trigger_static_asserts_by_stmt_index: List[bool],
-                                 was_inlined_by_stmt_index: List[bool],
-                                 var: str,
-                                 from_stmt_index: int,
-                                 by: int):
-      assert by > 0
-      remaining_uses_of_var[var] -= by
-      remaining_uses_of_var_by_stmt_index[from_stmt_index][var] -= by
-
-      stmt_index_defining_var = var_name_to_defining_stmt_index[var]
-
-      if remaining_uses_of_var[var] == 0 and (
-          not can_trigger_static_asserts_by_stmt_index[stmt_index_defining_var]
-          or was_inlined_by_stmt_index[stmt_index_defining_var]):
-        # The assignment to `var` will be eliminated. So we also need to decrement the uses of the variables referenced
-        # in this assignment.
-        for referenced_var in referenced_vars_by_stmt_index[stmt_index_defining_var]:
-          self._decrease_remaining_uses(remaining_uses_of_var,
-                                        remaining_uses_of_var_by_stmt_index,
-                                        referenced_vars_by_stmt_index,
-                                        var_name_to_defining_stmt_index,
-                                        can_trigger_static_asserts_by_stmt_index,
-                                        was_inlined_by_stmt_index,
-                                        var=referenced_var,
-                                        from_stmt_index=stmt_index_defining_var,
-                                        by=remaining_uses_of_var_by_stmt_index[stmt_index_defining_var][referenced_var])
+    def _will_be_eliminated(self, stmt_index: int):
+        var = self.defined_var_by_stmt_index[stmt_index]
+        return (var is not None
+                and self.remaining_uses_of_var[var] == 0
+                and (not self.can_trigger_static_asserts_by_stmt_index[stmt_index]
+                     or self.was_inlined_by_stmt_index[stmt_index]))
+
+    def _update_barrier_status(self, stmt_index: int):
+        is_barrier = (self.can_trigger_static_asserts_by_stmt_index[stmt_index]
+                      # If all references have been inlined, we won't emit this assignment; so we can disregard it.
+                      and not self._will_be_eliminated(stmt_index))
+        if is_barrier != self.is_barrier_by_stmt_index[stmt_index]:
+            self.is_barrier_by_stmt_index[stmt_index] = is_barrier
+            if is_barrier:
+                bisect.insort(self.barrier_stmt_indexes, stmt_index)
+            else:
+                del self.barrier_stmt_indexes[bisect.bisect_left(self.barrier_stmt_indexes, stmt_index)]
+
+    def _has_barrier_between(self, begin_stmt_index: int, end_stmt_index: int):
+        '''Returns true if there's a barrier with an index strictly between the two indexes.'''
+        position = bisect.bisect_right(self.barrier_stmt_indexes, begin_stmt_index)
+        return position < len(self.barrier_stmt_indexes) and self.barrier_stmt_indexes[position] < end_stmt_index
+
+    def _get_compound_type_literal_identifiers(self, stmt_index: int):
+        # This is only called for stmts that haven't been processed yet, so stmts[stmt_index] is the original stmt.
+        identifiers = self.compound_type_literal_identifiers_by_stmt_index.get(stmt_index)
+        if identifiers is None:
+            identifiers = _get_compound_type_literal_identifiers(self.stmts[stmt_index])
+            self.compound_type_literal_identifiers_by_stmt_index[stmt_index] = identifiers
+        return identifiers
+
+    def _decrease_remaining_uses(self, var: str, from_stmt_index: int, by: int):
+        # This uses an explicit worklist instead of recursion, since chains of definitions can be very long.
+        worklist = [(var, from_stmt_index, by)]
+        while worklist:
+            var, from_stmt_index, by = worklist.pop()
+            assert by > 0
+            self.remaining_uses_of_var[var] -= by
+            self.remaining_uses_of_var_by_stmt_index[from_stmt_index][var] -= by
+
+            stmt_index_defining_var = self.var_name_to_defining_stmt_index[var]
+            self._update_barrier_status(stmt_index_defining_var)
+
+            if self.remaining_uses_of_var[var] == 0 and (
+                not self.can_trigger_static_asserts_by_stmt_index[stmt_index_defining_var]
+                or self.was_inlined_by_stmt_index[stmt_index_defining_var]):
+                # The assignment to `var` will be eliminated. So we also need to decrement the uses of the variables
+                # referenced in this assignment.
+                for referenced_var in self.referenced_vars_by_stmt_index[stmt_index_defining_var]:
+                    worklist.append((referenced_var,
+                                     stmt_index_defining_var,
+                                     self.remaining_uses_of_var_by_stmt_index[stmt_index_defining_var][referenced_var]))
+
+class ConstantFoldingTransformation(transform_ir0.Transformation):
+    def __init__(self, inline_template_instantiations_with_multiple_references: bool):
+        super().__init__()
+        self.inline_template_instantiations_with_multiple_references = inline_template_instantiations_with_multiple_references
+
+    def transform_template_defn(self, template_defn: ir0.TemplateDefn, writer: transform_ir0.Writer):
+      writer.write(ir0.TemplateDefn(args=template_defn.args,
+                                    main_definition=self._transform_template_specialization(template_defn.main_definition,
+                                                                                            template_defn.result_element_names)
+                                        if template_defn.main_definition is not None else None,
+                                    specializations=[self._transform_template_specialization(specialization,
+                                                                                             template_defn.result_element_names)
+                                                     for specialization in template_defn.specializations],
+                                    name=template_defn.name,
+                                    description=template_defn.description,
+                                    result_element_names=template_defn.result_element_names,
+                                    source_location=template_defn.source_location))
+
+    def _transform_template_specialization(self,
+                                          specialization: ir0.TemplateSpecialization,
+                                          result_element_names: Tuple[str]) -> ir0.TemplateSpecialization:
+      return ir0.TemplateSpecialization(args=specialization.args,
+                                        patterns=specialization.patterns,
+                                        body=self._transform_template_body_elems(specialization.body,
+                                                                                 result_element_names))
+
+    def _transform_template_body_elems(self,
+                                       stmts: Tuple[ir0.TemplateBodyElement],
+                                       result_element_names: Tuple[str]):
+        return _ConstantFoldingWorklist(stmts,
+                                        result_element_names,
+                                        self.inline_template_instantiations_with_multiple_references).run()
 
 def perform_constant_folding(template_defn: ir0.TemplateDefn,
                              identifier_generator: Iterator[str],
@@ -533,18 +774,24 @@ def perform_constant_folding_on_toplevel_elems(toplevel_elems: List[Union[ir0.St
 def perform_local_optimizations_on_template_defn(template_defn: ir0.TemplateDefn,
                                                  identifier_generator: Iterator[str],
                                                  inline_template_instantiations_with_multiple_references: bool,
-                                                 verbose: bool):
+                                                 verbose: bool,
+                                                 stats: Optional[CompilationStats] = None,
+                                                 verbose_templates: Optional[List[str]] = None):
     template_defn = apply_optimization(template_defn,
                                        identifier_generator,
                                        optimization=lambda: normalize_template_defn(template_defn, identifier_generator),
                                        optimization_name='normalize_template_defn()',
-                                       verbose=verbose)
+                                       verbose=verbose,
+                                       stats=stats,
+                                       verbose_templates=verbose_templates)
 
     template_defn = apply_optimization(template_defn,
                                        identifier_generator,
                                        optimization=lambda: perform_common_subexpression_normalization(template_defn, identifier_generator),
                                        optimization_name='perform_common_subexpression_normalization()',
-                                       verbose=verbose)
+                                       verbose=verbose,
+                                       stats=stats,
+                                       verbose_templates=verbose_templates)
 
     template_defn = apply_optimization(template_defn,
                                        identifier_generator,
@@ -552,25 +799,33 @@ def perform_local_optimizations_on_template_defn(template_defn: ir0.TemplateDefn
                                                                                      identifier_generator,
                                                                                      inline_template_instantiations_with_multiple_references),
                                        optimization_name='perform_constant_folding()',
-                                       verbose=verbose)
+                                       verbose=verbose,
+                                       stats=stats,
+                                       verbose_templates=verbose_templates)
 
     return template_defn
 
 def perform_local_optimizations_on_toplevel_elems(toplevel_elems: List[Union[ir0.StaticAssert, ir0.ConstantDef, ir0.Typedef]],
                                                   identifier_generator: Iterator[str],
                                                   inline_template_instantiations_with_multiple_references: bool,
-                                                  verbose: bool):
+                                                  verbose: bool,
+                                                  stats: Optional[CompilationStats] = None,
+                                                  verbose_templates: Optional[List[str]] = None):
   toplevel_elems = apply_toplevel_elems_optimization(toplevel_elems,
                                                      identifier_generator,
                                                      optimization=lambda: normalize_toplevel_elems(toplevel_elems, identifier_generator),
                                                      optimization_name='normalize_toplevel_elems()',
-                                                     verbose=verbose)
+                                                     verbose=verbose,
+                                                     stats=stats,
+                                                     verbose_templates=verbose_templates)
 
   toplevel_elems = apply_toplevel_elems_optimization(toplevel_elems,
                                                      identifier_generator,
                                                      optimization=lambda: perform_common_subexpression_normalization_on_toplevel_elems(toplevel_elems, identifier_generator),
                                                      optimization_name='perform_common_subexpression_normalization_on_toplevel_elems()',
-                                                     verbose=verbose)
+                                                     verbose=verbose,
+                                                     stats=stats,
+                                                     verbose_templates=verbose_templates)
 
   toplevel_elems = apply_toplevel_elems_optimization(toplevel_elems,
                                                      identifier_generator,
@@ -578,17 +833,130 @@ def perform_local_optimizations_on_toplevel_elems(toplevel_elems: List[Union[ir0
                                                                                                                      identifier_generator,
                                                                                                                      inline_template_instantiations_with_multiple_references),
                                                      optimization_name='perform_constant_folding_on_toplevel_elems()',
-                                                     verbose=verbose)
+                                                     verbose=verbose,
+                                                     stats=stats,
+                                                     verbose_templates=verbose_templates)
 
   return toplevel_elems
 
+def _get_defined_names(elems: Iterable[ir0.TemplateBodyElement]) -> Set[str]:
+    return {elem.name
+            for elem in elems
+            if isinstance(elem, (ir0.ConstantDef, ir0.Typedef, ir0.TemplateDefn))}
+
+class PartialEvaluationTransformation(transform_ir0.Transformation):
+    '''Replaces the exprs that don't depend on template parameters with their value, and removes the static_asserts
+    that are known to hold.'''
+    def __init__(self, evaluator: evaluate_ir0.Evaluator):
+        super().__init__()
+        self.evaluator = evaluator
+        # The known values of the local vars defined so far (in the current body and in the bodies that contain it).
+        self.env = dict()  # type: Dict[str, ir0.Expr]
+        # All the local names in scope, including the template args.
+        self.local_names = set()  # type: Set[str]
+
+    def transform_toplevel_elems(self,
+                                 toplevel_elems: List[Union[ir0.StaticAssert, ir0.ConstantDef, ir0.Typedef]],
+                                 writer: transform_ir0.ToplevelWriter):
+        self.local_names = _get_defined_names(toplevel_elems)
+        return self.transform_template_body_elems(toplevel_elems, writer)
+
+    def transform_template_specialization(self, specialization: ir0.TemplateSpecialization, writer: transform_ir0.Writer):
+        old_env = self.env
+        old_local_names = self.local_names
+        arg_names = {arg_decl.name for arg_decl in specialization.args if arg_decl.name}
+        self.env = {name: value
+                    for name, value in old_env.items()
+                    if name not in arg_names}
+        self.local_names = old_local_names | arg_names | _get_defined_names(specialization.body)
+        try:
+            return super().transform_template_specialization(specialization, writer)
+        finally:
+            self.env = old_env
+            self.local_names = old_local_names
+
+    def transform_pattern(self, expr: ir0.Expr, writer: transform_ir0.Writer):
+        return expr
+
+    def transform_expr(self, expr: ir0.Expr, writer: transform_ir0.Writer):
+        # We don't replace local vars with their value, ConstantFoldingTransformation decides when that's useful.
+        if not isinstance(expr, ir0.AtomicTypeLiteral):
+            value = self.evaluator.try_evaluate(expr, self.env, self.local_names)
+            if value is not None:
+                return value
+        return super().transform_expr(expr, writer)
+
+    def transform_static_assert(self, static_assert: ir0.StaticAssert, writer: transform_ir0.Writer):
+        if self.evaluator.try_evaluate(static_assert.expr, self.env, self.local_names) == ir0.Literal(True):
+            return
+        # We leave the static_assert as is, so that if it fails the C++ compiler reports the usual error.
+        writer.write(static_assert)
+
+    def transform_constant_def(self, constant_def: ir0.ConstantDef, writer: transform_ir0.Writer):
+        value = self.evaluator.try_evaluate(constant_def.expr, self.env, self.local_names)
+        if value is None:
+            super().transform_constant_def(constant_def, writer)
+        else:
+            self.env[constant_def.name] = value
+            writer.write(ir0.ConstantDef(name=constant_def.name, expr=value))
+
+    def transform_typedef(self, typedef: ir0.Typedef, writer: transform_ir0.Writer):
+        value = self.evaluator.try_evaluate(typedef.expr, self.env, self.local_names)
+        if value is None:
+            super().transform_typedef(typedef, writer)
+        else:
+            self.env[typedef.name] = value
+            writer.write(ir0.Typedef(name=typedef.name, expr=value))
+
+def perform_partial_evaluation(template_defn: ir0.TemplateDefn,
+                               template_defn_by_name: Dict[str, ir0.TemplateDefn],
+                               identifier_generator: Iterator[str],
+                               options: OptimizationOptions,
+                               verbose: bool,
+                               stats: Optional[CompilationStats] = None,
+                               verbose_templates: Optional[List[str]] = None):
+    def perform_optimization():
+        evaluator = evaluate_ir0.Evaluator(template_defn_by_name, step_budget=options.partial_evaluation_step_budget)
+        writer = transform_ir0.ToplevelWriter(identifier_generator, allow_toplevel_elems=False)
+        PartialEvaluationTransformation(evaluator).transform_template_defn(template_defn, writer)
+        [new_template_defn] = writer.template_defns
+        return new_template_defn
+
+    return apply_optimization(template_defn,
+                              identifier_generator,
+                              optimization=perform_optimization,
+                              optimization_name='PartialEvaluationTransformation',
+                              verbose=verbose,
+                              stats=stats,
+                              verbose_templates=verbose_templates)
+
+def perform_partial_evaluation_on_toplevel_elems(toplevel_elems: List[Union[ir0.StaticAssert, ir0.ConstantDef, ir0.Typedef]],
+                                                 template_defn_by_name: Dict[str, ir0.TemplateDefn],
+                                                 identifier_generator: Iterator[str],
+                                                 options: OptimizationOptions,
+                                                 verbose: bool,
+                                                 stats: Optional[CompilationStats] = None,
+                                                 verbose_templates: Optional[List[str]] = None):
+    def perform_optimization():
+        evaluator = evaluate_ir0.Evaluator(template_defn_by_name, step_budget=options.partial_evaluation_step_budget)
+        writer = transform_ir0.ToplevelWriter(identifier_generator, allow_toplevel_elems=False, allow_template_defns=False)
+        return PartialEvaluationTransformation(evaluator).transform_toplevel_elems(toplevel_elems, writer)
+
+    return apply_toplevel_elems_optimization(toplevel_elems,
+                                             identifier_generator,
+                                             optimization=perform_optimization,
+                                             optimization_name='PartialEvaluationTransformation',
+                                             verbose=verbose,
+                                             stats=stats,
+                                             verbose_templates=verbose_templates)
+
 class NameReplacementTransformation(transform_ir0.Transformation):
     def __init__(self, replacements: Dict[str, str]):
         super().__init__()
         self.replacements = replacements
 
     def transform_type_literal(self, type_literal: ir0.AtomicTypeLiteral, writer: transform_ir0.Writer):
-        return ir0.AtomicTypeLiteral(cpp_type=utils.replace_identifiers(type_literal.cpp_type, self.replacements),
+        return ir0.AtomicTypeLiteral(cpp_type=type_literal.tokenized_cpp_type.replace_identifiers(self.replacements),
                                      is_local=type_literal.is_local,
                                      is_metafunction_that_may_return_error=type_literal.is_metafunction_that_may_return_error,
                                      type=type_literal.type)
@@ -609,7 +977,8 @@ class NameReplacementTransformation(transform_ir0.Transformation):
                                                        for specialization in template_defn.specializations],
                                       name=self._transform_name(template_defn.name),
                                       description=template_defn.description,
-                                      result_element_names=template_defn.result_element_names))
+                                      result_element_names=template_defn.result_element_names,
+                                      source_location=template_defn.source_location))
 
     def transform_template_arg_decl(self, arg_decl: ir0.TemplateArgDecl):
         return ir0.TemplateArgDecl(type=arg_decl.type,
@@ -667,11 +1036,15 @@ def perform_template_inlining(template_defn: ir0.TemplateDefn,
                               inlineable_refs: Set[str],
                               template_defn_by_name: Dict[str, ir0.TemplateDefn],
                               identifier_generator: Iterator[str],
-                              verbose: bool):
+                              verbose: bool,
+                              stats: Optional[CompilationStats] = None,
+                              verbose_templates: Optional[List[str]] = None):
   template_defn = perform_local_optimizations_on_template_defn(template_defn,
                                                                identifier_generator,
                                                                inline_template_instantiations_with_multiple_references=True,
-                                                               verbose=verbose)
+                                                               verbose=verbose,
+                                                               stats=stats,
+                                                               verbose_templates=verbose_templates)
 
   def perform_optimization():
     transformation = TemplateInstantiationInliningTransformation({template_name: template_defn_by_name[template_name]
@@ -688,7 +1061,9 @@ def perform_template_inlining(template_defn: ir0.TemplateDefn,
                                      optimization_name='TemplateInstantiationInliningTransformation',
                                      other_context=lambda: 'Inlined template(s):\n' + ''.join(template_defn_to_cpp(template_defn_by_name[template_name], identifier_generator)
                                                                                               for template_name in inlineable_refs) + '\n',
-                                     verbose=verbose)
+                                     verbose=verbose,
+                                     stats=stats,
+                                     verbose_templates=verbose_templates)
 
   return template_defn
 
@@ -696,11 +1071,15 @@ def perform_template_inlining_on_toplevel_elems(toplevel_elems: List[Union[ir0.S
                                                 inlineable_refs: Set[str],
                                                 template_defn_by_name: Dict[str, ir0.TemplateDefn],
                                                 identifier_generator: Iterator[str],
-                                                verbose: bool):
+                                                verbose: bool,
+                                                stats: Optional[CompilationStats] = None,
+                                                verbose_templates: Optional[List[str]] = None):
   toplevel_elems = perform_local_optimizations_on_toplevel_elems(toplevel_elems,
                                                                  identifier_generator,
                                                                  inline_template_instantiations_with_multiple_references=True,
-                                                                 verbose=verbose)
+                                                                 verbose=verbose,
+                                                                 stats=stats,
+                                                                 verbose_templates=verbose_templates)
 
   def perform_optimization():
     transformation = TemplateInstantiationInliningTransformation({template_name: template_defn_by_name[template_name]
@@ -717,9 +1096,292 @@ def perform_template_inlining_on_toplevel_elems(toplevel_elems: List[Union[ir0.S
                                            optimization_name='TemplateInstantiationInliningTransformation',
                                            other_context=lambda: 'Inlined template(s):\n' + ''.join(template_defn_to_cpp(template_defn_by_name[template_name], identifier_generator)
                                                                                                     for template_name in inlineable_refs) + '\n',
-                                           verbose=verbose)
+                                           verbose=verbose,
+                                           stats=stats,
+                                           verbose_templates=verbose_templates)
+
+# The identifiers generated by the identifier_generator. These are the only identifiers that can change when an
+# unrelated part of the module changes, so they're the ones that we need to canonicalize in the cache keys.
+_internal_identifier_regex = re.compile('TmppyInternal_[0-9]+')
+
+def _canonicalize_internal_identifiers(s: str, canonical_name_by_name: Dict[str, str]):
+    def replace(match):
+        name = match.group(0)
+        canonical_name = canonical_name_by_name.get(name)
+        if canonical_name is None:
+            canonical_name = 'TmppyCanonical_%s' % len(canonical_name_by_name)
+            canonical_name_by_name[name] = canonical_name
+        return canonical_name
+    return _internal_identifier_regex.sub(replace, s)
+
+def _compute_optimized_template_cache_key(template_defn: ir0.TemplateDefn,
+                                          inlineable_refs: Set[str],
+                                          template_defn_by_name: Dict[str, ir0.TemplateDefn],
+                                          cache: CompilationCache,
+                                          options: OptimizationOptions):
+    # The result of the optimization of a template only depends on the template itself and on the (current definitions
+    # of the) templates that it references, so that's what we include in the key. Internal identifiers are
+    # canonicalized based on the order in which they appear, so that the key doesn't change when e.g. a function
+    # defined earlier in the module generates more/less internal identifiers.
+    # With partial evaluation, the result also depends on the templates referenced indirectly.
+    canonical_name_by_name = dict()  # type: Dict[str, str]
+    key_parts = [_canonicalize_internal_identifiers(utils.ir_to_string(template_defn), canonical_name_by_name)]
+    referenced_template_names = {template_defn.name}
+    templates_to_visit = [template_defn]
+    while templates_to_visit:
+        for identifier in templates_to_visit.pop(0).get_referenced_identifiers():
+            if identifier in template_defn_by_name and identifier not in referenced_template_names:
+                referenced_template_names.add(identifier)
+                key_parts.append(_canonicalize_internal_identifiers('%s (inlineable: %s): %s' % (
+                    identifier,
+                    identifier in inlineable_refs,
+                    utils.ir_to_string(template_defn_by_name[identifier])),
+                    canonical_name_by_name))
+                if options.partial_evaluation_step_budget:
+                    templates_to_visit.append(template_defn_by_name[identifier])
+
+    # The time budget is not part of the key, since we only cache the templates that were optimized within it.
+    optimization_options = {'level': options.level,
+                            'max_iterations': options.max_iterations,
+                            'template_node_budget': options.template_node_budget,
+                            'partial_evaluation_step_budget': options.partial_evaluation_step_budget}
+    return (cache.compute_optimized_template_key('\n'.join(key_parts), optimization_options),
+            canonical_name_by_name)
+
+def _put_optimized_template_in_cache(cache: CompilationCache,
+                                     cache_key: str,
+                                     canonical_name_by_name: Dict[str, str],
+                                     template_defn: ir0.TemplateDefn):
+    canonical_name_by_name = canonical_name_by_name.copy()
+    num_names_in_key = len(canonical_name_by_name)
+    # This also adds any new internal identifiers generated during the optimization to canonical_name_by_name.
+    _canonicalize_internal_identifiers(utils.ir_to_string(template_defn), canonical_name_by_name)
+    new_canonical_names = list(canonical_name_by_name.values())[num_names_in_key:]
+    canonical_template_defn = _rename_internal_identifiers(template_defn, canonical_name_by_name)
+    cache.put_optimized_template(cache_key, (canonical_template_defn, new_canonical_names))
+
+def _get_optimized_template_from_cache(cache: CompilationCache,
+                                       cache_key: str,
+                                       canonical_name_by_name: Dict[str, str],
+                                       identifier_generator: Iterator[str]) -> Optional[ir0.TemplateDefn]:
+    cached_value = cache.get_optimized_template(cache_key)
+    if cached_value is None:
+        return None
+    canonical_template_defn, new_canonical_names = cached_value
+    name_by_canonical_name = {canonical_name: name
+                              for name, canonical_name in canonical_name_by_name.items()}
+    for canonical_name in new_canonical_names:
+        name_by_canonical_name[canonical_name] = next(identifier_generator)
+    return _rename_internal_identifiers(canonical_template_defn, name_by_canonical_name)
+
+class _InternalIdentifiersRenamingTransformation(NameReplacementTransformation):
+    '''Like NameReplacementTransformation, but also renames class members.
+
+    This is only correct when renaming *all* occurrences of the identifiers generated by the identifier_generator (e.g.
+    when canonicalizing them), since they're guaranteed not to clash with user-defined names.
+    '''
+    def transform_class_member_access(self, class_member_access: ir0.ClassMemberAccess, writer: transform_ir0.Writer):
+        return ir0.ClassMemberAccess(class_type_expr=self.transform_expr(class_member_access.expr, writer),
+                                     member_type=class_member_access.type,
+                                     member_name=self._transform_name(class_member_access.member_name))
+
+    def transform_template_defn(self, template_defn: ir0.TemplateDefn, writer: transform_ir0.Writer):
+        writer.write(ir0.TemplateDefn(args=[self.transform_template_arg_decl(arg_decl) for arg_decl in template_defn.args],
+                                      main_definition=self.transform_template_specialization(template_defn.main_definition, writer)
+                                          if template_defn.main_definition is not None else None,
+                                      specializations=[self.transform_template_specialization(specialization, writer)
+                                                       for specialization in template_defn.specializations],
+                                      name=self._transform_name(template_defn.name),
+                                      description=template_defn.description,
+                                      result_element_names=[self._transform_name(name)
+                                                            for name in template_defn.result_element_names],
+                                      source_location=template_defn.source_location))
+
+def _rename_internal_identifiers(template_defn: ir0.TemplateDefn, replacements: Dict[str, str]):
+    writer = transform_ir0.ToplevelWriter(identifier_generator=iter([]), allow_toplevel_elems=False)
+    _InternalIdentifiersRenamingTransformation(replacements).transform_template_defn(template_defn, writer)
+    [template_defn] = writer.template_defns
+    return template_defn
 
-def optimize_header_first_pass(header: ir0.Header, identifier_generator: Iterator[str], verbose: bool):
+def _is_internal_identifier(identifier: str):
+    return _internal_identifier_regex.fullmatch(identifier) is not None
+
+def _get_internal_identifiers_in_order(s: str) -> List[str]:
+    return list(dict.fromkeys(_internal_identifier_regex.findall(s)))
+
+def _get_member_names(template_defn: ir0.TemplateDefn) -> Iterator[str]:
+    for result_element_name in template_defn.result_element_names:
+        yield result_element_name
+    for specialization in itertools.chain([template_defn.main_definition] if template_defn.main_definition else [],
+                                          template_defn.specializations):
+        for elem in specialization.body:
+            if isinstance(elem, (ir0.ConstantDef, ir0.Typedef)):
+                yield elem.name
+            elif isinstance(elem, ir0.TemplateDefn):
+                yield elem.name
+                for member_name in _get_member_names(elem):
+                    yield member_name
+
+def compute_template_dependency_graph(template_defns: List[ir0.TemplateDefn]):
+    template_names = {template_defn.name for template_defn in template_defns}
+    template_dependency_graph = nx.DiGraph()
+    for template_defn in template_defns:
+        template_dependency_graph.add_node(template_defn.name)
+        for identifier in template_defn.get_referenced_identifiers():
+            if identifier in template_names:
+                template_dependency_graph.add_edge(template_defn.name, identifier)
+    return template_dependency_graph
+
+def _get_module_independent_template_names(template_dependency_graph: nx.DiGraph,
+                                           is_internal_template_name: Callable[[str], bool]) -> Set[str]:
+    # An internal template is module-independent if all the templates that it references (directly or indirectly) are
+    # also internal, so the only templates of the module that it references are module-independent too.
+    module_independent_template_names = set()  # type: Set[str]
+    condensed_graph = nx.condensation(template_dependency_graph)
+    for connected_component_index in nx.topological_sort(condensed_graph, reverse=True):
+        connected_component = condensed_graph.node[connected_component_index]['members']
+        if (all(is_internal_template_name(node) for node in connected_component)
+                and all(node in module_independent_template_names
+                        for successor_index in condensed_graph.successors(connected_component_index)
+                        for node in condensed_graph.node[successor_index]['members'])):
+            module_independent_template_names |= connected_component
+    return module_independent_template_names
+
+def get_module_independent_template_names(header: ir0.Header) -> Set[str]:
+    '''Returns the names of the internal templates that don't reference any user-defined template.
+
+    The header must have been returned by assign_content_derived_internal_identifiers(), that names these templates
+    based only on their structure. So when multiple modules define a template with the same name, the definitions are
+    identical and the template can be defined once for all modules instead.
+    '''
+    return _get_module_independent_template_names(compute_template_dependency_graph(header.template_defns),
+                                                  utils.is_content_derived_identifier)
+
+def assign_content_derived_internal_identifiers(header: ir0.Header) -> ir0.Header:
+    '''Renames the internal identifiers in the header so that they don't depend on the rest of the module.
+
+    The identifiers returned by the identifier_generator depend on how many identifiers were generated before, so
+    changing a function usually changes the internal identifiers (and therefore the generated code) of all the functions
+    after it. Instead, the name of an internal template defined here is derived from the public template (or the
+    toplevel code) that first references it and from its structure (including the templates that it references), while
+    other internal identifiers are numbered within the element that defines them. The name of an internal template that
+    doesn't reference any user-defined template only depends on its structure, so it's the same in all modules.
+    '''
+    ir_string_by_template_name = {template_defn.name: utils.ir_to_string(template_defn)
+                                  for template_defn in header.template_defns}
+    template_index_by_name = {template_defn.name: index
+                              for index, template_defn in enumerate(header.template_defns)}
+
+    template_dependency_graph = compute_template_dependency_graph(header.template_defns)
+    module_independent_template_names = _get_module_independent_template_names(template_dependency_graph,
+                                                                               _is_internal_identifier)
+
+    # A template reachable from multiple public templates is attributed to the first one (in the order in which they
+    # appear in the header). Templates that aren't reachable from any public template are only used in the toplevel code.
+    defining_template_name_by_name = dict()  # type: Dict[str, str]
+    for template_defn in header.template_defns:
+        if _is_internal_identifier(template_defn.name):
+            continue
+        nodes_to_visit = [template_defn.name]
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            if node not in defining_template_name_by_name:
+                defining_template_name_by_name[node] = template_defn.name
+                nodes_to_visit.extend(template_dependency_graph.successors(node))
+
+    new_name_by_name = dict()  # type: Dict[str, str]
+    def replace_known_identifiers(s: str):
+        return _internal_identifier_regex.sub(lambda match: new_name_by_name.get(match.group(0), match.group(0)), s)
+
+    num_occurrences_by_key = defaultdict(lambda: 0)  # type: Dict[Tuple[str, ...], int]
+    def compute_new_name(*key_parts: str):
+        num_occurrences = num_occurrences_by_key[key_parts]
+        num_occurrences_by_key[key_parts] = num_occurrences + 1
+        return utils.content_derived_identifier(*key_parts, str(num_occurrences))
+
+    # We name the templates in dependency order, so that the key of a template can contain the new names of the
+    # templates that it references. Within a strongly connected component we can't do that, so the structure of the
+    # whole component is included in the keys of its templates instead.
+    condensed_graph = nx.condensation(template_dependency_graph)
+    for connected_component_index in nx.topological_sort(condensed_graph, reverse=True):
+        connected_component = condensed_graph.node[connected_component_index]['members']
+        canonical_ir_string_by_template_name = {node: _canonicalize_internal_identifiers(replace_known_identifiers(ir_string_by_template_name[node]),
+                                                                                         dict())
+                                                for node in connected_component}
+        connected_component = sorted(connected_component,
+                                     key=lambda node: (canonical_ir_string_by_template_name[node], template_index_by_name[node]))
+        connected_component_key = '\n'.join(canonical_ir_string_by_template_name[node] for node in connected_component)
+        for node in connected_component:
+            if node in module_independent_template_names:
+                # These don't depend on anything else in the module, so identical templates in different modules get
+                # the same name and can be shared (see get_module_independent_template_names()).
+                new_name_by_name[node] = compute_new_name('template',
+                                                          '<module-independent>',
+                                                          connected_component_key,
+                                                          canonical_ir_string_by_template_name[node])
+            elif _is_internal_identifier(node):
+                new_name_by_name[node] = compute_new_name('template',
+                                                          defining_template_name_by_name.get(node, '<toplevel>'),
+                                                          connected_component_key,
+                                                          canonical_ir_string_by_template_name[node])
+
+    # Members (e.g. result elements) can be accessed from other templates, so they must have the same name everywhere.
+    # Other internal identifiers (i.e. template args) are local to a template, so each template can rename them
+    # independently.
+    template_name_by_member_name = {member_name: template_defn.name
+                                    for template_defn in header.template_defns
+                                    for member_name in _get_member_names(template_defn)}
+    def is_local_to_template(identifier: str, template_name: str):
+        member_template_name = template_name_by_member_name.get(identifier, template_name)
+        # A module-independent template can't reference members of the other templates, so this must be a template
+        # arg that happens to have the same name as a member of another template.
+        return (member_template_name == template_name
+                or (template_name in module_independent_template_names
+                    and member_template_name not in module_independent_template_names))
+    local_new_name_by_name_by_template_name = dict()  # type: Dict[str, Dict[str, str]]
+    for template_defn in header.template_defns:
+        local_identifier_generator = utils.content_derived_identifier_generator('local',
+                                                                                new_name_by_name.get(template_defn.name,
+                                                                                                     template_defn.name))
+        local_new_name_by_name_by_template_name[template_defn.name] = {
+            identifier: next(local_identifier_generator)
+            for identifier in _get_internal_identifiers_in_order(ir_string_by_template_name[template_defn.name])
+            if (identifier not in new_name_by_name
+                and is_local_to_template(identifier, template_defn.name))}
+    for member_name, template_name in template_name_by_member_name.items():
+        if _is_internal_identifier(member_name):
+            new_name_by_name[member_name] = local_new_name_by_name_by_template_name[template_name][member_name]
+
+    template_defns = [_rename_internal_identifiers(template_defn,
+                                                   {**new_name_by_name,
+                                                    **local_new_name_by_name_by_template_name[template_defn.name]})
+                      for template_defn in header.template_defns]
+
+    for elem in header.toplevel_content:
+        elem_ir_string = utils.ir_to_string(elem)
+        local_identifier_generator = utils.content_derived_identifier_generator(
+            compute_new_name('toplevel', _canonicalize_internal_identifiers(replace_known_identifiers(elem_ir_string), dict())))
+        for identifier in _get_internal_identifiers_in_order(elem_ir_string):
+            if identifier not in new_name_by_name:
+                new_name_by_name[identifier] = next(local_identifier_generator)
+
+    writer = transform_ir0.ToplevelWriter(identifier_generator=iter([]), allow_template_defns=False)
+    transformation = _InternalIdentifiersRenamingTransformation(new_name_by_name)
+    for elem in header.toplevel_content:
+        transformation.transform_toplevel_elem(elem, writer)
+
+    return ir0.Header(template_defns=template_defns,
+                      toplevel_content=writer.toplevel_elems,
+                      public_names=header.public_names)
+
+def optimize_header_first_pass(header: ir0.Header,
+                               identifier_generator: Iterator[str],
+                               verbose: bool,
+                               cache: Optional[CompilationCache],
+                               stats: Optional[CompilationStats],
+                               verbose_templates: Optional[List[str]],
+                               options: OptimizationOptions,
+                               status: Optional[OptimizationStatus] = None):
     new_template_defns = {elem.name: elem
                           for elem in header.template_defns}
 
@@ -733,9 +1395,10 @@ def optimize_header_first_pass(header: ir0.Header, identifier_generator: Iterato
 
     condensed_graph = nx.condensation(template_dependency_graph)
     assert isinstance(condensed_graph, nx.DiGraph)
-
-    template_dependency_graph_transitive_closure = nx.transitive_closure(template_dependency_graph)
-    assert isinstance(template_dependency_graph_transitive_closure, nx.DiGraph)
+    # For a direct dependency A->B, there's a path B->...->A iff A and B are in the same strongly connected component.
+    # This also holds for A->A, so (as when this used a transitive closure, that contains the self-loop A->A too) a
+    # recursive template is never inlined into itself, and mutually-recursive templates aren't inlined into each other.
+    connected_component_index_by_template_name = condensed_graph.graph['mapping']
 
     for connected_component_index in nx.topological_sort(condensed_graph, reverse=True):
         connected_component = condensed_graph.node[connected_component_index]['members']
@@ -744,21 +1407,66 @@ def optimize_header_first_pass(header: ir0.Header, identifier_generator: Iterato
 
             inlineable_refs = {other_node
                                for other_node in template_dependency_graph.successors(node)
-                               if not template_dependency_graph_transitive_closure.has_edge(other_node, node)
+                               if connected_component_index_by_template_name[other_node] != connected_component_index_by_template_name[node]
                                and not new_template_defns[other_node].specializations}
-            if inlineable_refs:
-                template_defn = perform_template_inlining(template_defn,
-                                                          inlineable_refs,
-                                                          new_template_defns,
-                                                          identifier_generator,
-                                                          verbose=verbose)
 
-            template_defn = perform_local_optimizations_on_template_defn(template_defn,
-                                                                         identifier_generator,
-                                                                         inline_template_instantiations_with_multiple_references=False,
-                                                                         verbose=verbose)
+            if cache:
+                cache_key, canonical_name_by_name = _compute_optimized_template_cache_key(template_defn,
+                                                                                          inlineable_refs,
+                                                                                          new_template_defns,
+                                                                                          cache,
+                                                                                          options)
+                cached_template_defn = _get_optimized_template_from_cache(cache,
+                                                                          cache_key,
+                                                                          canonical_name_by_name,
+                                                                          identifier_generator)
+                if cached_template_defn is not None:
+                    # The source location is not part of the key, the cached template might come from a different line.
+                    cached_template_defn.source_location = template_defn.source_location
+                    new_template_defns[node] = cached_template_defn
+                    continue
+
+            budget = _OptimizationBudget(options)
+            if inlineable_refs:
+                inlined_template_defn = perform_template_inlining(template_defn,
+                                                                  inlineable_refs,
+                                                                  new_template_defns,
+                                                                  identifier_generator,
+                                                                  verbose=verbose,
+                                                                  stats=stats,
+                                                                  verbose_templates=verbose_templates)
+                if budget.allows_result(template_defn, inlined_template_defn):
+                    template_defn = inlined_template_defn
+
+            if options.partial_evaluation_step_budget:
+                evaluated_template_defn = perform_partial_evaluation(template_defn,
+                                                                     new_template_defns,
+                                                                     identifier_generator,
+                                                                     options,
+                                                                     verbose=verbose,
+                                                                     stats=stats,
+                                                                     verbose_templates=verbose_templates)
+                if budget.allows_result(template_defn, evaluated_template_defn):
+                    template_defn = evaluated_template_defn
+
+            template_defn = _optimize_until_fixpoint(
+                template_defn,
+                lambda template_defn: perform_local_optimizations_on_template_defn(template_defn,
+                                                                                   identifier_generator,
+                                                                                   inline_template_instantiations_with_multiple_references=False,
+                                                                                   verbose=verbose,
+                                                                                   stats=stats,
+                                                                                   verbose_templates=verbose_templates),
+                options,
+                budget)
             new_template_defns[node] = template_defn
 
+            if status and budget.exceeded_deadline:
+                status.exceeded_deadline = True
+            # When the deadline is exceeded the result depends on the machine's speed, so we don't cache it.
+            if cache and not budget.exceeded_deadline:
+                _put_optimized_template_in_cache(cache, cache_key, canonical_name_by_name, template_defn)
+
     new_toplevel_content = header.toplevel_content
     inlineable_refs = {template_name
                        for template_name in new_template_defns.keys()
@@ -769,12 +1477,17 @@ def optimize_header_first_pass(header: ir0.Header, identifier_generator: Iterato
                        # TemplateDefn elements don't depend on toplevel_content elements.
                        and not any(isinstance(elem, ir0.TemplateDefn)
                                    for elem in new_template_defns[template_name].main_definition.body)}
+    budget = _OptimizationBudget(options)
     if inlineable_refs:
       elems = perform_template_inlining_on_toplevel_elems(new_toplevel_content,
                                                           inlineable_refs,
                                                           new_template_defns,
                                                           identifier_generator,
-                                                          verbose=verbose)
+                                                          verbose=verbose,
+                                                          stats=stats,
+                                                          verbose_templates=verbose_templates)
+      if not budget.allows_result(new_toplevel_content, elems):
+        elems = new_toplevel_content
       additional_toplevel_template_defns = [elem
                                             for elem in elems
                                             if isinstance(elem, ir0.TemplateDefn)]
@@ -784,10 +1497,32 @@ def optimize_header_first_pass(header: ir0.Header, identifier_generator: Iterato
     else:
       additional_toplevel_template_defns = []
 
-    new_toplevel_content = perform_local_optimizations_on_toplevel_elems(new_toplevel_content,
-                                                                         identifier_generator,
-                                                                         inline_template_instantiations_with_multiple_references=False,
-                                                                         verbose=verbose)
+    if options.partial_evaluation_step_budget:
+      template_defn_by_name = dict(new_template_defns)
+      template_defn_by_name.update((template_defn.name, template_defn)
+                                   for template_defn in additional_toplevel_template_defns)
+      elems = perform_partial_evaluation_on_toplevel_elems(new_toplevel_content,
+                                                           template_defn_by_name,
+                                                           identifier_generator,
+                                                           options,
+                                                           verbose=verbose,
+                                                           stats=stats,
+                                                           verbose_templates=verbose_templates)
+      if budget.allows_result(new_toplevel_content, elems):
+        new_toplevel_content = elems
+
+    new_toplevel_content = _optimize_until_fixpoint(
+        new_toplevel_content,
+        lambda toplevel_elems: perform_local_optimizations_on_toplevel_elems(toplevel_elems,
+                                                                             identifier_generator,
+                                                                             inline_template_instantiations_with_multiple_references=False,
+                                                                             verbose=verbose,
+                                                                             stats=stats,
+                                                                             verbose_templates=verbose_templates),
+        options,
+        budget)
+    if status and budget.exceeded_deadline:
+        status.exceeded_deadline = True
 
     return ir0.Header(template_defns=[new_template_defns[template_defn.name]
                                       for template_defn in header.template_defns] + additional_toplevel_template_defns,
@@ -816,7 +1551,7 @@ def optimize_header_second_pass(header: ir0.Header):
       if identifier in template_defns_by_name.keys():
         template_dependency_graph.add_edge(elem_name, identifier)
 
-  used_templates = nx.single_source_shortest_path(template_dependency_graph, source='').keys()
+  used_templates = set(nx.dfs_preorder_nodes(template_dependency_graph, source=''))
 
   return ir0.Header(template_defns=[template_defn
                                     for template_defn in header.template_defns
@@ -824,7 +1559,20 @@ def optimize_header_second_pass(header: ir0.Header):
                     toplevel_content=header.toplevel_content,
                     public_names=header.public_names)
 
-def optimize_header(header: ir0.Header, identifier_generator: Iterator[str], verbose: bool = False):
-    header = optimize_header_first_pass(header, identifier_generator, verbose)
-    header = optimize_header_second_pass(header)
+def optimize_header(header: ir0.Header,
+                    identifier_generator: Iterator[str],
+                    verbose: bool = False,
+                    cache: Optional[CompilationCache] = None,
+                    stats: Optional[CompilationStats] = None,
+                    verbose_templates: Optional[List[str]] = None,
+                    options: Optional[OptimizationOptions] = None,
+                    status: Optional[OptimizationStatus] = None):
+    if options is None:
+        options = OptimizationOptions()
+    if options.level == 0:
+        return header
+    header = optimize_header_first_pass(header, identifier_generator, verbose, cache, stats, verbose_templates, options,
+                                        status)
+    header = profiling.run_optimization(stats, 'optimize_header_second_pass()', header,
+                                        lambda: optimize_header_second_pass(header))
     return header
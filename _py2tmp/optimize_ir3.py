@@ -20,10 +20,13 @@ from typing import List, Tuple, Union, Dict, Set, Iterator, Callable
 class GetReferencedGlobalFunctionNamesTransformation(transform_ir3.Transformation):
     def __init__(self):
         self.referenced_global_function_names = set()
+        self.referenced_global_function_names_that_may_throw = set()
 
     def transform_var_reference(self, expr: ir3.VarReference):
         if expr.is_global_function:
           self.referenced_global_function_names.add(expr.name)
+          if expr.is_function_that_may_throw:
+            self.referenced_global_function_names_that_may_throw.add(expr.name)
         return expr
 
 def get_referenced_global_function_names(function_defn: ir3.FunctionDefn):
@@ -31,6 +34,11 @@ def get_referenced_global_function_names(function_defn: ir3.FunctionDefn):
     transformation.transform_function_defn(function_defn)
     return transformation.referenced_global_function_names
 
+def get_referenced_global_function_names_that_may_throw(function_defn: ir3.FunctionDefn):
+    transformation = GetReferencedGlobalFunctionNamesTransformation()
+    transformation.transform_function_defn(function_defn)
+    return transformation.referenced_global_function_names_that_may_throw
+
 class FunctionContainsRaiseStmt(transform_ir3.Transformation):
     def __init__(self):
         self.found_raise_stmt = False
@@ -50,7 +58,9 @@ class ApplyFunctionCanThrowInfo(transform_ir3.Transformation):
 
     def transform_var_reference(self, var: ir3.VarReference):
         is_function_that_may_throw = var.is_function_that_may_throw
-        if is_function_that_may_throw and var.is_global_function and not self.function_can_throw[var.name]:
+        # Functions defined in other modules aren't in function_can_throw, but their references already have the
+        # right value.
+        if is_function_that_may_throw and var.is_global_function and not self.function_can_throw.get(var.name, True):
           is_function_that_may_throw = False
         return ir3.VarReference(type=var.type,
                                 name=var.name,
@@ -70,9 +80,10 @@ class ApplyFunctionCanThrowInfo(transform_ir3.Transformation):
 def apply_function_can_throw_info(module: ir3.Module, function_can_throw: Dict[str, bool]):
     return ApplyFunctionCanThrowInfo(function_can_throw).transform_module(module)
 
-def recalculate_function_can_throw_info(module: ir3.Module):
+def compute_function_can_throw_info(module: ir3.Module) -> Dict[str, bool]:
+  '''Returns whether each function defined in the module can throw an exception.'''
   if not module.function_defns:
-    return module
+    return dict()
 
   function_dependency_graph = nx.DiGraph()
 
@@ -89,9 +100,6 @@ def recalculate_function_can_throw_info(module: ir3.Module):
   condensed_graph = nx.condensation(function_dependency_graph)
   assert isinstance(condensed_graph, nx.DiGraph)
 
-  function_dependency_graph_transitive_closure = nx.transitive_closure(function_dependency_graph)
-  assert isinstance(function_dependency_graph_transitive_closure, nx.DiGraph)
-
   # Determine which connected components can throw.
   condensed_node_can_throw = defaultdict(lambda: False)
   for connected_component_index in nx.topological_sort(condensed_graph, reverse=True):
@@ -102,6 +110,11 @@ def recalculate_function_can_throw_info(module: ir3.Module):
       if function_contains_raise_stmt(function_defn_by_name[function_name]):
         condensed_node_can_throw[connected_component_index] = True
 
+      # Functions imported from other modules aren't in the graph, so we check them here.
+      for global_function_name in get_referenced_global_function_names_that_may_throw(function_defn_by_name[function_name]):
+        if global_function_name not in function_defn_by_name.keys():
+          condensed_node_can_throw[connected_component_index] = True
+
     # If a function in this connected component calls a function in a connected component that can throw, this
     # connected component can also throw.
     for called_condensed_node_index in condensed_graph.successors(connected_component_index):
@@ -113,7 +126,13 @@ def recalculate_function_can_throw_info(module: ir3.Module):
     for function_name in condensed_graph.node[connected_component_index]['members']:
       function_can_throw[function_name] = condensed_node_can_throw[connected_component_index]
 
-  return apply_function_can_throw_info(module, function_can_throw)
+  return function_can_throw
+
+def recalculate_function_can_throw_info(module: ir3.Module):
+  if not module.function_defns:
+    return module
+
+  return apply_function_can_throw_info(module, compute_function_can_throw_info(module))
 
 def optimize_module(module: ir3.Module):
     module = recalculate_function_can_throw_info(module)
@@ -0,0 +1,156 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import tracemalloc
+from enum import Enum
+from typing import Callable, TypeVar, Optional, Dict, List, Any, Tuple
+
+from _py2tmp import ir0, utils
+
+T = TypeVar('T')
+
+class PassStats:
+    '''Statistics for a pipeline stage or an optimization pass.
+
+    Optimization passes run once per template, so these statistics are aggregated over all the runs: times and node
+    counts are summed, while the peak memory is the maximum over all runs.
+    '''
+    def __init__(self, name: str):
+        self.name = name
+        self.num_runs = 0
+        self.wall_time_seconds = 0.0
+        # The peak memory allocated during the pass, on top of the memory already allocated when the pass started.
+        # This is None if memory usage was not tracked.
+        self.peak_memory_bytes = None  # type: Optional[int]
+        self.num_nodes_before = 0
+        self.num_nodes_after = 0
+        self.num_templates_before = 0
+        self.num_templates_after = 0
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+class CompilationStats:
+    '''Collects PassStats for the pipeline stages of convert_to_cpp() and for the optimizations in optimize_ir0.
+
+    Peak memory is measured using tracemalloc, which slows down the conversion; pass track_memory=False to only collect
+    times and IR sizes. If tracemalloc is not already running, it's started at the beginning of each stage and stopped
+    at the end of it. Note that the peaks of nested passes require Python 3.9+ (tracemalloc.reset_peak()); with older
+    versions each nested pass reports the peak since the start of the enclosing stage.
+    '''
+    def __init__(self, track_memory: bool = True):
+        self.track_memory = track_memory
+        self.stages = []  # type: List[PassStats]
+        self.optimizations = dict()  # type: Dict[str, PassStats]
+        # The peaks observed so far by the passes currently running (outermost first), excluding the nested pass
+        # currently running (if any).
+        self._running_pass_peaks = []  # type: List[int]
+
+    def run_stage(self, name: str, ir_before: Any, compute: Callable[[], T]) -> T:
+        pass_stats = PassStats(name)
+        self.stages.append(pass_stats)
+        return self._run(pass_stats, ir_before, compute)
+
+    def run_optimization(self, name: str, ir_before: Any, compute: Callable[[], T]) -> T:
+        pass_stats = self.optimizations.get(name)
+        if pass_stats is None:
+            pass_stats = PassStats(name)
+            self.optimizations[name] = pass_stats
+        return self._run(pass_stats, ir_before, compute)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'stages': [pass_stats.to_json() for pass_stats in self.stages],
+            'optimizations': [pass_stats.to_json()
+                              for pass_stats in sorted(self.optimizations.values(),
+                                                       key=lambda pass_stats: pass_stats.wall_time_seconds,
+                                                       reverse=True)],
+        }
+
+    def _run(self, pass_stats: PassStats, ir_before: Any, compute: Callable[[], T]) -> T:
+        num_nodes_before, num_templates_before = count_ir_nodes(ir_before)
+
+        started_tracing = False
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            current_memory, peak_memory = tracemalloc.get_traced_memory()
+            if self._running_pass_peaks:
+                # The peak for the enclosing pass would be lost by the reset below, so we save it.
+                self._running_pass_peaks[-1] = max(self._running_pass_peaks[-1], peak_memory)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._running_pass_peaks.append(current_memory)
+
+        start_time = time.perf_counter()
+        try:
+            result = compute()
+        finally:
+            wall_time_seconds = time.perf_counter() - start_time
+            if self.track_memory:
+                _, peak_memory = tracemalloc.get_traced_memory()
+                peak_memory = max(peak_memory, self._running_pass_peaks.pop())
+                if self._running_pass_peaks:
+                    self._running_pass_peaks[-1] = max(self._running_pass_peaks[-1], peak_memory)
+                if started_tracing:
+                    tracemalloc.stop()
+            else:
+                peak_memory = None
+
+        num_nodes_after, num_templates_after = count_ir_nodes(result)
+
+        pass_stats.num_runs += 1
+        pass_stats.wall_time_seconds += wall_time_seconds
+        if peak_memory is not None:
+            peak_memory_bytes = peak_memory - current_memory
+            if pass_stats.peak_memory_bytes is None or peak_memory_bytes > pass_stats.peak_memory_bytes:
+                pass_stats.peak_memory_bytes = peak_memory_bytes
+        pass_stats.num_nodes_before += num_nodes_before
+        pass_stats.num_nodes_after += num_nodes_after
+        pass_stats.num_templates_before += num_templates_before
+        pass_stats.num_templates_after += num_templates_after
+
+        return result
+
+def run_stage(stats: Optional[CompilationStats], name: str, ir_before: Any, compute: Callable[[], T]) -> T:
+    if stats is None:
+        return compute()
+    return stats.run_stage(name, ir_before, compute)
+
+def run_optimization(stats: Optional[CompilationStats], name: str, ir_before: Any, compute: Callable[[], T]) -> T:
+    if stats is None:
+        return compute()
+    return stats.run_optimization(name, ir_before, compute)
+
+def count_ir_nodes(ir_elem: Any) -> Tuple[int, int]:
+    '''Returns the number of nodes in the given IR (of any kind) and the number of ir0.TemplateDefn nodes among those.'''
+    num_nodes = 0
+    num_templates = 0
+    elems_to_visit = [ir_elem]
+    while elems_to_visit:
+        elem = elems_to_visit.pop()
+        if elem is None or isinstance(elem, (str, bool, int, float, Enum)):
+            pass
+        elif isinstance(elem, (list, tuple, set, frozenset)):
+            elems_to_visit.extend(elem)
+        elif isinstance(elem, dict):
+            elems_to_visit.extend(elem.values())
+        else:
+            num_nodes += 1
+            if isinstance(elem, ir0.TemplateDefn):
+                num_templates += 1
+            elems_to_visit.extend(value for _, value in utils.iter_fields(elem))
+    return num_nodes, num_templates
@@ -0,0 +1,107 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''A long-running compilation server (started with "py2tmp --serve SOCKET_PATH").
+
+Converting a small module takes a few milliseconds, much less than starting Python and importing the compiler, so
+build systems that invoke py2tmp once per module can instead start the server once and then use the (stdlib-only)
+client in client.py. The server also keeps its in-process state (e.g. the loaded modules and the CompilationCache, if
+any) across requests.
+
+Requests are handled one at a time. See client.py for the protocol.
+'''
+
+import json
+import os
+import socket
+import socketserver
+import traceback
+from typing import Callable, List, Dict, Any
+
+import _py2tmp
+from _py2tmp import client
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            request = client.receive_message(self.request)
+        except (client.ServerError, ValueError) as e:
+            client.send_message(self.request, {'error': 'Malformed request: %s' % e})
+            return
+        if request is None:
+            return
+        try:
+            response = self.server.handle_request_message(request)
+        except Exception:
+            response = {'error': traceback.format_exc()}
+        client.send_message(self.request, response)
+
+class CompilationServer(socketserver.UnixStreamServer):
+    '''Serves compile requests on a Unix socket.
+
+    compile_files(source_file_names, format) must return a list of BatchCompilationResult, one per source file.
+    '''
+    def __init__(self, socket_path: str, compile_files: Callable[[List[str], str], List[Any]]):
+        self.socket_path = socket_path
+        self.compile_files = compile_files
+        self.shutdown_requested = False
+        _remove_stale_socket(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+
+    def serve_until_shutdown(self):
+        try:
+            while not self.shutdown_requested:
+                self.handle_request()
+        finally:
+            self.server_close()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+    def handle_request_message(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        command = request.get('command')
+        if command == 'ping':
+            return {'version': _py2tmp.__version__}
+        elif command == 'shutdown':
+            self.shutdown_requested = True
+            return {}
+        elif command == 'compile':
+            results = self.compile_files(request['sources'], request.get('format', 'native'))
+            return {'results': [{'source_file_name': result.source_file_name,
+                                 'output_file_name': result.output_file_name if result.cpp_source is not None else None,
+                                 'cpp_source': result.cpp_source,
+                                 'additional_cpp_sources': result.additional_cpp_sources,
+                                 'error': result.error}
+                                for result in results]}
+        else:
+            return {'error': 'Unknown command: %s' % json.dumps(command)}
+
+def _remove_stale_socket(socket_path: str):
+    if not os.path.exists(socket_path):
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except ConnectionRefusedError:
+        # Left over by a server that didn't exit cleanly.
+        os.unlink(socket_path)
+        return
+    finally:
+        sock.close()
+    raise Exception('A py2tmp server is already listening on %s' % socket_path)
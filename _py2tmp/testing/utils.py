@@ -23,7 +23,13 @@ import re
 import sys
 import itertools
 import subprocess
+import concurrent.futures
+import hashlib
+import shutil
+import threading
+from collections import defaultdict
 from functools import wraps
+from typing import List, Optional, Tuple, Dict
 import difflib
 
 import pytest
@@ -38,9 +44,13 @@ from _py2tmp import (
     optimize_ir3,
     optimize_ir0,
     ir0_to_cpp,
+    interpret_ir3,
     ir0,
+    ir1,
+    ir2,
     utils,
 )
+from _py2tmp.compilation_cache import CompilationCache
 
 def pretty_print_command(command):
     return ' '.join('"' + x + '"' for x in command)
@@ -107,6 +117,11 @@ class PosixCompiler:
     def __init__(self):
         self.executable = config.CXX
         self.name = config.CXX_COMPILER_NAME
+        self.flags = ['-W', '-Wall', '-g0', '-Werror', '-std=c++11']
+
+    def get_version(self):
+        stdout, _ = run_command(self.executable, ['--version'])
+        return stdout
 
     def compile_discarding_output(self, source, include_dirs, args=[]):
         try:
@@ -115,6 +130,12 @@ class PosixCompiler:
         except CommandFailedException as e:
             raise CompilationFailedException(e.command, e.stderr)
 
+    def check_syntax(self, source, include_dirs, args=[]):
+        try:
+            self._compile(include_dirs, args=args + ['-fsyntax-only', source])
+        except CommandFailedException as e:
+            raise CompilationFailedException(e.command, e.stderr)
+
     def compile_and_link(self, source, include_dirs, output_file_name, args=[]):
         self._compile(
             include_dirs,
@@ -127,7 +148,7 @@ class PosixCompiler:
     def _compile(self, include_dirs, args):
         include_flags = ['-I%s' % include_dir for include_dir in include_dirs]
         args = (
-            ['-W', '-Wall', '-g0', '-Werror', '-std=c++11']
+            self.flags
             + include_flags
             + args
         )
@@ -137,6 +158,13 @@ class MsvcCompiler:
     def __init__(self):
         self.executable = config.CXX
         self.name = config.CXX_COMPILER_NAME
+        self.flags = ['/nologo', '/FS', '/W4', '/D_SCL_SECURE_NO_WARNINGS', '/WX']
+
+    def get_version(self):
+        # MSVC has no --version flag, it prints the version (on stderr) when invoked without arguments.
+        p = subprocess.Popen([self.executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        _, stderr = p.communicate()
+        return stderr
 
     def compile_discarding_output(self, source, include_dirs, args=[]):
         try:
@@ -146,6 +174,12 @@ class MsvcCompiler:
             # Note that we use stdout here, unlike above. MSVC reports compilation warnings and errors on stdout.
             raise CompilationFailedException(e.command, e.stdout)
 
+    def check_syntax(self, source, include_dirs, args=[]):
+        try:
+            self._compile(include_dirs, args=args + ['/Zs', source])
+        except CommandFailedException as e:
+            raise CompilationFailedException(e.command, e.stdout)
+
     def compile_and_link(self, source, include_dirs, output_file_name, args=[]):
         self._compile(
             include_dirs,
@@ -158,7 +192,7 @@ class MsvcCompiler:
     def _compile(self, include_dirs, args):
         include_flags = ['-I%s' % include_dir for include_dir in include_dirs]
         args = (
-            ['/nologo', '/FS', '/W4', '/D_SCL_SECURE_NO_WARNINGS', '/WX']
+            self.flags
             + include_flags
             + args
         )
@@ -195,14 +229,94 @@ def try_remove_temporary_file(filename):
         # This shouldn't cause the tests to fail, so we ignore the exception and go ahead.
         pass
 
-def expect_cpp_code_compile_error_helper(check_error_fun, tmppy_source, module_ir2, module_ir1, cxx_source):
+# If PY2TMP_TEST_CACHE_DIR is set, the results of the compiler invocations (including the error messages) are cached
+# in that directory, so that when rerunning the tests only the C++ code that changed is compiled again.
+_CACHE_DIR = os.environ.get('PY2TMP_TEST_CACHE_DIR')
+_cache = CompilationCache(_CACHE_DIR) if _CACHE_DIR else None
+# The compiler invocations might run in parallel, see _check_snippets().
+_cache_lock = threading.Lock()
+_compiler_info = None
+
+def _get_compiler_info():
+    global _compiler_info
+    if _compiler_info is None:
+        # The generated code includes the TMPPy headers, so they affect the results too.
+        headers_hasher = hashlib.sha256()
+        for dir_path, dir_names, file_names in os.walk(config.MPYL_INCLUDE_DIR):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                path = os.path.join(dir_path, file_name)
+                headers_hasher.update(os.path.relpath(path, config.MPYL_INCLUDE_DIR).encode('utf-8'))
+                with open(path, 'rb') as f:
+                    headers_hasher.update(f.read())
+        _compiler_info = {
+            'executable': shutil.which(compiler.executable) or compiler.executable,
+            'version': compiler.get_version(),
+            'flags': compiler.flags,
+            'headers_digest': headers_hasher.hexdigest(),
+        }
+    return _compiler_info
+
+def _compute_cache_key(kind: str, cxx_source: str):
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps({'kind': kind, 'compiler': _get_compiler_info()}, sort_keys=True).encode('utf-8'))
+    hasher.update(b'\0')
+    hasher.update(cxx_source.encode('utf-8'))
+    return hasher.hexdigest()
+
+def _compile_with_cache(kind: str, cxx_source: str, compile_fun) -> Optional[CompilationFailedException]:
+    '''Returns compile_fun(cxx_source) (the compilation error, if any), using the cached result if available.'''
+    if _cache is None:
+        return compile_fun(cxx_source)
+    key = _compute_cache_key(kind, cxx_source)
+    cached_result = _cache.get(key)
+    if cached_result is not None:
+        result = json.loads(cached_result)
+        if result is None:
+            return None
+        return CompilationFailedException(result['command'], result['error_message'])
+
+    e = compile_fun(cxx_source)
+    result = None if e is None else {'command': e.command, 'error_message': e.error_message}
+    with _cache_lock:
+        _cache.put(key, json.dumps(result))
+    return e
+
+def _compile_discarding_output(cxx_source) -> Optional[CompilationFailedException]:
     source_file_name = _create_temporary_file(cxx_source, file_name_suffix='.cpp')
-
     try:
         compiler.compile_discarding_output(
             source=source_file_name,
             include_dirs=[config.MPYL_INCLUDE_DIR],
             args=[])
+    except CompilationFailedException as e:
+        return e
+    finally:
+        try_remove_temporary_file(source_file_name)
+    return None
+
+def _check_syntax(cxx_source) -> Optional[CompilationFailedException]:
+    source_file_name = _create_temporary_file(cxx_source, file_name_suffix='.cpp')
+    try:
+        compiler.check_syntax(source=source_file_name, include_dirs=[config.MPYL_INCLUDE_DIR])
+    except CompilationFailedException as e:
+        return e
+    finally:
+        try_remove_temporary_file(source_file_name)
+    return None
+
+def _compile_expecting_error(cxx_source) -> Optional[CompilationFailedException]:
+    return _compile_with_cache('compile', cxx_source, _compile_discarding_output)
+
+def expect_cpp_code_compile_error_helper(check_error_fun, tmppy_source, module_ir2, module_ir1, cxx_source,
+                                         snippet: Optional['_Snippet'] = None):
+    if snippet is not None and snippet.checked:
+        # The code was already compiled in a worker, see _check_snippets().
+        e = snippet.compilation_error
+    else:
+        e = _compile_expecting_error(cxx_source)
+
+    if e is None:
         pytest.fail(textwrap.dedent('''\
             The test should have failed to compile, but it compiled successfully.
             
@@ -222,8 +336,6 @@ def expect_cpp_code_compile_error_helper(check_error_fun, tmppy_source, module_i
                         tmppy_ir1=str(module_ir1),
                         cxx_source = add_line_numbers(cxx_source)),
             pytrace=False)
-    except CompilationFailedException as e1:
-        e = e1
 
     error_message = e.error_message
     error_message_lines = error_message.splitlines()
@@ -235,15 +347,15 @@ def expect_cpp_code_compile_error_helper(check_error_fun, tmppy_source, module_i
 
     check_error_fun(e, error_message_lines, error_message_head, normalized_error_message_lines)
 
-    try_remove_temporary_file(source_file_name)
-
-def expect_cpp_code_generic_compile_error(expected_error_regex, tmppy_source, module_ir2, module_ir1, cxx_source):
+def expect_cpp_code_generic_compile_error(expected_error_regex, tmppy_source, module_ir2, module_ir1, cxx_source,
+                                          snippet: Optional['_Snippet'] = None):
     """
     Tests that the given source produces the expected error during compilation.
 
     :param expected_error_regex: A regex used to match the _py2tmp error type,
            e.g. 'NoBindingFoundForAbstractClassError<ScalerImpl>'.
     :param cxx_source: The second part of the source code. This will be dedented.
+    :param snippet: If specified and already checked, its compilation result is used instead of compiling again.
     """
 
     expected_error_regex = expected_error_regex.replace(' ', '')
@@ -279,7 +391,7 @@ def expect_cpp_code_generic_compile_error(expected_error_regex, tmppy_source, mo
                             error_message = error_message_head),
             pytrace=False)
 
-    expect_cpp_code_compile_error_helper(check_error, tmppy_source, module_ir2, module_ir1, cxx_source)
+    expect_cpp_code_compile_error_helper(check_error, tmppy_source, module_ir2, module_ir1, cxx_source, snippet)
 
 
 def expect_cpp_code_compile_error(
@@ -288,7 +400,8 @@ def expect_cpp_code_compile_error(
         tmppy_source,
         module_ir2,
         module_ir1,
-        cxx_source):
+        cxx_source,
+        snippet: Optional['_Snippet'] = None):
     """
     Tests that the given source produces the expected error during compilation.
 
@@ -298,6 +411,7 @@ def expect_cpp_code_compile_error(
            e.g. 'No explicit binding was found for C, and C is an abstract class'.
     :param source_code: The C++ source code. This will be dedented.
     :param ignore_deprecation_warnings: A boolean. If True, deprecation warnings will be ignored.
+    :param snippet: If specified and already checked, its compilation result is used instead of compiling again.
     """
     if '\n' in expected_py2tmp_error_regex:
         raise Exception('expected_py2tmp_error_regex should not contain newlines')
@@ -516,7 +630,7 @@ def expect_cpp_code_compile_error(
                     'The compilation failed with the expected message, but the error message contained some metaprogramming types in the output (besides Error). Error message:\n%s' + error_message_head,
                     pytrace=False)
 
-    expect_cpp_code_compile_error_helper(check_error, tmppy_source, module_ir2, module_ir1, cxx_source)
+    expect_cpp_code_compile_error_helper(check_error, tmppy_source, module_ir2, module_ir1, cxx_source, snippet)
 
 def expect_cpp_code_success(tmppy_source, module_ir2, module_ir1, cxx_source):
     """
@@ -531,6 +645,11 @@ def expect_cpp_code_success(tmppy_source, module_ir2, module_ir1, cxx_source):
             }
             ''')
 
+    # Only successful runs are cached: on failure the code is always compiled and run again, to report the error.
+    cache_key = _compute_cache_key('compile_and_run', cxx_source) if _cache is not None else None
+    if cache_key is not None and _cache.get(cache_key) is not None:
+        return
+
     source_file_name = _create_temporary_file(cxx_source, file_name_suffix='.cpp')
     executable_suffix = {'posix': '', 'nt': '.exe'}[os.name]
     output_file_name = _create_temporary_file('', executable_suffix)
@@ -595,6 +714,10 @@ def expect_cpp_code_success(tmppy_source, module_ir2, module_ir1, cxx_source):
                             error_message = _cap_to_lines(e.stderr, 40)),
             pytrace=False)
 
+    if cache_key is not None:
+        with _cache_lock:
+            _cache.put(cache_key, json.dumps(None))
+
     # Note that we don't delete the temporary files if the test failed. This is intentional, keeping them around helps debugging the failure.
     try_remove_temporary_file(source_file_name)
     try_remove_temporary_file(output_file_name)
@@ -620,15 +743,23 @@ def create_identifier_generator():
             yield 'TmppyInternal_%s' % i
     return iter(identifier_generator_fun())
 
-def _convert_tmppy_source_to_ir(python_source, identifier_generator):
+def _convert_tmppy_source_to_ir3(python_source):
     filename='<unknown>'
     source_ast = ast.parse(python_source, filename)
     module_ir3 = ast_to_ir3.module_ast_to_ir3(source_ast, filename, python_source.splitlines())
-    module_ir3 = optimize_ir3.optimize_module(module_ir3)
+    return optimize_ir3.optimize_module(module_ir3)
+
+def _convert_tmppy_source_to_ir(python_source, identifier_generator):
+    module_ir3 = _convert_tmppy_source_to_ir3(python_source)
     module_ir2 = ir3_to_ir2.module_to_ir2(module_ir3, identifier_generator)
     module_ir1 = ir2_to_ir1.module_to_ir1(module_ir2)
     return module_ir2, module_ir1
 
+# The partial evaluation (see evaluate_ir0) would evaluate most toplevel assertions at conversion time, so they would
+# never reach the C++ compiler and the tests would check the evaluator instead of the generated code. It's tested
+# against the C++ compiler in test_partial_evaluation.py.
+_OPTIMIZATION_OPTIONS = optimize_ir0.OptimizationOptions(partial_evaluation_step_budget=0)
+
 def _convert_to_cpp_expecting_success(tmppy_source):
     identifier_generator = create_identifier_generator()
     try:
@@ -651,7 +782,8 @@ def _convert_to_cpp_expecting_success(tmppy_source):
 
     try:
         header = ir1_to_ir0.module_to_ir0(module_ir1, identifier_generator)
-        header = optimize_ir0.optimize_header(header, identifier_generator, verbose=False)
+        header = optimize_ir0.optimize_header(header, identifier_generator, verbose=False,
+                                              options=_OPTIMIZATION_OPTIONS)
         cpp_source = ir0_to_cpp.header_to_cpp(header, identifier_generator)
         cpp_source = utils.clang_format(cpp_source)
 
@@ -679,12 +811,181 @@ def _convert_to_cpp_expecting_success(tmppy_source):
                             error_message=e.args[0]),
             pytrace=False)
 
+# In batch mode (if PY2TMP_TEST_BATCH_SIZE is set), the C++ code of the tests in a test module is compiled when the
+# first of those tests runs, with up to PY2TMP_TEST_JOBS (by default, the number of CPUs) compiler invocations in
+# parallel. The code of the tests that are expected to compile successfully is grouped into translation units of up to
+# PY2TMP_TEST_BATCH_SIZE tests (each in its own namespace) that are only checked with -fsyntax-only, so they're not
+# linked nor run. If a batch fails to compile it's bisected to find the failing tests, that are then compiled and
+# run on their own to report the error.
+_BATCH_SIZE = int(os.environ.get('PY2TMP_TEST_BATCH_SIZE', '0'))
+_JOBS = int(os.environ.get('PY2TMP_TEST_JOBS', '0')) or os.cpu_count() or 1
+
+class _Snippet:
+    '''The code of a test, as registered by the assert_compilation_* decorators in batch mode.'''
+    def __init__(self, tmppy_source: str, extra_cpp_prelude: str, expects_success: bool):
+        self.tmppy_source = tmppy_source
+        self.extra_cpp_prelude = extra_cpp_prelude
+        self.expects_success = expects_success
+        # (module_ir2, module_ir1, cpp_source), or None if the conversion failed (the test reports the error).
+        self.conversion_result = None  # type: Optional[Tuple[ir2.Module, ir1.Module, str]]
+        self.checked = False
+        # If expects_success, whether the code compiled successfully. Otherwise, the compilation error (if any).
+        self.compiled_successfully = False
+        self.compilation_error = None  # type: Optional[CompilationFailedException]
+
+    @property
+    def cxx_source(self):
+        return self.extra_cpp_prelude + self.conversion_result[2]
+
+_pending_snippets_by_module = defaultdict(list)  # type: Dict[str, List[_Snippet]]
+
+def _register_snippet(f, extra_cpp_prelude: str, expects_success: bool) -> Optional[_Snippet]:
+    if not _BATCH_SIZE or _BACKEND == 'interpreter':
+        return None
+    snippet = _Snippet(_get_function_body(f), extra_cpp_prelude, expects_success)
+    _pending_snippets_by_module[f.__module__].append(snippet)
+    return snippet
+
+def _check_pending_snippets(f):
+    snippets = _pending_snippets_by_module.pop(f.__module__, None)
+    if snippets:
+        _check_snippets(snippets, batch_size=_BATCH_SIZE, jobs=_JOBS)
+
+def _create_batch_source(snippets: List[_Snippet]):
+    includes = []
+    namespaces = []
+    for index, snippet in enumerate(snippets):
+        lines = []
+        for line in snippet.cxx_source.splitlines():
+            if line.strip().startswith('#include'):
+                if line.strip() not in includes:
+                    includes.append(line.strip())
+            else:
+                lines.append(line)
+        namespaces.append('namespace tmppy_test_batch_snippet_%s {\n%s\n}\n' % (index, '\n'.join(lines)))
+    return '\n'.join(includes) + '\n' + ''.join(namespaces)
+
+def _compiles_successfully(cxx_source: str):
+    return _compile_with_cache('check_syntax', cxx_source, _check_syntax) is None
+
+def _check_snippets(snippets: List[_Snippet], batch_size: int, jobs: int):
+    '''Converts and compiles the snippets, storing the results in them.
+
+    The snippets expected to compile successfully are compiled in batches of up to batch_size snippets. Failing batches
+    are bisected (compiling the two halves in parallel) until each failing snippet is found.
+    '''
+    # The conversion is not thread-safe (e.g. due to hash-consing), so it's done here.
+    for snippet in snippets:
+        try:
+            snippet.conversion_result = _convert_to_cpp_expecting_success(snippet.tmppy_source)
+        except (Exception, pytest.fail.Exception):
+            # The test will report the error when it runs.
+            pass
+    snippets = [snippet
+                for snippet in snippets
+                if snippet.conversion_result is not None
+                # Code with a main() function must be run, and it couldn't be in the same translation unit anyway.
+                and not (snippet.expects_success and 'main(' in snippet.cxx_source)]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        compilation_error_futures = [(snippet, executor.submit(_compile_expecting_error, snippet.cxx_source))
+                                     for snippet in snippets
+                                     if not snippet.expects_success]
+
+        success_snippets = [snippet for snippet in snippets if snippet.expects_success]
+        batches = [success_snippets[i:i + batch_size]
+                   for i in range(0, len(success_snippets), batch_size)]
+        # All the batches at the same bisection depth are compiled in parallel.
+        while batches:
+            results = list(executor.map(lambda batch: _compiles_successfully(_create_batch_source(batch)), batches))
+            next_batches = []
+            for batch, compiled_successfully in zip(batches, results):
+                if compiled_successfully or len(batch) == 1:
+                    for snippet in batch:
+                        snippet.compiled_successfully = compiled_successfully
+                        snippet.checked = True
+                else:
+                    next_batches.append(batch[:len(batch) // 2])
+                    next_batches.append(batch[len(batch) // 2:])
+            batches = next_batches
+
+        for snippet, future in compilation_error_futures:
+            snippet.compilation_error = future.result()
+            snippet.checked = True
+
+# With PY2TMP_TEST_BACKEND=interpreter, the tests that only check the TMPPy assertions (assert_compilation_succeeds and
+# assert_compilation_fails_with_static_assert_error, with no extra C++ prelude) run the TMPPy code in-process with the
+# interpreter in interpret_ir3 instead of compiling the generated C++ code (the conversion to C++ is still checked).
+# The code that the interpreter can't evaluate exactly is compiled as usual (without batching). The default backend is
+# 'cpp', that compiles all the tests.
+_BACKEND = os.environ.get('PY2TMP_TEST_BACKEND', 'cpp')
+if _BACKEND not in ('cpp', 'interpreter'):
+    raise Exception('Unexpected value for PY2TMP_TEST_BACKEND: %s. The supported values are: cpp, interpreter.' % _BACKEND)
+
+def _check_with_interpreter(tmppy_source: str, expected_error_regex: Optional[str] = None):
+    '''Runs the TMPPy code with the interpreter and checks the result.
+
+    Returns False if the code can't be interpreted, so it must be compiled instead.
+    '''
+    try:
+        interpret_ir3.interpret_module(_convert_tmppy_source_to_ir3(tmppy_source))
+        error = None
+    except interpret_ir3.CannotInterpretException:
+        return False
+    except interpret_ir3.ProgramErrorException as e:
+        error = e
+
+    if expected_error_regex is None and error is not None:
+        pytest.fail(
+            textwrap.dedent('''\
+                The TMPPy code failed when run with the interpreter.
+                Error:
+                {error_message}
+                
+                TMPPy source:
+                {tmppy_source}
+                ''').format(tmppy_source=add_line_numbers(tmppy_source),
+                            error_message=error.message),
+            pytrace=False)
+    if expected_error_regex is not None and error is None:
+        pytest.fail(
+            textwrap.dedent('''\
+                Expected error {expected_error} but the TMPPy code ran successfully with the interpreter.
+                
+                TMPPy source:
+                {tmppy_source}
+                ''').format(expected_error=expected_error_regex,
+                            tmppy_source=add_line_numbers(tmppy_source)),
+            pytrace=False)
+    if expected_error_regex is not None and not re.search(expected_error_regex, error.message):
+        pytest.fail(
+            textwrap.dedent('''\
+                Expected error {expected_error} but the interpreter reported a different error:
+                {error_message}
+                
+                TMPPy source:
+                {tmppy_source}
+                ''').format(expected_error=expected_error_regex,
+                            error_message=error.message,
+                            tmppy_source=add_line_numbers(tmppy_source)),
+            pytrace=False)
+    return True
+
 def assert_compilation_succeeds(extra_cpp_prelude=''):
     def eval(f):
+        snippet = _register_snippet(f, extra_cpp_prelude, expects_success=True)
+
         @wraps(f)
         def wrapper():
+            if snippet is not None:
+                _check_pending_snippets(f)
+                if snippet.checked and snippet.compiled_successfully:
+                    return
+            # If the batch compilation failed for this test, this reports the error.
             tmppy_source = _get_function_body(f)
             module_ir2, module_ir1, cpp_source = _convert_to_cpp_expecting_success(tmppy_source)
+            if _BACKEND == 'interpreter' and not extra_cpp_prelude and _check_with_interpreter(tmppy_source):
+                return
             expect_cpp_code_success(tmppy_source, module_ir2, module_ir1, extra_cpp_prelude + cpp_source)
         return wrapper
 
@@ -733,19 +1034,29 @@ def assert_code_optimizes_to(expected_cpp_source: str):
         return wrapper
     return eval
 
+def _convert_snippet_to_cpp_expecting_success(f, snippet: Optional[_Snippet]):
+    if snippet is not None:
+        _check_pending_snippets(f)
+        if snippet.conversion_result is not None:
+            return snippet.conversion_result
+    return _convert_to_cpp_expecting_success(_get_function_body(f))
+
 def assert_compilation_fails(expected_py2tmp_error_regex: str, expected_py2tmp_error_desc_regex: str):
     def eval(f):
+        snippet = _register_snippet(f, extra_cpp_prelude='', expects_success=False)
+
         @wraps(f)
         def wrapper():
             tmppy_source = _get_function_body(f)
-            module_ir2, module_ir1, cpp_source = _convert_to_cpp_expecting_success(tmppy_source)
+            module_ir2, module_ir1, cpp_source = _convert_snippet_to_cpp_expecting_success(f, snippet)
             expect_cpp_code_compile_error(
                 expected_py2tmp_error_regex,
                 expected_py2tmp_error_desc_regex,
                 tmppy_source,
                 module_ir2,
                 module_ir1,
-                cpp_source)
+                cpp_source,
+                snippet)
 
         return wrapper
     return eval
@@ -753,32 +1064,40 @@ def assert_compilation_fails(expected_py2tmp_error_regex: str, expected_py2tmp_e
 # TODO: Check that the error is s reported on the desired line (moving the regex to a comment in the test).
 def assert_compilation_fails_with_generic_error(expected_error_regex: str):
     def eval(f):
+        snippet = _register_snippet(f, extra_cpp_prelude='', expects_success=False)
+
         @wraps(f)
         def wrapper():
             tmppy_source = _get_function_body(f)
-            module_ir2, module_ir1, cpp_source = _convert_to_cpp_expecting_success(tmppy_source)
+            module_ir2, module_ir1, cpp_source = _convert_snippet_to_cpp_expecting_success(f, snippet)
             expect_cpp_code_generic_compile_error(
                 expected_error_regex,
                 tmppy_source,
                 module_ir2,
                 module_ir1,
-                cpp_source)
+                cpp_source,
+                snippet)
         return wrapper
     return eval
 
 # TODO: Check that the error is s reported on the desired line (moving the regex to a comment in the test).
 def assert_compilation_fails_with_static_assert_error(expected_error_regex: str):
     def eval(f):
+        snippet = _register_snippet(f, extra_cpp_prelude='', expects_success=False)
+
         @wraps(f)
         def wrapper():
             tmppy_source = _get_function_body(f)
-            module_ir2, module_ir1, cpp_source = _convert_to_cpp_expecting_success(tmppy_source)
+            module_ir2, module_ir1, cpp_source = _convert_snippet_to_cpp_expecting_success(f, snippet)
+            if _BACKEND == 'interpreter' and _check_with_interpreter(tmppy_source, expected_error_regex):
+                return
             expect_cpp_code_generic_compile_error(
                 r'(error: static assertion failed: |error: static_assert failed .)' + expected_error_regex,
                 tmppy_source,
                 module_ir2,
                 module_ir1,
-                cpp_source)
+                cpp_source,
+                snippet)
         return wrapper
     return eval
 
@@ -0,0 +1,192 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''Attributes the template instantiation times in a clang -ftime-trace report to the TMPPy code.
+
+The generated headers must have been generated with source_locations=True (--source-locations in the py2tmp command),
+so that each template is preceded by a comment with the location of the TMPPy function, comprehension or match that it
+was generated from.
+
+Instantiations nest (instantiating a template instantiates the templates that it uses), so the time of each
+instantiation is split into its self time (excluding the nested instantiations) and the time of the nested ones. Each
+self time is attributed to the innermost enclosing instantiation (including itself) of a template with a known source
+location, so e.g. the time spent in the helper templates of tmppy.h is attributed to the TMPPy line that uses them.
+'''
+
+import argparse
+import json
+import sys
+from collections import defaultdict, OrderedDict
+from typing import Dict, List, Any, Iterable, Optional, Tuple
+
+from _py2tmp import ir0_to_cpp, utils
+
+_INSTANTIATION_EVENT_NAMES = ('InstantiateClass', 'InstantiateFunction')
+
+class HotSpot:
+    '''The instantiation time attributed to a TMPPy function or line.'''
+    def __init__(self, name: str):
+        self.name = name
+        # The number of instantiations of templates generated from this code.
+        self.num_instantiations = 0
+        # The time (in microseconds) spent in those instantiations and in the nested instantiations of templates without
+        # a known source location.
+        self.self_time_us = 0
+
+    def to_json(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+class TimeTraceReport:
+    def __init__(self):
+        self.hot_spots_by_function = OrderedDict()  # type: Dict[str, HotSpot]
+        self.hot_spots_by_line = OrderedDict()  # type: Dict[str, HotSpot]
+        # The self time of the instantiations that are not nested in any instantiation of a template with a known
+        # source location (e.g. of std templates used directly by the C++ code).
+        self.unattributed_time_us = 0
+        self.total_time_us = 0
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            'functions': [hot_spot.to_json() for hot_spot in self.hot_spots_by_function.values()],
+            'lines': [hot_spot.to_json() for hot_spot in self.hot_spots_by_line.values()],
+            'unattributed_time_us': self.unattributed_time_us,
+            'total_time_us': self.total_time_us,
+        }
+
+def get_template_name(detail: str) -> str:
+    '''Returns the name of the template in the "detail" of an instantiation event, e.g. "Foo" for "ns::Foo<int *>".'''
+    return detail.split('<', 1)[0].strip().split('::')[-1]
+
+def _get_instantiation_events(trace: Dict[str, Any]) -> List[Dict[str, Any]]:
+    events = trace['traceEvents'] if isinstance(trace, dict) else trace
+    return [event
+            for event in events
+            if event.get('ph') == 'X' and event.get('name') in _INSTANTIATION_EVENT_NAMES]
+
+def attribute_instantiation_times(trace: Dict[str, Any],
+                                  source_location_by_template_name: Dict[str, utils.SourceLocation]) -> TimeTraceReport:
+    '''Attributes the instantiation times in the trace (the parsed JSON of a -ftime-trace report) to the TMPPy code.
+
+    source_location_by_template_name is usually the result of ir0_to_cpp.parse_source_location_comments() on the
+    generated headers. The hot spots in the result are sorted by decreasing time.
+    '''
+    report = TimeTraceReport()
+    hot_spots_by_function = dict()  # type: Dict[str, HotSpot]
+    hot_spots_by_line = dict()  # type: Dict[str, HotSpot]
+
+    events_by_thread = defaultdict(list)  # type: Dict[Tuple[Any, Any], List[Dict[str, Any]]]
+    for event in _get_instantiation_events(trace):
+        events_by_thread[(event.get('pid'), event.get('tid'))].append(event)
+
+    for events in events_by_thread.values():
+        # Outer events first, so that each event comes after all the events that contain it.
+        events.sort(key=lambda event: (event['ts'], -event['dur']))
+        # The events that contain the current one (outermost first), with their source location (or the one inherited
+        # from the events that contain them) and their self time. The self time is a 1-element list, since it's
+        # updated when the nested events are found.
+        stack = []  # type: List[Tuple[Dict[str, Any], Optional[utils.SourceLocation], List[int]]]
+        self_times_us = []  # type: List[Tuple[Optional[utils.SourceLocation], bool, List[int]]]
+        for event in events:
+            while stack and stack[-1][0]['ts'] + stack[-1][0]['dur'] <= event['ts']:
+                stack.pop()
+            template_name = get_template_name(event.get('args', {}).get('detail', ''))
+            own_source_location = source_location_by_template_name.get(template_name)
+            if own_source_location is not None:
+                source_location = own_source_location
+            elif stack:
+                source_location = stack[-1][1]
+            else:
+                source_location = None
+            self_time_us = [event['dur']]
+            if stack:
+                stack[-1][2][0] -= event['dur']
+            else:
+                report.total_time_us += event['dur']
+            stack.append((event, source_location, self_time_us))
+            self_times_us.append((source_location, own_source_location is not None, self_time_us))
+
+        for source_location, is_own_source_location, [self_time_us] in self_times_us:
+            if source_location is None:
+                report.unattributed_time_us += self_time_us
+                continue
+            for hot_spots, name in ((hot_spots_by_function, source_location.function_name),
+                                    (hot_spots_by_line, str(source_location))):
+                hot_spot = hot_spots.get(name)
+                if hot_spot is None:
+                    hot_spot = HotSpot(name)
+                    hot_spots[name] = hot_spot
+                hot_spot.self_time_us += self_time_us
+                if is_own_source_location:
+                    hot_spot.num_instantiations += 1
+
+    def sort_hot_spots(hot_spots: Iterable[HotSpot]):
+        return OrderedDict((hot_spot.name, hot_spot)
+                           for hot_spot in sorted(hot_spots, key=lambda hot_spot: (-hot_spot.self_time_us, hot_spot.name)))
+    report.hot_spots_by_function = sort_hot_spots(hot_spots_by_function.values())
+    report.hot_spots_by_line = sort_hot_spots(hot_spots_by_line.values())
+    return report
+
+def _print_hot_spots(title: str, hot_spots: List[HotSpot], total_time_us: int):
+    print(title)
+    print('%12s %8s %16s  %s' % ('Time (ms)', '%', 'Instantiations', 'Code'))
+    for hot_spot in hot_spots:
+        print('%12.3f %7.1f%% %16s  %s' % (hot_spot.self_time_us / 1000,
+                                           100 * hot_spot.self_time_us / total_time_us if total_time_us else 0,
+                                           hot_spot.num_instantiations,
+                                           hot_spot.name))
+
+def print_report(report: TimeTraceReport, max_hot_spots: Optional[int] = None):
+    _print_hot_spots('Instantiation time by TMPPy function:',
+                     list(report.hot_spots_by_function.values())[:max_hot_spots],
+                     report.total_time_us)
+    print()
+    _print_hot_spots('Instantiation time by TMPPy line:',
+                     list(report.hot_spots_by_line.values())[:max_hot_spots],
+                     report.total_time_us)
+    print()
+    print('Total instantiation time: %.3f ms (%.3f ms not attributed to TMPPy code)' % (
+        report.total_time_us / 1000, report.unattributed_time_us / 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description='Attributes the template instantiation times in a clang -ftime-trace '
+                                                 'report to the TMPPy functions and lines that the templates were '
+                                                 'generated from, and prints the hot spots.')
+    parser.add_argument('trace', help='The JSON file written by clang with -ftime-trace.')
+    parser.add_argument('headers', nargs='+',
+                        help='The headers generated by py2tmp with --source-locations and used in the compiled C++ '
+                             'file.')
+    parser.add_argument('--top', type=int, default=20, help='The number of hot spots to print (for each report).')
+    parser.add_argument('--json', action='store_true', help='Print the full report as JSON.')
+    args = parser.parse_args()
+
+    source_location_by_template_name = dict()  # type: Dict[str, utils.SourceLocation]
+    for header in args.headers:
+        with open(header) as header_file:
+            source_location_by_template_name.update(ir0_to_cpp.parse_source_location_comments(header_file.read()))
+    if not source_location_by_template_name:
+        print('No source location comments found in the headers. Generate them with py2tmp --source-locations.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    with open(args.trace) as trace_file:
+        trace = json.load(trace_file)
+    report = attribute_instantiation_times(trace, source_location_by_template_name)
+    if args.json:
+        print(json.dumps(report.to_json(), indent=2))
+    else:
+        print_report(report, args.top)
+
+if __name__ == '__main__':
+    main()
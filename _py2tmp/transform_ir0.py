@@ -104,7 +104,8 @@ class Transformation:
                                       specializations=[self.transform_template_specialization(specialization, writer) for specialization in template_defn.specializations],
                                       name=template_defn.name,
                                       description=template_defn.description,
-                                      result_element_names=template_defn.result_element_names))
+                                      result_element_names=template_defn.result_element_names,
+                                      source_location=template_defn.source_location))
 
     def transform_static_assert(self, static_assert: ir0.StaticAssert, writer: Writer):
         writer.write(ir0.StaticAssert(expr=self.transform_expr(static_assert.expr, writer),
@@ -22,14 +22,16 @@ class Transformation:
                           assertions=[self.transform_assert(assertion)
                                       for assertion in module.assertions],
                           custom_types=module.custom_types,
-                          public_names=module.public_names)
+                          public_names=module.public_names,
+                          imported_custom_types=module.imported_custom_types)
 
     def transform_function_defn(self, function_defn: ir3.FunctionDefn) -> ir3.FunctionDefn:
         return ir3.FunctionDefn(name=function_defn.name,
                                 args=[self.transform_function_arg_decl(arg)
                                       for arg in function_defn.args],
                                 body=self.transform_stmts(function_defn.body),
-                                return_type=function_defn.return_type)
+                                return_type=function_defn.return_type,
+                                source_location=function_defn.source_location)
 
     def transform_function_arg_decl(self, arg_decl: ir3.FunctionArgDecl):
         return arg_decl
@@ -161,12 +163,14 @@ class Transformation:
     def transform_set_comprehension(self, comprehension: ir3.SetComprehension) -> ir3.SetComprehension:
         return ir3.SetComprehension(set_expr=self.transform_expr(comprehension.set_expr),
                                     loop_var=self.transform_var_reference(comprehension.loop_var),
-                                    result_elem_expr=self.transform_expr(comprehension.result_elem_expr))
+                                    result_elem_expr=self.transform_expr(comprehension.result_elem_expr),
+                                    source_location=comprehension.source_location)
 
     def transform_list_comprehension(self, comprehension: ir3.ListComprehension) -> ir3.ListComprehension:
         return ir3.ListComprehension(list_expr=self.transform_expr(comprehension.list_expr),
                                      loop_var=self.transform_var_reference(comprehension.loop_var),
-                                     result_elem_expr=self.transform_expr(comprehension.result_elem_expr))
+                                     result_elem_expr=self.transform_expr(comprehension.result_elem_expr),
+                                     source_location=comprehension.source_location)
 
     def transform_list_concat_expr(self, expr: ir3.ListConcatExpr) -> ir3.ListConcatExpr:
         return ir3.ListConcatExpr(lhs=self.transform_expr(expr.lhs),
@@ -280,7 +284,8 @@ class Transformation:
         return ir3.MatchExpr(matched_exprs=[self.transform_expr(matched_expr)
                                             for matched_expr in expr.matched_exprs],
                              match_cases=[self.transform_match_case(match_case)
-                                          for match_case in expr.match_cases])
+                                          for match_case in expr.match_cases],
+                             source_location=expr.source_location)
 
     def transform_match_case(self, match_case: ir3.MatchCase) -> ir3.MatchCase:
       return ir3.MatchCase(type_patterns=match_case.type_patterns,
@@ -12,13 +12,73 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import itertools
+import operator
 import re
 import subprocess
+import weakref
 from enum import Enum
+from typing import Dict, Tuple, Iterable, Any, Callable, List, Iterator, Optional
 
 import typed_ast.ast3 as ast
 
+# Fields of IR nodes are declared with __slots__ (so IR nodes don't have a __dict__). Slots whose name starts with an
+# underscore are not fields (e.g. they hold values computed from the fields, or metadata like source locations).
+
+_field_names_by_class = dict()  # type: Dict[type, Tuple[str, ...]]
+
+def get_field_names(cls: type) -> Tuple[str, ...]:
+    '''Returns the names of the fields of instances of cls, i.e. the slots declared by cls and its base classes.
+
+    The fields of base classes come first, so the order matches the order in which __init__ usually sets them.
+    '''
+    field_names = _field_names_by_class.get(cls)
+    if field_names is None:
+        field_names = []
+        for base in reversed(cls.__mro__):
+            slots = base.__dict__.get('__slots__', ())
+            if isinstance(slots, str):
+                slots = (slots,)
+            for slot_name in slots:
+                if not slot_name.startswith('_') and slot_name not in field_names:
+                    field_names.append(slot_name)
+        field_names = tuple(field_names)
+        _field_names_by_class[cls] = field_names
+    return field_names
+
+def iter_fields(obj: Any) -> Iterable[Tuple[str, Any]]:
+    '''Yields (field_name, value) for each field of the IR node obj that has been set.'''
+    for field_name in get_field_names(obj.__class__):
+        try:
+            value = getattr(obj, field_name)
+        except AttributeError:
+            continue
+        yield field_name, value
+
+_field_values_getter_by_class = dict()  # type: Dict[type, Callable[[Any], Tuple]]
+
+def _get_field_values_getter(cls: type) -> Callable[[Any], Tuple]:
+    getter = _field_values_getter_by_class.get(cls)
+    if getter is None:
+        field_names = get_field_names(cls)
+        if not field_names:
+            getter = lambda obj: ()
+        elif len(field_names) == 1:
+            field_name, = field_names
+            getter = lambda obj: (getattr(obj, field_name),)
+        else:
+            getter = operator.attrgetter(*field_names)
+        _field_values_getter_by_class[cls] = getter
+    return getter
+
+def get_field_values(obj: Any) -> Tuple:
+    '''Returns the values of all fields of the IR node obj, in the order of get_field_names().'''
+    return _get_field_values_getter(obj.__class__)(obj)
+
 class ValueType:
+    __slots__ = ()
+
     def __eq__(self, other):
         return isinstance(other, self.__class__) and self._key() == other._key()
 
@@ -26,7 +86,113 @@ class ValueType:
         return hash(self._key())
 
     def _key(self):
-        return tuple(sorted(self.__dict__.items()))
+        return tuple(sorted(iter_fields(self)))
+
+class SourceLocation(ValueType):
+    '''The location of the TMPPy code that some IR was generated from.
+
+    IR nodes store this in a _source_location slot, so that it's not a field: e.g. moving a function to a different
+    line doesn't change the IR (so it doesn't invalidate cached optimizations, nor the content-derived identifiers).
+    '''
+    __slots__ = ('filename', 'line', 'function_name')
+
+    def __init__(self, filename: str, line: int, function_name: str):
+        self.filename = filename
+        self.line = line
+        # The name of the (toplevel) TMPPy function that contains this code.
+        self.function_name = function_name
+
+    def __str__(self):
+        return '%s:%s (in %s)' % (self.filename, self.line, self.function_name)
+
+class HasSourceLocation:
+    '''Base class for IR nodes with a source location. Subclasses must declare a _source_location slot.'''
+    __slots__ = ()
+
+    @property
+    def source_location(self) -> Optional[SourceLocation]:
+        return self._source_location
+
+    @source_location.setter
+    def source_location(self, source_location: Optional[SourceLocation]):
+        self._source_location = source_location
+
+class _HashConsingTableRef(weakref.ref):
+    __slots__ = ('key',)
+
+def _remove_dead_hash_consing_table_entry(ref: _HashConsingTableRef):
+    if _hash_consing_table.get(ref.key) is ref:
+        del _hash_consing_table[ref.key]
+
+# The table of all live HashConsedValueType instances, by key. Since all fields of such instances are immutable and
+# the fields that are themselves IR nodes are also interned, two instances with the same key are interchangeable.
+# This is like a weakref.WeakValueDictionary, but faster since the lookup is on the hot path of IR construction.
+_hash_consing_table = dict()  # type: Dict[Tuple, _HashConsingTableRef]
+
+# The number of HashConsedValueType instances whose __init__ is currently running (some __init__ methods construct
+# other instances).
+_num_hash_consed_values_being_constructed = 0
+
+class _HashConsingMeta(type):
+    def __call__(cls, *args, **kwargs):
+        global _num_hash_consed_values_being_constructed
+        _num_hash_consed_values_being_constructed += 1
+        try:
+            obj = super().__call__(*args, **kwargs)
+        finally:
+            _num_hash_consed_values_being_constructed -= 1
+        return obj._intern()
+
+def _make_hash_consed_value(cls, field_values):
+    obj = cls.__new__(cls)
+    for field_name, value in zip(get_field_names(cls), field_values):
+        object.__setattr__(obj, field_name, value)
+    return obj._intern()
+
+class HashConsedValueType(metaclass=_HashConsingMeta):
+    '''A value type whose instances are immutable and hash-consed.
+
+    Constructing an instance equal to an existing one returns the existing instance, so equality is an identity check
+    and the hash is computed only once (when the instance is first constructed). Fields can only be set in __init__.
+    '''
+    __slots__ = ('_hash', '__weakref__')
+
+    def _intern(self):
+        # All instances of a class have the same fields, so the values are enough to identify an instance.
+        key = (self.__class__, get_field_values(self))
+        ref = _hash_consing_table.get(key)
+        if ref is not None:
+            existing_obj = ref()
+            if existing_obj is not None:
+                return existing_obj
+        object.__setattr__(self, '_hash', hash(key))
+        ref = _HashConsingTableRef(self, _remove_dead_hash_consing_table_entry)
+        ref.key = key
+        _hash_consing_table[key] = ref
+        return self
+
+    def __setattr__(self, name, value):
+        # This is a cheap check (this is called for every field of every instance), so it doesn't catch an
+        # assignment to an existing instance performed while constructing another one.
+        if not _num_hash_consed_values_being_constructed:
+            raise AttributeError('Can\'t set %s: %s is immutable' % (name, self.__class__.__name__))
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError('Can\'t delete %s: %s is immutable' % (name, self.__class__.__name__))
+
+    def __eq__(self, other):
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        # This makes sure that unpickled (and copied) instances are interned too.
+        return _make_hash_consed_value, (self.__class__, get_field_values(self))
 
 def ast_to_string(ast_node, line_indent=''):
     next_line_indent = line_indent + '  '
@@ -61,9 +227,55 @@ def ir_to_string(ir_elem, line_indent=''):
         return (ir_elem.__class__.__name__
                 + '('
                 + ','.join('\n' + next_line_indent + field_name + ' = ' + ir_to_string(child_node, next_line_indent)
-                           for field_name, child_node in ir_elem.__dict__.items())
+                           for field_name, child_node in iter_fields(ir_elem))
                 + ')')
 
+def ir_equals(ir_elem1, ir_elem2) -> bool:
+    '''Compares two IRs (of any kind) structurally.
+
+    This is much cheaper than comparing their string representations: it stops at the first difference, and shared
+    subtrees (e.g. the ones that an optimization didn't touch, or hash-consed values) are compared by identity.
+    '''
+    elems_to_compare = [(ir_elem1, ir_elem2)]
+    while elems_to_compare:
+        elem1, elem2 = elems_to_compare.pop()
+        if elem1 is elem2:
+            continue
+        if elem1.__class__ is not elem2.__class__:
+            return False
+        if isinstance(elem1, (list, tuple)):
+            if len(elem1) != len(elem2):
+                return False
+            elems_to_compare.extend(zip(elem1, elem2))
+        elif isinstance(elem1, HashConsedValueType):
+            # Equal instances are the same object.
+            return False
+        elif elem1 is None or isinstance(elem1, (str, bool, int, float, Enum, set, frozenset, dict)):
+            if elem1 != elem2:
+                return False
+        else:
+            fields1 = list(iter_fields(elem1))
+            fields2 = list(iter_fields(elem2))
+            if [field_name for field_name, _ in fields1] != [field_name for field_name, _ in fields2]:
+                return False
+            elems_to_compare.extend(zip((value for _, value in fields1), (value for _, value in fields2)))
+    return True
+
+def content_derived_identifier(*key_parts: str) -> str:
+    '''Returns an internal identifier that only depends on key_parts.
+
+    These can't clash with the ones of the form TmppyInternal_<number>, so the two kinds can be used in the same header.
+    '''
+    digest = hashlib.sha256('\0'.join(key_parts).encode('utf-8')).hexdigest()
+    return 'TmppyInternal_h%s' % digest[:16]
+
+def is_content_derived_identifier(identifier: str) -> bool:
+    return re.fullmatch('TmppyInternal_h[0-9a-f]{16}', identifier) is not None
+
+def content_derived_identifier_generator(*key_parts: str) -> Iterator[str]:
+    for i in itertools.count():
+        yield content_derived_identifier(*key_parts, str(i))
+
 def clang_format(cxx_source: str, code_style='LLVM') -> str:
     command = ['clang-format',
                '-assume-filename=file.cpp',
@@ -92,16 +304,51 @@ def clang_format(cxx_source: str, code_style='LLVM') -> str:
     else:
         return stdout
 
-def replace_identifiers(cpp_type, replacements):
-    last_index = 0
-    result_parts = []
-    for match in re.finditer(r'[a-zA-Z_][a-zA-Z_0-9]*', cpp_type):
-        result_parts.append(cpp_type[last_index:match.start()])
-        identifier = match.group(0)
-        if identifier in replacements:
-            result_parts.append(replacements[identifier])
-        else:
+_identifier_regex = re.compile(r'[a-zA-Z_][a-zA-Z_0-9]*')
+
+class TokenizedCppType:
+    '''A C++ type (or template) as a sequence of identifiers and of the text between them.
+
+    E.g. 'std::vector' has text_segments ('', '::', '') and identifiers ('std', 'vector').
+    '''
+    __slots__ = ('text', 'text_segments', 'identifiers', 'slots_by_identifier')
+
+    def __init__(self, text: str):
+        self.text = text
+        text_segments = []
+        identifiers = []
+        slots_by_identifier = dict()  # type: Dict[str, List[int]]
+        last_index = 0
+        for match in _identifier_regex.finditer(text):
+            text_segments.append(text[last_index:match.start()])
+            identifier = match.group(0)
+            slots_by_identifier.setdefault(identifier, []).append(len(identifiers))
+            identifiers.append(identifier)
+            last_index = match.end()
+        text_segments.append(text[last_index:])
+        # There's always one more text segment than identifiers.
+        self.text_segments = tuple(text_segments)
+        self.identifiers = tuple(identifiers)
+        # The slots (indexes in `identifiers`) where each identifier occurs, in order of first occurrence.
+        self.slots_by_identifier = {identifier: tuple(slots) for identifier, slots in slots_by_identifier.items()}
+
+    def replace_identifiers(self, replacements: Dict[str, str]) -> str:
+        # This only looks at the identifiers that occur here, so it's cheap even if `replacements` is large.
+        identifiers = None
+        for identifier, slots in self.slots_by_identifier.items():
+            replacement = replacements.get(identifier)
+            if replacement is not None:
+                if identifiers is None:
+                    identifiers = list(self.identifiers)
+                for slot in slots:
+                    identifiers[slot] = replacement
+        if identifiers is None:
+            return self.text
+        result_parts = [self.text_segments[0]]
+        for identifier, text_segment in zip(identifiers, self.text_segments[1:]):
             result_parts.append(identifier)
-        last_index = match.end()
-    result_parts.append(cpp_type[last_index:])
-    return ''.join(result_parts)
+            result_parts.append(text_segment)
+        return ''.join(result_parts)
+
+def replace_identifiers(cpp_type: str, replacements: Dict[str, str]):
+    return TokenizedCppType(cpp_type).replace_identifiers(replacements)
@@ -0,0 +1,141 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''Measures how the time taken by constant folding (in optimize_ir0) scales with the number of elements in a body.
+
+The bodies are synthetic: short chains of typedefs (each used once, so they get inlined) whose results are all used by
+the last element, interleaved with constants that are used more than once and static asserts. This is similar to what
+template bodies look like after the template instantiations in them have been inlined.
+
+Example usage:
+    PYTHONPATH=. python extras/benchmark/constant_folding_benchmark.py --sizes 100 1000 10000
+'''
+
+import argparse
+import itertools
+import json
+import time
+from typing import List
+
+from _py2tmp import ir0, optimize_ir0
+
+def _type_var(name: str):
+    return ir0.AtomicTypeLiteral.for_local(cpp_type=name, type=ir0.TypeType())
+
+def _int_var(name: str):
+    return ir0.AtomicTypeLiteral.for_local(cpp_type=name, type=ir0.Int64Type())
+
+_CHAIN_LENGTH = 8
+
+def generate_template_defn(num_elems: int) -> ir0.TemplateDefn:
+    f_template_expr = ir0.AtomicTypeLiteral.for_nonlocal_template(cpp_type='F',
+                                                                 arg_types=[ir0.TypeType()],
+                                                                 is_metafunction_that_may_return_error=False)
+    elems = [ir0.ConstantDef(name='C0', expr=ir0.Literal(0))]
+    last_int_var = 'C0'
+    chain_result_vars = []
+    i = 1
+    while i < num_elems - _CHAIN_LENGTH:
+        if i % (4 * _CHAIN_LENGTH) == 1:
+            # Used twice: by the next constant and by a static assert.
+            elems.append(ir0.ConstantDef(name='C%s' % i,
+                                         expr=ir0.Int64BinaryOpExpr(lhs=_int_var(last_int_var),
+                                                                    rhs=ir0.Literal(i),
+                                                                    op='+')))
+            elems.append(ir0.StaticAssert(expr=ir0.ComparisonExpr(lhs=_int_var('C%s' % i),
+                                                                  rhs=ir0.Literal(0),
+                                                                  op='>='),
+                                          message='Error %s' % i))
+            last_int_var = 'C%s' % i
+            i += 2
+        # A chain of typedefs, each used only by the next one. The first one might trigger static asserts, so it can
+        # only be inlined if there are no static asserts after it.
+        type_var = None
+        for j in range(_CHAIN_LENGTH):
+            if j == 0:
+                expr = ir0.TemplateInstantiation(template_expr=f_template_expr,
+                                                 args=[_type_var('T')],
+                                                 instantiation_might_trigger_static_asserts=True)
+            elif j % 2 == 0:
+                expr = ir0.PointerTypeExpr(_type_var(type_var))
+            else:
+                expr = ir0.TemplateInstantiation(template_expr=f_template_expr,
+                                                 args=[_type_var(type_var)],
+                                                 instantiation_might_trigger_static_asserts=False)
+            type_var = 'X%s' % i
+            elems.append(ir0.Typedef(name=type_var, expr=expr))
+            i += 1
+        chain_result_vars.append(type_var)
+
+    # The last element uses the results of all chains.
+    g_template_expr = ir0.AtomicTypeLiteral.for_nonlocal_template(cpp_type='G',
+                                                                 arg_types=[ir0.TypeType() for _ in chain_result_vars],
+                                                                 is_metafunction_that_may_return_error=False)
+    elems.append(ir0.Typedef(name='type',
+                             expr=ir0.TemplateInstantiation(template_expr=g_template_expr,
+                                                            args=[_type_var(var) for var in chain_result_vars],
+                                                            instantiation_might_trigger_static_asserts=False)))
+
+    arg_decl = ir0.TemplateArgDecl(type=ir0.TypeType(), name='T')
+    return ir0.TemplateDefn(args=[arg_decl],
+                            main_definition=ir0.TemplateSpecialization(args=[arg_decl], patterns=None, body=elems),
+                            specializations=[],
+                            name='BenchmarkTemplate',
+                            description='',
+                            result_element_names=['type'])
+
+def run_benchmark(sizes: List[int], num_runs: int):
+    results = []
+    for size in sizes:
+        template_defn = generate_template_defn(size)
+        num_elems = len(template_defn.main_definition.body)
+        best_time_seconds = None
+        for _ in range(num_runs):
+            identifier_generator = ('TmppyInternal_%s' % i for i in itertools.count())
+            start_time = time.perf_counter()
+            result = optimize_ir0.perform_constant_folding(template_defn,
+                                                           identifier_generator,
+                                                           inline_template_instantiations_with_multiple_references=False)
+            time_seconds = time.perf_counter() - start_time
+            if best_time_seconds is None or time_seconds < best_time_seconds:
+                best_time_seconds = time_seconds
+        results.append({
+            'num_elems': num_elems,
+            'num_elems_after_folding': len(result.main_definition.body),
+            'time_seconds': best_time_seconds,
+            'time_per_elem_microseconds': best_time_seconds / num_elems * 1e6,
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures how constant folding scales with the size of a body.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 300, 1000, 3000, 10000],
+                        help='The numbers of elements in the generated bodies.')
+    parser.add_argument('--num-runs', type=int, default=3, help='The best time out of this many runs is reported.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.num_runs)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('%10s %14s %12s %16s' % ('Elements', 'After folding', 'Time (s)', 'Time/elem (us)'))
+    for size_results in results:
+        print('%10d %14d %12.4f %16.1f' % (size_results['num_elems'], size_results['num_elems_after_folding'],
+                                           size_results['time_seconds'], size_results['time_per_elem_microseconds']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,396 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''Measures how long the C++ compiler takes to compile the code generated by py2tmp, compared to hand-written C++.
+
+Each workload is a TMPPy module parameterized by a size (e.g. the recursion depth or the number of match arms), paired
+with a hand-written C++ metaprogram that computes the same thing. For each size, both are compiled (with -fsyntax-only,
+so this only measures the compiler frontend) and the best time out of --num-runs runs is reported, together with the
+peak memory of the compiler and the number of class template instantiations. The latter is computed from
+-fdump-lang-class with GCC and from -ftime-trace with Clang; it's not available with other compilers.
+
+The results can be saved with --output and compared with the ones of a previous run (e.g. with another version of
+py2tmp) with --compare.
+
+Example usage:
+    PYTHONPATH=. python extras/benchmark/cpp_compile_time_benchmark.py --cxx g++ --output results.json
+    PYTHONPATH=. python extras/benchmark/cpp_compile_time_benchmark.py --cxx g++ --compare results.json
+'''
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+import _py2tmp
+from _py2tmp import main as py2tmp_main
+
+_INCLUDE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'include')
+
+class Workload:
+    '''A parameterized TMPPy module and the equivalent hand-written C++.'''
+    def __init__(self, name: str, description: str, default_sizes: List[int]):
+        self.name = name
+        self.description = description
+        self.default_sizes = default_sizes
+
+    def generate_tmppy_source(self, size: int) -> str: ...  # pragma: no cover
+
+    def generate_tmppy_usage(self, size: int) -> str:
+        '''Returns the C++ code that uses the code generated from the TMPPy source.'''
+        ...  # pragma: no cover
+
+    def generate_baseline_cpp(self, size: int) -> str:
+        '''Returns the hand-written C++ code, including its usage.'''
+        ...  # pragma: no cover
+
+class RecursionWorkload(Workload):
+    def __init__(self):
+        super().__init__('recursion', 'A recursive function, called with recursion depth N.', [16, 64, 256])
+
+    def generate_tmppy_source(self, size: int):
+        return '''
+def f(n: int) -> int:
+    if n == 0:
+        return 0
+    else:
+        return f(n - 1) + 1
+'''
+
+    def generate_tmppy_usage(self, size: int):
+        return 'static_assert(f<{size}>::value == {size}, "");\n'.format(size=size)
+
+    def generate_baseline_cpp(self, size: int):
+        return '''
+#include <cstdint>
+template <int64_t n>
+struct f {{
+  static constexpr int64_t value = f<n - 1>::value + 1;
+}};
+template <>
+struct f<0> {{
+  static constexpr int64_t value = 0;
+}};
+static_assert(f<{size}>::value == {size}, "");
+'''.format(size=size)
+
+class ListLengthWorkload(Workload):
+    def __init__(self):
+        super().__init__('list_length', 'A list comprehension over a list of length N.', [8, 32, 128])
+
+    def generate_tmppy_source(self, size: int):
+        return '''
+from tmppy import Type
+
+def f(x: Type):
+    return [Type.pointer(y) for y in [{elems}]]
+'''.format(elems=', '.join(['x'] * size))
+
+    def generate_tmppy_usage(self, size: int):
+        return 'using Result = f<int>::type;\n'
+
+    def generate_baseline_cpp(self, size: int):
+        return '''
+template <typename... Ts>
+struct TypeList {{}};
+template <typename L>
+struct AddPointer;
+template <typename... Ts>
+struct AddPointer<TypeList<Ts...>> {{
+  using type = TypeList<Ts*...>;
+}};
+template <typename x>
+struct f {{
+  using type = typename AddPointer<TypeList<{elems}>>::type;
+}};
+using Result = f<int>::type;
+'''.format(elems=', '.join(['x'] * size))
+
+class CustomTypesWorkload(Workload):
+    def __init__(self):
+        super().__init__('custom_types', 'N custom types, each constructed and accessed by a function.', [4, 16, 64])
+
+    def generate_tmppy_source(self, size: int):
+        return 'from tmppy import Type\n' + ''.join('''
+class C{i}:
+    def __init__(self, x: Type):
+        self.x = x
+
+def f{i}(x: Type):
+    return C{i}(Type.pointer(x)).x
+'''.format(i=i) for i in range(size))
+
+    def generate_tmppy_usage(self, size: int):
+        return ''.join('using Result%s = f%s<int>::type;\n' % (i, i) for i in range(size))
+
+    def generate_baseline_cpp(self, size: int):
+        return ''.join('''
+template <typename x_>
+struct C{i} {{
+  using x = x_;
+}};
+template <typename x>
+struct f{i} {{
+  using type = typename C{i}<x*>::x;
+}};
+using Result{i} = f{i}<int>::type;
+'''.format(i=i) for i in range(size))
+
+class MatchArmsWorkload(Workload):
+    def __init__(self):
+        super().__init__('match_arms', 'A match with N arms (for functions with 1..N args), each used once.',
+                         [4, 16, 64])
+
+    def generate_tmppy_source(self, size: int):
+        arms = ''.join('''
+        Type.function(T, [{args}]):
+            Type.pointer(T),'''.format(args=', '.join(["Type('int')"] * i)) for i in range(1, size + 1))
+        return '''
+from tmppy import Type, match
+
+def f(x: Type):
+    return match(x)(lambda T: {{{arms}
+    }})
+'''.format(arms=arms)
+
+    def generate_tmppy_usage(self, size: int):
+        return ''.join('using Result%s = f<char(%s)>::type;\n' % (i, ', '.join(['int'] * i))
+                       for i in range(1, size + 1))
+
+    def generate_baseline_cpp(self, size: int):
+        return 'template <typename>\nstruct f;\n' + ''.join('''
+template <typename T>
+struct f<T({args})> {{
+  using type = T*;
+}};
+using Result{i} = f<char({args})>::type;
+'''.format(i=i, args=', '.join(['int'] * i)) for i in range(1, size + 1))
+
+class TryExceptNestingWorkload(Workload):
+    def __init__(self):
+        super().__init__('try_except_nesting', 'A chain of N functions, each catching and re-raising an exception.',
+                         [4, 16, 64])
+
+    def generate_tmppy_source(self, size: int):
+        return '''
+class E(Exception):
+    def __init__(self, n: int):
+        self.message = 'error'
+        self.n = n
+
+def f0(n: int) -> int:
+    if n == 0:
+        raise E(0)
+    return n
+''' + ''.join('''
+def f{i}(n: int) -> int:
+    try:
+        m = f{prev}(n)
+        return m + 1
+    except E as e:
+        raise E(e.n + 1)
+'''.format(i=i, prev=i - 1) for i in range(1, size + 1))
+
+    def generate_tmppy_usage(self, size: int):
+        return '''
+static_assert(f{size}<1>::value == {size} + 1, "");
+using Error = f{size}<0>::error;
+'''.format(size=size)
+
+    def generate_baseline_cpp(self, size: int):
+        return '''
+#include <cstdint>
+template <int64_t n>
+struct f0 {
+  static constexpr bool is_error = n == 0;
+  static constexpr int64_t error_n = 0;
+  static constexpr int64_t value = n;
+};
+''' + ''.join('''
+template <int64_t n>
+struct f{i} {{
+  using R = f{prev}<n>;
+  static constexpr bool is_error = R::is_error;
+  static constexpr int64_t error_n = R::error_n + 1;
+  static constexpr int64_t value = R::value + 1;
+}};
+'''.format(i=i, prev=i - 1) for i in range(1, size + 1)) + '''
+static_assert(f{size}<1>::value == {size} + 1, "");
+static_assert(f{size}<0>::is_error, "");
+'''.format(size=size)
+
+WORKLOADS = [
+    RecursionWorkload(),
+    ListLengthWorkload(),
+    CustomTypesWorkload(),
+    MatchArmsWorkload(),
+    TryExceptNestingWorkload(),
+]
+
+def _get_compiler_version(cxx: str) -> str:
+    return subprocess.check_output([cxx, '--version'], universal_newlines=True).splitlines()[0]
+
+def _run_compiler(args: List[str]) -> Tuple[float, int]:
+    '''Runs the compiler, returning the time taken and its peak memory (in KB).'''
+    # We can't use communicate() since we need the resource usage of this child process, and we can't use pipes either
+    # since the compiler would block once the pipe buffer is full (e.g. with many errors), so the output goes to a file.
+    with tempfile.TemporaryFile(mode='w+') as output_file:
+        start_time = time.perf_counter()
+        process = subprocess.Popen(args, stdout=output_file, stderr=subprocess.STDOUT, universal_newlines=True)
+        _, status, rusage = os.wait4(process.pid, 0)
+        time_seconds = time.perf_counter() - start_time
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+        if process.returncode != 0:
+            output_file.seek(0)
+            raise Exception('The compilation failed. Command:\n%s\nOutput:\n%s' % (' '.join(args), output_file.read()))
+    return time_seconds, rusage.ru_maxrss
+
+def _count_instantiations(cxx: str, compiler_flags: List[str], source_file_name: str, dir: str) -> Optional[int]:
+    version = _get_compiler_version(cxx)
+    if 'clang' in version:
+        object_file_name = os.path.join(dir, 'instantiations.o')
+        subprocess.check_call([cxx] + compiler_flags + ['-ftime-trace', '-c', source_file_name, '-o', object_file_name])
+        with open(os.path.join(dir, 'instantiations.json')) as trace_file:
+            trace = json.load(trace_file)
+        return sum(1 for event in trace['traceEvents'] if event.get('name') == 'InstantiateClass')
+    elif 'g++' in version or 'GCC' in version:
+        dump_dir = os.path.join(dir, 'instantiations')
+        os.makedirs(dump_dir, exist_ok=True)
+        subprocess.check_call([cxx] + compiler_flags + ['-fsyntax-only', '-fdump-lang-class',
+                                                        '-dumpdir', dump_dir + os.sep, source_file_name])
+        num_instantiations = 0
+        for file_name in os.listdir(dump_dir):
+            if file_name.endswith('.class'):
+                with open(os.path.join(dump_dir, file_name)) as dump_file:
+                    num_instantiations += len(re.findall('^Class [^\n]*<', dump_file.read(), re.MULTILINE))
+        return num_instantiations
+    else:
+        return None
+
+def _measure_compilation(cxx: str, compiler_flags: List[str], cpp_source: str, num_runs: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as dir:
+        source_file_name = os.path.join(dir, 'benchmark.cpp')
+        with open(source_file_name, 'w') as source_file:
+            source_file.write(cpp_source)
+        best_time_seconds = None
+        peak_memory_kb = 0
+        for _ in range(num_runs):
+            time_seconds, memory_kb = _run_compiler([cxx] + compiler_flags + ['-fsyntax-only', source_file_name])
+            if best_time_seconds is None or time_seconds < best_time_seconds:
+                best_time_seconds = time_seconds
+            peak_memory_kb = max(peak_memory_kb, memory_kb)
+        return {
+            'time_seconds': best_time_seconds,
+            'peak_memory_kb': peak_memory_kb,
+            'num_instantiations': _count_instantiations(cxx, compiler_flags, source_file_name, dir),
+        }
+
+def run_benchmark(cxx: str,
+                  workloads: List[Workload],
+                  sizes: Optional[List[int]],
+                  num_runs: int,
+                  compiler_flags: List[str]) -> Dict[str, Any]:
+    compiler_flags = ['-std=c++11', '-ftemplate-depth=10000', '-I', _INCLUDE_DIR] + compiler_flags
+    results = []
+    for workload in workloads:
+        for size in sizes or workload.default_sizes:
+            tmppy_source = workload.generate_tmppy_source(size)
+            start_time = time.perf_counter()
+            tmppy_header = py2tmp_main.convert_to_cpp(tmppy_source, filename='%s.py' % workload.name)
+            conversion_time_seconds = time.perf_counter() - start_time
+            tmppy_results = _measure_compilation(cxx, compiler_flags,
+                                                 tmppy_header + workload.generate_tmppy_usage(size),
+                                                 num_runs)
+            tmppy_results['py2tmp_time_seconds'] = conversion_time_seconds
+            results.append({
+                'workload': workload.name,
+                'size': size,
+                'tmppy': tmppy_results,
+                'baseline': _measure_compilation(cxx, compiler_flags, workload.generate_baseline_cpp(size), num_runs),
+            })
+    return {
+        'py2tmp_version': _py2tmp.__version__,
+        'compiler': _get_compiler_version(cxx),
+        'compiler_flags': compiler_flags,
+        'results': results,
+    }
+
+def _print_results(results: Dict[str, Any]):
+    print('py2tmp %s, %s' % (results['py2tmp_version'], results['compiler']))
+    print('%-20s %6s %12s %12s %12s %12s %12s %12s' % ('Workload', 'Size', 'TMPPy (s)', 'C++ (s)', 'TMPPy (MB)',
+                                                        'C++ (MB)', 'TMPPy inst.', 'C++ inst.'))
+    for result in results['results']:
+        print('%-20s %6d %12.3f %12.3f %12.1f %12.1f %12s %12s' % (
+            result['workload'], result['size'],
+            result['tmppy']['time_seconds'], result['baseline']['time_seconds'],
+            result['tmppy']['peak_memory_kb'] / 1024, result['baseline']['peak_memory_kb'] / 1024,
+            result['tmppy']['num_instantiations'], result['baseline']['num_instantiations']))
+
+def _print_comparison(old_results: Dict[str, Any], new_results: Dict[str, Any]):
+    print('Old: py2tmp %s, %s' % (old_results['py2tmp_version'], old_results['compiler']))
+    print('New: py2tmp %s, %s' % (new_results['py2tmp_version'], new_results['compiler']))
+    old_result_by_key = {(result['workload'], result['size']): result for result in old_results['results']}
+    print('%-20s %6s %12s %12s %8s %12s %12s' % ('Workload', 'Size', 'Old (s)', 'New (s)', 'Change',
+                                                 'Old inst.', 'New inst.'))
+    for result in new_results['results']:
+        old_result = old_result_by_key.get((result['workload'], result['size']))
+        if old_result is None:
+            continue
+        old_time_seconds = old_result['tmppy']['time_seconds']
+        new_time_seconds = result['tmppy']['time_seconds']
+        print('%-20s %6d %12.3f %12.3f %+7.1f%% %12s %12s' % (
+            result['workload'], result['size'], old_time_seconds, new_time_seconds,
+            (new_time_seconds / old_time_seconds - 1) * 100,
+            old_result['tmppy']['num_instantiations'], result['tmppy']['num_instantiations']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the C++ compile time of the code generated by py2tmp, '
+                                                 'compared to equivalent hand-written C++.')
+    parser.add_argument('--cxx', default=os.environ.get('CXX', 'c++'), help='The C++ compiler to use.')
+    parser.add_argument('--workloads', nargs='+', choices=[workload.name for workload in WORKLOADS],
+                        help='The workloads to run (by default, all of them): '
+                             + ' '.join('"%s": %s' % (workload.name, workload.description) for workload in WORKLOADS))
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='The sizes to use for each workload (by default, a few sizes specific to each workload).')
+    parser.add_argument('--num-runs', type=int, default=3, help='The best time out of this many runs is reported.')
+    parser.add_argument('--cxxflag', action='append', dest='compiler_flags', default=[], metavar='FLAG',
+                        help='An additional flag to pass to the compiler. Can be specified multiple times.')
+    parser.add_argument('--output', metavar='FILE', help='Also write the results to this file, as JSON.')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='Compare the results with the ones in this file, written by a previous run with '
+                             '--output.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    workloads = [workload for workload in WORKLOADS if not args.workloads or workload.name in args.workloads]
+    results = run_benchmark(args.cxx, workloads, args.sizes, args.num_runs, args.compiler_flags)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2, sort_keys=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    elif args.compare:
+        with open(args.compare) as old_results_file:
+            _print_comparison(json.load(old_results_file), results)
+    else:
+        _print_results(results)
+
+if __name__ == '__main__':
+    main()
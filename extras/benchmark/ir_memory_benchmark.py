@@ -0,0 +1,180 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''Measures the memory used by the IRs of a large synthetic TMPPy module.
+
+For each IR (IR3, IR2, IR1 and IR0, both before and after the optimizations) this reports the number of nodes and the
+total size of the objects reachable from the IR (nodes, their attribute storage and the containers/strings they
+reference; objects shared between nodes are counted once). It also reports the peak memory allocated during the whole
+conversion, as measured by tracemalloc.
+
+Example usage:
+    PYTHONPATH=. python extras/benchmark/ir_memory_benchmark.py --num-functions 200
+'''
+
+import argparse
+import itertools
+import json
+import sys
+import tracemalloc
+from enum import Enum
+
+import typed_ast.ast3 as ast
+
+from _py2tmp import (
+    ast_to_ir3,
+    ir3_to_ir2,
+    ir2_to_ir1,
+    ir1_to_ir0,
+    optimize_ir3,
+    optimize_ir0,
+    ir0_to_cpp,
+    utils,
+)
+
+_FUNCTION_TEMPLATE = '''
+class MyError{n}(Exception):
+    def __init__(self, b: bool):
+        self.message = 'Error {n}'
+        self.b = b
+
+def f{n}(x: Type, n: int) -> Type:
+    if n == 0:
+        return x
+    else:
+        y = Type.pointer(x)
+        z = Type.pointer(y)
+        return f{n}(z, n-1)
+
+def g{n}(b: bool, t: Type):
+    return {{f{n}(t, 2) for x in {{b, True}}}}
+
+def h{n}(b: bool):
+    if b:
+        raise MyError{n}(b)
+    return 42
+
+def k{n}(b: bool):
+    try:
+        x = h{n}(b)
+        return x + {n}
+    except MyError{n} as e:
+        return 0
+'''
+
+def generate_module(num_functions: int) -> str:
+    return 'from tmppy import Type\n' + ''.join(_FUNCTION_TEMPLATE.format(n=n) for n in range(num_functions))
+
+def _iter_referenced_objects(obj):
+    # Attribute storage of IR nodes (either a __dict__ or __slots__) is included in sys.getsizeof(obj), except for the
+    # __dict__ that we yield separately.
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        yield from obj
+    elif isinstance(obj, dict):
+        yield from obj.keys()
+        yield from obj.values()
+    elif isinstance(obj, (str, bytes, bool, int, float, Enum)) or obj is None:
+        pass
+    else:
+        if hasattr(obj, '__dict__'):
+            yield obj.__dict__
+        for _, value in utils.iter_fields(obj):
+            yield value
+
+def measure_ir(ir):
+    '''Returns (num_nodes, num_bytes) for the given IR.'''
+    num_nodes = 0
+    num_bytes = 0
+    visited_ids = set()
+    objects_to_visit = [ir]
+    while objects_to_visit:
+        obj = objects_to_visit.pop()
+        if id(obj) in visited_ids or isinstance(obj, Enum) or obj is None or isinstance(obj, bool):
+            continue
+        visited_ids.add(id(obj))
+        num_bytes += sys.getsizeof(obj)
+        if not isinstance(obj, (list, tuple, set, frozenset, dict, str, bytes, int, float)):
+            num_nodes += 1
+        objects_to_visit.extend(_iter_referenced_objects(obj))
+    return num_nodes, num_bytes
+
+def run_benchmark(num_functions: int):
+    python_source = generate_module(num_functions)
+    source_ast = ast.parse(python_source, filename='benchmark.py')
+
+    def identifier_generator_fun():
+        for i in itertools.count():
+            yield 'TmppyInternal_%s' % i
+    identifier_generator = iter(identifier_generator_fun())
+
+    tracemalloc.start()
+    baseline_memory, _ = tracemalloc.get_traced_memory()
+
+    irs = []
+    module_ir3 = ast_to_ir3.module_ast_to_ir3(source_ast, 'benchmark.py', python_source.splitlines())
+    irs.append(('ir3', module_ir3))
+    module_ir3 = optimize_ir3.optimize_module(module_ir3)
+    irs.append(('optimized_ir3', module_ir3))
+    module_ir2 = ir3_to_ir2.module_to_ir2(module_ir3, identifier_generator)
+    irs.append(('ir2', module_ir2))
+    module_ir1 = ir2_to_ir1.module_to_ir1(module_ir2)
+    irs.append(('ir1', module_ir1))
+    header_ir0 = ir1_to_ir0.module_to_ir0(module_ir1, identifier_generator)
+    irs.append(('ir0', header_ir0))
+    header_ir0 = optimize_ir0.optimize_header(header_ir0, identifier_generator)
+    irs.append(('optimized_ir0', header_ir0))
+    ir0_to_cpp.header_to_cpp(header_ir0, identifier_generator)
+
+    current_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results = {
+        'num_functions': num_functions,
+        'retained_memory_bytes': current_memory - baseline_memory,
+        'peak_memory_bytes': peak_memory - baseline_memory,
+        'irs': [],
+    }
+    for name, ir in irs:
+        num_nodes, num_bytes = measure_ir(ir)
+        results['irs'].append({
+            'name': name,
+            'num_nodes': num_nodes,
+            'num_bytes': num_bytes,
+            'bytes_per_node': num_bytes / num_nodes if num_nodes else 0,
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures the memory used by the IRs of a synthetic TMPPy module.')
+    parser.add_argument('--num-functions', type=int, default=100,
+                        help='The number of groups of functions in the generated module.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.num_functions)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('%-15s %10s %14s %14s' % ('IR', 'Nodes', 'Bytes', 'Bytes/node'))
+    for ir_results in results['irs']:
+        print('%-15s %10d %14d %14.1f' % (ir_results['name'], ir_results['num_nodes'], ir_results['num_bytes'],
+                                          ir_results['bytes_per_node']))
+    print()
+    print('Memory retained after the conversion: %d bytes' % results['retained_memory_bytes'])
+    print('Peak memory during the conversion:    %d bytes' % results['peak_memory_bytes'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''Measures how the time taken by convert_to_cpp() scales with the number of functions in a module.
+
+The generated modules contain chains of functions (each calling the previous one), some of which are recursive, so the
+dependency graphs are deep and contain (small) cycles.
+
+Example usage:
+    PYTHONPATH=. python extras/benchmark/module_scaling_benchmark.py --sizes 100 1000 10000
+'''
+
+import argparse
+import json
+import time
+from typing import List
+
+from _py2tmp import main as py2tmp_main
+from _py2tmp.profiling import CompilationStats
+
+_FUNCTION_TEMPLATE = '''
+def f{n}(x: Type, n: int) -> Type:
+    if n == 0:
+        return {base_case}
+    else:
+        return f{n}(Type.pointer(x), n - 1)
+
+def g{n}(x: Type) -> Type:
+    return f{n}(Type.const(x), 2)
+'''
+
+def generate_module(num_functions: int) -> str:
+    # Each function group defines two functions.
+    function_groups = []
+    for n in range(num_functions // 2):
+        base_case = 'g%s(x)' % (n - 1) if n > 0 else 'x'
+        function_groups.append(_FUNCTION_TEMPLATE.format(n=n, base_case=base_case))
+    return 'from tmppy import Type\n' + ''.join(function_groups)
+
+def run_benchmark(sizes: List[int]):
+    results = []
+    for size in sizes:
+        python_source = generate_module(size)
+        stats = CompilationStats(track_memory=False)
+        start_time = time.perf_counter()
+        py2tmp_main.convert_to_cpp(python_source, filename='benchmark.py', stats=stats)
+        time_seconds = time.perf_counter() - start_time
+        results.append({
+            'num_functions': size,
+            'time_seconds': time_seconds,
+            'time_per_function_milliseconds': time_seconds / size * 1e3,
+            'stage_time_seconds': {stage.name: stage.wall_time_seconds for stage in stats.stages},
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures how convert_to_cpp() scales with the size of a module.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 300, 1000, 3000, 10000],
+                        help='The numbers of functions in the generated modules.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    stage_names = list(results[0]['stage_time_seconds'].keys())
+    print(('%10s %10s %12s' + ' %14s' * len(stage_names)) % (('Functions', 'Time (s)', 'ms/function') + tuple(stage_names)))
+    for size_results in results:
+        print(('%10d %10.2f %12.2f' + ' %14.2f' * len(stage_names)) % (
+            (size_results['num_functions'], size_results['time_seconds'], size_results['time_per_function_milliseconds'])
+            + tuple(size_results['stage_time_seconds'][stage_name] for stage_name in stage_names)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+'''Checks that the time and memory taken by each stage of convert_to_cpp() scale (almost) linearly with the input.
+
+The synthetic modules have 3 parameters: the number of functions, the nesting depth of the if-else statements in each
+function and the comprehension density (the fraction of the functions that also have a list comprehension). One of them
+(--vary) is multiplied by 2 at each step, starting from its --start value, while the others stay fixed.
+
+For the whole conversion and for each stage, the empirical complexity exponent k (so that time ~ size^k) is estimated
+with a least-squares fit in log-log space, and the benchmark fails (exit code 1) if it exceeds --max-exponent. E.g. the
+default, log2(2.5) ~= 1.32, fails if doubling the size more than 2.5x's the time. Stages that take less than
+--min-stage-time-seconds even at the largest size are too noisy to check, so they're only reported.
+
+Example usage:
+    PYTHONPATH=. python extras/benchmark/scaling_regression_benchmark.py --vary num_functions --start 50 --steps 4
+    PYTHONPATH=. python extras/benchmark/scaling_regression_benchmark.py --vary nesting_depth --start 2 --steps 4
+'''
+
+import argparse
+import gc
+import json
+import math
+import sys
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any
+
+from _py2tmp import main as py2tmp_main
+from _py2tmp.profiling import CompilationStats
+
+_PARAMETER_NAMES = ('num_functions', 'nesting_depth', 'comprehension_density')
+
+def generate_module(num_functions: int, nesting_depth: int, comprehension_density: float) -> str:
+    '''Generates a module with the given shape.
+
+    Each function has if-else statements nested nesting_depth times and calls the previous function (so the dependency
+    graph is a long chain). A fraction comprehension_density of the functions also has a list comprehension that uses
+    that function.
+    '''
+    lines = ['from tmppy import Type', '']
+    for i in range(num_functions):
+        lines.append('def f%s(x: Type) -> Type:' % i)
+        indent = '    '
+        for depth in range(nesting_depth):
+            lines.append('%sif x == Type(\'T%s\'):' % (indent, depth))
+            if depth == 0 and i > 0:
+                lines.append('%s    return f%s(Type.pointer(x))' % (indent, i - 1))
+            else:
+                lines.append('%s    return Type.pointer(x)' % indent)
+            lines.append('%selse:' % indent)
+            indent += '    '
+        lines.append('%sreturn x' % indent)
+        lines.append('')
+
+        if int((i + 1) * comprehension_density) > int(i * comprehension_density):
+            lines.append('def c%s(x: Type):' % i)
+            lines.append('    return [f%s(y) for y in [x, Type.pointer(x), Type.const(x)]]' % i)
+            lines.append('')
+    return '\n'.join(lines)
+
+def _measure(python_source: str, num_runs: int) -> Dict[str, Any]:
+    '''Returns the best times (out of num_runs runs) and the peak memory for the whole conversion and for each stage.'''
+    best_time_seconds = None
+    best_stage_time_seconds = OrderedDict()  # type: Dict[str, float]
+    for _ in range(num_runs):
+        # So that the garbage left by the previous runs doesn't slow down this one.
+        gc.collect()
+        stats = CompilationStats(track_memory=False)
+        start_time = time.perf_counter()
+        py2tmp_main.convert_to_cpp(python_source, filename='benchmark.py', stats=stats)
+        time_seconds = time.perf_counter() - start_time
+        if best_time_seconds is None or time_seconds < best_time_seconds:
+            best_time_seconds = time_seconds
+        for stage in stats.stages:
+            if stage.name not in best_stage_time_seconds or stage.wall_time_seconds < best_stage_time_seconds[stage.name]:
+                best_stage_time_seconds[stage.name] = stage.wall_time_seconds
+
+    # Tracking memory slows down the conversion, so it's done in a separate run.
+    gc.collect()
+    stats = CompilationStats(track_memory=True)
+    py2tmp_main.convert_to_cpp(python_source, filename='benchmark.py', stats=stats)
+
+    return {
+        'time_seconds': best_time_seconds,
+        'stage_time_seconds': best_stage_time_seconds,
+        'peak_memory_bytes': max(stage.peak_memory_bytes for stage in stats.stages),
+        'stage_peak_memory_bytes': OrderedDict((stage.name, stage.peak_memory_bytes) for stage in stats.stages),
+    }
+
+def estimate_exponent(sizes: List[float], values: List[float]) -> float:
+    '''Returns k such that values ~= c * sizes^k, using a least-squares fit of log(values) against log(sizes).'''
+    points = [(math.log(size), math.log(value))
+              for size, value in zip(sizes, values)
+              if value > 0]
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance_x == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance_x
+
+def run_benchmark(parameters: Dict[str, Any],
+                  vary: str,
+                  start: float,
+                  steps: int,
+                  num_runs: int,
+                  max_exponent: float,
+                  max_memory_exponent: float,
+                  min_stage_time_seconds: float) -> Dict[str, Any]:
+    sizes = [start * 2 ** step for step in range(steps)]
+    if vary != 'comprehension_density':
+        sizes = [int(size) for size in sizes]
+    measurements = []
+    for size in sizes:
+        module_parameters = dict(parameters)
+        module_parameters[vary] = size
+        measurement = _measure(generate_module(**module_parameters), num_runs)
+        measurement['size'] = size
+        measurements.append(measurement)
+
+    checks = []
+    def check(name: str, values: List[float], limit: float, is_checked: bool):
+        exponent = estimate_exponent(sizes, values)
+        checks.append({
+            'name': name,
+            'exponent': exponent,
+            'max_exponent': limit,
+            'checked': is_checked,
+            'failed': is_checked and exponent > limit,
+        })
+
+    check('total time', [measurement['time_seconds'] for measurement in measurements], max_exponent, True)
+    for stage_name in measurements[-1]['stage_time_seconds'].keys():
+        stage_times = [measurement['stage_time_seconds'].get(stage_name, 0.0) for measurement in measurements]
+        check('%s time' % stage_name, stage_times, max_exponent, stage_times[-1] >= min_stage_time_seconds)
+    check('peak memory', [measurement['peak_memory_bytes'] for measurement in measurements], max_memory_exponent, True)
+
+    return {
+        'parameters': parameters,
+        'vary': vary,
+        'measurements': measurements,
+        'checks': checks,
+        'failed': any(check['failed'] for check in checks),
+    }
+
+def _print_results(results: Dict[str, Any]):
+    print('Varying %s, with %s' % (results['vary'],
+                                   ', '.join('%s=%s' % (name, value)
+                                             for name, value in sorted(results['parameters'].items())
+                                             if name != results['vary'])))
+    print('%12s %12s %16s' % ('Size', 'Time (s)', 'Peak memory (MB)'))
+    for measurement in results['measurements']:
+        print('%12s %12.3f %16.1f' % (measurement['size'], measurement['time_seconds'],
+                                       measurement['peak_memory_bytes'] / 1024 / 1024))
+    print()
+    print('%-50s %10s %10s %8s' % ('Check', 'Exponent', 'Max', 'Result'))
+    for check in results['checks']:
+        if not check['checked']:
+            result = '(noisy)'
+        elif check['failed']:
+            result = 'FAILED'
+        else:
+            result = 'OK'
+        print('%-50s %10.2f %10.2f %8s' % (check['name'], check['exponent'], check['max_exponent'], result))
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks that convert_to_cpp() scales (almost) linearly with the size '
+                                                 'of the input.')
+    parser.add_argument('--vary', choices=_PARAMETER_NAMES, default='num_functions',
+                        help='The parameter that is doubled at each step.')
+    parser.add_argument('--start', type=float, help='The value of the varying parameter in the first step.')
+    parser.add_argument('--steps', type=int, default=4, help='The number of steps.')
+    parser.add_argument('--num-functions', type=int, default=50, help='The number of functions, if not varying.')
+    parser.add_argument('--nesting-depth', type=int, default=2,
+                        help='The nesting depth of the if-else statements, if not varying.')
+    parser.add_argument('--comprehension-density', type=float, default=0.25,
+                        help='The fraction of functions that also have a list comprehension, if not varying.')
+    parser.add_argument('--num-runs', type=int, default=3, help='The best time out of this many runs is used.')
+    parser.add_argument('--max-exponent', type=float, default=math.log(2.5, 2),
+                        help='The maximum allowed complexity exponent for the time. The default fails if doubling '
+                             'the size more than 2.5x\'s the time.')
+    parser.add_argument('--max-memory-exponent', type=float, default=math.log(2.5, 2),
+                        help='The maximum allowed complexity exponent for the peak memory.')
+    parser.add_argument('--min-stage-time-seconds', type=float, default=0.05,
+                        help='Stages that take less than this even with the largest size are not checked.')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON.')
+    args = parser.parse_args()
+
+    parameters = {
+        'num_functions': args.num_functions,
+        'nesting_depth': args.nesting_depth,
+        'comprehension_density': args.comprehension_density,
+    }
+    if args.start is not None:
+        start = args.start
+    else:
+        start = {'num_functions': 25, 'nesting_depth': 2, 'comprehension_density': 0.125}[args.vary]
+    results = run_benchmark(parameters, args.vary, start, args.steps, args.num_runs, args.max_exponent,
+                            args.max_memory_exponent, args.min_stage_time_seconds)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_results(results)
+
+    if results['failed']:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
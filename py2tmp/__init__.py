@@ -12,4 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from _py2tmp.main import convert_to_cpp, main
+from _py2tmp import __version__
+from _py2tmp.compilation_cache import CompilationCache
+from _py2tmp.optimize_ir0 import OptimizationOptions
+from _py2tmp.profiling import CompilationStats, PassStats
+from _py2tmp.module_interface import ModuleInterface
+from _py2tmp.instantiation_cost import InstantiationCost, SizePolynomial
+from _py2tmp.main import (convert_to_cpp, convert_to_split_cpp, convert_to_cpp_with_shared_templates,
+                          shared_support_header_to_cpp, convert_module_to_cpp, compute_module_interface,
+                          estimate_instantiation_costs, compile_batch, BatchCompilationResult, main)
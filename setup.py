@@ -48,6 +48,7 @@ setuptools.setup(
     packages=setuptools.find_packages(exclude=['*.tests', 'extras']),
     data_files=[('include/tmppy', ['include/tmppy/tmppy.h'])],
     entry_points={
-        'console_scripts': ['py2tmp=py2tmp:main'],
+        'console_scripts': ['py2tmp=py2tmp:main', 'py2tmp-client=_py2tmp.client:main',
+                            'py2tmp-time-trace=_py2tmp.time_trace:main'],
     },
 )
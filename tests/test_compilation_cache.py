@@ -0,0 +1,92 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import tempfile
+
+from _py2tmp import optimize_ir0
+from py2tmp import convert_to_cpp, CompilationCache
+
+_SOURCE = '''
+def f(x: bool):
+    return x
+'''
+
+def _cache_entries(cache_dir):
+    return sorted(file_name for file_name in os.listdir(cache_dir) if file_name.endswith('.h'))
+
+def test_compilation_cache_hit():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CompilationCache(cache_dir)
+        result = convert_to_cpp(_SOURCE, cache=cache)
+        assert len(_cache_entries(cache_dir)) == 1
+        assert convert_to_cpp(_SOURCE, cache=cache) == result
+        assert len(_cache_entries(cache_dir)) == 1
+
+def test_compilation_cache_key_depends_on_source_and_options():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CompilationCache(cache_dir)
+        convert_to_cpp(_SOURCE, cache=cache)
+        convert_to_cpp(_SOURCE + '\nassert f(True)\n', cache=cache)
+        convert_to_cpp(_SOURCE, filename='foo.py', cache=cache)
+        assert len(_cache_entries(cache_dir)) == 3
+
+def test_compilation_cache_evicts_least_recently_used_entries():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CompilationCache(cache_dir, max_size_bytes=10)
+        cache.put('a', 'x' * 6)
+        os.utime(os.path.join(cache_dir, 'a.h'), (1, 1))
+        cache.put('b', 'y' * 6)
+        assert cache.get('a') is None
+        assert cache.get('b') == 'y' * 6
+
+def _count_optimized_templates(monkeypatch):
+    optimized_template_names = []
+    perform_local_optimizations_on_template_defn = optimize_ir0.perform_local_optimizations_on_template_defn
+    def wrapper(template_defn, *args, **kwargs):
+        optimized_template_names.append(template_defn.name)
+        return perform_local_optimizations_on_template_defn(template_defn, *args, **kwargs)
+    monkeypatch.setattr(optimize_ir0, 'perform_local_optimizations_on_template_defn', wrapper)
+    return optimized_template_names
+
+def test_compilation_cache_only_reoptimizes_changed_templates(monkeypatch):
+    optimized_template_names = _count_optimized_templates(monkeypatch)
+    source = '''
+def f(x: int):
+    return x + 2
+
+def g(x: int):
+    return f(x) * 5
+'''
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CompilationCache(cache_dir)
+        convert_to_cpp(source, cache=cache)
+        assert 'f' in optimized_template_names
+        assert 'g' in optimized_template_names
+
+        # Adding a function before the others changes all the internal identifiers, but the templates generated for the
+        # other functions can still be reused.
+        del optimized_template_names[:]
+        convert_to_cpp('def h(b: bool):\n    return b\n' + source, cache=cache)
+        assert optimized_template_names == ['h']
+
+        # Changing f requires optimizing again f and g (that depends on f), but not h.
+        del optimized_template_names[:]
+        result = convert_to_cpp('def h(b: bool):\n    return b\n' + source.replace('x + 2', 'x + 3'),
+                                cache=cache)
+        assert 'f' in optimized_template_names
+        assert 'g' in optimized_template_names
+        assert 'h' not in optimized_template_names
+        assert '3LL' in result
@@ -0,0 +1,45 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import tempfile
+
+from py2tmp import convert_to_cpp, compile_batch
+
+def _write_file(dir, file_name, content):
+    path = os.path.join(dir, file_name)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+def test_compile_batch_success_and_failure():
+    with tempfile.TemporaryDirectory() as dir:
+        valid_source = 'def f(x: bool):\n    return x\n'
+        paths = [
+            _write_file(dir, 'valid1.py', valid_source),
+            _write_file(dir, 'invalid.py', 'x = 1\n'),
+            _write_file(dir, 'valid2.py', valid_source),
+            _write_file(dir, 'not_python.txt', valid_source),
+        ]
+        results = compile_batch(paths, jobs=2)
+        assert [result.source_file_name for result in results] == paths
+        assert results[0].error is None
+        assert results[0].cpp_source == convert_to_cpp(valid_source, paths[0])
+        assert results[0].output_file_name == os.path.join(dir, 'valid1.h')
+        assert results[1].cpp_source is None
+        assert 'This Python construct is not supported in TMPPy' in results[1].error
+        assert results[2].error is None
+        assert results[3].cpp_source is None
+        assert 'does not end with .py' in results[3].error
@@ -0,0 +1,70 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import tempfile
+import threading
+
+import pytest
+
+import _py2tmp
+from _py2tmp import client, server
+from py2tmp import convert_to_cpp, compile_batch
+
+def _write_file(dir, file_name, content):
+    path = os.path.join(dir, file_name)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+def _start_server(socket_path):
+    compilation_server = server.CompilationServer(socket_path,
+                                                  compile_files=lambda source_file_names, format: compile_batch(source_file_names,
+                                                                                                                jobs=1,
+                                                                                                                format=format))
+    thread = threading.Thread(target=compilation_server.serve_until_shutdown)
+    thread.start()
+    return thread
+
+def test_compile_server():
+    with tempfile.TemporaryDirectory() as dir:
+        socket_path = os.path.join(dir, 'py2tmp.sock')
+        thread = _start_server(socket_path)
+        try:
+            valid_source = 'def f(x: bool):\n    return x\n'
+            paths = [
+                _write_file(dir, 'valid.py', valid_source),
+                _write_file(dir, 'invalid.py', 'x = 1\n'),
+            ]
+            assert client.ping(socket_path) == _py2tmp.__version__
+            results = client.compile_files(socket_path, paths)
+            assert [result['source_file_name'] for result in results] == paths
+            assert results[0]['error'] is None
+            assert results[0]['cpp_source'] == convert_to_cpp(valid_source, paths[0])
+            assert results[0]['output_file_name'] == os.path.join(dir, 'valid.h')
+            assert results[1]['cpp_source'] is None
+            assert 'This Python construct is not supported in TMPPy' in results[1]['error']
+
+            with pytest.raises(client.ServerError, match='Unknown command'):
+                client.send_request(socket_path, {'command': 'foo'})
+        finally:
+            client.shutdown(socket_path)
+            thread.join()
+        assert not os.path.exists(socket_path)
+
+def test_client_without_server():
+    with tempfile.TemporaryDirectory() as dir:
+        with pytest.raises(client.ServerError, match='Could not connect to the py2tmp server'):
+            client.ping(os.path.join(dir, 'py2tmp.sock'))
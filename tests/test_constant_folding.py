@@ -0,0 +1,64 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from _py2tmp import ir0, optimize_ir0, utils
+
+def _type_var(name: str):
+    return ir0.AtomicTypeLiteral.for_local(cpp_type=name, type=ir0.TypeType())
+
+def _f(arg: ir0.Expr, instantiation_might_trigger_static_asserts: bool):
+    template_expr = ir0.AtomicTypeLiteral.for_nonlocal_template(cpp_type='F',
+                                                               arg_types=[ir0.TypeType()],
+                                                               is_metafunction_that_may_return_error=False)
+    return ir0.TemplateInstantiation(template_expr=template_expr,
+                                     args=[arg],
+                                     instantiation_might_trigger_static_asserts=instantiation_might_trigger_static_asserts)
+
+def _fold(body):
+    arg_decl = ir0.TemplateArgDecl(type=ir0.TypeType(), name='T')
+    template_defn = ir0.TemplateDefn(args=[arg_decl],
+                                     main_definition=ir0.TemplateSpecialization(args=[arg_decl], patterns=None, body=body),
+                                     specializations=[],
+                                     name='G',
+                                     description='',
+                                     result_element_names=['type'])
+    template_defn = optimize_ir0.perform_constant_folding(template_defn,
+                                                          identifier_generator=iter([]),
+                                                          inline_template_instantiations_with_multiple_references=False)
+    return utils.ir_to_string(template_defn.main_definition.body)
+
+def test_constant_folding_inlines_chains():
+    body = [ir0.Typedef(name='X%s' % i, expr=ir0.PointerTypeExpr(_type_var('X%s' % (i - 1) if i > 0 else 'T')))
+            for i in range(100)]
+    body.append(ir0.Typedef(name='type', expr=_type_var('X99')))
+    expected_expr = _type_var('T')
+    for _ in range(100):
+        expected_expr = ir0.PointerTypeExpr(expected_expr)
+    assert _fold(body) == utils.ir_to_string([ir0.Typedef(name='type', expr=expected_expr)])
+
+def test_constant_folding_does_not_move_instantiations_past_static_asserts():
+    static_assert = ir0.StaticAssert(expr=ir0.Literal(True), message='error')
+    body = [ir0.Typedef(name='X', expr=_f(_type_var('T'), instantiation_might_trigger_static_asserts=True)),
+            static_assert,
+            ir0.Typedef(name='type', expr=_f(_type_var('X'), instantiation_might_trigger_static_asserts=False))]
+    assert _fold(body) == utils.ir_to_string(body)
+
+def test_constant_folding_moves_instantiations_that_cannot_trigger_static_asserts():
+    static_assert = ir0.StaticAssert(expr=ir0.Literal(True), message='error')
+    body = [ir0.Typedef(name='X', expr=_f(_type_var('T'), instantiation_might_trigger_static_asserts=False)),
+            static_assert,
+            ir0.Typedef(name='type', expr=_f(_type_var('X'), instantiation_might_trigger_static_asserts=False))]
+    assert _fold(body) == utils.ir_to_string([static_assert,
+                                              ir0.Typedef(name='type', expr=_f(_f(_type_var('T'), False), False))])
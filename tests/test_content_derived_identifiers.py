@@ -0,0 +1,94 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+from _py2tmp.testing.utils import expect_cpp_code_success
+from py2tmp import convert_to_cpp
+
+_SOURCE = '''
+from tmppy import Type
+
+def f(x: Type):
+    if x == Type('int'):
+        return 1
+    else:
+        return 2
+
+def g(x: Type):
+    if x == Type('float'):
+        return Type('double')
+    else:
+        return x
+
+def is_even(n: int) -> bool:
+    if n == 0:
+        return True
+    else:
+        return is_odd(n - 1)
+
+def is_odd(n: int) -> bool:
+    if n == 0:
+        return False
+    else:
+        return is_even(n - 1)
+
+assert g(Type('int')) == Type('int')
+assert is_even(4)
+assert [g(x) for x in [Type('int'), Type('float')]] == [Type('int'), Type('double')]
+'''
+
+_SOURCE_WITH_CHANGED_F = _SOURCE.replace('''\
+    else:
+        return 2
+''', '''\
+    elif x == Type('char'):
+        return 3
+    else:
+        return 4
+''')
+
+def _get_struct_definitions(cpp_source: str):
+    return set(re.findall('^struct .*?^};$', cpp_source, re.MULTILINE | re.DOTALL))
+
+def test_content_derived_identifiers_unchanged_functions_generate_the_same_code():
+    result = convert_to_cpp(_SOURCE, naming='content-derived')
+    result_with_changed_f = convert_to_cpp(_SOURCE_WITH_CHANGED_F, naming='content-derived')
+
+    changed_struct_definitions = _get_struct_definitions(result) ^ _get_struct_definitions(result_with_changed_f)
+    assert changed_struct_definitions
+    # The templates for g, is_even and is_odd and the helper templates that they use didn't change.
+    unchanged_template_names = {'g', 'is_even', 'is_odd'}
+    for struct_definition in _get_struct_definitions(result):
+        if struct_definition.startswith(('struct g ', 'struct is_even ', 'struct is_odd ')):
+            unchanged_template_names |= set(re.findall('TmppyInternal_h[0-9a-f]+(?=<)', struct_definition))
+    assert len(unchanged_template_names) > 3
+    for struct_definition in changed_struct_definitions:
+        assert re.match('struct ([A-Za-z0-9_]+)', struct_definition).group(1) not in unchanged_template_names
+
+def test_sequential_identifiers_renumber_the_following_functions():
+    result = convert_to_cpp(_SOURCE)
+    result_with_changed_f = convert_to_cpp(_SOURCE_WITH_CHANGED_F)
+    changed_struct_definitions = _get_struct_definitions(result) ^ _get_struct_definitions(result_with_changed_f)
+    assert any(struct_definition.startswith('struct g ')
+               for struct_definition in changed_struct_definitions)
+
+def test_content_derived_identifiers_are_deterministic():
+    assert convert_to_cpp(_SOURCE, naming='content-derived') == convert_to_cpp(_SOURCE, naming='content-derived')
+
+def test_content_derived_identifiers_compile():
+    for source in (_SOURCE, _SOURCE_WITH_CHANGED_F):
+        cpp_source = convert_to_cpp(source, naming='content-derived')
+        assert re.search('TmppyInternal_[0-9]', cpp_source) is None
+        expect_cpp_code_success(source, module_ir2=None, module_ir1=None, cxx_source=cpp_source)
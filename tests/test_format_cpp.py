@@ -0,0 +1,67 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import textwrap
+
+from _py2tmp.ir0_to_cpp import format_cpp
+from py2tmp import convert_to_cpp
+
+def test_format_cpp_reindents_and_removes_empty_lines():
+    source = '''\
+              template <typename T>
+        struct Foo {
+                  // Braces in comments are ignored: {
+              using type = T;
+
+          template <bool b>
+            struct Bar {
+        static_assert(b, "Braces in strings are ignored: }");
+              };
+            };
+        '''
+    assert format_cpp(source) == textwrap.dedent('''\
+        template <typename T>
+        struct Foo {
+          // Braces in comments are ignored: {
+          using type = T;
+          template <bool b>
+          struct Bar {
+            static_assert(b, "Braces in strings are ignored: }");
+          };
+        };
+        ''')
+
+def test_convert_to_cpp_native_format():
+    source = '''\
+def f(x: bool):
+    return x
+'''
+    assert convert_to_cpp(source, format='native') == textwrap.dedent('''\
+        #include <tmppy/tmppy.h>
+        #include <type_traits>
+        template <typename>
+        struct CheckIfError;
+        template <bool TmppyInternal_5>
+        struct f;
+        template <typename>
+        struct CheckIfError {
+          using type = void;
+        };
+        template <bool TmppyInternal_5>
+        struct f {
+          using error = void;
+          static constexpr bool value = TmppyInternal_5;
+        };
+        ''')
@@ -0,0 +1,40 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import copy
+import pickle
+
+import pytest
+
+from _py2tmp import ir0
+
+def _pointer_to_int():
+    return ir0.PointerTypeExpr(ir0.AtomicTypeLiteral.for_nonlocal_type('int'))
+
+def test_equal_exprs_are_the_same_object():
+    assert _pointer_to_int() is _pointer_to_int()
+    assert ir0.TemplateType([ir0.BoolType(), ir0.TypeType()]) is ir0.TemplateType([ir0.BoolType(), ir0.TypeType()])
+    assert ir0.PointerTypeExpr(ir0.AtomicTypeLiteral.for_nonlocal_type('float')) is not _pointer_to_int()
+
+def test_exprs_are_immutable():
+    expr = _pointer_to_int()
+    with pytest.raises(AttributeError):
+        expr.type_expr = ir0.AtomicTypeLiteral.for_nonlocal_type('float')
+
+def test_copied_and_unpickled_exprs_are_interned():
+    expr = _pointer_to_int()
+    assert copy.deepcopy(expr) is expr
+    assert pickle.loads(pickle.dumps(expr)) is expr
+    assert hash(pickle.loads(pickle.dumps(expr))) == hash(expr)
@@ -0,0 +1,97 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+from py2tmp import estimate_instantiation_costs, compile_batch, SizePolynomial, CompilationCache
+
+_SOURCE = '''
+from tmppy import Type
+
+def identity(x: Type):
+    return x
+
+def factorial(n: int) -> int:
+    if n == 0:
+        return 1
+    else:
+        return n * factorial(n - 1)
+
+def pointers(x: Type, y: Type):
+    return [Type.pointer(z) for z in [x, y]]
+
+def factorials(x: int, y: int):
+    return [factorial(z) for z in [x, y]]
+
+def set_equals(x: Type, y: Type):
+    return {x, y} == {y}
+'''
+
+def test_size_polynomial():
+    n = SizePolynomial((0, 1))
+    p = 3 * n * n + n + 2
+    assert str(p) == '3*n^2 + n + 2'
+    assert p.degree == 2
+    assert p.evaluate(10) == 312
+    assert str(SizePolynomial((0,))) == '0'
+    assert SizePolynomial((1, 5)).max(SizePolynomial((3, 0, 1))) == SizePolynomial((3, 5, 1))
+
+def test_estimate_instantiation_costs():
+    costs = estimate_instantiation_costs(_SOURCE)
+
+    assert costs['identity'].num_instantiations.degree == 0
+    assert costs['identity'].max_depth.degree == 0
+    # Recursive templates are instantiated once per recursion step, and nested.
+    assert costs['factorial'].num_instantiations.degree == 1
+    assert costs['factorial'].max_depth.degree == 1
+    # The list comprehension instantiates a template for each element.
+    assert costs['pointers'].num_instantiations.degree == 1
+    # Each element instantiates the recursive template.
+    assert costs['factorials'].num_instantiations.degree == 2
+    assert costs['factorials'].max_depth.degree == 1
+    # Each element of each set is looked up in the other set.
+    assert costs['set_equals'].num_instantiations.degree == 2
+    assert costs['set_equals'].max_depth.degree == 0
+
+def test_estimate_instantiation_costs_only_reports_metafunctions():
+    assert set(estimate_instantiation_costs(_SOURCE).keys()) == {'identity', 'factorial', 'pointers', 'factorials',
+                                                                 'set_equals'}
+    assert set(estimate_instantiation_costs(_SOURCE, module_name='mylib.mod').keys()) == {
+        'identity', 'factorial', 'pointers', 'factorials', 'set_equals'}
+
+def test_compile_batch_cost_report():
+    with tempfile.TemporaryDirectory() as dir:
+        source_file_name = os.path.join(dir, 'mod.py')
+        with open(source_file_name, 'w') as f:
+            f.write(_SOURCE)
+        [result] = compile_batch([source_file_name], cost_report=True)
+        assert result.error is None
+        assert set(result.instantiation_costs.keys()) >= {'identity', 'factorial', 'pointers', 'factorials',
+                                                            'set_equals'}
+
+def test_compile_batch_cost_report_with_cache():
+    with tempfile.TemporaryDirectory() as dir:
+        source_file_name = os.path.join(dir, 'mod.py')
+        with open(source_file_name, 'w') as f:
+            f.write(_SOURCE)
+        cache = CompilationCache(os.path.join(dir, 'cache'))
+        compile_batch([source_file_name], cache=cache)
+        # The output is already in the cache, but the costs are still computed (from the same conversion).
+        [result] = compile_batch([source_file_name], cache=cache, profile=True, cost_report=True)
+        assert result.error is None
+        assert ({name: cost.to_json() for name, cost in result.instantiation_costs.items()}
+                == {name: cost.to_json() for name, cost in estimate_instantiation_costs(_SOURCE).items()})
+        assert [pass_stats.name for pass_stats in result.stats.stages].count('ir1_to_ir0') == 1
+        assert 'estimate_instantiation_costs' in [pass_stats.name for pass_stats in result.stats.stages]
@@ -0,0 +1,110 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from _py2tmp import interpret_ir3
+from _py2tmp.testing.utils import _convert_tmppy_source_to_ir3, _check_with_interpreter
+
+def _interpret(tmppy_source):
+    interpret_ir3.interpret_module(_convert_tmppy_source_to_ir3(tmppy_source))
+
+def test_types_normalized():
+    _interpret('''
+from tmppy import Type
+assert Type.reference(Type.rvalue_reference(Type('int'))) == Type.reference(Type('int'))
+assert Type.rvalue_reference(Type.rvalue_reference(Type('int'))) == Type.rvalue_reference(Type('int'))
+assert Type.const(Type.reference(Type('int'))) == Type.reference(Type('int'))
+assert Type.const(Type.array(Type('int'))) == Type.array(Type.const(Type('int')))
+assert Type.function(Type('int'), [Type.array(Type('int')), Type.const(Type('float'))]) \
+       == Type.function(Type('int'), [Type.pointer(Type('int')), Type('float')])
+assert Type.pointer(Type('int')) != Type.pointer(Type('float'))
+''')
+
+def test_int_division_rounds_towards_zero():
+    _interpret('''
+assert -7 // 2 == -3
+assert -7 % 2 == -1
+''')
+
+def test_most_specialized_match_branch_used():
+    _interpret('''
+from tmppy import Type, match
+def f(x: Type, y: Type):
+    return match(x, y)(lambda T, U: {
+        (Type.pointer(T), U):
+            1,
+        (Type.pointer(Type.pointer(T)), U):
+            2,
+        (T, U):
+            3,
+    })
+assert f(Type.pointer(Type.pointer(Type('int'))), Type('int')) == 2
+assert f(Type.pointer(Type('int')), Type('int')) == 1
+assert f(Type('int'), Type('int')) == 3
+''')
+
+def test_assertion_failure():
+    with pytest.raises(interpret_ir3.ProgramErrorException) as e:
+        _interpret('''
+assert 1 + 1 == 3, 'my message'
+''')
+    assert e.value.message.startswith('TMPPy assertion failed: my message\n<unknown>:2: ')
+
+def test_uncaught_exception():
+    with pytest.raises(interpret_ir3.ProgramErrorException) as e:
+        _interpret('''
+class MyError(Exception):
+    def __init__(self, n: int):
+        self.message = 'Something went wrong'
+        self.n = n
+def f(n: int):
+    if n == 0:
+        raise MyError(n)
+    return n
+def g(n: int):
+    try:
+        return f(n)
+    except MyError as e:
+        return e.n + 10
+assert g(0) == 10
+assert f(0) == 0
+''')
+    assert e.value.message == 'Something went wrong'
+
+def test_types_that_might_be_typedefs_not_interpreted():
+    with pytest.raises(interpret_ir3.CannotInterpretException):
+        _interpret('''
+from tmppy import Type
+assert Type('size_t') != Type('unsigned')
+''')
+
+def test_int64_overflow_not_interpreted():
+    with pytest.raises(interpret_ir3.CannotInterpretException):
+        _interpret('''
+assert 9223372036854775807 + 1 != 0
+''')
+
+def test_check_with_interpreter():
+    assert _check_with_interpreter('''
+from tmppy import Type
+assert Type('int') != Type('float')
+''')
+    assert not _check_with_interpreter('''
+from tmppy import Type
+assert Type('size_t') != Type('int')
+''')
+    assert _check_with_interpreter('''
+assert 1 == 2
+''', expected_error_regex='TMPPy assertion failed')
@@ -0,0 +1,53 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import inspect
+import pickle
+
+import pytest
+
+from _py2tmp import ir0, ir1, ir2, ir3, utils
+
+def _ir_classes():
+    for module in (ir0, ir1, ir2, ir3):
+        for _, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ == module.__name__ and hasattr(cls, '__slots__'):
+                yield cls
+
+@pytest.mark.parametrize('cls', _ir_classes(), ids=lambda cls: cls.__module__ + '.' + cls.__name__)
+def test_ir_nodes_have_no_dict(cls):
+    assert '__dict__' not in dir(cls)
+
+def test_get_field_names_includes_base_class_fields_first():
+    assert utils.get_field_names(ir3.FunctionType) == ('argtypes', 'returns')
+    assert utils.get_field_names(ir0.PointerTypeExpr) == ('type', 'type_expr')
+
+def test_iter_fields():
+    expr = ir3.BoolLiteral(value=True)
+    assert list(utils.iter_fields(expr)) == [('type', ir3.BoolType()), ('value', True)]
+
+def test_ir_to_string():
+    expr = ir3.BoolLiteral(value=True)
+    assert utils.ir_to_string(expr) == 'BoolLiteral(\n  type = BoolType(),\n  value = True)'
+
+def test_value_types_compare_by_fields():
+    assert ir3.ListType(ir3.BoolType()) == ir3.ListType(ir3.BoolType())
+    assert ir3.ListType(ir3.BoolType()) != ir3.ListType(ir3.IntType())
+    assert hash(ir3.ListType(ir3.BoolType())) == hash(ir3.ListType(ir3.BoolType()))
+
+def test_pickling_ir_nodes():
+    arg_decl = ir3.FunctionArgDecl(type=ir3.BoolType(), name='b')
+    unpickled_arg_decl = pickle.loads(pickle.dumps(arg_decl))
+    assert list(utils.iter_fields(unpickled_arg_decl)) == list(utils.iter_fields(arg_decl))
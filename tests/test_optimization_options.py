@@ -0,0 +1,101 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import tempfile
+
+from _py2tmp import optimize_ir0
+from py2tmp import convert_to_cpp, CompilationCache, CompilationStats, OptimizationOptions
+
+_SOURCE = '''
+def f(x: int):
+    return x + 1
+
+def g(x: int):
+    return f(x) * 2
+
+assert g(3) == 8
+'''
+
+def test_optimization_level_0_performs_no_optimizations():
+    stats = CompilationStats(track_memory=False)
+    convert_to_cpp(_SOURCE, stats=stats, optimization_options=OptimizationOptions(level=0))
+    assert stats.optimizations == {}
+
+def _count_local_optimization_rounds(monkeypatch):
+    num_rounds_by_template_name = dict()
+    perform_local_optimizations_on_template_defn = optimize_ir0.perform_local_optimizations_on_template_defn
+    def wrapper(template_defn, *args, **kwargs):
+        # The local optimizations performed as part of the inlining are not counted.
+        if not kwargs['inline_template_instantiations_with_multiple_references']:
+            num_rounds_by_template_name[template_defn.name] = num_rounds_by_template_name.get(template_defn.name, 0) + 1
+        return perform_local_optimizations_on_template_defn(template_defn, *args, **kwargs)
+    monkeypatch.setattr(optimize_ir0, 'perform_local_optimizations_on_template_defn', wrapper)
+    return num_rounds_by_template_name
+
+def test_optimization_level_2_reaches_a_fixpoint(monkeypatch):
+    num_rounds_by_template_name = _count_local_optimization_rounds(monkeypatch)
+
+    result_o1 = convert_to_cpp(_SOURCE)
+    assert set(num_rounds_by_template_name.values()) == {1}
+
+    num_rounds_by_template_name.clear()
+    result_o2 = convert_to_cpp(_SOURCE, optimization_options=OptimizationOptions(level=2))
+    # For f and g the second round doesn't change anything, so the iteration stops there. CheckIfError is already
+    # optimal, so the iteration stops after the first round.
+    assert num_rounds_by_template_name['f'] == 2
+    assert num_rounds_by_template_name['g'] == 2
+    assert num_rounds_by_template_name['CheckIfError'] == 1
+    assert result_o2 == result_o1
+
+def test_max_iterations(monkeypatch):
+    num_rounds_by_template_name = _count_local_optimization_rounds(monkeypatch)
+    convert_to_cpp(_SOURCE, optimization_options=OptimizationOptions(level=2, max_iterations=1))
+    assert set(num_rounds_by_template_name.values()) == {1}
+
+def test_template_node_budget_skips_inlining():
+    # Inlining f here would make g bigger, so it's skipped when the budget is exceeded.
+    source = '''
+def f(x: int):
+    return x * x + x * 3 + 7 * x - 5
+
+def g(x: int):
+    return f(x) * 2
+
+assert g(3) == 32
+'''
+    assert 'f<TmppyInternal' not in convert_to_cpp(source)
+    result_with_budget = convert_to_cpp(source, optimization_options=OptimizationOptions(template_node_budget=1))
+    assert 'f<TmppyInternal' in result_with_budget
+
+def test_template_time_budget(monkeypatch):
+    num_rounds_by_template_name = _count_local_optimization_rounds(monkeypatch)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CompilationCache(cache_dir)
+        result = convert_to_cpp(_SOURCE,
+                                cache=cache,
+                                optimization_options=OptimizationOptions(template_time_budget_seconds=0))
+        assert num_rounds_by_template_name == {}
+        assert result != convert_to_cpp(_SOURCE)
+        # The templates that exceeded their budget are not cached, and neither is the output of the whole module.
+        assert os.listdir(cache_dir) == []
+
+def test_optimization_options_are_part_of_the_cache_key():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CompilationCache(cache_dir)
+        result_o1 = convert_to_cpp(_SOURCE, cache=cache)
+        result_o0 = convert_to_cpp(_SOURCE, cache=cache, optimization_options=OptimizationOptions(level=0))
+        assert result_o0 != result_o1
+        assert convert_to_cpp(_SOURCE, cache=cache) == result_o1
@@ -0,0 +1,221 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from _py2tmp.testing.utils import expect_cpp_code_success, expect_cpp_code_generic_compile_error
+from py2tmp import convert_to_cpp, OptimizationOptions
+
+_PARTIAL_EVALUATION = OptimizationOptions(partial_evaluation_step_budget=10000)
+
+_SOURCE = '''
+def fact(n: int) -> int:
+    if n == 0:
+        return 1
+    else:
+        return n * fact(n - 1)
+
+assert fact(5) == 120
+'''
+
+# Each of these is converted with and without the partial evaluation, and both results are compiled. The partial
+# evaluation must remove at least one toplevel assertion from each, so that the C++ compiler checks the code that
+# uses the evaluated values.
+_SOURCES_WITH_EVALUATED_ASSERTIONS = {
+    'int_recursion': _SOURCE,
+    'bool_ops': '''
+def f(b: bool, n: int):
+    return (b or n > 3) and not (n == 7)
+
+assert f(False, 5)
+assert not f(True, 7)
+''',
+    'types': '''
+from tmppy import Type
+
+def add_pointer(x: Type):
+    return Type.pointer(x)
+
+def is_pointer_to_int(x: Type):
+    return x == Type.pointer(Type('int'))
+
+assert add_pointer(Type('int')) == Type.pointer(Type('int'))
+assert is_pointer_to_int(add_pointer(Type('int')))
+assert not is_pointer_to_int(Type('int'))
+''',
+    'lists': '''
+from tmppy import Type
+
+def f(n: int):
+    return [x * n for x in [1, 2, 3]]
+
+def g(l: List[Type]):
+    return l + [Type('void')]
+
+assert f(2) == [2, 4, 6]
+assert sum(f(2)) == 12
+assert g([Type('int')]) == [Type('int'), Type('void')]
+assert all([x > 0 for x in [1, 2]])
+assert any([x == 4 for x in [3, 4]])
+''',
+    'sets': '''
+from tmppy import Type
+
+def f(x: Type):
+    return {x, Type('int')}
+
+assert f(Type('float')) == {Type('int'), Type('float')}
+assert f(Type('int')) == {Type('int')}
+''',
+    'match': '''
+from tmppy import Type, match
+
+def f(x: Type):
+    return match(x)(lambda T: {
+        Type.pointer(T):
+            T,
+        T:
+            Type('void'),
+    })
+
+assert f(Type.pointer(Type('int'))) == Type('int')
+assert f(Type('int')) == Type('void')
+''',
+    'custom_types': '''
+class Pair:
+    def __init__(self, first: int, second: int):
+        self.first = first
+        self.second = second
+
+def swap(p: Pair):
+    return Pair(p.second, p.first)
+
+assert swap(Pair(1, 2)).first == 2
+assert swap(Pair(1, 2)) == Pair(2, 1)
+''',
+    'exceptions': '''
+class MyError(Exception):
+    def __init__(self, n: int):
+        self.message = 'Something went wrong'
+        self.n = n
+
+def f(n: int):
+    if n == 0:
+        raise MyError(n)
+    return n
+
+def g(n: int):
+    try:
+        return f(n)
+    except MyError as e:
+        return e.n + 10
+
+assert g(0) == 10
+assert g(5) == 5
+''',
+    'function_call_in_function': '''
+from tmppy import Type
+
+def f(x: Type):
+    if x == Type('int'):
+        return [Type('float'), Type('double')]
+    else:
+        return [x]
+
+def g(x: Type):
+    return f(Type('int'))
+
+assert g(Type('void')) == [Type('float'), Type('double')]
+''',
+}
+
+@pytest.mark.parametrize('source_name', sorted(_SOURCES_WITH_EVALUATED_ASSERTIONS.keys()))
+def test_partial_evaluation_result_compiles(source_name):
+    source = _SOURCES_WITH_EVALUATED_ASSERTIONS[source_name]
+    cpp_source = convert_to_cpp(source)
+    evaluated_cpp_source = convert_to_cpp(source, optimization_options=_PARTIAL_EVALUATION)
+    assert evaluated_cpp_source.count('static_assert') < cpp_source.count('static_assert')
+    expect_cpp_code_success(source, module_ir2=None, module_ir1=None, cxx_source=cpp_source)
+    expect_cpp_code_success(source, module_ir2=None, module_ir1=None, cxx_source=evaluated_cpp_source)
+
+_SOURCES_WITH_FAILING_ASSERTIONS = {
+    'int_recursion': _SOURCE.replace('== 120', '== 121'),
+    'function_call': '''
+def f(n: int):
+    return n + 1
+
+assert f(3) == 5
+''',
+    'lists': '''
+def f(n: int):
+    return [x * n for x in [1, 2, 3]]
+
+assert f(2) == [2, 4, 7]
+''',
+}
+
+@pytest.mark.parametrize('source_name', sorted(_SOURCES_WITH_FAILING_ASSERTIONS.keys()))
+def test_partial_evaluation_failing_assertion_still_reported(source_name):
+    source = _SOURCES_WITH_FAILING_ASSERTIONS[source_name]
+    for optimization_options in (OptimizationOptions(), _PARTIAL_EVALUATION):
+        cpp_source = convert_to_cpp(source, optimization_options=optimization_options)
+        assert 'static_assert' in cpp_source
+        expect_cpp_code_generic_compile_error('TMPPy assertion failed', source, module_ir2=None, module_ir1=None,
+                                              cxx_source=cpp_source)
+
+def test_toplevel_assertion_evaluated():
+    assert 'static_assert' not in convert_to_cpp(_SOURCE, optimization_options=_PARTIAL_EVALUATION)
+
+def test_partial_evaluation_disabled_by_default():
+    assert 'static_assert' in convert_to_cpp(_SOURCE)
+
+def test_partial_evaluation_step_budget_exceeded():
+    # The evaluation is abandoned, the C++ compiler will evaluate the assertion instead.
+    assert 'static_assert' in convert_to_cpp(_SOURCE,
+                                             optimization_options=OptimizationOptions(partial_evaluation_step_budget=5))
+
+def test_instantiation_depth_exceeded():
+    source = '''
+def sum_up_to(n: int) -> int:
+    if n == 0:
+        return 0
+    else:
+        return n + sum_up_to(n - 1)
+
+assert sum_up_to(30) == 465
+assert sum_up_to(10) == 55
+'''
+    # Evaluating the first assertion exceeds the max instantiation depth (so it's left to the C++ compiler) at one of
+    # the instantiations needed by the second one too, but there they're at a lower depth so they can be evaluated.
+    assert convert_to_cpp(source, optimization_options=_PARTIAL_EVALUATION).count('static_assert') == 1
+
+def test_match_with_constant_arg_evaluated():
+    source = '''
+from tmppy import Type, match
+
+def f(x: Type):
+    return match(x)(lambda T: {
+        Type.pointer(T):
+            T,
+        T:
+            Type('void'),
+    })
+
+def g(x: Type):
+    return f(Type.pointer(Type('int')))
+'''
+    cpp_source = convert_to_cpp(source, optimization_options=_PARTIAL_EVALUATION)
+    assert 'using type = int;' in cpp_source
+    assert 'f<int*>' not in cpp_source
+    expect_cpp_code_success(source, module_ir2=None, module_ir1=None, cxx_source=cpp_source)
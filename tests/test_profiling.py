@@ -0,0 +1,57 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import json
+import tracemalloc
+
+from py2tmp import convert_to_cpp, CompilationStats
+
+def test_profiling_stats():
+    stats = CompilationStats()
+    convert_to_cpp('''
+def f(x: int):
+    return x + 1
+
+def g(x: int):
+    return f(x) * 2
+''', stats=stats)
+
+    assert [pass_stats.name for pass_stats in stats.stages] == [
+        'parse', 'ast_to_ir3', 'optimize_ir3', 'ir3_to_ir2', 'ir2_to_ir1', 'ir1_to_ir0', 'optimize_ir0', 'ir0_to_cpp',
+        'format_cpp',
+    ]
+    for pass_stats in stats.stages:
+        assert pass_stats.num_runs == 1
+        assert pass_stats.wall_time_seconds >= 0
+        assert pass_stats.peak_memory_bytes >= 0
+    [ir1_to_ir0_stats] = [pass_stats for pass_stats in stats.stages if pass_stats.name == 'ir1_to_ir0']
+    assert ir1_to_ir0_stats.num_nodes_after > 0
+    assert ir1_to_ir0_stats.num_templates_after >= 2
+
+    assert 'perform_common_subexpression_normalization()' in stats.optimizations
+    assert 'perform_constant_folding()' in stats.optimizations
+    assert 'TemplateInstantiationInliningTransformation' in stats.optimizations
+    assert stats.optimizations['perform_constant_folding()'].num_runs >= 2
+
+    # The tracing started for the conversion is stopped at the end of it.
+    assert not tracemalloc.is_tracing()
+
+    # Check that the report can be serialized.
+    json.dumps(stats.to_json())
+
+def test_profiling_stats_without_memory_tracking():
+    stats = CompilationStats(track_memory=False)
+    convert_to_cpp('def f(x: bool):\n    return x\n', stats=stats)
+    assert all(pass_stats.peak_memory_bytes is None for pass_stats in stats.stages)
@@ -0,0 +1,162 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+import pytest
+
+from _py2tmp.ast_to_ir3 import CompilationError
+from _py2tmp.testing.utils import expect_cpp_code_success
+from py2tmp import (convert_module_to_cpp, compute_module_interface, compile_batch, ModuleInterface,
+                    CompilationCache)
+
+_LIB_SOURCE = '''
+from tmppy import Type
+
+class MyError(Exception):
+    def __init__(self, b: bool):
+        self.message = 'my error'
+        self.b = b
+
+def f(x: Type):
+    if x == Type('int'):
+        raise MyError(True)
+    return Type.pointer(x)
+
+def g(x: Type):
+    return x
+
+assert g(Type('int')) == Type('int')
+'''
+
+_OTHER_LIB_SOURCE = '''
+from tmppy import Type
+
+def g2(x: Type):
+    return x == Type('int')
+
+assert g2(Type('int'))
+'''
+
+_APP_SOURCE = '''
+from tmppy import Type
+from mylib.traits import f, g, MyError
+
+def h(x: Type):
+    return f(g(x))
+
+def k(x: Type):
+    try:
+        y = f(x)
+        return False
+    except MyError as e:
+        return e.b
+
+def r(b: bool):
+    if b:
+        raise MyError(b)
+    return 1
+
+def s(x: Type):
+    return g(x)
+
+assert h(Type('float')) == Type.pointer(Type('float'))
+assert k(Type('int'))
+'''
+
+_APP_CXX_SOURCE = '''
+    #include "{dir}/app.h"
+    #include "{dir}/mylib/traits.h"
+    #include "{dir}/mylib/other.h"
+    static_assert(std::is_same<h<float>::type, float*>::value, "");
+    static_assert(k<int>::value, "");
+    static_assert(!k<float>::value, "");
+    static_assert(g2<int>::value, "");
+    '''
+
+def _write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def test_module_interface():
+    interface = compute_module_interface(_LIB_SOURCE, 'mylib.traits')
+    assert interface.header_name == 'mylib/traits.h'
+    assert [(function.name, function.is_function_that_may_throw) for function in interface.functions] == [('f', True),
+                                                                                                          ('g', False)]
+    assert [custom_type.custom_type.name for custom_type in interface.custom_types] == ['MyError']
+    assert ModuleInterface.deserialize(interface.serialize()).to_json() == interface.to_json()
+    _, interface_from_conversion = convert_module_to_cpp(_LIB_SOURCE, 'mylib.traits')
+    assert interface_from_conversion.to_json() == interface.to_json()
+
+    app_interface = compute_module_interface(_APP_SOURCE, 'app', {'mylib.traits': interface})
+    assert [(function.name, function.is_function_that_may_throw) for function in app_interface.functions] == [
+        ('h', True), ('k', True), ('r', True), ('s', False)]
+    # The imported exception types are in the interface too, since they can propagate to the modules that import app.
+    assert [(custom_type.module_name, custom_type.custom_type.name)
+            for custom_type in app_interface.custom_types] == [('mylib.traits', 'MyError')]
+
+def test_separately_compiled_modules_can_be_used_in_the_same_cpp_file():
+    lib_cpp_source, lib_interface = convert_module_to_cpp(_LIB_SOURCE, 'mylib.traits')
+    other_lib_cpp_source, _ = convert_module_to_cpp(_OTHER_LIB_SOURCE, 'mylib.other')
+    # Only the interface of the imported module is needed, not its source.
+    app_cpp_source, _ = convert_module_to_cpp(_APP_SOURCE, 'app',
+                                              {'mylib.traits': ModuleInterface.deserialize(lib_interface.serialize())})
+    assert '#include "mylib/traits.h"' in app_cpp_source
+    with tempfile.TemporaryDirectory() as dir:
+        _write_file(os.path.join(dir, 'mylib', 'traits.h'), lib_cpp_source)
+        _write_file(os.path.join(dir, 'mylib', 'other.h'), other_lib_cpp_source)
+        _write_file(os.path.join(dir, 'app.h'), app_cpp_source)
+        expect_cpp_code_success(_APP_SOURCE, module_ir2=None, module_ir1=None,
+                                cxx_source=_APP_CXX_SOURCE.format(dir=dir))
+
+def test_import_of_unknown_module_error():
+    with pytest.raises(CompilationError, match='The only modules that can be imported in TMPPy are'):
+        convert_module_to_cpp(_APP_SOURCE, 'app')
+
+def test_import_of_undefined_name_error():
+    interface = compute_module_interface(_LIB_SOURCE, 'mylib.traits')
+    with pytest.raises(CompilationError, match='The module mylib.traits doesn\'t define a public function or type called foo'):
+        convert_module_to_cpp('from mylib.traits import foo\n', 'app', {'mylib.traits': interface})
+
+def test_compile_batch_with_import_dirs():
+    with tempfile.TemporaryDirectory() as dir:
+        _write_file(os.path.join(dir, 'mylib', 'traits.py'), _LIB_SOURCE)
+        _write_file(os.path.join(dir, 'mylib', 'other.py'), _OTHER_LIB_SOURCE)
+        _write_file(os.path.join(dir, 'app.py'), _APP_SOURCE)
+        source_file_names = [os.path.join(dir, 'app.py'),
+                             os.path.join(dir, 'mylib', 'traits.py'),
+                             os.path.join(dir, 'mylib', 'other.py')]
+        results = compile_batch(source_file_names, jobs=2, import_dirs=[dir])
+        assert [result.error for result in results] == [None, None, None]
+        for result in results:
+            for file_name, content in result.output_files.items():
+                _write_file(file_name, content)
+        assert os.path.exists(os.path.join(dir, 'mylib', 'traits.tmppyi'))
+        expect_cpp_code_success(_APP_SOURCE, module_ir2=None, module_ir1=None,
+                                cxx_source=_APP_CXX_SOURCE.format(dir=dir))
+
+        # Now that the interface files exist, app can be converted on its own. The cache key includes the interfaces.
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = CompilationCache(cache_dir)
+            [result] = compile_batch([os.path.join(dir, 'app.py')], import_dirs=[dir], cache=cache)
+            assert result.cpp_source == results[0].cpp_source
+            [result] = compile_batch([os.path.join(dir, 'app.py')], import_dirs=[dir], cache=cache)
+            assert result.cpp_source == results[0].cpp_source
+            assert result.module_interface.to_json() == results[0].module_interface.to_json()
+
+        os.remove(os.path.join(dir, 'mylib', 'traits.tmppyi'))
+        [result] = compile_batch([os.path.join(dir, 'app.py')], import_dirs=[dir])
+        assert 'Couldn\'t get the interface of the imported module mylib.traits' in result.error
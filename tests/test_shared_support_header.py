@@ -0,0 +1,116 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+from _py2tmp.testing.utils import expect_cpp_code_success
+from py2tmp import (convert_to_cpp_with_shared_templates, shared_support_header_to_cpp, compile_batch,
+                    CompilationCache, OptimizationOptions)
+
+_SOURCE1 = '''
+def f(b: bool):
+    return [not x for x in [b, True]]
+'''
+
+_SOURCE2 = '''
+from tmppy import Type
+
+def g(b: bool):
+    return [not x for x in [True, b]]
+
+def h(x: Type):
+    return x
+'''
+
+# At -O0 the call to f() is not inlined, and it needs a custom Select1st* variant since g's only param is a function.
+_SOURCE_WITH_SELECT1ST = '''
+from typing import Callable
+
+def f(x: bool):
+    assert x
+    return x
+
+def g(h: Callable[[bool], bool]):
+    return f(True)
+'''
+
+def test_shared_support_header_defines_shared_templates_once():
+    cpp_source1, shared_templates1 = convert_to_cpp_with_shared_templates(_SOURCE1, 'shared.h')
+    cpp_source2, shared_templates2 = convert_to_cpp_with_shared_templates(_SOURCE2, 'shared.h')
+    assert '#include "shared.h"' in cpp_source1
+    # The list comprehension wrappers (and the if-else helpers) are the same in both modules.
+    assert 'list comprehension' not in cpp_source1
+    assert 'list comprehension' not in cpp_source2
+    assert set(shared_templates1.keys()) == set(shared_templates2.keys())
+    assert 'CheckIfError' in shared_templates1
+
+    shared_support_header = shared_support_header_to_cpp([shared_templates1, shared_templates2])
+    assert shared_support_header.count('list comprehension') == 1
+    assert shared_support_header.count('struct CheckIfError {') == 1
+    assert shared_support_header == shared_support_header_to_cpp([shared_templates2, shared_templates1])
+
+def test_shared_support_header_custom_select1st():
+    optimization_options = OptimizationOptions(level=0)
+    cpp_source, shared_templates = convert_to_cpp_with_shared_templates(_SOURCE_WITH_SELECT1ST, 'shared.h',
+                                                                        optimization_options=optimization_options)
+    assert 'Custom Select1st' not in cpp_source
+    assert any('Custom Select1st' in defn for _, defn in shared_templates.values())
+    with tempfile.TemporaryDirectory() as dir:
+        with open(os.path.join(dir, 'shared.h'), 'w') as f:
+            f.write(shared_support_header_to_cpp([shared_templates]))
+        with open(os.path.join(dir, 'mod.h'), 'w') as f:
+            f.write(cpp_source)
+        expect_cpp_code_success(_SOURCE_WITH_SELECT1ST, module_ir2=None, module_ir1=None, cxx_source='''
+            #include "{dir}/mod.h"
+            template <bool b>
+            struct Not {{
+              static constexpr bool value = !b;
+            }};
+            static_assert(g<Not>::value, "");
+            '''.format(dir=dir))
+
+def test_shared_support_header_cache():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = CompilationCache(cache_dir)
+        result = convert_to_cpp_with_shared_templates(_SOURCE2, 'shared.h', cache=cache)
+        assert convert_to_cpp_with_shared_templates(_SOURCE2, 'shared.h', cache=cache) == result
+        assert convert_to_cpp_with_shared_templates(_SOURCE2, 'shared.h') == result
+
+def test_compile_batch_shared_support_header():
+    with tempfile.TemporaryDirectory() as dir:
+        source_file_names = []
+        for module_name, source in (('mod1', _SOURCE1), ('mod2', _SOURCE2)):
+            source_file_name = os.path.join(dir, module_name + '.py')
+            with open(source_file_name, 'w') as f:
+                f.write(source)
+            source_file_names.append(source_file_name)
+        shared_support_header = os.path.join(dir, 'support', 'shared.h')
+        results = compile_batch(source_file_names, shared_support_header=shared_support_header)
+        assert [result.error for result in results] == [None, None]
+        os.makedirs(os.path.dirname(shared_support_header))
+        with open(shared_support_header, 'w') as f:
+            f.write(shared_support_header_to_cpp([result.shared_templates for result in results]))
+        for result in results:
+            assert '#include "support/shared.h"' in result.cpp_source
+            with open(result.output_file_name, 'w') as f:
+                f.write(result.cpp_source)
+
+        # Both modules can be used in the same C++ file, with the same list comprehension wrapper.
+        expect_cpp_code_success(_SOURCE1 + _SOURCE2, module_ir2=None, module_ir1=None, cxx_source='''
+            #include "{dir}/mod1.h"
+            #include "{dir}/mod2.h"
+            static_assert(std::is_same<f<true>::type, BoolList<false, false>>::value, "");
+            static_assert(std::is_same<g<true>::type, BoolList<false, false>>::value, "");
+            '''.format(dir=dir))
@@ -0,0 +1,86 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+from _py2tmp.testing.utils import expect_cpp_code_success
+from py2tmp import convert_to_split_cpp, compile_batch
+
+_SOURCE = '''
+from tmppy import Type
+
+def _helper(x: Type):
+    if x == Type('int'):
+        return Type('long')
+    else:
+        return x
+
+def f(x: Type):
+    return _helper(x)
+
+def g(x: Type):
+    if x == Type('float'):
+        return Type('double')
+    else:
+        return _helper(x)
+
+def h(n: int):
+    return n + 1
+
+assert g(Type('int')) == Type('long')
+'''
+
+def _write_headers(dir, cpp_sources):
+    for file_name, cpp_source in cpp_sources.items():
+        path = os.path.join(dir, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(cpp_source)
+
+def test_split_output_headers():
+    cpp_sources = convert_to_split_cpp(_SOURCE, 'mod')
+    assert set(cpp_sources.keys()) == {'mod.h', 'mod/_internal.h', 'mod/f.h', 'mod/g.h', 'mod/h.h', 'mod/CheckIfError.h'}
+
+    # _helper is used by both f and g, so it's in the internal header.
+    assert 'using type = long;' in cpp_sources['mod/_internal.h']
+    assert 'using type = long;' not in cpp_sources['mod/f.h']
+    assert '#include "_internal.h"' in cpp_sources['mod/f.h']
+    assert 'struct g' not in cpp_sources['mod/f.h']
+    # h doesn't use any template shared with other public functions.
+    assert '#include "_internal.h"' not in cpp_sources['mod/h.h']
+    # The toplevel assertions are only in the main header.
+    assert 'static_assert' not in cpp_sources['mod/g.h']
+    assert 'static_assert' in cpp_sources['mod.h']
+    assert '#include "mod/g.h"' in cpp_sources['mod.h']
+
+def test_split_output_headers_compile_independently():
+    cpp_sources = convert_to_split_cpp(_SOURCE, 'mod')
+    with tempfile.TemporaryDirectory() as dir:
+        _write_headers(dir, cpp_sources)
+        for file_name in cpp_sources.keys():
+            expect_cpp_code_success(_SOURCE, module_ir2=None, module_ir1=None,
+                                    cxx_source='#include "%s"\n' % os.path.join(dir, file_name))
+
+def test_compile_batch_split_output():
+    with tempfile.TemporaryDirectory() as dir:
+        source_file_name = os.path.join(dir, 'mod.py')
+        with open(source_file_name, 'w') as f:
+            f.write(_SOURCE)
+        [result] = compile_batch([source_file_name], split_output=True)
+        assert result.error is None
+        assert result.cpp_source == convert_to_split_cpp(_SOURCE, 'mod', source_file_name)['mod.h']
+        assert set(result.output_files.keys()) == {os.path.join(dir, file_name)
+                                                   for file_name in ('mod.h', 'mod/_internal.h', 'mod/f.h', 'mod/g.h',
+                                                                     'mod/h.h', 'mod/CheckIfError.h')}
@@ -0,0 +1,77 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict, Set
+
+from _py2tmp import ir0, optimize_ir0
+
+def _type_var(name: str):
+    return ir0.AtomicTypeLiteral.for_local(cpp_type=name, type=ir0.TypeType())
+
+def _call(template_name: str, arg: ir0.Expr):
+    template_expr = ir0.AtomicTypeLiteral.for_nonlocal_template(cpp_type=template_name,
+                                                               arg_types=[ir0.TypeType()],
+                                                               is_metafunction_that_may_return_error=False)
+    return ir0.ClassMemberAccess(ir0.TemplateInstantiation(template_expr=template_expr,
+                                                           args=[arg],
+                                                           instantiation_might_trigger_static_asserts=False),
+                                 member_name='type',
+                                 member_type=ir0.TypeType())
+
+def _template_defn(name: str, result_expr: ir0.Expr):
+    arg_decl = ir0.TemplateArgDecl(type=ir0.TypeType(), name='T')
+    body = [ir0.Typedef(name='type', expr=result_expr)]
+    return ir0.TemplateDefn(args=[arg_decl],
+                            main_definition=ir0.TemplateSpecialization(args=[arg_decl], patterns=None, body=body),
+                            specializations=[],
+                            name=name,
+                            description='',
+                            result_element_names=['type'])
+
+def _compute_inlineable_refs(template_defns, monkeypatch) -> Dict[str, Set[str]]:
+    inlineable_refs_by_template_name = dict()
+    perform_template_inlining = optimize_ir0.perform_template_inlining
+    def wrapper(template_defn, inlineable_refs, *args, **kwargs):
+        inlineable_refs_by_template_name[template_defn.name] = set(inlineable_refs)
+        return perform_template_inlining(template_defn, inlineable_refs, *args, **kwargs)
+    monkeypatch.setattr(optimize_ir0, 'perform_template_inlining', wrapper)
+    header = ir0.Header(template_defns=template_defns,
+                        toplevel_content=[],
+                        public_names={template_defn.name for template_defn in template_defns})
+    optimize_ir0.optimize_header(header, identifier_generator=iter('TmppyInternal_%s' % i for i in range(1000)))
+    return inlineable_refs_by_template_name
+
+def test_recursive_template_not_inlined_into_itself(monkeypatch):
+    inlineable_refs_by_template_name = _compute_inlineable_refs([
+        _template_defn('Helper', ir0.PointerTypeExpr(_type_var('T'))),
+        # Recursive: Recursive<T> = Recursive<Helper<T>>.
+        _template_defn('Recursive', _call('Recursive', _call('Helper', _type_var('T')))),
+        _template_defn('Caller', _call('Recursive', _type_var('T'))),
+    ], monkeypatch)
+    assert inlineable_refs_by_template_name == {
+        'Recursive': {'Helper'},
+        'Caller': {'Recursive'},
+    }
+
+def test_mutually_recursive_templates_not_inlined_into_each_other(monkeypatch):
+    inlineable_refs_by_template_name = _compute_inlineable_refs([
+        _template_defn('Helper', ir0.PointerTypeExpr(_type_var('T'))),
+        _template_defn('F', _call('G', _call('Helper', _type_var('T')))),
+        _template_defn('G', _call('F', _type_var('T'))),
+        _template_defn('Caller', _call('F', _type_var('T'))),
+    ], monkeypatch)
+    assert inlineable_refs_by_template_name == {
+        'F': {'Helper'},
+        'Caller': {'F'},
+    }
@@ -0,0 +1,47 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from _py2tmp.testing.utils import _Snippet, _check_snippets
+
+def _snippet(tmppy_source, expects_success=True):
+    return _Snippet(tmppy_source, extra_cpp_prelude='', expects_success=expects_success)
+
+def test_check_snippets_bisects_failing_batch():
+    succeeding_snippets = [_snippet('assert %s == %s' % (n, n)) for n in range(5)]
+    failing_snippet = _snippet('assert 1 == 2')
+    snippets = succeeding_snippets[:3] + [failing_snippet] + succeeding_snippets[3:]
+
+    _check_snippets(snippets, batch_size=4, jobs=2)
+
+    for snippet in snippets:
+        assert snippet.checked
+    assert not failing_snippet.compiled_successfully
+    for snippet in succeeding_snippets:
+        assert snippet.compiled_successfully
+
+def test_check_snippets_compile_errors():
+    compile_error_snippet = _snippet('assert 1 == 2', expects_success=False)
+    no_compile_error_snippet = _snippet('assert 1 == 1', expects_success=False)
+    conversion_error_snippet = _snippet('assert undefined_variable', expects_success=False)
+
+    _check_snippets([compile_error_snippet, no_compile_error_snippet, conversion_error_snippet], batch_size=4, jobs=2)
+
+    assert compile_error_snippet.checked
+    assert 'static assert' in str(compile_error_snippet.compilation_error) \
+           or 'static_assert' in str(compile_error_snippet.compilation_error)
+    assert no_compile_error_snippet.checked
+    assert no_compile_error_snippet.compilation_error is None
+    # The test will report the conversion error itself.
+    assert conversion_error_snippet.conversion_result is None
+    assert not conversion_error_snippet.checked
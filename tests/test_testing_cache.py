@@ -0,0 +1,58 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tempfile
+
+from _py2tmp.compilation_cache import CompilationCache
+from _py2tmp.testing import utils
+
+def _count_compilations(monkeypatch, cache_dir):
+    monkeypatch.setattr(utils, '_cache', CompilationCache(cache_dir))
+    compiled_sources = []
+    compile_discarding_output = utils._compile_discarding_output
+    def compile_and_record(cxx_source):
+        compiled_sources.append(cxx_source)
+        return compile_discarding_output(cxx_source)
+    monkeypatch.setattr(utils, '_compile_discarding_output', compile_and_record)
+    return compiled_sources
+
+def test_compilation_results_cached(monkeypatch):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        compiled_sources = _count_compilations(monkeypatch, cache_dir)
+
+        e = utils._compile_expecting_error('static_assert(false, "my error");')
+        assert 'my error' in e.error_message
+        assert utils._compile_expecting_error('static_assert(true, "");') is None
+        assert len(compiled_sources) == 2
+
+        # The results (including the error message) come from the cache.
+        cached_e = utils._compile_expecting_error('static_assert(false, "my error");')
+        assert cached_e.error_message == e.error_message
+        assert cached_e.command == e.command
+        assert utils._compile_expecting_error('static_assert(true, "");') is None
+        assert len(compiled_sources) == 2
+
+        # Changed code is compiled again.
+        assert utils._compile_expecting_error('static_assert(true, "changed");') is None
+        assert len(compiled_sources) == 3
+
+def test_compilation_results_cached_per_compiler(monkeypatch):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        compiled_sources = _count_compilations(monkeypatch, cache_dir)
+        utils._compile_expecting_error('static_assert(true, "");')
+
+        compiler_info = dict(utils._get_compiler_info(), flags=utils.compiler.flags + ['-DFOO'])
+        monkeypatch.setattr(utils, '_compiler_info', compiler_info)
+        utils._compile_expecting_error('static_assert(true, "");')
+        assert len(compiled_sources) == 2
@@ -0,0 +1,92 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from py2tmp import convert_to_cpp
+from _py2tmp import ir0_to_cpp
+from _py2tmp.time_trace import attribute_instantiation_times
+
+_SOURCE = '''
+from tmppy import Type, match
+
+def f(x: Type):
+    return match(x)(lambda T: {
+        Type.pointer(T):
+            T,
+        T:
+            x,
+    })
+
+def g(x: Type, y: Type):
+    return [Type.pointer(z)
+            for z in [x, y]]
+'''
+
+def _get_source_locations(naming='sequential'):
+    cpp_source = convert_to_cpp(_SOURCE, filename='mod.py', naming=naming, source_locations=True)
+    return {name: str(source_location)
+            for name, source_location in ir0_to_cpp.parse_source_location_comments(cpp_source).items()}
+
+def test_source_locations():
+    source_locations = _get_source_locations()
+    assert source_locations['f'] == 'mod.py:4 (in f)'
+    assert source_locations['g'] == 'mod.py:12 (in g)'
+    # The helper templates for the match and the list comprehension get the line of the expression.
+    assert 'mod.py:5 (in f)' in source_locations.values()
+    assert 'mod.py:13 (in g)' in source_locations.values()
+
+    assert sorted(source_locations.values()) == sorted(_get_source_locations(naming='content-derived').values())
+
+def test_source_locations_not_emitted_by_default():
+    assert 'Source location of' not in convert_to_cpp(_SOURCE, filename='mod.py')
+
+def test_source_locations_dont_affect_generated_code():
+    # Moving the code to different lines only changes the source location comments.
+    moved_source = '\n\n\n' + _SOURCE
+    assert convert_to_cpp(_SOURCE, filename='mod.py') == convert_to_cpp(moved_source, filename='mod.py')
+
+def test_attribute_instantiation_times():
+    source_locations = ir0_to_cpp.parse_source_location_comments(
+        convert_to_cpp(_SOURCE, filename='mod.py', source_locations=True))
+    [comprehension_template_name] = [name
+                                     for name, source_location in source_locations.items()
+                                     if source_location.line == 13]
+
+    def event(detail, ts, dur, name='InstantiateClass'):
+        return {'ph': 'X', 'pid': 1, 'tid': 1, 'name': name, 'ts': ts, 'dur': dur, 'args': {'detail': detail}}
+    trace = {'traceEvents': [
+        event('g<int, float>', ts=0, dur=100),
+        # A helper template of tmppy.h, instantiated by g: attributed to g.
+        event('TransformTypeListToTypeList<List<int, float>, %s>' % comprehension_template_name, ts=10, dur=60),
+        # Instantiated by TransformTypeListToTypeList, but with its own source location.
+        event('%s<int>' % comprehension_template_name, ts=20, dur=15),
+        event('%s<float>' % comprehension_template_name, ts=40, dur=15),
+        # Not related to TMPPy code.
+        event('std::vector<int>', ts=200, dur=30),
+        # Other events are ignored.
+        event('std::vector<int>', ts=300, dur=1000, name='Total InstantiateClass'),
+    ]}
+
+    report = attribute_instantiation_times(trace, source_locations)
+    assert report.total_time_us == 130
+    assert report.unattributed_time_us == 30
+
+    assert list(report.hot_spots_by_function.keys()) == ['g']
+    assert report.hot_spots_by_function['g'].self_time_us == 100
+    assert report.hot_spots_by_function['g'].num_instantiations == 3
+
+    assert list(report.hot_spots_by_line.keys()) == ['mod.py:12 (in g)', 'mod.py:13 (in g)']
+    assert report.hot_spots_by_line['mod.py:12 (in g)'].self_time_us == 70
+    assert report.hot_spots_by_line['mod.py:12 (in g)'].num_instantiations == 1
+    assert report.hot_spots_by_line['mod.py:13 (in g)'].self_time_us == 30
+    assert report.hot_spots_by_line['mod.py:13 (in g)'].num_instantiations == 2
@@ -0,0 +1,47 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pickle
+
+from _py2tmp import ir0, optimize_ir0, transform_ir0, utils
+
+def test_tokenized_cpp_type():
+    tokenized_cpp_type = utils.TokenizedCppType('std::pair<T, T>')
+    assert tokenized_cpp_type.text_segments == ('', '::', '<', ', ', '>')
+    assert tokenized_cpp_type.identifiers == ('std', 'pair', 'T', 'T')
+    assert tokenized_cpp_type.slots_by_identifier == {'std': (0,), 'pair': (1,), 'T': (2, 3)}
+
+def test_tokenized_cpp_type_replace_identifiers():
+    tokenized_cpp_type = utils.TokenizedCppType('std::pair<T, T>')
+    assert tokenized_cpp_type.replace_identifiers({'T': 'int', 'U': 'float'}) == 'std::pair<int, int>'
+    assert tokenized_cpp_type.replace_identifiers({'U': 'float'}) == 'std::pair<T, T>'
+
+def test_atomic_type_literal_referenced_identifiers():
+    literal = ir0.AtomicTypeLiteral.for_nonlocal_type('std::pair<T, T>')
+    assert list(literal.get_referenced_identifiers()) == ['std', 'pair', 'T']
+    unpickled_literal = pickle.loads(pickle.dumps(literal))
+    assert list(unpickled_literal.get_referenced_identifiers()) == ['std', 'pair', 'T']
+
+def test_name_replacement():
+    literal = ir0.AtomicTypeLiteral.for_nonlocal_type('Foo<T>')
+    typedef = ir0.Typedef(name='X', expr=literal)
+    writer = transform_ir0.ToplevelWriter(identifier_generator=iter([]), allow_template_defns=False, allow_toplevel_elems=False)
+    [elem] = optimize_ir0.NameReplacementTransformation({'T': 'U'}).transform_template_body_elems([typedef], writer)
+    assert elem.expr.cpp_type == 'Foo<U>'
+
+def test_replace_var_with_atomic_type_literal_in_compound_literal():
+    typedef = ir0.Typedef(name='X', expr=ir0.AtomicTypeLiteral.for_nonlocal_type('Foo<T>'))
+    elem = optimize_ir0.replace_var_with_expr(typedef, 'T', ir0.AtomicTypeLiteral.for_nonlocal_type('int'))
+    assert elem.expr.cpp_type == 'Foo<int>'
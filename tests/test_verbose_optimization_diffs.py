@@ -0,0 +1,68 @@
+#  Copyright 2017 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from _py2tmp import ir0, optimize_ir0, utils
+
+def _type_var(name: str):
+    return ir0.AtomicTypeLiteral.for_local(cpp_type=name, type=ir0.TypeType())
+
+def _template_defn(name: str, body):
+    arg_decl = ir0.TemplateArgDecl(type=ir0.TypeType(), name='T')
+    return ir0.TemplateDefn(args=[arg_decl],
+                            main_definition=ir0.TemplateSpecialization(args=[arg_decl], patterns=None, body=body),
+                            specializations=[],
+                            name=name,
+                            description='',
+                            result_element_names=['type'])
+
+def _foldable_template_defn(name: str):
+    return _template_defn(name, [ir0.Typedef(name='X', expr=ir0.PointerTypeExpr(_type_var('T'))),
+                                 ir0.Typedef(name='type', expr=_type_var('X'))])
+
+def _fold(template_defn: ir0.TemplateDefn, verbose_templates=None):
+    return optimize_ir0.apply_optimization(template_defn,
+                                           identifier_generator=iter([]),
+                                           optimization=lambda: optimize_ir0.perform_constant_folding(
+                                               template_defn,
+                                               identifier_generator=iter([]),
+                                               inline_template_instantiations_with_multiple_references=False),
+                                           optimization_name='ConstantFoldingTransformation',
+                                           verbose=True,
+                                           verbose_templates=verbose_templates)
+
+def test_ir_equals():
+    assert utils.ir_equals(_foldable_template_defn('F'), _foldable_template_defn('F'))
+    assert not utils.ir_equals(_foldable_template_defn('F'), _foldable_template_defn('G'))
+    assert not utils.ir_equals(_foldable_template_defn('F'),
+                               _template_defn('F', [ir0.Typedef(name='type', expr=_type_var('T'))]))
+    assert utils.ir_equals([_type_var('T')], [_type_var('T')])
+    assert not utils.ir_equals([_type_var('T')], [_type_var('T'), _type_var('T')])
+    assert not utils.ir_equals([_type_var('T')], (_type_var('T'),))
+
+def test_verbose_prints_diff_for_changed_template(capsys):
+    _fold(_foldable_template_defn('F'))
+    output = capsys.readouterr().out
+    assert 'After ConstantFoldingTransformation' in output
+    assert 'Diff:' in output
+
+def test_verbose_does_not_print_unchanged_template(capsys):
+    _fold(_template_defn('F', [ir0.Typedef(name='type', expr=ir0.PointerTypeExpr(_type_var('T')))]))
+    assert capsys.readouterr().out == ''
+
+def test_verbose_templates_filter(capsys):
+    _fold(_foldable_template_defn('Foo'), verbose_templates=['Bar*'])
+    assert capsys.readouterr().out == ''
+    _fold(_foldable_template_defn('BarBaz'), verbose_templates=['Bar*'])
+    assert 'After ConstantFoldingTransformation' in capsys.readouterr().out